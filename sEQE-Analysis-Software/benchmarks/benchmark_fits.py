@@ -0,0 +1,488 @@
+"""Benchmark suite for the sEQE fitting paths
+
+Synthetic EQE and reduced EL spectra with known parameters and controlled noise are fitted with the same
+source functions that heatMap, double_fit, double_fit_MLJ and sim_double_fit use in the GUI (feasible_Windows,
+fit_Windows, calculate_guess_fit, fit_model_double and FitResults). Reduced EL spectra are fitted with fit_function.
+For every analysis path and fit range resolution, the run time, fits per second, restarts per window,
+peak memory and parameter recovery error of the best fit are reported.
+
+Run from the sEQE-Analysis-Software directory:
+
+    python -m benchmarks.benchmark_fits
+    python -m benchmarks.benchmark_fits --paths heatMap sim_double_fit --steps 0.02 0.01 --noise 0.02
+
+The exit code is 1 if any path does not recover the known parameters within --tolerance.
+"""
+
+import argparse
+import json
+import math
+import sys
+import time
+import tracemalloc
+import warnings
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+from numpy import exp
+
+import source.utils_fit as utils_fit
+from source.add_subtract import subtract_Opt
+from source.compilation import Spectrum, compile_Data, feasible_Windows, window_cache
+from source.fit_cache import fit_cache
+from source.fit_results import FitResults
+from source.gaussian import calculate_gaussian_absorption, calculate_gaussian_absorption_jac, \
+    calculate_MLJ_absorption, calculate_combined_fit, calculate_combined_fit_MLJ
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Define parameters of the synthetic spectra
+
+k = 8.617 * math.pow(10, -5)  # [ev/K]
+h = 6.626 * math.pow(10, -34)  # [m^2 kg/s]
+c = 2.998 * math.pow(10, 8)  # [m/s]
+q = 1.602 * math.pow(10, -19)  # [C]
+
+T = 300  # [K]
+CT_params = [0.01, 0.25, 1.42]  # f, l, Ect
+Opt_params = [0.5, 0.15, 1.90]  # f, l, Eopt
+S = 1.0  # Huang-Rhys parameter
+hbarw = 0.15  # Vibrational energy [eV]
+
+# Fit ranges [eV]
+CT_start = (1.20, 1.30)
+CT_stop = (1.45, 1.55)
+Opt_start = (1.75, 1.80)
+Opt_stop = (1.95, 2.00)
+sim_start = (1.20, 1.30)
+sim_stop = (1.95, 2.05)
+
+guessRange_CT = [1.3, 1.5]
+guessRange_Opt = [1.8, 2.0]
+
+sim_bounds = {'start_fCT': 0, 'stop_fCT': 0.1,
+              'start_lCT': 0.01, 'stop_lCT': 0.5,
+              'start_ECT': 1.2, 'stop_ECT': 1.6,
+              'start_fopt': 0, 'stop_fopt': 2,
+              'start_lopt': 0.01, 'stop_lopt': 0.5,
+              'start_Eopt': 1.7, 'stop_Eopt': 2.1,
+              'start_sig': 0, 'stop_sig': 0.2
+              }
+sim_guess = [0.001, 0.150, 1.30, 0.01, 0.150, 1.8]  # fCT, lCT, ECT, fopt, lopt, Eopt
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Model functions (equivalent to the GUI model functions at temperature T)
+
+def gaussian(E, f, l, Ect):
+    return calculate_gaussian_absorption(E, f, l, Ect, T)
+
+
+def gaussian_jac(E, f, l, Ect):
+    return calculate_gaussian_absorption_jac(E, f, l, Ect, T)
+
+
+def MLJ_gaussian(E, f, l, Ect):
+    return calculate_MLJ_absorption(E, f, l, Ect, T, S, hbarw)
+
+
+def gaussian_double_sim(E, fCT, lCT, ECT, fopt, lopt, Eopt):
+    return gaussian(E, fCT, lCT, ECT) + gaussian(E, fopt, lopt, Eopt)
+
+
+def gaussian_double_sim_jac(E, fCT, lCT, ECT, fopt, lopt, Eopt):
+    return np.hstack([gaussian_jac(E, fCT, lCT, ECT), gaussian_jac(E, fopt, lopt, Eopt)])
+
+
+def gaussian_EL(E, f, l, Ect):
+    return (f / (math.sqrt(4 * math.pi * l * T * k))) * exp(-(Ect - l - E) ** 2 / (4 * l * k * T))
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Functions to generate synthetic data
+
+def synthetic_EQE(noise,
+                  seed,
+                  MLJ=False
+                  ):
+    """Function to generate a synthetic EQE spectrum of a CT state and an optical (S1) peak
+
+    Parameters
+    ----------
+    noise : float, required
+        Relative standard deviation of multiplicative gaussian noise
+    seed : int, required
+        Random seed
+    MLJ : bool, optional
+        Boolean value specifying whether to calculate the CT state with MLJ theory
+
+    Returns
+    -------
+    eqe : Spectrum
+        Synthetic EQE spectrum
+    """
+
+    rng = np.random.default_rng(seed)
+
+    wavelength = np.arange(500, 1100, 2, dtype=float)  # [nm]
+    energy = (h * c) / (wavelength * math.pow(10, -9) * q)  # [eV]
+
+    CT = MLJ_gaussian(energy, *CT_params) if MLJ else gaussian(energy, *CT_params)
+    EQE = (CT + gaussian(energy, *Opt_params)) * (1 + noise * rng.standard_normal(len(energy)))
+    EQE = np.abs(EQE) + 1e-12  # Keep EQE positive for the logarithmic R squared
+
+    return Spectrum(wavelength, energy, {'EQE': EQE, 'Log_EQE': np.log10(EQE)})
+
+
+def synthetic_EL(noise,
+                 seed
+                 ):
+    """Function to generate a synthetic reduced EL spectrum of a CT state
+
+    Parameters
+    ----------
+    noise : float, required
+        Relative standard deviation of multiplicative gaussian noise
+    seed : int, required
+        Random seed
+
+    Returns
+    -------
+    energy : array
+        Energy values [eV]
+    EL : array
+        Reduced EL values
+    """
+
+    rng = np.random.default_rng(seed)
+
+    energy = np.arange(0.9, 1.6, 0.002)
+    EL = gaussian_EL(energy, *CT_params) * (1 + noise * rng.standard_normal(len(energy)))
+
+    return energy, np.abs(EL) + 1e-12
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to compile fit ranges
+
+def fit_Range(bounds,
+              step
+              ):
+    """Function to compile start or stop energies of a fit range grid
+
+    Parameters
+    ----------
+    bounds : tuple, required
+        First and last energy [eV]
+    step : float, required
+        Grid resolution [eV]
+
+    Returns
+    -------
+    energies : list
+        List of energies [eV]
+    """
+
+    return np.round(np.arange(bounds[0], bounds[1] + step / 2, step), 3).tolist()
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Context manager to count fit attempts
+
+@contextmanager
+def count_Fits():
+    """Context manager to count calls of the single window fit functions in utils_fit
+
+    Yields
+    ------
+    counter : dict
+        Dictionary with the number of fit attempts and of windows fitted individually with guess_fit
+    """
+
+    counter = {'attempts': 0, 'fallbacks': 0}
+    names = ['fit_function', 'fit_model', 'fit_varpro', 'fit_model_double', 'guess_fit']
+    originals = {name: getattr(utils_fit, name) for name in names}
+
+    def counted(function):
+        def wrapper(*args, **kwargs):
+            counter['fallbacks' if function is originals['guess_fit'] else 'attempts'] += 1
+            return function(*args, **kwargs)
+        return wrapper
+
+    for name in names:
+        setattr(utils_fit, name, counted(originals[name]))
+    try:
+        yield counter
+    finally:
+        for name in names:
+            setattr(utils_fit, name, originals[name])
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Analysis paths
+
+def run_heatMap(eqe, step):
+    """Single peak CT fits of all start / stop combinations (heatMap)"""
+
+    best = (-np.inf, None)
+    n_windows = 0
+    n_batch = 0
+
+    starts = fit_Range(CT_start, step)
+    stops = fit_Range(CT_stop, step)
+    feasible = feasible_Windows(eqe, *np.meshgrid(starts, stops, indexing='ij'), n_params=3)
+
+    for x, start in enumerate(starts):
+        windows = [(start, stop) for y, stop in enumerate(stops) if feasible[x, y]]
+        with count_Fits() as counter:
+            best_vals, covar, r_squared = utils_fit.fit_Windows(eqe=eqe,
+                                                                windows=windows,
+                                                                function=gaussian,
+                                                                jac=gaussian_jac,
+                                                                T=T,
+                                                                guessRange=guessRange_CT
+                                                                )
+        n_windows += len(windows)
+        n_batch += len(windows) - counter['fallbacks']
+        for y in range(len(windows)):
+            if r_squared[y] > best[0]:
+                best = (r_squared[y], best_vals[y])
+
+    return n_windows, n_batch, {'CT': (best[1], CT_params)}
+
+
+def run_double_fit(eqe, step, MLJ=False):
+    """Separate optical peak and CT state fits with subtraction of all optical fits (double_fit / double_fit_MLJ)"""
+
+    fit_results = FitResults(T=T, S=S if MLJ else None, hbarw=hbarw if MLJ else None, n_best=1)
+
+    df_Opt = pd.DataFrame([(start, stop) for start in fit_Range(Opt_start, 0.05) for stop in fit_Range(Opt_stop, 0.05)],
+                          columns=['Start', 'Stop'])
+    df_CT = pd.DataFrame([(start, stop) for start in fit_Range(CT_start, step) for stop in fit_Range(CT_stop, step)],
+                         columns=['Start', 'Stop'])
+    df_Opt = df_Opt[feasible_Windows(eqe, df_Opt['Start'], df_Opt['Stop'], n_params=3)].reset_index(drop=True)
+    df_CT = df_CT[feasible_Windows(eqe, df_CT['Start'], df_CT['Stop'], n_params=3)].reset_index(drop=True)
+    CT_windows = list(zip(df_CT['Start'], df_CT['Stop']))
+
+    n_windows = 0
+    n_batch = 0
+
+    for x in range(len(df_Opt)):
+        fit_Opt, covar_Opt, R2_Opt = utils_fit.calculate_guess_fit(x=x, df=df_Opt, eqe=eqe, function=gaussian,
+                                                                   jac=gaussian_jac, T=T,
+                                                                   guessRange=guessRange_Opt)[:3]
+        n_windows += 1
+        if R2_Opt <= 0:
+            continue
+
+        new_eqe = subtract_Opt(eqe, fit_Opt, T=T)
+
+        with count_Fits() as counter:
+            fit_CT, covar_CT, R2_CT = utils_fit.fit_Windows(eqe=new_eqe,
+                                                            windows=CT_windows,
+                                                            function=MLJ_gaussian if MLJ else gaussian,
+                                                            jac=None if MLJ else gaussian_jac,
+                                                            T=None if MLJ else T,  # Individual MLJ fits
+                                                            guessRange=guessRange_CT
+                                                            )
+        n_windows += len(CT_windows)
+        n_batch += len(CT_windows) - counter['fallbacks']
+
+        for y in range(len(CT_windows)):
+            if MLJ:
+                parameter_dict = calculate_combined_fit_MLJ(eqe=eqe, stopE=df_Opt['Stop'][x], best_vals_Opt=fit_Opt,
+                                                            best_vals_CT=fit_CT[y], T=T, S=S, hbarw=hbarw,
+                                                            R2_Opt=R2_Opt, R2_CT=R2_CT[y])
+            else:
+                parameter_dict = calculate_combined_fit(eqe=eqe, stopE=df_Opt['Stop'][x], best_vals_Opt=fit_Opt,
+                                                        best_vals_CT=fit_CT[y], T=T, R2_Opt=R2_Opt, R2_CT=R2_CT[y])
+
+            fit_results.append_separate(start_Opt=df_Opt['Start'][x], stop_Opt=df_Opt['Stop'][x], fit_Opt=fit_Opt,
+                                        R2_Opt=R2_Opt, covar_Opt=covar_Opt, start_CT=df_CT['Start'][y],
+                                        stop_CT=df_CT['Stop'][y], fit_CT=fit_CT[y], R2_CT=R2_CT[y],
+                                        covar_CT=covar_CT[y], parameter_dict=parameter_dict)
+
+    index = fit_results.best(1)[0]
+
+    return n_windows, n_batch, {'CT': (fit_results['Fit_CT'][index], CT_params),
+                                'Opt': (fit_results['Fit_Opt'][index], Opt_params)}
+
+
+def run_double_fit_MLJ(eqe, step):
+    """Separate optical peak (Marcus) and CT state (MLJ) fits (double_fit_MLJ)"""
+
+    return run_double_fit(eqe, step, MLJ=True)
+
+
+def run_sim_double_fit(eqe, step):
+    """Simultaneous double peak fits of all start / stop combinations (sim_double_fit)"""
+
+    fit_results = FitResults(T=T, simultaneous_double=True, n_best=1, rank='Total_R2')
+
+    windows = [(start, stop) for start in fit_Range(sim_start, step) for stop in fit_Range(sim_stop, step)]
+    feasible = feasible_Windows(eqe, *np.transpose(windows), n_params=6)
+    windows = [window for window, ok in zip(windows, feasible) if ok]
+
+    for start, stop in windows:
+        energy_fit, eqe_fit = eqe.compile(start, stop, 1)[1:3]
+        try:
+            best_vals, covar, y_fit, r_squared = utils_fit.fit_model_double(function=gaussian_double_sim,
+                                                                            jac=gaussian_double_sim_jac,
+                                                                            energy_fit=energy_fit,
+                                                                            eqe_fit=eqe_fit,
+                                                                            bound_dict=sim_bounds,
+                                                                            p0=sim_guess,
+                                                                            print_report=False)
+        except Exception:
+            continue
+
+        parameter_dict = calculate_combined_fit(eqe=eqe, stopE=stop, best_vals_Opt=best_vals[3:6],
+                                                best_vals_CT=best_vals[:3], T=T)
+        fit_results.append_simultaneous(start=start, stop=stop, fit_Opt=best_vals[3:6], fit_CT=best_vals[:3],
+                                        covar=covar, parameter_dict=parameter_dict)
+
+    index = fit_results.best(1)[0]
+
+    return len(windows), 0, {'CT': (fit_results['Fit_CT'][index], CT_params),
+                             'Opt': (fit_results['Fit_Opt'][index], Opt_params)}
+
+
+def run_fit_EL_EQE(data, step):
+    """Reduced EL fits of all start / stop combinations (fit_EL_EQE)"""
+
+    energy, EL = data
+    best = (-np.inf, None)
+    n_windows = 0
+
+    for start in fit_Range((1.00, 1.10), step):
+        for stop in fit_Range((1.25, 1.35), step):
+            n_windows += 1
+            energy_fit, y_fit = compile_Data(energy, EL, start, stop)
+            try:
+                best_vals, covar, y_fit, r_squared = utils_fit.fit_function(gaussian_EL,
+                                                                            np.array(energy_fit),
+                                                                            np.array(y_fit),
+                                                                            p0=[utils_fit.f_guess,
+                                                                                utils_fit.l_guess,
+                                                                                1.4])
+            except Exception:
+                continue
+            if r_squared > best[0]:
+                best = (r_squared, best_vals)
+
+    return n_windows, 0, {'CT': (best[1], CT_params)}
+
+
+paths = {'heatMap': (run_heatMap, False),
+         'double_fit': (run_double_fit, False),
+         'double_fit_MLJ': (run_double_fit_MLJ, True),
+         'sim_double_fit': (run_sim_double_fit, False),
+         'fit_EL_EQE': (run_fit_EL_EQE, None)
+         }
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to benchmark an analysis path
+
+def benchmark(name,
+              step,
+              noise,
+              seed
+              ):
+    """Function to time an analysis path and check parameter recovery
+
+    Parameters
+    ----------
+    name : str, required
+        Name of analysis path (see paths)
+    step : float, required
+        Fit range resolution [eV]
+    noise : float, required
+        Relative noise of the synthetic data
+    seed : int, required
+        Random seed
+
+    Returns
+    -------
+    result : dict
+        Benchmark results
+    """
+
+    function, MLJ = paths[name]
+    data = synthetic_EL(noise, seed) if MLJ is None else synthetic_EQE(noise, seed, MLJ=MLJ)
+
+    window_cache.clear()
+
+    tracemalloc.start()
+    with count_Fits() as counter:
+        start_time = time.perf_counter()
+        n_windows, n_batch, recovered = function(data, step)
+        elapsed = time.perf_counter() - start_time
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    # Maximum relative error of recovered parameters of the best fit
+    error = max(float(np.max(np.abs(np.asarray(fit[:len(truth)], dtype=float) - truth) / np.abs(truth)))
+                for fit, truth in recovered.values())
+
+    return {'path': name,
+            'step': step,
+            'windows': n_windows,
+            'time [s]': elapsed,
+            'fits/s': n_windows / elapsed if elapsed > 0 else float('inf'),
+            'restarts/window': max(counter['attempts'] - (n_windows - n_batch), 0) / n_windows if n_windows else 0,
+            'peak memory [MB]': peak_memory / 1e6,
+            'max rel. error': error
+            }
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Benchmark the sEQE fitting paths with synthetic spectra.')
+    parser.add_argument('--paths', nargs='+', default=list(paths), choices=list(paths))
+    parser.add_argument('--steps', nargs='+', type=float, default=[0.05, 0.02, 0.01], help='Fit range resolutions [eV]')
+    parser.add_argument('--noise', type=float, default=0.01, help='Relative noise of the synthetic data')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--tolerance', type=float, default=0.15, help='Maximum relative parameter error')
+    parser.add_argument('--json', help='File to save results to')
+    args = parser.parse_args(argv)
+
+    warnings.filterwarnings('ignore')
+    fit_cache.enabled = False  # Time the fits, not the on-disk cache
+
+    columns = ['path', 'step', 'windows', 'time [s]', 'fits/s', 'restarts/window', 'peak memory [MB]',
+               'max rel. error']
+    print(' | '.join(f'{column:>16}' for column in columns))
+
+    results = []
+    for name in args.paths:
+        for step in args.steps:
+            result = benchmark(name, step, args.noise, args.seed)
+            results.append(result)
+            print(' | '.join(f'{result[column]:>16.4g}' if isinstance(result[column], float)
+                             else f'{result[column]:>16}' for column in columns))
+
+    if args.json is not None:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    failed = [result for result in results if not result['max rel. error'] <= args.tolerance]
+    for result in failed:
+        print(f"Parameter recovery failed: {result['path']} (step {result['step']}): "
+              f"max. relative error {result['max rel. error']:.3g} > {args.tolerance}")
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -16,30 +16,42 @@ import matplotlib.pyplot as plt
 import matplotlib as mpl
 import numpy as np
 import pandas as pd
-import seaborn
 # for the gui
 from PyQt5 import QtWidgets,QtCore
 from PyQt5.QtWidgets import QFileDialog
 from numpy import exp, linspace
 from scipy.optimize import curve_fit
-from tqdm import tqdm
 from collections import defaultdict
 from scipy.interpolate import interp1d
 
 import sEQE_Analysis_template
+from source.adaptive_grid import use_adaptive_heatMap, refine_Grid, fill_Grid
 from source.add_subtract import subtract_Opt
-from source.compilation import compile_EQE, compile_EL, compile_Data
-from source.electroluminescence import bb_spectrum
+from source.bootstrap import use_bootstrap, bootstrap_Fit, format_Bootstrap
+from source.compilation import Spectrum, compile_EQE, compile_Data, feasible_Windows, window_cache
+from source.file_cache import file_cache
+from source.fit_cache import fit_cache
+from source.fit_profile import fit_profiler
+from source.fit_results import FitResults
+from source.electroluminescence import calculate_EL_energy, calculate_reduced_EQE, process_EL, process_EL_files
 from source.gaussian import calculate_gaussian_absorption, calculate_gaussian_disorder_absorption, \
+    calculate_gaussian_absorption_jac, calculate_gaussian_disorder_absorption_jac, calculate_MLJ_replicas, \
     calculate_MLJ_absorption, calculate_MLJ_disorder_absorption, calculate_combined_fit, calculate_combined_fit_MLJ
+from source.global_fit import parameter_names, shared_parameters, fit_Global, format_GlobalFit
+from source.heat_map_file import use_heat_map_file, save_HeatMap, load_HeatMap, name_HeatMap
 from source.normalization import normalize_EQE
-from source.plot import plot, set_up_plot, set_up_EQE_plot, set_up_EL_plot
-from source.reference_correction import calculate_Power
-from source.utils import interpolate, sep_list, get_logger
+from source.posterior import use_posterior, sample_Spectrum, format_Posterior
+from source.plot import plot, set_up_plot, set_up_EQE_plot, set_up_EL_plot, plot_HeatMap
+from source.reference_correction import calculate_Power, calculate_EQE_spectrum
+from source.stitching import stitch_EQE
+from source.task_runner import TaskRunner, fit_task
+from source.utils import sep_list, get_logger
 from source.utils_plot import is_Colour, pick_EQE_Color, pick_EQE_Label, pick_Label
 from source.validity import Ref_Data_is_valid, EQE_is_valid, Data_is_valid, Normalization_is_valid, Fit_is_valid, \
     StartStop_is_valid
-from source.utils_fit import guess_fit, fit_function, calculate_guess_fit, fit_model, fit_model_double, find_best_fit
+from source.utils_fit import guess_fit, fit_function, calculate_guess_fit, fit_model, fit_model_double, find_best_fit, \
+    fit_Windows
+from source.window_search import use_window_search, search_Windows
 from source.utils import R_squared
 
 warnings.filterwarnings("ignore")
@@ -60,6 +72,11 @@ class MainWindow(QtWidgets.QMainWindow):
         # Logger
         self.logger = get_logger()
 
+        # Task runner to run fits off the GUI thread with progress and cancellation in the status bar
+        # NOTE: All input widgets are disabled during a fit, as the fit reads files, temperatures and cached spectra
+        self.task_runner = TaskRunner(self.ui.statusbar,
+                                      widgets=[self.ui.tabWidget, self.ui.actionGlobalFit, self.ui.actionLoadHeatMap])
+
         ## Page 1 - Calculate EQE
         # Dynamically create ref_x and data_x attributes
         for i in range(1, 7):
@@ -138,6 +155,18 @@ class MainWindow(QtWidgets.QMainWindow):
                                  self.ui.stopStart_2, self.ui.stopStop_2, self.ui.textBox_f4,
                                  self.ui.textBox_f5, self.ui.textBox_f6, 2))
 
+        # Handle Save Heat Maps Action
+        self.ui.actionSaveHeatMap.setChecked(use_heat_map_file)
+
+        # Handle Load Heat Map Action
+        self.ui.actionLoadHeatMap.triggered.connect(lambda: self.load_heatMap())
+
+        # Handle Global Fit Action
+        self.ui.actionGlobalFit.triggered.connect(lambda: self.global_fit())
+
+        # Handle Plot EL Files Action
+        self.ui.actionPlotELFiles.triggered.connect(lambda: self.plot_EL_files())
+
         self.ui.clearButton_2.clicked.connect(self.clear_EQE_plot)
 
         ## Page 4 - Extended Fits (Marcus Theory)
@@ -323,6 +352,10 @@ class MainWindow(QtWidgets.QMainWindow):
         # Set floating point precision
         precision = 8  # decimal places
 
+        # Sorted spectra of loaded data, used to compile fit ranges
+        # NOTE: Sorted spectra and cached fit ranges are reset whenever a new file is loaded
+        self.spectra = {}
+
     # -----------------------------------------------------------------------------------------------------------
 
     # Functions to read file and update textbox
@@ -394,136 +427,172 @@ class MainWindow(QtWidgets.QMainWindow):
             text_Box.clear()  # Clear the text box in case sth has been uploaded already
             text_Box.insertPlainText(filename_)  # Insert filename into text box
 
+            self.spectra.clear()  # Reset sorted spectra and cached fit ranges of previously loaded files
+            window_cache.clear()
+
             ## Page 1 - Calculate EQE
 
+            # NOTE: Slots that load the same file share one dataFrame (see FileCache.read).
+            #       Copy a loaded dataFrame before modifying it, e.g. ref_df = ref_df.copy().
+
             # Reference files:
 
             if textBox_no == 1:
-                self.ref_1 = pd.read_csv(file_)  # Turn file into dataFrame
+                self.ref_1 = file_cache.read(file_)  # Turn file into dataFrame (shared if already loaded)
 
             elif textBox_no == 3:
-                self.ref_2 = pd.read_csv(file_)
+                self.ref_2 = file_cache.read(file_)
 
             elif textBox_no == 5:
-                self.ref_3 = pd.read_csv(file_)
+                self.ref_3 = file_cache.read(file_)
 
             elif textBox_no == 7:
-                self.ref_4 = pd.read_csv(file_)
+                self.ref_4 = file_cache.read(file_)
 
             elif textBox_no == 9:
-                self.ref_5 = pd.read_csv(file_)
+                self.ref_5 = file_cache.read(file_)
 
             elif textBox_no == 11:
-                self.ref_6 = pd.read_csv(file_)
+                self.ref_6 = file_cache.read(file_)
 
             # Data files:
 
             elif textBox_no == 2:
-                self.data_1 = pd.read_csv(file_)
+                self.data_1 = file_cache.read(file_)
 
             elif textBox_no == 4:
-                self.data_2 = pd.read_csv(file_)
+                self.data_2 = file_cache.read(file_)
 
             elif textBox_no == 6:
-                self.data_3 = pd.read_csv(file_)
+                self.data_3 = file_cache.read(file_)
 
             elif textBox_no == 8:
-                self.data_4 = pd.read_csv(file_)
+                self.data_4 = file_cache.read(file_)
 
             elif textBox_no == 10:
-                self.data_5 = pd.read_csv(file_)
+                self.data_5 = file_cache.read(file_)
 
             elif textBox_no == 12:
-                self.data_6 = pd.read_csv(file_)
+                self.data_6 = file_cache.read(file_)
 
             ## Page 2 - Plot EQE
 
             elif textBox_no == 'p1':
-                self.EQE_1 = pd.read_csv(file_)
+                self.EQE_1 = file_cache.read(file_)
 
             elif textBox_no == 'p4':
-                self.EQE_2 = pd.read_csv(file_)
+                self.EQE_2 = file_cache.read(file_)
 
             elif textBox_no == 'p7':
-                self.EQE_3 = pd.read_csv(file_)
+                self.EQE_3 = file_cache.read(file_)
 
             elif textBox_no == 'p10':
-                self.EQE_4 = pd.read_csv(file_)
+                self.EQE_4 = file_cache.read(file_)
 
             elif textBox_no == 'p13':
-                self.EQE_5 = pd.read_csv(file_)
+                self.EQE_5 = file_cache.read(file_)
 
             elif textBox_no == 'p16':
-                self.EQE_6 = pd.read_csv(file_)
+                self.EQE_6 = file_cache.read(file_)
 
             elif textBox_no == 'p19':
-                self.EQE_7 = pd.read_csv(file_)
+                self.EQE_7 = file_cache.read(file_)
 
             elif textBox_no == 'p22':
-                self.EQE_8 = pd.read_csv(file_)
+                self.EQE_8 = file_cache.read(file_)
 
             elif textBox_no == 'p25':
-                self.EQE_9 = pd.read_csv(file_)
+                self.EQE_9 = file_cache.read(file_)
 
             elif textBox_no == 'p28':
-                self.EQE_10 = pd.read_csv(file_)
+                self.EQE_10 = file_cache.read(file_)
 
             ## Page 3 - Fit EQE (Marcus Theory)
 
             elif textBox_no == 'f1':
-                self.data_fit_1 = pd.read_csv(file_)
+                self.data_fit_1 = file_cache.read(file_)
 
             elif textBox_no == 'f4':
-                self.data_fit_2 = pd.read_csv(file_)
+                self.data_fit_2 = file_cache.read(file_)
 
             ## Page 4 - Extended Fits (Marcus Theory)
 
             # For Double Fits
 
             elif textBox_no == 'double1':
-                self.data_double = pd.read_csv(file_)
+                self.data_double = file_cache.read(file_)
 
             # For Simultaneous Fits
 
             elif textBox_no == 'sim':
-                self.data_sim = pd.read_csv(file_)
+                self.data_sim = file_cache.read(file_)
 
             ## Page 5 - Fit EQE (MLJ Theory)
 
             elif textBox_no == 'xF1':
-                self.data_xFit_1 = pd.read_csv(file_)
+                self.data_xFit_1 = file_cache.read(file_)
 
             elif textBox_no == 'xDF1':
-                self.data_extraDouble = pd.read_csv(file_)
+                self.data_extraDouble = file_cache.read(file_)
 
             ## Page 6 - Fit EL and EQE
 
             elif textBox_no == 'el1':
-                self.EL = pd.read_table(file_, sep=',', index_col=0)
+                self.EL = file_cache.read(file_, index_col=0)
 
             elif textBox_no == 'el2':
-                self.EL_EQE = pd.read_csv(file_)
+                self.EL_EQE = file_cache.read(file_)
 
             ## Page 7 - Subtract and Add Peak Fits
 
             # Subtract Peak Fits
 
             elif textBox_no == 'sub1':
-                self.data_subFit = pd.read_csv(file_)
+                self.data_subFit = file_cache.read(file_)
 
             elif textBox_no == 'sub2':
-                self.data_subEQE = pd.read_csv(file_)
+                self.data_subEQE = file_cache.read(file_)
 
             # Add Peak Fits
 
             elif textBox_no == 'add1':
-                self.data_addOptFit = pd.read_csv(file_)
+                self.data_addOptFit = file_cache.read(file_)
 
             elif textBox_no == 'add2':
-                self.data_addCTFit = pd.read_csv(file_)
+                self.data_addCTFit = file_cache.read(file_)
 
             elif textBox_no == 'add3':
-                self.data_addEQE = pd.read_csv(file_)
+                self.data_addEQE = file_cache.read(file_)
+
+    # -----------------------------------------------------------------------------------------------------------
+
+    # Function to look up sorted spectrum of loaded data
+
+    def get_spectrum(self,
+                     data_df
+                     ):
+        """Function to look up sorted spectrum of loaded data
+
+        Parameters
+        ----------
+        data_df : dataFrame, required
+            Loaded EQE or EL data
+
+        Returns
+        -------
+        spectrum : Spectrum
+            Spectrum sorted by energy
+            If no data has been loaded, data_df is returned unchanged
+        """
+
+        if len(data_df) == 0:
+            return data_df
+
+        data_id = id(data_df)
+        if data_id not in self.spectra or self.spectra[data_id][0] is not data_df:
+            self.spectra[data_id] = (data_df, Spectrum.from_df(data_df))  # Keep dataFrame to hold on to its id
+
+        return self.spectra[data_id][1]
 
     # -----------------------------------------------------------------------------------------------------------
     # -----------------------------------------------------------------------------------------------------------
@@ -599,7 +668,6 @@ class MainWindow(QtWidgets.QMainWindow):
         None
         """
 
-        power_dict = {}
         Wavelength = []
         Energy = []
         EQE = []
@@ -608,6 +676,7 @@ class MainWindow(QtWidgets.QMainWindow):
         if 'Power' not in ref_df.columns:
 
             self.logger.info('Calculating power values.')
+            ref_df = ref_df.copy()  # Keep the loaded dataFrame unchanged as it may be shared (see file_cache)
 
             if range_no == 1:
                 if self.ui.Range1_Si_button.isChecked() and not self.ui.Range1_InGaAs_button.isChecked():
@@ -694,39 +763,7 @@ class MainWindow(QtWidgets.QMainWindow):
                     self.logger.error('Please select a valid reference diode.')
 
         if 'Power' in ref_df.columns:  # Check if the power has been calculated already
-
-            for x in range(len(ref_df['Wavelength'])):  # Iterate through columns of reference file
-                power_dict[ref_df['Wavelength'][x]] = ref_df['Power'][
-                    x]  # Add wavelength and corresponding power to dictionary
-
-            for y in range(len(data_df['Wavelength'])):  # Iterate through columns of data file
-                if startNM <= data_df['Wavelength'][y] <= stopNM:  # Calculate EQE if start <= wave <= stop, else ignore
-
-                    if data_df['Wavelength'][y] in power_dict.keys():  # Check if data wavelength is in reference file
-                        Wavelength.append(data_df['Wavelength'][y])
-                        Energy_val = (self.h * self.c) / (
-                                data_df['Wavelength'][y] * math.pow(10, -9) * self.q)  # Calculate energy in eV
-                        Energy.append(Energy_val)
-                        EQE_val = (data_df['Mean Current'][y] * Energy_val) / (
-                            power_dict[data_df['Wavelength'][y]])  # Easier way to calculate EQE
-                        # EQE_val = ((data_df['Mean Current'][y] * self.h * self.c) / (
-                        #   data_df['Wavelength'][y] * math.pow(10,-9) * power_dict[data_df['Wavelength'][y]] * self.q))
-                        # EQE_val = (100 * data_df['Mean Current'][y] * Energy_val) / (
-                        #   power_dict[data_df['Wavelength'][y]]) # *100 to turn into percent
-                        EQE.append(EQE_val)
-                        log_EQE.append(math.log10(EQE_val))
-
-                    else:  # If data wavelength is not in reference file
-                        Wavelength.append(data_df['Wavelength'][y])
-                        Energy_val = (self.h * self.c) / (data_df['Wavelength'][y] * math.pow(10, -9) * self.q)
-                        Energy.append(Energy_val)
-                        Power_int = interpolate(data_df['Wavelength'][y], ref_df['Wavelength'],
-                                                ref_df['Power'])  # Interpolate power
-                        EQE_int = (data_df['Mean Current'][y] * Energy_val) / (Power_int)
-                        # EQE_int = ((data_df['Mean Current'][y] * self.h * self.c) / (
-                        #         data_df['Wavelength'][y] * math.pow(10,-9) * Power_int * self.q))
-                        EQE.append(EQE_int)
-                        log_EQE.append(math.log10(EQE_int))
+            Wavelength, Energy, EQE, log_EQE = calculate_EQE_spectrum(ref_df, data_df, startNM, stopNM)
 
         if len(Wavelength) == len(EQE) and len(Energy) == len(log_EQE):  # Check if the lists have the same length
 
@@ -741,7 +778,7 @@ class MainWindow(QtWidgets.QMainWindow):
                 label_ = pick_Label(range_no, startNM, stopNM)
 
                 self.ax1.plot(Wavelength, EQE, linewidth=3, label=label_)
-                self.ax2.semilogy(Wavelength, [10**x for x in log_EQE], linewidth=3)
+                self.ax2.semilogy(Wavelength, np.power(10, log_EQE), linewidth=3)
                 #self.ax2.plot(Wavelength, log_EQE, linewidth=3)  # Equivalent to the line above but with proper log scale axes
                 self.ax1.legend()
                 plt.draw()
@@ -774,11 +811,7 @@ class MainWindow(QtWidgets.QMainWindow):
         ok_5 = True
         ok_6 = True
 
-        columns = ['Wavelength', 'Energy', 'EQE', 'Log_EQE']  # Columns for dataFrame
-
-        export_file = pd.DataFrame(columns=columns)  # Create empty dataFrame
-
-        wave_inc = {}  # create empty dictionary
+        export_ranges = []  # Create empty list for the EQE dataFrames of each range
 
         if self.ui.exportBox_1.isChecked():  # If the checkBox is checked
             startNM1 = self.ui.startNM_1.value()  # Pick start wavelength
@@ -787,7 +820,7 @@ class MainWindow(QtWidgets.QMainWindow):
                 Wave_1, Energy_1, EQE_1, log_EQE_1 = self.calculate_EQE(self.ref_1, self.data_1, startNM1, stopNM1,1)  # Extract data
                 export_1 = pd.DataFrame({'Wavelength': Wave_1, 'Energy': Energy_1, 'EQE': EQE_1,
                                          'Log_EQE': log_EQE_1})  # Create dataFrame with EQE data
-                wave_inc['1'] = Wave_1[0]  # Add the first wavelength value to the wave_inc list
+                export_ranges.append(export_1)  # Add the dataFrame to the list of ranges to stitch
             else:
                 ok_1 = False  # Set variable to False if calculation is invalid
 
@@ -797,7 +830,7 @@ class MainWindow(QtWidgets.QMainWindow):
             if Ref_Data_is_valid(self.ref_2, self.data_2, startNM2, stopNM2, 2):
                 Wave_2, Energy_2, EQE_2, log_EQE_2 = self.calculate_EQE(self.ref_2, self.data_2, startNM2, stopNM2, 2)
                 export_2 = pd.DataFrame({'Wavelength': Wave_2, 'Energy': Energy_2, 'EQE': EQE_2, 'Log_EQE': log_EQE_2})
-                wave_inc['2'] = Wave_2[0]
+                export_ranges.append(export_2)
             else:
                 ok_2 = False
 
@@ -807,7 +840,7 @@ class MainWindow(QtWidgets.QMainWindow):
             if Ref_Data_is_valid(self.ref_3, self.data_3, startNM3, stopNM3, 3):
                 Wave_3, Energy_3, EQE_3, log_EQE_3 = self.calculate_EQE(self.ref_3, self.data_3, startNM3, stopNM3, 3)
                 export_3 = pd.DataFrame({'Wavelength': Wave_3, 'Energy': Energy_3, 'EQE': EQE_3, 'Log_EQE': log_EQE_3})
-                wave_inc['3'] = Wave_3[0]
+                export_ranges.append(export_3)
             else:
                 ok_3 = False
 
@@ -817,7 +850,7 @@ class MainWindow(QtWidgets.QMainWindow):
             if Ref_Data_is_valid(self.ref_4, self.data_4, startNM4, stopNM4, 4):
                 Wave_4, Energy_4, EQE_4, log_EQE_4 = self.calculate_EQE(self.ref_4, self.data_4, startNM4, stopNM4, 4)
                 export_4 = pd.DataFrame({'Wavelength': Wave_4, 'Energy': Energy_4, 'EQE': EQE_4, 'Log_EQE': log_EQE_4})
-                wave_inc['4'] = Wave_4[0]
+                export_ranges.append(export_4)
             else:
                 ok_4 = False
 
@@ -827,7 +860,7 @@ class MainWindow(QtWidgets.QMainWindow):
             if Ref_Data_is_valid(self.ref_5, self.data_5, startNM5, stopNM5, 5):
                 Wave_5, Energy_5, EQE_5, log_EQE_5 = self.calculate_EQE(self.ref_5, self.data_5, startNM5, stopNM5, 5)
                 export_5 = pd.DataFrame({'Wavelength': Wave_5, 'Energy': Energy_5, 'EQE': EQE_5, 'Log_EQE': log_EQE_5})
-                wave_inc['5'] = Wave_5[0]
+                export_ranges.append(export_5)
             else:
                 ok_5 = False
 
@@ -837,28 +870,14 @@ class MainWindow(QtWidgets.QMainWindow):
             if Ref_Data_is_valid(self.ref_6, self.data_6, startNM6, stopNM6, 6):
                 Wave_6, Energy_6, EQE_6, log_EQE_6 = self.calculate_EQE(self.ref_6, self.data_6, startNM6, stopNM6, 6)
                 export_6 = pd.DataFrame({'Wavelength': Wave_6, 'Energy': Energy_6, 'EQE': EQE_6, 'Log_EQE': log_EQE_6})
-                wave_inc['6'] = Wave_6[0]
+                export_ranges.append(export_6)
             else:
                 ok_6 = False
 
         if ok_1 and ok_2 and ok_3 and ok_4 and ok_5 and ok_6:  # Check if all operations are ok or if fields are empty
 
-            for x in range(len(wave_inc.keys())):  # Iterate through wave_inc list
-                minimum = min(wave_inc, key=wave_inc.get)  # Find key corresponding to minimum value
-                if minimum == '1':  # Append correct dataFrame in order of decending wavelength
-                    export_file = export_file.append(export_1, ignore_index=True)
-                elif minimum == '2':
-                    export_file = export_file.append(export_2, ignore_index=True)
-                elif minimum == '3':
-                    export_file = export_file.append(export_3, ignore_index=True)
-                elif minimum == '4':
-                    export_file = export_file.append(export_4, ignore_index=True)
-                elif minimum == '5':
-                    export_file = export_file.append(export_5, ignore_index=True)
-                elif minimum == '6':
-                    export_file = export_file.append(export_6, ignore_index=True)
-
-                del wave_inc[minimum]  # Delete recently appended value
+            # Merge all ranges into one spectrum (see stitching.py for overlap handling)
+            export_file = stitch_EQE(export_ranges)
 
             # EQE_file = filedialog.asksaveasfilename() old tk version
             # Prompt the user to pick a folder & name to save data to
@@ -1240,6 +1259,8 @@ class MainWindow(QtWidgets.QMainWindow):
                                                                 startE=startFit,
                                                                 stopE=stopFit,
                                                                 function=self.gaussian_disorder,
+                                                                jac=self.gaussian_disorder_jac,
+                                                                T=self.T_CT,
                                                                 guessRange=ECT_guess,
                                                                 guessRange_sig=Sig_guess,
                                                                 include_disorder=True,
@@ -1260,6 +1281,8 @@ class MainWindow(QtWidgets.QMainWindow):
                                                                 startE=startFit,
                                                                 stopE=stopFit,
                                                                 function=self.gaussian,
+                                                                jac=self.gaussian_jac,
+                                                                T=self.T_CT,
                                                                 guessRange=ECT_guess,
                                                                 guessRange_sig=Sig_guess,
                                                                 include_disorder=False,
@@ -1302,6 +1325,26 @@ class MainWindow(QtWidgets.QMainWindow):
 
                     print('R2 : ', format(r_squared, '.6f'))
                     print('-' * 80)
+
+                    if use_bootstrap:  # Estimate bootstrap confidence intervals
+                        print(format_Bootstrap(bootstrap_Fit(eqe=eqe_df,
+                                                             startE=startFit,
+                                                             stopE=stopFit,
+                                                             best_vals=best_vals,
+                                                             T=self.T_CT,
+                                                             include_disorder=include_Disorder
+                                                             )))
+                        print('-' * 80)
+
+                    if use_posterior and not fit_opticalPeak:  # Sample the posterior of the CT state fit
+                        print(format_Posterior(sample_Spectrum(eqe=eqe_df,
+                                                               startE=startFit,
+                                                               stopE=stopFit,
+                                                               T=self.T_CT,
+                                                               p0=best_vals,
+                                                               include_disorder=include_Disorder
+                                                               )))
+                        print('-' * 80)
                     print("")
 
                     # Plot EQE data and CT fit
@@ -1564,6 +1607,7 @@ class MainWindow(QtWidgets.QMainWindow):
 
     # Function to generate heat map of fitting values
 
+    @fit_task
     def heatMap(self,
                 eqe_df,
                 startStartE,
@@ -1603,6 +1647,8 @@ class MainWindow(QtWidgets.QMainWindow):
         None
         """
 
+        fit_profiler.reset()  # Record fit statistics of this run
+
         include_Disorder = False
         fit_opticalPeak = False
 
@@ -1639,6 +1685,8 @@ class MainWindow(QtWidgets.QMainWindow):
                 stopEnergies.append(round(y, 3))
                 y += 0.005
 
+            eqe_df = self.get_spectrum(eqe_df)  # Sort EQE once to compile each fit range by binary search
+
             # Fit EQE (Marcus Theory)
             if (str(file_no)).isnumeric():
 
@@ -1677,53 +1725,38 @@ class MainWindow(QtWidgets.QMainWindow):
                 # Sig_guess = np.round(np.arange(guessStart_sig, guessStop_sig + 0.05, 0.05), 3).tolist()
                 Sig_guess = [round(guessStart_sig, 3), round(guessStop_sig, 3)]
 
-                for start in tqdm(startEnergies):  # Iterate through start energies
-                    for stop in tqdm(stopEnergies):  # Iterate through stop energies
-                        if include_Disorder:
-                            best_vals, covar, p0, r_squared = guess_fit(eqe=eqe_df,
-                                                                        startE=start,
-                                                                        stopE=stop,
-                                                                        function=self.gaussian_disorder,
-                                                                        guessRange=ECT_guess,
-                                                                        guessRange_sig=Sig_guess,
-                                                                        include_disorder=True,
-                                                                        bounds=True  # to use fit model
-                                                                        )
-
-                            if r_squared > 0:
-                                start_df.append(start)
-                                stop_df.append(stop)
-                                f_df.append(best_vals[0])
-                                l_df.append(best_vals[1])
-                                Ect_df.append(best_vals[2])
-                                sig_df.append(best_vals[3])
-                                R_df.append(r_squared)
-                            else:
-                                self.logger.info('Optimal parameters not found.')
+                # Function to fit a list of start / stop windows
+                def fit_windows(windows):
+                    stops = defaultdict(list)
+                    for start, stop in windows:
+                        stops[start].append(stop)
+
+                    fits = {}
+                    self.task_runner.add(len(windows))
+                    for start in stops:  # Iterate through start energies
+
+                        # Fit all stop energies of this start energy at once
+                        best_vals, covar, r_squared = fit_Windows(eqe=eqe_df,
+                                                                  windows=[(start, stop) for stop in stops[start]],
+                                                                  function=self.gaussian_disorder if include_Disorder
+                                                                  else self.gaussian,
+                                                                  jac=self.gaussian_disorder_jac if include_Disorder
+                                                                  else self.gaussian_jac,
+                                                                  T=self.T_CT,
+                                                                  guessRange=ECT_guess,
+                                                                  guessRange_sig=Sig_guess,
+                                                                  include_disorder=include_Disorder,
+                                                                  check=self.task_runner.check
+                                                                  )
+                        for y, stop in enumerate(stops[start]):  # Iterate through stop energies
+                            fits[(start, stop)] = (best_vals[y], r_squared[y])
 
-                        else:
-                            best_vals, covar, p0, r_squared = guess_fit(eqe=eqe_df,
-                                                                        startE=start,
-                                                                        stopE=stop,
-                                                                        function=self.gaussian,
-                                                                        guessRange=ECT_guess,
-                                                                        guessRange_sig=Sig_guess,
-                                                                        include_disorder=False,
-                                                                        bounds=None  # to use fit function
-                                                                        )
+                        self.task_runner.step(len(stops[start]))
 
-                            if r_squared > 0:
-                                start_df.append(start)
-                                stop_df.append(stop)
-                                f_df.append(best_vals[0])
-                                l_df.append(best_vals[1])
-                                Ect_df.append(best_vals[2])
-                                R_df.append(r_squared)
-                            else:
-                                self.logger.info('Optimal parameters not found.')
+                    return [fits[window] for window in windows]
 
             # Fit EQE (MLJ Theory)
-            elif file_no == 'x1':
+            else:  # file_no == 'x1'
 
                 self.S_i = self.ui.Huang_Rhys.value()
                 self.hbarw_i = self.ui.vib_Energy.value()
@@ -1742,43 +1775,37 @@ class MainWindow(QtWidgets.QMainWindow):
                 # Sig_guess = np.round(np.arange(guessStart_sig, guessStop_sig + 0.05, 0.05), 3).tolist()
                 Sig_guess = [round(guessStart_sig, 3), round(guessStop_sig, 3)]
 
-                for start in tqdm(startEnergies):  # Iterate through start energies
-                    for stop in tqdm(stopEnergies):  # Iterate through stop energies
-
-                        wave_fit, energy_fit, eqe_fit, log_eqe_fit = compile_EQE(eqe_df,
-                                                                                 start,
-                                                                                 stop,
-                                                                                 1)
+                # Function to fit a list of start / stop windows
+                def fit_windows(windows):
+                    fits = []
+                    for start, stop in self.task_runner.track(windows):  # Iterate through start / stop energies
                         if include_Disorder:
+                            wave_fit, energy_fit, eqe_fit, log_eqe_fit = compile_EQE(eqe_df,
+                                                                                     start,
+                                                                                     stop,
+                                                                                     1)
+                            best_vals = [0, 0, 0, 0]
+                            r_squared = 0
                             # NOTE: This code could be replaced by the guess fit function
                             for ECT in ECT_guess:
                                 for sig in Sig_guess:
-                                    r_squared = 0
                                     try:
                                         best_vals, covar, y_fit, r_squared = fit_function(self.MLJ_gaussian_disorder,
                                                                                           energy_fit,
                                                                                           eqe_fit,
-                                                                                          p0=p0,
-                                                                                          bounds=bounds,
-                                                                                          include_disorder=include_Disorder
+                                                                                          p0=[self.f_guess,
+                                                                                              self.l_guess,
+                                                                                              round(ECT, 3),
+                                                                                              round(sig, 3)],
+                                                                                          bounds=self.bounds_sig,
+                                                                                          include_disorder=True
                                                                                           )
                                     except:
-                                        p0 = [self.f_guess, self.l_guess, round(ECT, 3), round(sig, 3)]
-                                        bounds = self.bounds_sig
-                                        if ECT == ECT_guess[-1]:
-                                            self.logger.info('Optimal parameters not found.')
+                                        r_squared = 0
                                     if r_squared > 0:
-                                        start_df.append(start)
-                                        stop_df.append(stop)
-                                        f_df.append(best_vals[0])
-                                        l_df.append(best_vals[1])
-                                        Ect_df.append(best_vals[2])
-                                        sig_df.append(best_vals[3])
-                                        R_df.append(r_squared)
                                         break
                                 if r_squared > 0:  # To break the second loop
                                     break
-
                         else:
                             best_vals, covar, p0, r_squared = guess_fit(eqe=eqe_df,
                                                                         startE=start,
@@ -1789,16 +1816,45 @@ class MainWindow(QtWidgets.QMainWindow):
                                                                         include_disorder=False,
                                                                         bounds=None  # to use fit function
                                                                         )
+                        fits.append((best_vals, r_squared))
 
-                            if r_squared > 0:
-                                start_df.append(start)
-                                stop_df.append(stop)
-                                f_df.append(best_vals[0])
-                                l_df.append(best_vals[1])
-                                Ect_df.append(best_vals[2])
-                                R_df.append(r_squared)
-                            else:
-                                self.logger.info('Optimal parameters not found.')
+                    return fits
+
+            # Skip fit ranges with too few data points
+            feasible = feasible_Windows(eqe_df,
+                                        *np.meshgrid(startEnergies, stopEnergies, indexing='ij'),
+                                        n_params=4 if include_Disorder else 3
+                                        )
+
+            if use_adaptive_heatMap:  # Refine a coarse grid where R2 is high or parameters change steeply
+                fits = self.task_runner.run(lambda: refine_Grid(startEnergies, stopEnergies, fit_windows, feasible),
+                                            label='Heat map fits'
+                                            )
+                self.logger.info(f'Adaptive heat map: fitted {len(fits)} of {feasible.size} fit ranges.')
+            else:
+                fit_ranges = [(start, stop) for x, start in enumerate(startEnergies)
+                              for y, stop in enumerate(stopEnergies) if feasible[x, y]]
+                fits = dict(zip(fit_ranges, self.task_runner.run(lambda: fit_windows(fit_ranges),
+                                                                 label='Heat map fits'
+                                                                 )))
+
+            for (start, stop), (best_vals, r_squared) in fits.items():
+                if r_squared > 0:
+                    start_df.append(start)
+                    stop_df.append(stop)
+                    f_df.append(best_vals[0])
+                    l_df.append(best_vals[1])
+                    Ect_df.append(best_vals[2])
+                    if include_Disorder:
+                        sig_df.append(best_vals[3])
+                    R_df.append(r_squared)
+                else:
+                    self.logger.info('Optimal parameters not found.')
+
+            self.logger.info(window_cache.summary())
+            fit_cache.flush()
+            self.logger.info(fit_cache.summary())
+            self.logger.info(fit_profiler.report())
 
             if len(R_df) != 0:  # Check that there are results to plot
 
@@ -1820,166 +1876,380 @@ class MainWindow(QtWidgets.QMainWindow):
                          'Ect': Ect_df,
                          'R_Squared': R_df})
 
-                max_index = parameter_df[parameter_df['R_Squared'] == max(parameter_df['R_Squared'])].index.values[0]
-
                 self.logger.info('Fit Results: ')
                 print("")
-                print('-' * 80)
-                if file_no == 'x1':
-                    print('Temperature [T] (K) : ', self.T_x)
+                max_index = self.report_heatMap(parameter_df,
+                                                T=self.T_x if file_no == 'x1' else self.T_CT,
+                                                fit_opticalPeak=fit_opticalPeak,
+                                                include_Disorder=include_Disorder,
+                                                adaptive=use_adaptive_heatMap
+                                                )
+
+                # Estimate bootstrap confidence intervals of the fit range with the highest R squared
+                if use_bootstrap and file_no != 'x1':
+                    print(format_Bootstrap(bootstrap_Fit(eqe=eqe_df,
+                                                         startE=parameter_df['Start'][max_index],
+                                                         stopE=parameter_df['Stop'][max_index],
+                                                         best_vals=parameter_df.loc[max_index, ['f', 'l', 'Ect'] +
+                                                                                    ['Sig'] * include_Disorder],
+                                                         T=self.T_CT,
+                                                         include_disorder=include_Disorder
+                                                         )))
+                    print('-' * 80)
+                print("")
+
+                # Fill fit ranges that were not refined with the nearest fit to plot the full resolution grid
+                if use_adaptive_heatMap:
+                    filled = fill_Grid(fits, startEnergies, stopEnergies, feasible)
+                    filled_df = pd.DataFrame([[start, stop, best_vals[0], best_vals[1], best_vals[2], r_squared]
+                                              + ([best_vals[3]] if include_Disorder else [])
+                                              for (start, stop), (best_vals, r_squared) in filled.items()],
+                                             columns=parameter_df.columns)
+                    heat_df = pd.concat([parameter_df.assign(Fitted=True), filled_df.assign(Fitted=False)],
+                                        ignore_index=True)
                 else:
-                    print('Temperature [T] (K) : ', self.T_CT)
+                    heat_df = parameter_df
+
+                # Save heat map run to replot it later without fitting (see load_heatMap)
+                if self.ui.actionSaveHeatMap.isChecked():
+                    heat_map_file, _ = QFileDialog.getSaveFileName(caption="Save Heat Map",
+                                                                   directory=name_HeatMap(pick_EQE_Label(label_Box,
+                                                                                                         filename_Box)),
+                                                                   filter="Heat Map Files (*.npz)")
+                    if len(heat_map_file) != 0:  # Check if the user actually selected a path
+                        try:
+                            heat_map_file = save_HeatMap(heat_map_file,
+                                                         parameter_df,
+                                                         heat_df,
+                                                         metadata={'label': pick_EQE_Label(label_Box, filename_Box),
+                                                                   'T': self.T_x if file_no == 'x1' else self.T_CT,
+                                                                   'fit_opticalPeak': fit_opticalPeak,
+                                                                   'include_Disorder': include_Disorder,
+                                                                   'MLJ': file_no == 'x1',
+                                                                   'adaptive': use_adaptive_heatMap
+                                                                   }
+                                                         )
+                            self.logger.info('Saving heat map to: %s' % heat_map_file)
+                            fit_profiler.save(os.path.splitext(heat_map_file)[0])
+                        except OSError as e:
+                            self.logger.error(f'Heat map could not be saved: {e}')
+
+                self.plot_heatMap(heat_df,
+                                  fit_opticalPeak=fit_opticalPeak,
+                                  include_Disorder=include_Disorder
+                                  )
 
-                print('Average Oscillator Strength [f] (eV**2) : ', format(parameter_df['f'].mean(), '.6f'), '+/-',
-                      format(parameter_df['f'].std(), '.6f'))  # Determine the average value and standard deviation
-                print('Average Reorganization Energy [l] (eV) : ', format(parameter_df['l'].mean(), '.6f'), '+/-',
-                      format(parameter_df['l'].std(), '.6f'))
+            else:
+                self.logger.info('No fits determined.')
 
-                if fit_opticalPeak:
-                    print('Average Optical Peak Energy [E_Opt] (eV) : ', format(parameter_df['Ect'].mean(), '.6f'),'+/-',
-                          format(parameter_df['Ect'].std(), '.6f'))
-                else:
-                    print('Average CT State Energy [ECT] (eV) : ', format(parameter_df['Ect'].mean(), '.6f'), '+/-',
-                          format(parameter_df['Ect'].std(), '.6f'))
+    # -----------------------------------------------------------------------------------------------------------
 
-                if include_Disorder:
-                    print('Average Sigma [Sig] (eV) : ', format(parameter_df['Sig'].mean(), '.6f'), '+/-',
-                          format(parameter_df['Sig'].std(), '.6f'))
-                    if file_no == 'x1':
-                        Average_W = parameter_df['l'].mean() * self.T_x + (parameter_df['Sig'].mean() ** 2) / (
-                                2 * self.k)
-                    else:
-                        Average_W = parameter_df['l'].mean() * self.T_CT + (parameter_df['Sig'].mean() ** 2) / (
-                                2 * self.k)
-                    print('Average Gaussian Variance [W] (eV K) : ', format(Average_W, '.2f'))
+    # Function to print heat map summary statistics
 
-                print('Average R2 : ', format(parameter_df['R_Squared'].mean(), '.6f'), '+/-',
-                      format(parameter_df['R_Squared'].std(), '.6f'))
+    def report_heatMap(self,
+                       parameter_df,
+                       T,
+                       fit_opticalPeak=False,
+                       include_Disorder=False,
+                       adaptive=False
+                       ):
+        """Function to print the summary statistics of a heat map
 
-                print('-' * 80)
+        Parameters
+        ----------
+        parameter_df : DataFrame, required
+            Fitted fit ranges with columns ['Start', 'Stop', 'f', 'l', 'Ect', 'R_Squared'(, 'Sig')]
+        T : float, required
+            Temperature [K]
+        fit_opticalPeak : bool, optional
+            Boolean value specifying whether the optical peak was fitted
+        include_Disorder : bool, optional
+            Boolean value specifying whether disorder was included
+        adaptive : bool, optional
+            Boolean value specifying whether the heat map was refined adaptively (see refine_Grid)
 
-                if max(parameter_df['R_Squared']) == 1.0:
-                    print('Max R_squared : ', format(max(parameter_df['R_Squared']), '.6f'))
-                    print('Start Energies (eV) : ',
-                          np.array(parameter_df['Start'][parameter_df['R_Squared'] == 1.0]).tolist())
-                    print('Stop Energies (eV) : ',
-                          np.array(parameter_df['Stop'][parameter_df['R_Squared'] == 1.0]).tolist())
-                    print('Average Oscillator Strength [f] (eV**2) : ',
-                          format(parameter_df['f'][parameter_df['R_Squared'] == 1.0].mean(), '.6f'), '+/-',
-                          format(parameter_df['f'][parameter_df['R_Squared'] == 1.0].std(), '.6f'))
-                    print('Average Reorganization Energy [l] (eV) : ',
-                          format(parameter_df['l'][parameter_df['R_Squared'] == 1.0].mean(), '.6f'), '+/-',
-                          format(parameter_df['l'][parameter_df['R_Squared'] == 1.0].std(), '.6f'))
-                    if fit_opticalPeak:
-                        print('Average Optical Peak Energy [E_Opt] (eV) : ',
-                              format(parameter_df['Ect'][parameter_df['R_Squared'] == 1.0].mean(), '.6f'), '+/-',
-                              format(parameter_df['Ect'][parameter_df['R_Squared'] == 1.0].std(), '.6f'))
-                    else:
-                        print('Average CT State Energy [ECT] (eV) : ',
-                              format(parameter_df['Ect'][parameter_df['R_Squared'] == 1.0].mean(), '.6f'), '+/-',
-                              format(parameter_df['Ect'][parameter_df['R_Squared'] == 1.0].std(), '.6f'))
+        Returns
+        -------
+        max_index : int
+            Index of the fit range with the highest R squared
+        """
 
-                    if include_Disorder:
-                        print('Average Sigma [Sig] (eV) : ',
-                              format(parameter_df['Sig'][parameter_df['R_Squared'] == 1.0].mean(), '.6f'), '+/-',
-                              format(parameter_df['Sig'][parameter_df['R_Squared'] == 1.0].std(), '.6f'))
-                        if file_no == 'x1':
-                            Average_W = parameter_df['l'][parameter_df['R_Squared'] == 1.0].mean() * self.T_x + (
-                                    parameter_df['Sig'][parameter_df['R_Squared'] == 1.0].mean() ** 2) / (2 * self.k)
-                        else:
-                            Average_W = parameter_df['l'][parameter_df['R_Squared'] == 1.0].mean() * self.T_CT + (
-                                    parameter_df['Sig'][parameter_df['R_Squared'] == 1.0].mean() ** 2) / (2 * self.k)
-                        print('Average Gaussian Variance [W] (eV K) : ', format(Average_W, '.2f'))
+        max_index = parameter_df[parameter_df['R_Squared'] == max(parameter_df['R_Squared'])].index.values[0]
 
-                else:
-                    print('Max R_squared : ', format(max(parameter_df['R_Squared']), '.6f'))
-                    print('Start Energy (eV) : ', parameter_df['Start'][max_index])
-                    print('Stop Energy (eV) : ', parameter_df['Stop'][max_index])
-                print('-' * 80)
-                print("")
+        print('-' * 80)
+        if adaptive:
+            print(f'Adaptive heat map: statistics of the {len(parameter_df)} refined fit ranges only '
+                  f'(biased towards high R2)')
+        print('Temperature [T] (K) : ', T)
 
-                # Pivot dataFrame: x-value = Stop, y-value = Start, value = f
-                f_df = parameter_df.pivot('Stop', 'Start', 'f')
-                l_df = parameter_df.pivot('Stop', 'Start', 'l')
-                Ect_df = parameter_df.pivot('Stop', 'Start', 'Ect')
-                R_df = parameter_df.pivot('Stop', 'Start', 'R_Squared')
-
-                plt.ion()
-                plt.figure(figsize=(11, 9))  # Create a new figure
-                self.heatmap_1 = seaborn.heatmap(f_df, xticklabels=3, yticklabels=3)  # Create the heat map
-                plt.xlabel('Initial Energy Value (eV)', fontsize=17, fontweight='medium')
-                plt.ylabel('Final Energy Value (eV)', fontsize=17, fontweight='medium')
-                plt.title('Oscillator Strength ($eV^2$)', fontsize=17, fontweight='medium')
-                cbar = self.heatmap_1.collections[0].colorbar
-                cbar.ax.tick_params(labelsize=15)
-                plt.yticks(rotation=360)
-                plt.xticks(rotation=90)
-                plt.tick_params(labelsize=15, direction='in', axis='both', which='major', length=8, width=2)
-                # plt.tick_params(labelsize=15, direction='in', axis='both', which='minor', length=4, width=2)
-                plt.show()
-
-                plt.ion()
-                plt.figure(figsize=(11, 9))
-                self.heatmap_2 = seaborn.heatmap(l_df, xticklabels=3, yticklabels=3)
-                plt.xlabel('Initial Energy Value (eV)', fontsize=17, fontweight='medium')
-                plt.ylabel('Final Energy Value (eV)', fontsize=17, fontweight='medium')
-                plt.title('Reorganization Energy (eV)', fontsize=17, fontweight='medium')
-                cbar = self.heatmap_2.collections[0].colorbar
-                cbar.ax.tick_params(labelsize=15)
-                plt.yticks(rotation=360)
-                plt.xticks(rotation=90)
-                plt.tick_params(labelsize=15, direction='in', axis='both', which='major', length=8, width=2)
-                plt.show()
-
-                plt.ion()
-                plt.figure(figsize=(11, 9))
-                self.heatmap_3 = seaborn.heatmap(Ect_df, xticklabels=3, yticklabels=3)
-                plt.xlabel('Initial Energy Value (eV)', fontsize=17, fontweight='medium')
-                plt.ylabel('Final Energy Value (eV)', fontsize=17, fontweight='medium')
-                if fit_opticalPeak:
-                    plt.title('Optical Peak Energy (eV)', fontsize=17, fontweight='medium')
-                else:
-                    plt.title('CT State Energy (eV)', fontsize=17, fontweight='medium')
-                cbar = self.heatmap_3.collections[0].colorbar
-                cbar.ax.tick_params(labelsize=15)
-                plt.yticks(rotation=360)
-                plt.xticks(rotation=90)
-                plt.tick_params(labelsize=15, direction='in', axis='both', which='major', length=8, width=2)
-                plt.show()
-
-                plt.ion()
-                plt.figure(figsize=(11, 9))
-                self.heatmap_4 = seaborn.heatmap(R_df, xticklabels=3, yticklabels=3)
-                plt.xlabel('Initial Energy Value (eV)', fontsize=17, fontweight='medium')
-                plt.ylabel('Final Energy Value (eV)', fontsize=17, fontweight='medium')
-                plt.title('$\mathregular{R^{2}}$', fontsize=17, fontweight='medium')
-                cbar = self.heatmap_4.collections[0].colorbar
-                cbar.ax.tick_params(labelsize=15)
-                plt.yticks(rotation=360)
-                plt.xticks(rotation=90)
-                plt.tick_params(labelsize=15, direction='in', axis='both', which='major', length=8, width=2)
-                plt.show()
+        print('Average Oscillator Strength [f] (eV**2) : ', format(parameter_df['f'].mean(), '.6f'), '+/-',
+              format(parameter_df['f'].std(), '.6f'))  # Determine the average value and standard deviation
+        print('Average Reorganization Energy [l] (eV) : ', format(parameter_df['l'].mean(), '.6f'), '+/-',
+              format(parameter_df['l'].std(), '.6f'))
 
-                if include_Disorder:
-                    Sig_df = parameter_df.pivot('Stop', 'Start', 'Sig')
-                    plt.ion()
-                    plt.figure(figsize=(11, 9))
-                    self.heatmap_5 = seaborn.heatmap(Sig_df, xticklabels=3, yticklabels=3)
-                    plt.xlabel('Initial Energy Value (eV)', fontsize=17, fontweight='medium')
-                    plt.ylabel('Final Energy Value (eV)', fontsize=17, fontweight='medium')
-                    plt.title('Sigma (eV)', fontsize=17, fontweight='medium')
-                    cbar = self.heatmap_5.collections[0].colorbar
-                    cbar.ax.tick_params(labelsize=15)
-                    plt.yticks(rotation=360)
-                    plt.xticks(rotation=90)
-                    plt.tick_params(labelsize=15, direction='in', axis='both', which='major', length=8, width=2)
-                    plt.show()
+        if fit_opticalPeak:
+            print('Average Optical Peak Energy [E_Opt] (eV) : ', format(parameter_df['Ect'].mean(), '.6f'),'+/-',
+                  format(parameter_df['Ect'].std(), '.6f'))
+        else:
+            print('Average CT State Energy [ECT] (eV) : ', format(parameter_df['Ect'].mean(), '.6f'), '+/-',
+                  format(parameter_df['Ect'].std(), '.6f'))
+
+        if include_Disorder:
+            print('Average Sigma [Sig] (eV) : ', format(parameter_df['Sig'].mean(), '.6f'), '+/-',
+                  format(parameter_df['Sig'].std(), '.6f'))
+            Average_W = parameter_df['l'].mean() * T + (parameter_df['Sig'].mean() ** 2) / (2 * self.k)
+            print('Average Gaussian Variance [W] (eV K) : ', format(Average_W, '.2f'))
+
+        print('Average R2 : ', format(parameter_df['R_Squared'].mean(), '.6f'), '+/-',
+              format(parameter_df['R_Squared'].std(), '.6f'))
+
+        print('-' * 80)
+
+        if max(parameter_df['R_Squared']) == 1.0:
+            print('Max R_squared : ', format(max(parameter_df['R_Squared']), '.6f'))
+            print('Start Energies (eV) : ',
+                  np.array(parameter_df['Start'][parameter_df['R_Squared'] == 1.0]).tolist())
+            print('Stop Energies (eV) : ',
+                  np.array(parameter_df['Stop'][parameter_df['R_Squared'] == 1.0]).tolist())
+            print('Average Oscillator Strength [f] (eV**2) : ',
+                  format(parameter_df['f'][parameter_df['R_Squared'] == 1.0].mean(), '.6f'), '+/-',
+                  format(parameter_df['f'][parameter_df['R_Squared'] == 1.0].std(), '.6f'))
+            print('Average Reorganization Energy [l] (eV) : ',
+                  format(parameter_df['l'][parameter_df['R_Squared'] == 1.0].mean(), '.6f'), '+/-',
+                  format(parameter_df['l'][parameter_df['R_Squared'] == 1.0].std(), '.6f'))
+            if fit_opticalPeak:
+                print('Average Optical Peak Energy [E_Opt] (eV) : ',
+                      format(parameter_df['Ect'][parameter_df['R_Squared'] == 1.0].mean(), '.6f'), '+/-',
+                      format(parameter_df['Ect'][parameter_df['R_Squared'] == 1.0].std(), '.6f'))
+            else:
+                print('Average CT State Energy [ECT] (eV) : ',
+                      format(parameter_df['Ect'][parameter_df['R_Squared'] == 1.0].mean(), '.6f'), '+/-',
+                      format(parameter_df['Ect'][parameter_df['R_Squared'] == 1.0].std(), '.6f'))
+
+            if include_Disorder:
+                print('Average Sigma [Sig] (eV) : ',
+                      format(parameter_df['Sig'][parameter_df['R_Squared'] == 1.0].mean(), '.6f'), '+/-',
+                      format(parameter_df['Sig'][parameter_df['R_Squared'] == 1.0].std(), '.6f'))
+                Average_W = parameter_df['l'][parameter_df['R_Squared'] == 1.0].mean() * T + (
+                        parameter_df['Sig'][parameter_df['R_Squared'] == 1.0].mean() ** 2) / (2 * self.k)
+                print('Average Gaussian Variance [W] (eV K) : ', format(Average_W, '.2f'))
+
+        else:
+            print('Max R_squared : ', format(max(parameter_df['R_Squared']), '.6f'))
+            print('Start Energy (eV) : ', parameter_df['Start'][max_index])
+            print('Stop Energy (eV) : ', parameter_df['Stop'][max_index])
+        print('-' * 80)
+
+        return max_index
+
+    # -----------------------------------------------------------------------------------------------------------
+
+    # Function to plot heat maps
+
+    def plot_heatMap(self,
+                     heat_df,
+                     fit_opticalPeak=False,
+                     include_Disorder=False
+                     ):
+        """Function to plot heat maps of fit parameters and R squared
+
+        Parameters
+        ----------
+        heat_df : DataFrame, required
+            Fit ranges with columns ['Start', 'Stop', 'f', 'l', 'Ect', 'R_Squared'(, 'Sig', 'Fitted')]
+            If included, fit ranges with 'Fitted' False were filled with the nearest fit and are hatched.
+        fit_opticalPeak : bool, optional
+            Boolean value specifying whether the optical peak was fitted
+        include_Disorder : bool, optional
+            Boolean value specifying whether disorder was included
+
+        Returns
+        -------
+        None
+        """
+
+        if fit_opticalPeak:
+            E_title = 'Optical Peak Energy (eV)'
+        else:
+            E_title = 'CT State Energy (eV)'
+
+        filled = None
+        if 'Fitted' in heat_df:
+            filled = ~heat_df.pivot(index='Stop', columns='Start', values='Fitted').fillna(True).astype(bool)
+
+        # Pivot dataFrame: x-value = Stop, y-value = Start, value = f
+        self.heatmap_1 = plot_HeatMap(heat_df.pivot(index='Stop', columns='Start', values='f'),
+                                      'Oscillator Strength ($eV^2$)', filled=filled)
+        self.heatmap_2 = plot_HeatMap(heat_df.pivot(index='Stop', columns='Start', values='l'),
+                                      'Reorganization Energy (eV)', filled=filled)
+        self.heatmap_3 = plot_HeatMap(heat_df.pivot(index='Stop', columns='Start', values='Ect'), E_title,
+                                      filled=filled)
+        self.heatmap_4 = plot_HeatMap(heat_df.pivot(index='Stop', columns='Start', values='R_Squared'),
+                                      '$\mathregular{R^{2}}$', filled=filled)
+
+        if include_Disorder:
+            self.heatmap_5 = plot_HeatMap(heat_df.pivot(index='Stop', columns='Start', values='Sig'), 'Sigma (eV)',
+                                          filled=filled)
+
+    # -----------------------------------------------------------------------------------------------------------
+
+    # Function to load a saved heat map run
+
+    def load_heatMap(self):
+        """Function to load a heat map run saved by heatMap and replot it without fitting
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        file_, _ = QFileDialog.getOpenFileName(None, "Load Heat Map", self.data_dir,
+                                               "Heat Map Files (*.npz);;All Files (*)")
+
+        if len(file_) != 0:
+            try:
+                parameter_df, heat_df, metadata = load_HeatMap(file_)
+            except (OSError, KeyError, ValueError) as e:
+                self.logger.error(f'Heat map could not be loaded: {e}')
+                return
 
+            if len(parameter_df) != 0:
+                self.logger.info('Loading heat map from: %s' % file_)
+                self.logger.info('Fit Results: ')
+                print("")
+                print('Label : ', metadata.get('label'))
+                self.report_heatMap(parameter_df,
+                                    T=metadata.get('T'),
+                                    fit_opticalPeak=metadata.get('fit_opticalPeak', False),
+                                    include_Disorder='Sig' in parameter_df,
+                                    adaptive=metadata.get('adaptive', False)
+                                    )
+                print("")
+                self.plot_heatMap(heat_df,
+                                  fit_opticalPeak=metadata.get('fit_opticalPeak', False),
+                                  include_Disorder='Sig' in parameter_df
+                                  )
             else:
                 self.logger.info('No fits determined.')
 
     # -----------------------------------------------------------------------------------------------------------
 
+    # Function to fit a series of EQE files with shared parameters
+
+    @fit_task
+    def global_fit(self):
+        """Function to fit a single Marcus peak to a series of EQE files at once with shared parameters
+
+        Fit range, plot ranges, disorder setting and disorder guess are taken from fit range 1.
+        The temperature of each file and the shared parameters are entered in dialogs.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        files, _ = QFileDialog.getOpenFileNames(None, "Select EQE Files", self.data_dir, "All Files (*);;")
+        if len(files) == 0:
+            return
+
+        text, ok = QtWidgets.QInputDialog.getText(self, 'Global Fit',
+                                                  'Temperatures [K] (one for all files or one per file, comma separated):',
+                                                  text=str(self.ui.Temperature_1.value()))
+        if not ok:
+            return
+        try:
+            T = [float(value) for value in text.split(',') if len(value.strip()) != 0]
+        except ValueError:
+            T = []
+        if len(T) not in [1, len(files)]:
+            self.logger.error(f'Please enter one temperature or {len(files)} temperatures.')
+            return
+
+        include_disorder = self.ui.disorder_1.isChecked()
+        names = parameter_names[:3 + include_disorder]
+
+        text, ok = QtWidgets.QInputDialog.getText(self, 'Global Fit',
+                                                  f'Shared parameters ({", ".join(names)}):',
+                                                  text=', '.join(name for name in shared_parameters if name in names))
+        if not ok:
+            return
+        shared = [name.strip() for name in text.split(',') if len(name.strip()) != 0]
+        if not all(name in names for name in shared):
+            self.logger.error(f'Please select shared parameters from: {", ".join(names)}')
+            return
+
+        startFit = self.ui.startFit_1.value()
+        stopFit = self.ui.stopFit_1.value()
+        if not StartStop_is_valid(startFit, stopFit):
+            return
+
+        eqe_list = []
+        for file in files:
+            try:
+                eqe_list.append(self.get_spectrum(file_cache.read(file)))
+            except KeyError as e:
+                self.logger.error(f'EQE file {os.path.basename(file)} has no column {e}.')
+                return
+            except (OSError, ValueError) as e:
+                self.logger.error(f'EQE file {os.path.basename(file)} could not be read: {e}')
+                return
+        labels = [os.path.splitext(os.path.basename(file))[0] for file in files]
+
+        self.logger.info(f'Fitting {len(files)} EQE files with shared parameters: {", ".join(shared) or "None"}')
+        try:
+            df = self.task_runner.run(lambda: fit_Global(eqe_list,
+                                                         startFit,
+                                                         stopFit,
+                                                         T=T if len(T) > 1 else T[0],
+                                                         shared=shared,
+                                                         include_disorder=include_disorder,
+                                                         sig=self.ui.guessStartSig_1.value(),
+                                                         labels=labels,
+                                                         callback=self.task_runner.check
+                                                         ),
+                                      label='Global fit'
+                                      )
+        except ValueError as e:
+            self.logger.error(f'Global fit failed: {e}')
+            return
+
+        print('-' * 80)
+        print(format_GlobalFit(df))
+        print('-' * 80)
+
+        # Plot EQE data and fits
+        axGlobal_1, axGlobal_2 = set_up_EQE_plot()
+        energy_fit = np.linspace(self.ui.startFitPlot_1.value(), self.ui.stopFitPlot_1.value(), 200)
+
+        for n, row in df.iterrows():
+            color_ = f'C{n % 10}'
+            wave, energy, eqe, log_eqe = compile_EQE(eqe_list[n], self.ui.startPlot_1.value(),
+                                                     self.ui.stopPlot_1.value(), 1)
+            axGlobal_1.plot(energy, eqe, linewidth=3, label=row['Label'], color=color_)
+            axGlobal_2.semilogy(energy, eqe, linewidth=3, label=row['Label'], color=color_)
+
+            if include_disorder:
+                y_fit = calculate_gaussian_disorder_absorption(energy_fit, row['f'], row['l'], row['Ect'], row['Sig'],
+                                                               row['T'])
+            else:
+                y_fit = calculate_gaussian_absorption(energy_fit, row['f'], row['l'], row['Ect'], row['T'])
+            axGlobal_1.plot(energy_fit, y_fit, linewidth=2, linestyle='--', color=color_)
+            axGlobal_2.semilogy(energy_fit, y_fit, linewidth=2, linestyle='--', color=color_)
+
+        axGlobal_1.legend()
+        axGlobal_2.legend()
+        plt.show()
+
+    # -----------------------------------------------------------------------------------------------------------
+
     # Gaussian function
 
     def gaussian(self, E, f, l, Ect):
@@ -2031,6 +2301,52 @@ class MainWindow(QtWidgets.QMainWindow):
             -((Ect - (sig ** 2 / (2 * self.k * self.T_CT)) + l + (sig ** 2 / (2 * self.k * self.T_CT)) - E) ** 2 / (
                     4 * l * self.k * self.T_CT + 2 * sig ** 2)))
 
+    def gaussian_jac(self, E, f, l, Ect):
+        """Analytic Jacobian of gaussian
+
+        Parameters
+        ----------
+        E : list, required
+            List of energy values
+        f : float, required
+            Oscillator strength
+        l : float, required
+            Reorganization energy
+        Ect : float, required
+            CT state energy
+
+        Returns
+        -------
+        jac : array
+            Derivatives of EQE with respect to [f, l, Ect]
+        """
+
+        return calculate_gaussian_absorption_jac(E, f, l, Ect, self.T_CT)
+
+    def gaussian_disorder_jac(self, E, f, l, Ect, sig):
+        """Analytic Jacobian of gaussian_disorder
+
+        Parameters
+        ----------
+        E : list, required
+            List of energy values
+        f : float, required
+            Oscillator strength
+        l : float, required
+            Reorganization energy
+        Ect : float, required
+            CT state energy
+        sig : float, required
+            Gaussian disorder
+
+        Returns
+        -------
+        jac : array
+            Derivatives of EQE with respect to [f, l, Ect, sig]
+        """
+
+        return calculate_gaussian_disorder_absorption_jac(E, f, l, Ect, sig, self.T_CT)
+
     # -----------------------------------------------------------------------------------------------------------
 
     # MLJ function
@@ -2055,14 +2371,8 @@ class MainWindow(QtWidgets.QMainWindow):
             EQE value
         """
 
-        EQE = 0
-        for n in range(0, 6):  # TODO: Check line breaks
-            EQE_n = (f / (E * math.sqrt(4 * math.pi * l * self.T_x * self.k))) \
-                    * (math.exp(-self.S_i) * self.S_i ** n / math.factorial(n)) \
-                    * exp(-(Ect + l - E + n * self.hbarw_i) ** 2 \
-                          / (4 * l * self.k * self.T_x))
-            EQE += EQE_n
-        return EQE
+        return (f / (E * math.sqrt(4 * math.pi * l * self.T_x * self.k))) \
+               * calculate_MLJ_replicas(Ect + l - E, 2 * l * self.k * self.T_x, self.S_i, self.hbarw_i)
 
     # MLJ function including disorder
 
@@ -2088,14 +2398,8 @@ class MainWindow(QtWidgets.QMainWindow):
             EQE value
         """
 
-        EQE = 0
-        for n in range(0, 6):  # TODO: Check line breaks
-            EQE_n = (f / (E * math.sqrt(2 * math.pi * (2 * l * self.T_x * self.k + sig ** 2))) \
-                     * (math.exp(-self.S_i) * self.S_i ** n / math.factorial(n)) \
-                     * exp(-(Ect + l - E + n * self.hbarw_i) ** 2 \
-                           / (4 * l * self.k * self.T_x + 2 * sig ** 2)))
-            EQE += EQE_n
-        return EQE
+        return (f / (E * math.sqrt(2 * math.pi * (2 * l * self.T_x * self.k + sig ** 2)))) \
+               * calculate_MLJ_replicas(Ect + l - E, 2 * l * self.k * self.T_x + sig ** 2, self.S_i, self.hbarw_i)
 
     # -----------------------------------------------------------------------------------------------------------
 
@@ -2145,25 +2449,23 @@ class MainWindow(QtWidgets.QMainWindow):
 
         if data_no < 2:  # EL data
 
-            Energy = []
             scaleFactor = self.ui.scalePlot.value()
 
             if len(data_df) != 0:  # Check that file is non-empty
 
-                for y in range(len(data_df['Wavelength'])):  # Calculate energy values
-
-                    Energy_val = (self.h * self.c) / (data_df['Wavelength'][y] * math.pow(10, -9) * self.q)
-                    Energy.append(Energy_val)
-
-                data_df['Energy'] = Energy
+                # Calculate energy values, keep the loaded (shared) dataFrame unchanged
+                data_df = data_df.assign(Energy=calculate_EL_energy(data_df['Wavelength']))
 
                 if Data_is_valid(data_df, startE, stopE) and StartStop_is_valid(startE, stopE):
 
-                    EL_wave, EL_energy, EL_signal = compile_EL(data_df, startE, stopE, 1)
-                    red_EL = [EL_signal[x] / (EL_energy[x])
-                              for x in range(len(EL_signal))]  # Divide by energy to reduce (checked in Benduhn thesis)
-                    red_EL_scaled = [red_EL[x] / scaleFactor
-                                     for x in range(len(red_EL))]
+                    # Calculate reduced EL and EL derived absorption
+                    el_df = process_EL(data_df,
+                                       startE,
+                                       stopE,
+                                       T_EL=self.T_EL,
+                                       scale=scaleFactor,
+                                       scale_abs=self.ui.scalePlot_calc.value()  # test which scale factor is correct
+                                       )
 
                     if data_no == 0:  # EL Data
 
@@ -2173,40 +2475,21 @@ class MainWindow(QtWidgets.QMainWindow):
                             color_ = '#1f77b4'  # Blue
                             plot(self.axEL_1,
                                  self.axEL_2,
-                                 EL_energy,
-                                 red_EL_scaled,
+                                 el_df['Energy'],
+                                 el_df['Red_EL'],
                                  label_,
                                  color_
                                  )
 
                         elif fit:
-                            self.fit_EL_EQE(EL_energy,
-                                            red_EL_scaled,
+                            self.fit_EL_EQE(el_df['Energy'],
+                                            el_df['Red_EL'],
                                             self.ui.startFit_EL1,
                                             self.ui.stopFit_EL1,
                                             0)
 
                     elif data_no == 1:  # Abs Data
 
-                        bb_dict = bb_spectrum(EL_energy, self.T_EL)
-
-                        # TODO: Old code to be removed?
-                        # EL_abs = [EL_signal[x] / bb_dict[EL_energy[x]] for x in range(len(EL_energy))]
-                        # red_EL_abs_scaled = [EL_abs[x] / (scaleFactor * EL_energy[x]) for x in range(len(EL_abs))]
-
-                        scaleFactor_calc = self.ui.scalePlot_calc.value()
-
-                        EL_abs_scaled = [EL_signal[x] / (scaleFactor * bb_dict[EL_energy[x]])
-                                         for x in range(len(EL_energy))]
-                        EL_abs_scaled_test = [EL_signal[x] / (scaleFactor_calc * bb_dict[EL_energy[x]])
-                                              for x in range(len(EL_energy))]  # test which scale factor is correct
-
-                        red_EL_abs_scaled = [EL_energy[x] * EL_signal[x] / (scaleFactor * bb_dict[EL_energy[x]])
-                                             for x in range(len(EL_energy))]
-                        red_EL_abs_scaled_test = [
-                            EL_energy[x] * EL_signal[x] / (scaleFactor_calc * bb_dict[EL_energy[x]])
-                            for x in range(len(EL_energy))]  # test which scale factor is correct
-
                         if not fit:
                             # label_ = pick_EQE_Label(self.ui.textBox_EL2, self.ui.textBox_EL1)
                             # color_ = pick_EQE_Color(self.ui.textBox_EL3, 100) # not currently used
@@ -2215,15 +2498,15 @@ class MainWindow(QtWidgets.QMainWindow):
 
                             plot(self.axEL_1,
                                  self.axEL_2,
-                                 EL_energy,
-                                 red_EL_abs_scaled_test,
+                                 el_df['Energy'],
+                                 el_df['Red_EL_Abs'],
                                  label_=label_,
                                  color_=color_
                                  )
 
                         elif fit:
-                            self.fit_EL_EQE(EL_energy,
-                                            red_EL_abs_scaled_test,
+                            self.fit_EL_EQE(el_df['Energy'],
+                                            el_df['Red_EL_Abs'],
                                             self.ui.startFit_EL2,
                                             self.ui.stopFit_EL2,
                                             1)
@@ -2237,8 +2520,7 @@ class MainWindow(QtWidgets.QMainWindow):
 
                 self.Red_EQE_meas = pd.DataFrame()  # For determining the intersect between abs and emission
                 EQE_wave, EQE_energy, EQE, EQE_log = compile_EQE(data_df, startE, stopE, 1)
-                red_EQE = [EQE[x] * EQE_energy[x] for x in
-                           range(len(EQE))]  # Multiplication confirmed in Benduhn thesis
+                red_EQE = calculate_reduced_EQE(EQE_energy, EQE)
 
                 if not fit:
                     label_ = pick_EQE_Label(self.ui.textBox_EL5, self.ui.textBox_EL4)
@@ -2259,6 +2541,55 @@ class MainWindow(QtWidgets.QMainWindow):
 
     # -----------------------------------------------------------------------------------------------------------
 
+    # Function to plot many EL files
+
+    def plot_EL_files(self):
+        """Function to plot reduced EL and EL derived absorption of many EL files at once
+
+        The EL plot range, EL temperature and scale factors are taken from page 6.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        files, _ = QFileDialog.getOpenFileNames(None, "Select EL Files", self.data_dir, "All Files (*);;")
+        if len(files) == 0:
+            return
+
+        self.T_EL = self.ui.EL_Temperature.value()
+        startE = self.ui.startPlot_EL1.value()
+        stopE = self.ui.stopPlot_EL1.value()
+
+        if StartStop_is_valid(startE, stopE):
+
+            results = process_EL_files(files,
+                                       startE,
+                                       stopE,
+                                       T_EL=self.T_EL,
+                                       scale=self.ui.scalePlot.value(),
+                                       scale_abs=self.ui.scalePlot_calc.value()
+                                       )
+
+            if self.do_plot_EL:
+                self.axEL_1, self.axEL_2 = set_up_EL_plot()
+                self.do_plot_EL = False
+
+            for n, (file_, el_df) in enumerate(results.items()):
+                label_ = os.path.splitext(os.path.basename(file_))[0]
+                if len(el_df) != 0:
+                    plot(self.axEL_1, self.axEL_2, el_df['Energy'], el_df['Red_EL'], label_, f'C{n % 10}')
+                    plot(self.axEL_1, self.axEL_2, el_df['Energy'], el_df['Red_EL_Abs'], f'{label_} (Abs)',
+                         f'C{n % 10}')
+                else:
+                    self.logger.info(f'No EL data in plot range: {label_}')
+
+    # -----------------------------------------------------------------------------------------------------------
+
     # Function to fit reduced EL and EQE
 
     # TODO: Check and update EL components
@@ -2596,14 +2927,8 @@ class MainWindow(QtWidgets.QMainWindow):
             Reduced EL value
         """
 
-        EL = 0
-        for n in range(0, 6):  # TODO: Check line breaks
-            EL_n = (f / (math.sqrt(4 * math.pi * l * self.T_EL * self.k))) \
-                   * (math.exp(-self.S_i_EL) * self.S_i_EL ** n / math.factorial(n)) \
-                   * exp(-(Ect - E - l - n * self.hbarw_i_EL) ** 2 \
-                         / (4 * l * self.k * self.T_EL))
-            EL += EL_n
-        return EL
+        return (f / (math.sqrt(4 * math.pi * l * self.T_EL * self.k))) \
+               * calculate_MLJ_replicas(E - Ect + l, 2 * l * self.k * self.T_EL, self.S_i_EL, self.hbarw_i_EL)
 
     # MLJ function for reduced EL including disorder
 
@@ -2629,14 +2954,12 @@ class MainWindow(QtWidgets.QMainWindow):
             Reduced EL value
         """
 
-        EL = 0
-        for n in range(0, 6):  # TODO: Check line breaks
-            EL_n = (f / (math.sqrt(4 * math.pi * l * self.T_EL * self.k + 2 * self.sig_EL ** 2))) \
-                   * (math.exp(-self.S_i_EL) * self.S_i_EL ** n / math.factorial(n)) \
-                   * exp(-(Ect - E - l - n * self.hbarw_i_EL) ** 2 \
-                         / (4 * l * self.k * self.T_EL + 2 * self.sig_EL ** 2))
-            EL += EL_n
-        return EL
+        return (f / (math.sqrt(4 * math.pi * l * self.T_EL * self.k + 2 * self.sig_EL ** 2))) \
+               * calculate_MLJ_replicas(E - Ect + l,
+                                        2 * l * self.k * self.T_EL + self.sig_EL ** 2,
+                                        self.S_i_EL,
+                                        self.hbarw_i_EL
+                                        )
 
     # -----------------------------------------------------------------------------------------------------------
 
@@ -2716,14 +3039,8 @@ class MainWindow(QtWidgets.QMainWindow):
             Reduced EQE value
         """
 
-        EQE = 0
-        for n in range(0, 6):  # TODO: Check line breaks
-            EQE_n = (f / (math.sqrt(4 * math.pi * l * self.T_EL * self.k))) \
-                    * (math.exp(-self.S_i_EL) * self.S_i_EL ** n / math.factorial(n)) \
-                    * exp(-(Ect - E + l + n * self.hbarw_i_EL) ** 2 \
-                          / (4 * l * self.k * self.T_EL))
-            EQE += EQE_n
-        return EQE
+        return (f / (math.sqrt(4 * math.pi * l * self.T_EL * self.k))) \
+               * calculate_MLJ_replicas(Ect - E + l, 2 * l * self.k * self.T_EL, self.S_i_EL, self.hbarw_i_EL)
 
     # MLJ function for reduced EQE including disorder
 
@@ -2749,14 +3066,12 @@ class MainWindow(QtWidgets.QMainWindow):
             Reduced EQE value
         """
 
-        EQE = 0
-        for n in range(0, 6):  # TODO: Check line breaks
-            EQE_n = (f / (math.sqrt(4 * math.pi * l * self.T_EL * self.k + 2 * self.sig_EL ** 2))) \
-                    * (math.exp(-self.S_i_EL) * self.S_i_EL ** n / math.factorial(n)) \
-                    * exp(-(Ect - E + l + n * self.hbarw_i_EL) ** 2 \
-                          / (4 * l * self.k * self.T_EL + 2 * self.sig_EL ** 2))
-            EQE += EQE_n
-        return EQE
+        return (f / (math.sqrt(4 * math.pi * l * self.T_EL * self.k + 2 * self.sig_EL ** 2))) \
+               * calculate_MLJ_replicas(Ect - E + l,
+                                        2 * l * self.k * self.T_EL + self.sig_EL ** 2,
+                                        self.S_i_EL,
+                                        self.hbarw_i_EL
+                                        )
 
     # -----------------------------------------------------------------------------------------------------------
 
@@ -3113,6 +3428,7 @@ class MainWindow(QtWidgets.QMainWindow):
 
     # Function to compile fits for separate double peak fitting
 
+    @fit_task
     def double_fit(self):
         """Function to perform separate double fit of S1 and CT peaks
 
@@ -3125,6 +3441,8 @@ class MainWindow(QtWidgets.QMainWindow):
         None
         """
 
+        fit_profiler.reset()  # Record fit statistics of this run
+
         increase_factor = 1.05  # NOTE: Modify to increase data range for R2 calculation and fit selection
         include_disorder = False
         guessRange_Sig = None
@@ -3199,6 +3517,8 @@ class MainWindow(QtWidgets.QMainWindow):
             guessRange_Opt = np.round(np.arange(startGuess_Opt, stopGuess_Opt + 0.1, 0.05), 3).tolist()
             guessRange_CT = np.round(np.arange(startGuess_CT, stopGuess_CT + 0.1, 0.05), 3).tolist()
 
+            eqe = self.get_spectrum(eqe)  # Sort EQE once to compile each fit range by binary search
+
             # Compile a dataFrame with all combinations of start / stop values for Opt and CT fit
 
             self.logger.info('Compiling Fit Ranges ...')
@@ -3227,16 +3547,32 @@ class MainWindow(QtWidgets.QMainWindow):
             df_CT['Start'] = start_CT_list
             df_CT['Stop'] = stop_CT_list
 
+            # Skip fit ranges with too few data points
+            df_Opt = df_Opt[feasible_Windows(eqe, df_Opt['Start'], df_Opt['Stop'], n_params=3,
+                                             label='optical peak fit ranges')].reset_index(drop=True)
+            df_CT = df_CT[feasible_Windows(eqe, df_CT['Start'], df_CT['Stop'], n_params=4 if include_disorder else 3,
+                                           label='CT state fit ranges')].reset_index(drop=True)
+
+            if len(df_Opt) == 0 or len(df_CT) == 0:
+                self.logger.error('No fit range contains enough data points.')
+                self.bias = False
+                return
+
             # Calculate all optical peak fits
 
             self.logger.info('Calculating Optical Peak Fits ...')
 
-            cal_vals_Opt = list(map(lambda x: calculate_guess_fit(x=x,
-                                                                  df=df_Opt,
-                                                                  eqe=eqe,
-                                                                  function=self.gaussian_double,
-                                                                  guessRange=guessRange_Opt
-                                                                  ), tqdm(range(len(df_Opt)))))
+            cal_vals_Opt = self.task_runner.map(lambda x: calculate_guess_fit(x=x,
+                                                                              df=df_Opt,
+                                                                              eqe=eqe,
+                                                                              function=self.gaussian_double,
+                                                                              jac=self.gaussian_double_jac,
+                                                                              T=self.T_double,
+                                                                              guessRange=guessRange_Opt
+                                                                              ),
+                                                range(len(df_Opt)),
+                                                label='Optical peak fits'
+                                                )
 
             best_vals_Opt = list(map(lambda list_: sep_list(list_, 0), cal_vals_Opt))
             covar_Opt = list(map(lambda list_: sep_list(list_, 1), cal_vals_Opt))
@@ -3248,78 +3584,258 @@ class MainWindow(QtWidgets.QMainWindow):
 
             # Calculate CT state fits
 
-            start_Opt_list = []
-            stop_Opt_list = []
-            start_CT_list = []
-            stop_CT_list = []
+            # Store fit parameters and R squared values only, fit curves are regenerated for the best fits
+            fit_results = FitResults(T=self.T_double,
+                                     n_best=int(self.ui.n.value()),  # Keep only the best fits
+                                     include_disorder=include_disorder,
+                                     range=increase_factor
+                                     )
 
-            best_vals_Opt = []
-            best_vals_CT = []
+            self.logger.info('Calculating CT State Fits ...')
 
-            Opt_covar_list = []
-            CT_covar_list = []
+            if include_disorder:
+                self.logger.info('Including CT State Disorder ...')
 
-            R2_Opt = []
-            R2_CT = []
+            subtract = self.ui.subtract_DoubleFit.isChecked()
+            best_subtract = self.ui.bestSubtract_DoubleFit.isChecked()
 
-            combined_R2_list = []
+            # Function to calculate all CT state fits in the task runner (must not access GUI objects)
+            def fit_CT():
 
-            Opt_Fit_list = []
-            CT_Fit_list = []
-            combined_Fit_list = []
-            Energy_list = []
-            EQE_list = []
+                # If Optical peak to be subtracted before CT fit, fit a budget of fit range combinations
+                if subtract and not best_subtract and use_window_search:
+                    self.logger.info('Subtracting All Optical Peak Fits ...')
+                    self.logger.info('Searching Fit Range Combinations ...')
 
-            df_results = pd.DataFrame()
+                    pairs = [(x, y) for x in range(len(df_Opt)) if df_Opt['R2'][x] > 0 for y in range(len(df_CT))]
+                    subtracted = {}  # Subtracted EQE of each optical peak fit
 
-            self.logger.info('Calculating CT State Fits ...')
+                    # Function to fit a combination of optical peak and CT state fit ranges and return its score
+                    def fit_pair(i):
+                        x, y = pairs[i]
+                        if x not in subtracted:
+                            subtracted[x] = subtract_Opt(eqe, df_Opt['Fit'][x], T=self.T_double)
 
-            if include_disorder:
-                self.logger.info('Including CT State Disorder ...')
+                        if include_disorder:
+                            best_vals, covar, p0, r_squared = guess_fit(eqe=subtracted[x],
+                                                                        startE=df_CT['Start'][y],
+                                                                        stopE=df_CT['Stop'][y],
+                                                                        function=self.gaussian_disorder_double,
+                                                                        jac=self.gaussian_disorder_double_jac,
+                                                                        T=self.T_double,
+                                                                        guessRange=guessRange_CT,
+                                                                        guessRange_sig=guessRange_Sig,
+                                                                        include_disorder=True,
+                                                                        bounds=True  # to use fit model
+                                                                        )
+                        else:
+                            best_vals, covar, p0, r_squared = guess_fit(eqe=subtracted[x],
+                                                                        startE=df_CT['Start'][y],
+                                                                        stopE=df_CT['Stop'][y],
+                                                                        function=self.gaussian_double,
+                                                                        jac=self.gaussian_double_jac,
+                                                                        T=self.T_double,
+                                                                        guessRange=guessRange_CT,
+                                                                        include_disorder=False,
+                                                                        bounds=None  # to use fit function
+                                                                        )
+                        if r_squared <= 0:
+                            return np.nan
 
-            # If Optical peak to be subtracted before CT fit
-            if self.ui.subtract_DoubleFit.isChecked() and not self.ui.bestSubtract_DoubleFit.isChecked():
-                self.logger.info('Subtracting All Optical Peak Fits ...')
-                for x in tqdm(range(len(df_Opt))):
-                    for y in tqdm(range(len(df_CT))):
+                        parameter_dict = calculate_combined_fit(stopE=df_Opt['Stop'][x],
+                                                                best_vals_Opt=df_Opt['Fit'][x],
+                                                                best_vals_CT=best_vals,
+                                                                R2_Opt=df_Opt['R2'][x],
+                                                                R2_CT=r_squared,
+                                                                eqe=eqe,
+                                                                T=self.T_double,
+                                                                bias=self.bias,
+                                                                tolerance=self.tolerance,
+                                                                range=increase_factor,
+                                                                include_disorder=include_disorder
+                                                                )
+
+                        fit_results.append_separate(start_Opt=df_Opt['Start'][x],
+                                                    stop_Opt=df_Opt['Stop'][x],
+                                                    fit_Opt=df_Opt['Fit'][x],
+                                                    R2_Opt=df_Opt['R2'][x],
+                                                    covar_Opt=df_Opt['Covar'][x],
+                                                    start_CT=df_CT['Start'][y],
+                                                    stop_CT=df_CT['Stop'][y],
+                                                    fit_CT=best_vals,
+                                                    R2_CT=r_squared,
+                                                    covar_CT=covar,
+                                                    parameter_dict=parameter_dict
+                                                    )
+
+                        return fit_results.score(parameter_dict)
+
+                    search_Windows([(df_Opt['Start'][x], df_Opt['Stop'][x], df_CT['Start'][y], df_CT['Stop'][y])
+                                    for x, y in pairs], fit_pair, track=self.task_runner.track)
+
+                # If Optical peak to be subtracted before CT fit
+                elif subtract and not best_subtract:
+                    self.logger.info('Subtracting All Optical Peak Fits ...')
+                    self.task_runner.add(len(df_Opt) * len(df_CT))
+                    for x in range(len(df_Opt)):
                         if df_Opt['R2'][x] > 0:  # Check that the optical peak fit was successful
 
                             new_eqe = subtract_Opt(eqe, df_Opt['Fit'][x], T=self.T_double)
 
+                            # Fit all CT state fit ranges at once
+                            fit_vals, fit_covar, fit_R2 = fit_Windows(eqe=new_eqe,
+                                                                      windows=list(zip(df_CT['Start'], df_CT['Stop'])),
+                                                                      function=self.gaussian_disorder_double
+                                                                      if include_disorder else self.gaussian_double,
+                                                                      jac=self.gaussian_disorder_double_jac
+                                                                      if include_disorder else self.gaussian_double_jac,
+                                                                      T=self.T_double,
+                                                                      guessRange=guessRange_CT,
+                                                                      guessRange_sig=guessRange_Sig,
+                                                                      include_disorder=include_disorder,
+                                                                      check=self.task_runner.check
+                                                                      )
+                        else:
+                            fit_vals = [[0, 0, 0]] * len(df_CT)
+                            fit_covar = [None] * len(df_CT)
+                            fit_R2 = np.zeros(len(df_CT))
+
+                        for y in self.task_runner.track(range(len(df_CT)), total=0):
+                            best_vals = fit_vals[y]
+                            covar = fit_covar[y]
+                            r_squared = fit_R2[y]
+
+                            # Calculate combined fit here
+                            parameter_dict = calculate_combined_fit(stopE=df_Opt['Stop'][x],
+                                                                    best_vals_Opt=df_Opt['Fit'][x],
+                                                                    best_vals_CT=best_vals,
+                                                                    R2_Opt=df_Opt['R2'][x],
+                                                                    R2_CT=r_squared,
+                                                                    eqe=eqe,
+                                                                    T=self.T_double,
+                                                                    bias=self.bias,
+                                                                    tolerance=self.tolerance,
+                                                                    range=increase_factor,
+                                                                    include_disorder=include_disorder
+                                                                    )
+
+                            fit_results.append_separate(start_Opt=df_Opt['Start'][x],
+                                                        stop_Opt=df_Opt['Stop'][x],
+                                                        fit_Opt=df_Opt['Fit'][x],
+                                                        R2_Opt=df_Opt['R2'][x],
+                                                        covar_Opt=df_Opt['Covar'][x],
+                                                        start_CT=df_CT['Start'][y],
+                                                        stop_CT=df_CT['Stop'][y],
+                                                        fit_CT=best_vals,
+                                                        R2_CT=r_squared,
+                                                        covar_CT=covar,
+                                                        parameter_dict=parameter_dict
+                                                        )
+
+                # If only best Optical peak is to be subtracted before CT fit
+                elif best_subtract and not subtract:
+                    self.logger.info('Subtracting Only Best Optical Peak Fit ...')
+
+                    # best_fit_index = df_Opt['Fit'][df_Opt['R2']==max(df_Opt['R2'])].index[0]
+                    # print(best_fit_index)
+
+                    # To avoid picking a fit that has a high R2 but moves above the data
+                    advanced_R2_list = []
+                    for x in range(len(df_Opt)):
+                        wave_fit, energy_fit, eqe_fit, log_eqe_fit = compile_EQE(eqe,
+                                                                                 df_Opt['Start'][x],
+                                                                                 df_Opt['Stop'][x] * increase_factor,
+                                                                                 1)
+                        y_fit = [self.gaussian_double(e,
+                                                      df_Opt['Fit'][x][0],
+                                                      df_Opt['Fit'][x][1],
+                                                      df_Opt['Fit'][x][2]
+                                                      ) for e in energy_fit]
+                        advanced_R2_list.append(R_squared(eqe_fit, y_fit))
+
+                    df_Opt['Advanced R2'] = advanced_R2_list
+
+                    best_fit_index = df_Opt['Fit'][df_Opt['Advanced R2'] == max(df_Opt['Advanced R2'])].index[0]
+                    # print(best_fit_index)
+
+                    new_eqe = subtract_Opt(eqe, df_Opt['Fit'][best_fit_index], T=self.T_double)
+
+                    # Fit all CT state fit ranges at once
+                    fit_vals, fit_covar, fit_R2 = fit_Windows(eqe=new_eqe,
+                                                              windows=list(zip(df_CT['Start'], df_CT['Stop'])),
+                                                              function=self.gaussian_disorder_double
+                                                              if include_disorder else self.gaussian_double,
+                                                              jac=self.gaussian_disorder_double_jac
+                                                              if include_disorder else self.gaussian_double_jac,
+                                                              T=self.T_double,
+                                                              guessRange=guessRange_CT,
+                                                              guessRange_sig=guessRange_Sig,
+                                                              include_disorder=include_disorder,
+                                                              check=self.task_runner.check
+                                                              )
+
+                    for y in self.task_runner.track(range(len(df_CT))):
+                        best_vals = fit_vals[y]
+                        covar = fit_covar[y]
+                        r_squared = fit_R2[y]
+
+                        # Calculate combined fit here
+                        parameter_dict = calculate_combined_fit(stopE=df_Opt['Stop'][best_fit_index],
+                                                                best_vals_Opt=df_Opt['Fit'][best_fit_index],
+                                                                best_vals_CT=best_vals,
+                                                                R2_Opt=df_Opt['R2'][best_fit_index],
+                                                                R2_CT=r_squared,
+                                                                eqe=eqe,
+                                                                T=self.T_double,
+                                                                bias=self.bias,
+                                                                tolerance=self.tolerance,
+                                                                range=increase_factor,
+                                                                include_disorder=include_disorder
+                                                                )
+
+                        fit_results.append_separate(start_Opt=df_Opt['Start'][best_fit_index],
+                                                    stop_Opt=df_Opt['Stop'][best_fit_index],
+                                                    fit_Opt=df_Opt['Fit'][best_fit_index],
+                                                    R2_Opt=df_Opt['R2'][best_fit_index],
+                                                    covar_Opt=df_Opt['Covar'][best_fit_index],
+                                                    start_CT=df_CT['Start'][y],
+                                                    stop_CT=df_CT['Stop'][y],
+                                                    fit_CT=best_vals,
+                                                    R2_CT=r_squared,
+                                                    covar_CT=covar,
+                                                    parameter_dict=parameter_dict
+                                                    )
+
+                # If Optical peak not to be subtracted before CT fit
+                elif not subtract and not best_subtract:
+                    self.logger.info('Not Subtracting Optical Peak Fits.')
+                    self.task_runner.add(len(df_Opt) * len(df_CT))
+                    for x in range(len(df_Opt)):
+                        for y in self.task_runner.track(range(len(df_CT)), total=0):
+
                             if include_disorder:
-                                best_vals, covar, p0, r_squared = guess_fit(eqe=new_eqe,
+                                best_vals, covar, p0, r_squared = guess_fit(eqe=eqe,
                                                                             startE=df_CT['Start'][y],
                                                                             stopE=df_CT['Stop'][y],
                                                                             function=self.gaussian_disorder_double,
+                                                                            jac=self.gaussian_disorder_double_jac,
+                                                                            T=self.T_double,
                                                                             guessRange=guessRange_CT,
                                                                             guessRange_sig=guessRange_Sig,
                                                                             include_disorder=True,
                                                                             bounds=True  # to use fit model
                                                                             )
                             else:
-                                best_vals, covar, p0, r_squared = guess_fit(eqe=new_eqe,
+                                best_vals, covar, p0, r_squared = guess_fit(eqe=eqe,
                                                                             startE=df_CT['Start'][y],
                                                                             stopE=df_CT['Stop'][y],
                                                                             function=self.gaussian_double,
+                                                                            jac=self.gaussian_double_jac,
+                                                                            T=self.T_double,
                                                                             guessRange=guessRange_CT,
                                                                             include_disorder=False,
                                                                             bounds=None  # to use fit function
                                                                             )
-                        else:
-                            best_vals = [0, 0, 0]
-                            r_squared = 0
-
-                        Opt_covar_list.append(df_Opt['Covar'][x])
-                        CT_covar_list.append(covar)
-                        start_Opt_list.append(df_Opt['Start'][x])
-                        stop_Opt_list.append(df_Opt['Stop'][x])
-                        start_CT_list.append(df_CT['Start'][y])
-                        stop_CT_list.append(df_CT['Stop'][y])
-                        best_vals_Opt.append(df_Opt['Fit'][x])
-                        best_vals_CT.append(best_vals)
-                        R2_Opt.append(df_Opt['R2'][x])
-                        R2_CT.append(r_squared)
-
                         # Calculate combined fit here
                         parameter_dict = calculate_combined_fit(stopE=df_Opt['Stop'][x],
                                                                 best_vals_Opt=df_Opt['Fit'][x],
@@ -3334,175 +3850,25 @@ class MainWindow(QtWidgets.QMainWindow):
                                                                 include_disorder=include_disorder
                                                                 )
 
-                        combined_R2_list.append(parameter_dict['R2_Combined'])
-                        combined_Fit_list.append(parameter_dict['Combined_Fit'])
-                        Opt_Fit_list.append(parameter_dict['Opt_Fit'])
-                        CT_Fit_list.append(parameter_dict['CT_Fit'])
-                        Energy_list.append(parameter_dict['Energy'])
-                        EQE_list.append(parameter_dict['EQE'])
+                        fit_results.append_separate(start_Opt=df_Opt['Start'][x],
+                                                    stop_Opt=df_Opt['Stop'][x],
+                                                    fit_Opt=df_Opt['Fit'][x],
+                                                    R2_Opt=df_Opt['R2'][x],
+                                                    covar_Opt=df_Opt['Covar'][x],
+                                                    start_CT=df_CT['Start'][y],
+                                                    stop_CT=df_CT['Stop'][y],
+                                                    fit_CT=best_vals,
+                                                    R2_CT=r_squared,
+                                                    covar_CT=covar,
+                                                    parameter_dict=parameter_dict
+                                                    )
 
-            # If only best Optical peak is to be subtracted before CT fit
-            elif self.ui.bestSubtract_DoubleFit.isChecked() and not self.ui.subtract_DoubleFit.isChecked():
-                self.logger.info('Subtracting Only Best Optical Peak Fit ...')
-
-                # best_fit_index = df_Opt['Fit'][df_Opt['R2']==max(df_Opt['R2'])].index[0]
-                # print(best_fit_index)
-
-                # To avoid picking a fit that has a high R2 but moves above the data
-                advanced_R2_list = []
-                for x in range(len(df_Opt)):
-                    wave_fit, energy_fit, eqe_fit, log_eqe_fit = compile_EQE(eqe,
-                                                                             df_Opt['Start'][x],
-                                                                             df_Opt['Stop'][x] * increase_factor,
-                                                                             1)
-                    y_fit = [self.gaussian_double(e,
-                                                  df_Opt['Fit'][x][0],
-                                                  df_Opt['Fit'][x][1],
-                                                  df_Opt['Fit'][x][2]
-                                                  ) for e in energy_fit]
-                    advanced_R2_list.append(R_squared(eqe_fit, y_fit))
-
-                df_Opt['Advanced R2'] = advanced_R2_list
-
-                best_fit_index = df_Opt['Fit'][df_Opt['Advanced R2'] == max(df_Opt['Advanced R2'])].index[0]
-                # print(best_fit_index)
-
-                new_eqe = subtract_Opt(eqe, df_Opt['Fit'][best_fit_index], T=self.T_double)
-
-                for y in tqdm(range(len(df_CT))):
+                else:
+                    self.logger.info('Please select valid fit settings.')
 
-                    if include_disorder:
-                        best_vals, covar, p0, r_squared = guess_fit(eqe=new_eqe,
-                                                                    startE=df_CT['Start'][y],
-                                                                    stopE=df_CT['Stop'][y],
-                                                                    function=self.gaussian_disorder_double,
-                                                                    guessRange=guessRange_CT,
-                                                                    guessRange_sig=guessRange_Sig,
-                                                                    include_disorder=True,
-                                                                    bounds=True  # to use fit model
-                                                                    )
-                    else:
-                        best_vals, covar, p0, r_squared = guess_fit(eqe=new_eqe,
-                                                                    startE=df_CT['Start'][y],
-                                                                    stopE=df_CT['Stop'][y],
-                                                                    function=self.gaussian_double,
-                                                                    guessRange=guessRange_CT,
-                                                                    include_disorder=False,
-                                                                    bounds=None  # to use fit function
-                                                                    )
+            self.task_runner.run(fit_CT, label='CT state fits')
 
-                    Opt_covar_list.append(df_Opt['Covar'][x])
-                    CT_covar_list.append(covar)
-                    start_Opt_list.append(df_Opt['Start'][best_fit_index])
-                    stop_Opt_list.append(df_Opt['Stop'][best_fit_index])
-                    start_CT_list.append(df_CT['Start'][y])
-                    stop_CT_list.append(df_CT['Stop'][y])
-                    best_vals_Opt.append(df_Opt['Fit'][best_fit_index])
-                    best_vals_CT.append(best_vals)
-                    R2_Opt.append(df_Opt['R2'][best_fit_index])
-                    R2_CT.append(r_squared)
-
-                    # Calculate combined fit here
-                    parameter_dict = calculate_combined_fit(stopE=df_Opt['Stop'][x],
-                                                            best_vals_Opt=df_Opt['Fit'][x],
-                                                            best_vals_CT=best_vals,
-                                                            R2_Opt=df_Opt['R2'][x],
-                                                            R2_CT=r_squared,
-                                                            eqe=eqe,
-                                                            T=self.T_double,
-                                                            bias=self.bias,
-                                                            tolerance=self.tolerance,
-                                                            range=increase_factor,
-                                                            include_disorder=include_disorder
-                                                            )
-
-                    combined_R2_list.append(parameter_dict['R2_Combined'])
-                    combined_Fit_list.append(parameter_dict['Combined_Fit'])
-                    Opt_Fit_list.append(parameter_dict['Opt_Fit'])
-                    CT_Fit_list.append(parameter_dict['CT_Fit'])
-                    Energy_list.append(parameter_dict['Energy'])
-                    EQE_list.append(parameter_dict['EQE'])
-
-            # If Optical peak not to be subtracted before CT fit
-            elif not self.ui.subtract_DoubleFit.isChecked() and not self.ui.bestSubtract_DoubleFit.isChecked():
-                self.logger.info('Not Subtracting Optical Peak Fits.')
-                for x in tqdm(range(len(df_Opt))):
-                    for y in tqdm(range(len(df_CT))):
-
-                        if include_disorder:
-                            best_vals, covar, p0, r_squared = guess_fit(eqe=eqe,
-                                                                        startE=df_CT['Start'][y],
-                                                                        stopE=df_CT['Stop'][y],
-                                                                        function=self.gaussian_disorder_double,
-                                                                        guessRange=guessRange_CT,
-                                                                        guessRange_sig=guessRange_Sig,
-                                                                        include_disorder=True,
-                                                                        bounds=True  # to use fit model
-                                                                        )
-                        else:
-                            best_vals, covar, p0, r_squared = guess_fit(eqe=eqe,
-                                                                        startE=df_CT['Start'][y],
-                                                                        stopE=df_CT['Stop'][y],
-                                                                        function=self.gaussian_double,
-                                                                        guessRange=guessRange_CT,
-                                                                        include_disorder=False,
-                                                                        bounds=None  # to use fit function
-                                                                        )
-                    Opt_covar_list.append(df_Opt['Covar'][x])
-                    CT_covar_list.append(covar)
-                    start_Opt_list.append(df_Opt['Start'][x])
-                    stop_Opt_list.append(df_Opt['Stop'][x])
-                    start_CT_list.append(df_CT['Start'][y])
-                    stop_CT_list.append(df_CT['Stop'][y])
-                    best_vals_Opt.append(df_Opt['Fit'][x])
-                    best_vals_CT.append(best_vals)
-                    R2_Opt.append(df_Opt['R2'][x])
-                    R2_CT.append(r_squared)
-
-                    # Calculate combined fit here
-                    parameter_dict = calculate_combined_fit(stopE=df_Opt['Stop'][x],
-                                                            best_vals_Opt=df_Opt['Fit'][x],
-                                                            best_vals_CT=best_vals,
-                                                            R2_Opt=df_Opt['R2'][x],
-                                                            R2_CT=r_squared,
-                                                            eqe=eqe,
-                                                            T=self.T_double,
-                                                            bias=self.bias,
-                                                            tolerance=self.tolerance,
-                                                            range=increase_factor,
-                                                            include_disorder=include_disorder
-                                                            )
-
-                    combined_R2_list.append(parameter_dict['R2_Combined'])
-                    combined_Fit_list.append(parameter_dict['Combined_Fit'])
-                    Opt_Fit_list.append(parameter_dict['Opt_Fit'])
-                    CT_Fit_list.append(parameter_dict['CT_Fit'])
-                    Energy_list.append(parameter_dict['Energy'])
-                    EQE_list.append(parameter_dict['EQE'])
-
-            else:
-                self.logger.info('Please select valid fit settings.')
-
-            if len(best_vals_Opt) == len(best_vals_CT) and len(best_vals_Opt) != 0:  # Confirm lists are acceptable
-
-                df_results['Start_Opt'] = start_Opt_list
-                df_results['Stop_Opt'] = stop_Opt_list
-                df_results['Fit_Opt'] = best_vals_Opt
-                df_results['R2_Opt'] = R2_Opt
-                df_results['Start_CT'] = start_CT_list
-                df_results['Stop_CT'] = stop_CT_list
-                df_results['Fit_CT'] = best_vals_CT
-                df_results['R2_CT'] = R2_CT
-                df_results['Covar_Opt'] = Opt_covar_list
-                df_results['Covar_CT'] = CT_covar_list
-
-                # Add combined fit to dataFrame
-                df_results['Total_R2'] = combined_R2_list
-                df_results['Total_Fit'] = combined_Fit_list
-                df_results['Opt_Fit'] = Opt_Fit_list
-                df_results['CT_Fit'] = CT_Fit_list
-                df_results['Energy'] = Energy_list
-                df_results['EQE'] = EQE_list
+            if len(fit_results) != 0:  # Confirm fits are available
 
                 # Find best fit
 
@@ -3526,22 +3892,31 @@ class MainWindow(QtWidgets.QMainWindow):
                 label = pick_EQE_Label(self.ui.textBox_dF2, self.ui.textBox_dF1)
 
                 # for x in np.arange(1, 6, 1):
-                n = int(self.ui.n.value())
-                for x in np.arange(1, n + 1, 1):
+                self.logger.info(f'Kept {len(fit_results)} best of {fit_results.n_fits} fits.')
+                for x, index in enumerate(fit_results.best(), 1):
                     print('-' * 80)
                     print(('Best Fit No. {} : ').format(x))
-                    df_results = find_best_fit(df_both=df_results,
-                                               eqe=eqe,
-                                               T=self.T_double,
-                                               label=label,
-                                               n_fit=x,
-                                               include_disorder=include_disorder,
-                                               save_fit=save_fit,
-                                               save_fit_file=save_fit_file
-                                               )
+                    find_best_fit(df_both=fit_results,
+                                  eqe=eqe,
+                                  T=self.T_double,
+                                  label=label,
+                                  n_fit=x,
+                                  include_disorder=include_disorder,
+                                  save_fit=save_fit,
+                                  save_fit_file=save_fit_file,
+                                  index=index,
+                                  bias=self.bias,
+                                  tolerance=self.tolerance
+                                  )
                     print(' ' * 80)
                 print('-' * 80)
+                if save_fit:  # Save fit statistics next to the fit files
+                    fit_profiler.save(save_fit_file)
 
+        self.logger.info(window_cache.summary())
+        fit_cache.flush()
+        self.logger.info(fit_cache.summary())
+        self.logger.info(fit_profiler.report())
         self.bias = False
 
     # -----------------------------------------------------------------------------------------------------------
@@ -3597,6 +3972,52 @@ class MainWindow(QtWidgets.QMainWindow):
             -((Ect - (sig ** 2 / (2 * self.k * self.T_double)) + l + (sig ** 2 / (2 * self.k * self.T_double)) - E) ** 2 / (
                       4 * l * self.k * self.T_double + 2 * sig ** 2)))
 
+    def gaussian_double_jac(self, E, f, l, Ect):
+        """Analytic Jacobian of gaussian_double
+
+        Parameters
+        ----------
+        E : list, required
+            List of energy values
+        f : float, required
+            Oscillator strength
+        l : float, required
+            Reorganization energy
+        Ect : float, required
+            CT state energy
+
+        Returns
+        -------
+        jac : array
+            Derivatives of EQE with respect to [f, l, Ect]
+        """
+
+        return calculate_gaussian_absorption_jac(E, f, l, Ect, self.T_double)
+
+    def gaussian_disorder_double_jac(self, E, f, l, Ect, sig):
+        """Analytic Jacobian of gaussian_disorder_double
+
+        Parameters
+        ----------
+        E : list, required
+            List of energy values
+        f : float, required
+            Oscillator strength
+        l : float, required
+            Reorganization energy
+        Ect : float, required
+            CT state energy
+        sig : float, required
+            Gaussian disorder
+
+        Returns
+        -------
+        jac : array
+            Derivatives of EQE with respect to [f, l, Ect, sig]
+        """
+
+        return calculate_gaussian_disorder_absorption_jac(E, f, l, Ect, sig, self.T_double)
+
     # -----------------------------------------------------------------------------------------------------------
 
     # Simultaneous Double Peak Fit
@@ -3638,6 +4059,7 @@ class MainWindow(QtWidgets.QMainWindow):
         if include_disorder:
             p0 = self.sim_guess_sig
             best_vals, covar, y_fit, r_squared = fit_model_double(function=self.gaussian_disorder_double_sim,
+                                                                  jac=self.gaussian_disorder_double_sim_jac,
                                                                   energy_fit=energy_fit,
                                                                   eqe_fit=eqe_fit,
                                                                   bound_dict=bound_dict,
@@ -3664,6 +4086,7 @@ class MainWindow(QtWidgets.QMainWindow):
         else:
             p0 = self.sim_guess
             best_vals, covar, y_fit, r_squared = fit_model_double(function=self.gaussian_double_sim,
+                                                                  jac=self.gaussian_double_sim_jac,
                                                                   energy_fit=energy_fit,
                                                                   eqe_fit=eqe_fit,
                                                                   bound_dict=bound_dict,
@@ -3805,6 +4228,7 @@ class MainWindow(QtWidgets.QMainWindow):
 
     # Function to perform simultaneous double peak fitting multiple times
 
+    @fit_task
     def sim_double_fit(self):
         """Function to perform simultaneous double peak fitting for multiple energy ranges
 
@@ -3817,6 +4241,8 @@ class MainWindow(QtWidgets.QMainWindow):
         None
         """
 
+        fit_profiler.reset()  # Record fit statistics of this run
+
         # Import relevant parameters
         eqe = self.data_sim
         self.T_sim = self.ui.Temperature_Sim.value()
@@ -3853,6 +4279,8 @@ class MainWindow(QtWidgets.QMainWindow):
                                            bound_dict['stop_stop'] + 0.005,
                                            0.01), 3).tolist()
 
+            eqe = self.get_spectrum(eqe)  # Sort EQE once to compile each fit range by binary search
+
             # Compile a dataFrame with all combinations of start / stop values for the optical and CT fit
             self.logger.info('Compiling Fit Ranges ...')
 
@@ -3869,30 +4297,26 @@ class MainWindow(QtWidgets.QMainWindow):
             df['Start'] = start_list
             df['Stop'] = stop_list
 
-            self.logger.info('Calculating Fits ...')
-
-            best_vals_Opt = []
-            best_vals_CT = []
-
-            covar_list = []
-
-            start_list = []
-            stop_list = []
+            # Skip fit ranges with too few data points
+            df = df[feasible_Windows(eqe, df['Start'], df['Stop'],
+                                     n_params=7 if include_disorder else 6)].reset_index(drop=True)
 
-            R2_Opt_list = []
-            R2_CT_list = []
-            R2_sum_list = []
-            R2_average_list = []
+            if len(df) == 0:
+                self.logger.error('No fit range contains enough data points.')
+                return
 
-            Opt_Fit_list = []
-            CT_Fit_list = []
-            combined_Fit_list = []
-            Energy_list = []
-            EQE_list = []
+            self.logger.info('Calculating Fits ...')
 
-            df_results = pd.DataFrame()
+            # Store fit parameters and R squared values only, fit curves are regenerated for the best fits
+            fit_results = FitResults(T=self.T_sim,
+                                     n_best=int(self.ui.n_Sim.value()),  # Keep only the best fits
+                                     include_disorder=include_disorder,
+                                     simultaneous_double=True,
+                                     rank='Total_R2'  # NOTE: Change to 'Comp_R2' to rank by average R2
+                                     )
 
-            for x in tqdm(range(len(df))):
+            # Function to fit a fit range and return its score
+            def fit_window(x):
                 if df['Start'][x] < df['Stop'][x]:
                     wave_fit, energy_fit, eqe_fit, log_eqe_fit = compile_EQE(eqe, df['Start'][x], df['Stop'][x], 1)
 
@@ -3901,6 +4325,7 @@ class MainWindow(QtWidgets.QMainWindow):
                         try:
                             best_vals, covar, y_fit, r_squared = fit_model_double(
                                 function=self.gaussian_disorder_double_sim,
+                                jac=self.gaussian_disorder_double_sim_jac,
                                 energy_fit=energy_fit,
                                 eqe_fit=eqe_fit,
                                 bound_dict=bound_dict,
@@ -3925,6 +4350,7 @@ class MainWindow(QtWidgets.QMainWindow):
                         p0 = self.sim_guess
                         try:
                             best_vals, covar, y_fit, r_squared = fit_model_double(function=self.gaussian_double_sim,
+                                                                                  jac=self.gaussian_double_sim_jac,
                                                                                   energy_fit=energy_fit,
                                                                                   eqe_fit=eqe_fit,
                                                                                   bound_dict=bound_dict,
@@ -3957,23 +4383,15 @@ class MainWindow(QtWidgets.QMainWindow):
                                                                 include_disorder=include_disorder
                                                                 )
 
-                        covar_list.append(covar)
-
-                        start_list.append(df['Start'][x])
-                        stop_list.append(df['Stop'][x])
-                        best_vals_CT.append(best_CT)
-                        best_vals_Opt.append(best_Opt)
-
-                        R2_sum_list.append(parameter_dict['R2_Combined'])
-                        R2_Opt_list.append(parameter_dict['R2_Opt'])
-                        R2_CT_list.append(parameter_dict['R2_CT'])
-                        R2_average_list.append(parameter_dict['R2_Average'])
+                        fit_results.append_simultaneous(start=df['Start'][x],
+                                                        stop=df['Stop'][x],
+                                                        fit_Opt=best_Opt,
+                                                        fit_CT=best_CT,
+                                                        covar=covar,
+                                                        parameter_dict=parameter_dict
+                                                        )
 
-                        combined_Fit_list.append(parameter_dict['Combined_Fit'])
-                        Opt_Fit_list.append(parameter_dict['Opt_Fit'])
-                        CT_Fit_list.append(parameter_dict['CT_Fit'])
-                        Energy_list.append(parameter_dict['Energy'])
-                        EQE_list.append(parameter_dict['EQE'])
+                        return fit_results.score(parameter_dict)
 
                     else:  # If sum was unsuccessful, skip and move on
                         pass
@@ -3981,24 +4399,17 @@ class MainWindow(QtWidgets.QMainWindow):
                 else:
                     pass
 
-            if len(best_vals_Opt) == len(best_vals_CT) and len(best_vals_Opt) != 0:
-
-                df_results['Start'] = start_list
-                df_results['Stop'] = stop_list
-                df_results['Fit_Opt'] = best_vals_Opt
-                df_results['R2_Opt'] = R2_Opt_list
-                df_results['Fit_CT'] = best_vals_CT
-                df_results['R2_CT'] = R2_CT_list
-                df_results['Covar'] = covar_list
-
-                # Add combined fit to dataFrame
-                df_results['Total_R2'] = R2_sum_list
-                df_results['Total_Fit'] = combined_Fit_list
-                df_results['Opt_Fit'] = Opt_Fit_list
-                df_results['CT_Fit'] = CT_Fit_list
-                df_results['Energy'] = Energy_list
-                df_results['EQE'] = EQE_list
-                df_results['Comp_R2'] = R2_average_list
+                return np.nan
+
+            if use_window_search:  # Fit a budget of fit ranges proposed by a surrogate model
+                self.task_runner.run(lambda: search_Windows(df[['Start', 'Stop']].to_numpy(), fit_window,
+                                                            track=self.task_runner.track),
+                                     label='Simultaneous double fits'
+                                     )
+            else:
+                self.task_runner.map(fit_window, range(len(df)), label='Simultaneous double fits')
+
+            if len(fit_results) != 0:  # Confirm fits are available
 
                 # Find best fit
 
@@ -4020,24 +4431,34 @@ class MainWindow(QtWidgets.QMainWindow):
 
                 label = pick_EQE_Label(self.ui.textBox_simFit_label, self.ui.textBox_simFit)
 
-                n = int(self.ui.n_Sim.value())
-                for x in np.arange(1, n + 1, 1):
+                self.logger.info(f'Kept {len(fit_results)} best of {fit_results.n_fits} fits.')
+                for x, index in enumerate(fit_results.best(), 1):
                     print('-' * 80)
                     print(('Best Fit No. {} : ').format(x))
-                    df_results = find_best_fit(df_both=df_results,
-                                               eqe=eqe,
-                                               T=self.T_sim,
-                                               label=label,
-                                               n_fit=x,
-                                               include_disorder=include_disorder,
-                                               simultaneous_double=True,
-                                               save_fit=save_fit,
-                                               save_fit_file=save_fit_file
-                                               )
+                    find_best_fit(df_both=fit_results,
+                                  eqe=eqe,
+                                  T=self.T_sim,
+                                  label=label,
+                                  n_fit=x,
+                                  include_disorder=include_disorder,
+                                  simultaneous_double=True,
+                                  save_fit=save_fit,
+                                  save_fit_file=save_fit_file,
+                                  index=index,
+                                  bias=self.bias_sim,
+                                  tolerance=self.tolerance_sim
+                                  )
                     print(' ' * 80)
                 print('-' * 80)
+                if save_fit:  # Save fit statistics next to the fit files
+                    fit_profiler.save(save_fit_file)
                 print("")
 
+            self.logger.info(window_cache.summary())
+            fit_cache.flush()
+            self.logger.info(fit_cache.summary())
+            self.logger.info(fit_profiler.report())
+
     # -----------------------------------------------------------------------------------------------------------
 
     # Function to load dictionary of fit bounds
@@ -4145,6 +4566,36 @@ class MainWindow(QtWidgets.QMainWindow):
 
         return val_CT + val_opt
 
+    def gaussian_double_sim_jac(self, E, fCT, lCT, ECT, fopt, lopt, Eopt):
+        """Analytic Jacobian of gaussian_double_sim
+
+        Parameters
+        ----------
+        E : list, required
+            List of energy values
+        fCT : float, required
+            CT state oscillator strength
+        lCT : float, required
+            CT state reorganization energy
+        ECT : float, required
+            CT state energy
+        fopt : float, required
+            S1 peak oscillator strength
+        lopt : float, required
+            S1 peak reorganization energy
+        Eopt : float, required
+            S1 peak energy
+
+        Returns
+        -------
+        jac : array
+            Derivatives of EQE with respect to [fCT, lCT, ECT, fopt, lopt, Eopt]
+        """
+
+        return np.hstack([calculate_gaussian_absorption_jac(E, fCT, lCT, ECT, self.T_sim),
+                          calculate_gaussian_absorption_jac(E, fopt, lopt, Eopt, self.T_sim)
+                          ])
+
     # Gaussian fitting function for simultaneous double peak fit including disorder
 
     def gaussian_disorder_double_sim(self, E, fCT, lCT, ECT, fopt, lopt, Eopt, sig):
@@ -4182,6 +4633,39 @@ class MainWindow(QtWidgets.QMainWindow):
 
         return val_CT + val_opt
 
+    def gaussian_disorder_double_sim_jac(self, E, fCT, lCT, ECT, fopt, lopt, Eopt, sig):
+        """Analytic Jacobian of gaussian_disorder_double_sim
+
+        Parameters
+        ----------
+        E : list, required
+            List of energy values
+        fCT : float, required
+            CT state oscillator strength
+        lCT : float, required
+            CT state reorganization energy
+        ECT : float, required
+            CT state energy
+        fopt : float, required
+            S1 peak oscillator strength
+        lopt : float, required
+            S1 peak reorganization energy
+        Eopt : float, required
+            S1 peak energy
+        sig : float, required
+            Gaussian disorder
+
+        Returns
+        -------
+        jac : array
+            Derivatives of EQE with respect to [fCT, lCT, ECT, fopt, lopt, Eopt, sig]
+        """
+
+        jac_CT = calculate_gaussian_disorder_absorption_jac(E, fCT, lCT, ECT, sig, self.T_sim)
+        jac_opt = calculate_gaussian_absorption_jac(E, fopt, lopt, Eopt, self.T_sim)
+
+        return np.hstack([jac_CT[:, :3], jac_opt, jac_CT[:, 3:]])
+
     # -----------------------------------------------------------------------------------------------------------
 
     # Page 5 - Extended Fits (MLJ Theory)
@@ -4192,6 +4676,7 @@ class MainWindow(QtWidgets.QMainWindow):
 
     # Function to compile fits for separate double peak fitting
 
+    @fit_task
     def double_fit_MLJ(self):
         """Function for separate double peak fitting of S1 and CT state peaks using MLJ theory
 
@@ -4205,6 +4690,8 @@ class MainWindow(QtWidgets.QMainWindow):
             EQE value
         """
 
+        fit_profiler.reset()  # Record fit statistics of this run
+
         increase_factor = 1.05  # NOTE: Modify to increase data range for R2 calculation and fit selection
         include_disorder = False
         guessRange_Sig = None
@@ -4281,6 +4768,8 @@ class MainWindow(QtWidgets.QMainWindow):
             guessRange_Opt = np.round(np.arange(startGuess_Opt, stopGuess_Opt + 0.1, 0.05), 3).tolist()
             guessRange_CT = np.round(np.arange(startGuess_CT, stopGuess_CT + 0.1, 0.05), 3).tolist()
 
+            eqe = self.get_spectrum(eqe)  # Sort EQE once to compile each fit range by binary search
+
             # Compile a dataFrame with all combinations of start / stop values for Opt and CT fit
 
             self.logger.info('Compiling Fit Ranges ...')
@@ -4309,16 +4798,30 @@ class MainWindow(QtWidgets.QMainWindow):
             df_CT['Start'] = start_CT_list
             df_CT['Stop'] = stop_CT_list
 
+            # Skip fit ranges with too few data points
+            df_Opt = df_Opt[feasible_Windows(eqe, df_Opt['Start'], df_Opt['Stop'], n_params=3,
+                                             label='optical peak fit ranges')].reset_index(drop=True)
+            df_CT = df_CT[feasible_Windows(eqe, df_CT['Start'], df_CT['Stop'], n_params=4 if include_disorder else 3,
+                                           label='CT state fit ranges')].reset_index(drop=True)
+
+            if len(df_Opt) == 0 or len(df_CT) == 0:
+                self.logger.error('No fit range contains enough data points.')
+                self.bias = False
+                return
+
             # Calculate all optical peak fits
 
             self.logger.info('Calculating Optical Peak Fits ...')
 
-            cal_vals_Opt = list(map(lambda x: calculate_guess_fit(x=x,
-                                                                  df=df_Opt,
-                                                                  eqe=eqe,
-                                                                  function=self.MLJ_double_gaussian,
-                                                                  guessRange=guessRange_Opt
-                                                                  ), tqdm(range(len(df_Opt)))))
+            cal_vals_Opt = self.task_runner.map(lambda x: calculate_guess_fit(x=x,
+                                                                              df=df_Opt,
+                                                                              eqe=eqe,
+                                                                              function=self.MLJ_double_gaussian,
+                                                                              guessRange=guessRange_Opt
+                                                                              ),
+                                                range(len(df_Opt)),
+                                                label='Optical peak fits'
+                                                )
 
             best_vals_Opt = list(map(lambda list_: sep_list(list_, 0), cal_vals_Opt))
             covar_Opt = list(map(lambda list_: sep_list(list_, 1), cal_vals_Opt))
@@ -4330,46 +4833,177 @@ class MainWindow(QtWidgets.QMainWindow):
 
             # Calculate CT state fits
 
-            start_Opt_list = []
-            stop_Opt_list = []
-            start_CT_list = []
-            stop_CT_list = []
+            # Store fit parameters and R squared values only, fit curves are regenerated for the best fits
+            fit_results = FitResults(T=self.T_xDouble,
+                                     n_best=int(self.ui.n_Extra.value()),  # Keep only the best fits
+                                     include_disorder=include_disorder,
+                                     S=self.S_Double,
+                                     hbarw=self.hbarw_Double,
+                                     range=increase_factor
+                                     )
+
+            self.logger.info('Calculating CT State Fits ...')
 
-            best_vals_Opt = []
-            best_vals_CT = []
+            if include_disorder:
+                self.logger.info('Including CT State Disorder ...')
 
-            Opt_covar_list = []
-            CT_covar_list = []
+            subtract = self.ui.subtract_extraDoubleFit.isChecked()
+            best_subtract = self.ui.bestSubtract_extraDoubleFit.isChecked()
+
+            # Function to calculate all CT state fits in the task runner (must not access GUI objects)
+            def fit_CT():
+
+                # If Optical peak to be subtracted before CT fit
+                if subtract and not best_subtract:
+                    self.logger.info('Subtracting All Optical Peak Fits ...')
+                    self.task_runner.add(len(df_Opt) * len(df_CT))
+                    for x in range(len(df_Opt)):
+                        for y in self.task_runner.track(range(len(df_CT)), total=0):
+                            if df_Opt['R2'][x] > 0:  # Check that the optical peak fit was successful
+
+                                new_eqe = subtract_Opt(eqe, df_Opt['Fit'][x], T=self.T_xDouble)
+
+                                if include_disorder:
+                                    best_vals, covar, p0, r_squared = guess_fit(eqe=new_eqe,
+                                                                                startE=df_CT['Start'][y],
+                                                                                stopE=df_CT['Stop'][y],
+                                                                                function=self.MLJ_double_disorder,
+                                                                                guessRange=guessRange_CT,
+                                                                                guessRange_sig=guessRange_Sig,
+                                                                                include_disorder=True,
+                                                                                bounds=True  # to use fit model
+                                                                                )
+                                else:
+                                    best_vals, covar, p0, r_squared = guess_fit(eqe=new_eqe,
+                                                                                startE=df_CT['Start'][y],
+                                                                                stopE=df_CT['Stop'][y],
+                                                                                function=self.MLJ_double,
+                                                                                guessRange=guessRange_CT,
+                                                                                include_disorder=False,
+                                                                                bounds=None  # to use fit function
+                                                                                )
+                            else:
+                                best_vals = [0, 0, 0]
+                                covar = None
+                                r_squared = 0
+
+                            # Calculate combined fit here
+                            parameter_dict = calculate_combined_fit_MLJ(stopE=df_Opt['Stop'][x],
+                                                                        best_vals_Opt=df_Opt['Fit'][x],
+                                                                        best_vals_CT=best_vals,
+                                                                        R2_Opt=df_Opt['R2'][x],
+                                                                        R2_CT=r_squared,
+                                                                        eqe=eqe,
+                                                                        T=self.T_xDouble,
+                                                                        S=self.S_Double,
+                                                                        hbarw=self.hbarw_Double,
+                                                                        bias=self.bias,
+                                                                        tolerance=self.tolerance,
+                                                                        range=increase_factor,
+                                                                        include_disorder=include_disorder
+                                                                        )
 
-            R2_Opt = []
-            R2_CT = []
+                            fit_results.append_separate(start_Opt=df_Opt['Start'][x],
+                                                        stop_Opt=df_Opt['Stop'][x],
+                                                        fit_Opt=df_Opt['Fit'][x],
+                                                        R2_Opt=df_Opt['R2'][x],
+                                                        covar_Opt=df_Opt['Covar'][x],
+                                                        start_CT=df_CT['Start'][y],
+                                                        stop_CT=df_CT['Stop'][y],
+                                                        fit_CT=best_vals,
+                                                        R2_CT=r_squared,
+                                                        covar_CT=covar,
+                                                        parameter_dict=parameter_dict
+                                                        )
+
+                # If only best Optical peak is to be subtracted before CT fit
+                elif best_subtract and not subtract:
+                    self.logger.info('Subtracting Only Best Optical Peak Fit ...')
+
+                    # best_fit_index = df_Opt['Fit'][df_Opt['R2']==max(df_Opt['R2'])].index[0]
+                    # print(best_fit_index)
+
+                    # To avoid picking a fit that has a high R2 but moves above the data
+                    advanced_R2_list = []
+                    for x in range(len(df_Opt)):
+                        wave_fit, energy_fit, eqe_fit, log_eqe_fit = compile_EQE(eqe,
+                                                                                 df_Opt['Start'][x],
+                                                                                 df_Opt['Stop'][x] * increase_factor,
+                                                                                 1)
+                        y_fit = [self.MLJ_double_gaussian(e,
+                                                          df_Opt['Fit'][x][0],
+                                                          df_Opt['Fit'][x][1],
+                                                          df_Opt['Fit'][x][2]
+                                                          ) for e in energy_fit]
+                        advanced_R2_list.append(R_squared(eqe_fit, y_fit))
 
-            combined_R2_list = []
+                    df_Opt['Advanced R2'] = advanced_R2_list
 
-            Opt_Fit_list = []
-            CT_Fit_list = []
-            combined_Fit_list = []
-            Energy_list = []
-            EQE_list = []
+                    best_fit_index = df_Opt['Fit'][df_Opt['Advanced R2'] == max(df_Opt['Advanced R2'])].index[0]
+                    # print(best_fit_index)
 
-            df_results = pd.DataFrame()
+                    new_eqe = subtract_Opt(eqe, df_Opt['Fit'][best_fit_index], T=self.T_xDouble)
 
-            self.logger.info('Calculating CT State Fits ...')
+                    for y in self.task_runner.track(range(len(df_CT))):
 
-            if include_disorder:
-                self.logger.info('Including CT State Disorder ...')
+                        if include_disorder:
+                            best_vals, covar, p0, r_squared = guess_fit(eqe=new_eqe,
+                                                                        startE=df_CT['Start'][y],
+                                                                        stopE=df_CT['Stop'][y],
+                                                                        function=self.MLJ_double_disorder,
+                                                                        guessRange=guessRange_CT,
+                                                                        guessRange_sig=guessRange_Sig,
+                                                                        include_disorder=True,
+                                                                        bounds=True  # to use fit model
+                                                                        )
+                        else:
+                            best_vals, covar, p0, r_squared = guess_fit(eqe=new_eqe,
+                                                                        startE=df_CT['Start'][y],
+                                                                        stopE=df_CT['Stop'][y],
+                                                                        function=self.MLJ_double,
+                                                                        guessRange=guessRange_CT,
+                                                                        include_disorder=False,
+                                                                        bounds=None  # to use fit function
+                                                                        )
 
-            # If Optical peak to be subtracted before CT fit
-            if self.ui.subtract_extraDoubleFit.isChecked() and not self.ui.bestSubtract_extraDoubleFit.isChecked():
-                self.logger.info('Subtracting All Optical Peak Fits ...')
-                for x in tqdm(range(len(df_Opt))):
-                    for y in tqdm(range(len(df_CT))):
-                        if df_Opt['R2'][x] > 0:  # Check that the optical peak fit was successful
+                        # Calculate combined fit here
+                        parameter_dict = calculate_combined_fit_MLJ(stopE=df_Opt['Stop'][best_fit_index],
+                                                                    best_vals_Opt=df_Opt['Fit'][best_fit_index],
+                                                                    best_vals_CT=best_vals,
+                                                                    R2_Opt=df_Opt['R2'][best_fit_index],
+                                                                    R2_CT=r_squared,
+                                                                    eqe=eqe,
+                                                                    T=self.T_xDouble,
+                                                                    S=self.S_Double,
+                                                                    hbarw=self.hbarw_Double,
+                                                                    bias=self.bias,
+                                                                    tolerance=self.tolerance,
+                                                                    range=increase_factor,
+                                                                    include_disorder=include_disorder
+                                                                    )
 
-                            new_eqe = subtract_Opt(eqe, df_Opt['Fit'][x], T=self.T_xDouble)
+                        fit_results.append_separate(start_Opt=df_Opt['Start'][best_fit_index],
+                                                    stop_Opt=df_Opt['Stop'][best_fit_index],
+                                                    fit_Opt=df_Opt['Fit'][best_fit_index],
+                                                    R2_Opt=df_Opt['R2'][best_fit_index],
+                                                    covar_Opt=df_Opt['Covar'][best_fit_index],
+                                                    start_CT=df_CT['Start'][y],
+                                                    stop_CT=df_CT['Stop'][y],
+                                                    fit_CT=best_vals,
+                                                    R2_CT=r_squared,
+                                                    covar_CT=covar,
+                                                    parameter_dict=parameter_dict
+                                                    )
+
+                # If Optical peak not to be subtracted before CT fit
+                elif not subtract and not best_subtract:
+                    self.logger.info('Not Subtracting Optical Peak Fits.')
+                    self.task_runner.add(len(df_Opt) * len(df_CT))
+                    for x in range(len(df_Opt)):
+                        for y in self.task_runner.track(range(len(df_CT)), total=0):
 
                             if include_disorder:
-                                best_vals, covar, p0, r_squared = guess_fit(eqe=new_eqe,
+                                best_vals, covar, p0, r_squared = guess_fit(eqe=eqe,
                                                                             startE=df_CT['Start'][y],
                                                                             stopE=df_CT['Stop'][y],
                                                                             function=self.MLJ_double_disorder,
@@ -4379,7 +5013,7 @@ class MainWindow(QtWidgets.QMainWindow):
                                                                             bounds=True  # to use fit model
                                                                             )
                             else:
-                                best_vals, covar, p0, r_squared = guess_fit(eqe=new_eqe,
+                                best_vals, covar, p0, r_squared = guess_fit(eqe=eqe,
                                                                             startE=df_CT['Start'][y],
                                                                             stopE=df_CT['Stop'][y],
                                                                             function=self.MLJ_double,
@@ -4387,21 +5021,6 @@ class MainWindow(QtWidgets.QMainWindow):
                                                                             include_disorder=False,
                                                                             bounds=None  # to use fit function
                                                                             )
-                        else:
-                            best_vals = [0, 0, 0]
-                            r_squared = 0
-
-                        Opt_covar_list.append(df_Opt['Covar'][x])
-                        CT_covar_list.append(covar)
-                        start_Opt_list.append(df_Opt['Start'][x])
-                        stop_Opt_list.append(df_Opt['Stop'][x])
-                        start_CT_list.append(df_CT['Start'][y])
-                        stop_CT_list.append(df_CT['Stop'][y])
-                        best_vals_Opt.append(df_Opt['Fit'][x])
-                        best_vals_CT.append(best_vals)
-                        R2_Opt.append(df_Opt['R2'][x])
-                        R2_CT.append(r_squared)
-
                         # Calculate combined fit here
                         parameter_dict = calculate_combined_fit_MLJ(stopE=df_Opt['Stop'][x],
                                                                     best_vals_Opt=df_Opt['Fit'][x],
@@ -4418,179 +5037,25 @@ class MainWindow(QtWidgets.QMainWindow):
                                                                     include_disorder=include_disorder
                                                                     )
 
-                        combined_R2_list.append(parameter_dict['R2_Combined'])
-                        combined_Fit_list.append(parameter_dict['Combined_Fit'])
-                        Opt_Fit_list.append(parameter_dict['Opt_Fit'])
-                        CT_Fit_list.append(parameter_dict['CT_Fit'])
-                        Energy_list.append(parameter_dict['Energy'])
-                        EQE_list.append(parameter_dict['EQE'])
-
-            # If only best Optical peak is to be subtracted before CT fit
-            elif self.ui.bestSubtract_extraDoubleFit.isChecked() and not self.ui.subtract_extraDoubleFit.isChecked():
-                self.logger.info('Subtracting Only Best Optical Peak Fit ...')
-
-                # best_fit_index = df_Opt['Fit'][df_Opt['R2']==max(df_Opt['R2'])].index[0]
-                # print(best_fit_index)
-
-                # To avoid picking a fit that has a high R2 but moves above the data
-                advanced_R2_list = []
-                for x in range(len(df_Opt)):
-                    wave_fit, energy_fit, eqe_fit, log_eqe_fit = compile_EQE(eqe,
-                                                                             df_Opt['Start'][x],
-                                                                             df_Opt['Stop'][x] * increase_factor,
-                                                                             1)
-                    y_fit = [self.MLJ_double_gaussian(e,
-                                                      df_Opt['Fit'][x][0],
-                                                      df_Opt['Fit'][x][1],
-                                                      df_Opt['Fit'][x][2]
-                                                      ) for e in energy_fit]
-                    advanced_R2_list.append(R_squared(eqe_fit, y_fit))
-
-                df_Opt['Advanced R2'] = advanced_R2_list
-
-                best_fit_index = df_Opt['Fit'][df_Opt['Advanced R2'] == max(df_Opt['Advanced R2'])].index[0]
-                # print(best_fit_index)
-
-                new_eqe = subtract_Opt(eqe, df_Opt['Fit'][best_fit_index], T=self.T_xDouble)
-
-                for y in tqdm(range(len(df_CT))):
-
-                    if include_disorder:
-                        best_vals, covar, p0, r_squared = guess_fit(eqe=new_eqe,
-                                                                    startE=df_CT['Start'][y],
-                                                                    stopE=df_CT['Stop'][y],
-                                                                    function=self.MLJ_double_disorder,
-                                                                    guessRange=guessRange_CT,
-                                                                    guessRange_sig=guessRange_Sig,
-                                                                    include_disorder=True,
-                                                                    bounds=True  # to use fit model
-                                                                    )
-                    else:
-                        best_vals, covar, p0, r_squared = guess_fit(eqe=new_eqe,
-                                                                    startE=df_CT['Start'][y],
-                                                                    stopE=df_CT['Stop'][y],
-                                                                    function=self.MLJ_double,
-                                                                    guessRange=guessRange_CT,
-                                                                    include_disorder=False,
-                                                                    bounds=None  # to use fit function
-                                                                    )
-
-                    Opt_covar_list.append(df_Opt['Covar'][x])
-                    CT_covar_list.append(covar)
-                    start_Opt_list.append(df_Opt['Start'][best_fit_index])
-                    stop_Opt_list.append(df_Opt['Stop'][best_fit_index])
-                    start_CT_list.append(df_CT['Start'][y])
-                    stop_CT_list.append(df_CT['Stop'][y])
-                    best_vals_Opt.append(df_Opt['Fit'][best_fit_index])
-                    best_vals_CT.append(best_vals)
-                    R2_Opt.append(df_Opt['R2'][best_fit_index])
-                    R2_CT.append(r_squared)
-
-                    # Calculate combined fit here
-                    parameter_dict = calculate_combined_fit_MLJ(stopE=df_Opt['Stop'][x],
-                                                                best_vals_Opt=df_Opt['Fit'][x],
-                                                                best_vals_CT=best_vals,
-                                                                R2_Opt=df_Opt['R2'][x],
-                                                                R2_CT=r_squared,
-                                                                eqe=eqe,
-                                                                T=self.T_xDouble,
-                                                                S=self.S_Double,
-                                                                hbarw=self.hbarw_Double,
-                                                                bias=self.bias,
-                                                                tolerance=self.tolerance,
-                                                                range=increase_factor,
-                                                                include_disorder=include_disorder
-                                                                )
-
-                    combined_R2_list.append(parameter_dict['R2_Combined'])
-                    combined_Fit_list.append(parameter_dict['Combined_Fit'])
-                    Opt_Fit_list.append(parameter_dict['Opt_Fit'])
-                    CT_Fit_list.append(parameter_dict['CT_Fit'])
-                    Energy_list.append(parameter_dict['Energy'])
-                    EQE_list.append(parameter_dict['EQE'])
-
-            # If Optical peak not to be subtracted before CT fit
-            elif not self.ui.subtract_extraDoubleFit.isChecked() and not self.ui.bestSubtract_extraDoubleFit.isChecked():
-                self.logger.info('Not Subtracting Optical Peak Fits.')
-                for x in tqdm(range(len(df_Opt))):
-                    for y in tqdm(range(len(df_CT))):
+                        fit_results.append_separate(start_Opt=df_Opt['Start'][x],
+                                                    stop_Opt=df_Opt['Stop'][x],
+                                                    fit_Opt=df_Opt['Fit'][x],
+                                                    R2_Opt=df_Opt['R2'][x],
+                                                    covar_Opt=df_Opt['Covar'][x],
+                                                    start_CT=df_CT['Start'][y],
+                                                    stop_CT=df_CT['Stop'][y],
+                                                    fit_CT=best_vals,
+                                                    R2_CT=r_squared,
+                                                    covar_CT=covar,
+                                                    parameter_dict=parameter_dict
+                                                    )
 
-                        if include_disorder:
-                            best_vals, covar, p0, r_squared = guess_fit(eqe=eqe,
-                                                                        startE=df_CT['Start'][y],
-                                                                        stopE=df_CT['Stop'][y],
-                                                                        function=self.MLJ_double_disorder,
-                                                                        guessRange=guessRange_CT,
-                                                                        guessRange_sig=guessRange_Sig,
-                                                                        include_disorder=True,
-                                                                        bounds=True  # to use fit model
-                                                                        )
-                        else:
-                            best_vals, covar, p0, r_squared = guess_fit(eqe=eqe,
-                                                                        startE=df_CT['Start'][y],
-                                                                        stopE=df_CT['Stop'][y],
-                                                                        function=self.MLJ_double,
-                                                                        guessRange=guessRange_CT,
-                                                                        include_disorder=False,
-                                                                        bounds=None  # to use fit function
-                                                                        )
-                    Opt_covar_list.append(df_Opt['Covar'][x])
-                    CT_covar_list.append(covar)
-                    start_Opt_list.append(df_Opt['Start'][x])
-                    stop_Opt_list.append(df_Opt['Stop'][x])
-                    start_CT_list.append(df_CT['Start'][y])
-                    stop_CT_list.append(df_CT['Stop'][y])
-                    best_vals_Opt.append(df_Opt['Fit'][x])
-                    best_vals_CT.append(best_vals)
-                    R2_Opt.append(df_Opt['R2'][x])
-                    R2_CT.append(r_squared)
-
-                    # Calculate combined fit here
-                    parameter_dict = calculate_combined_fit_MLJ(stopE=df_Opt['Stop'][x],
-                                                                best_vals_Opt=df_Opt['Fit'][x],
-                                                                best_vals_CT=best_vals,
-                                                                R2_Opt=df_Opt['R2'][x],
-                                                                R2_CT=r_squared,
-                                                                eqe=eqe,
-                                                                T=self.T_xDouble,
-                                                                S=self.S_Double,
-                                                                hbarw=self.hbarw_Double,
-                                                                bias=self.bias,
-                                                                tolerance=self.tolerance,
-                                                                range=increase_factor,
-                                                                include_disorder=include_disorder
-                                                                )
+                else:
+                    self.logger.info('Please select valid fit settings.')
 
-                    combined_R2_list.append(parameter_dict['R2_Combined'])
-                    combined_Fit_list.append(parameter_dict['Combined_Fit'])
-                    Opt_Fit_list.append(parameter_dict['Opt_Fit'])
-                    CT_Fit_list.append(parameter_dict['CT_Fit'])
-                    Energy_list.append(parameter_dict['Energy'])
-                    EQE_list.append(parameter_dict['EQE'])
+            self.task_runner.run(fit_CT, label='CT state fits')
 
-            else:
-                self.logger.info('Please select valid fit settings.')
-
-            if len(best_vals_Opt) == len(best_vals_CT) and len(best_vals_Opt) != 0:  # Confirm lists are acceptable
-
-                df_results['Start_Opt'] = start_Opt_list
-                df_results['Stop_Opt'] = stop_Opt_list
-                df_results['Fit_Opt'] = best_vals_Opt
-                df_results['R2_Opt'] = R2_Opt
-                df_results['Start_CT'] = start_CT_list
-                df_results['Stop_CT'] = stop_CT_list
-                df_results['Fit_CT'] = best_vals_CT
-                df_results['R2_CT'] = R2_CT
-                df_results['Covar_Opt'] = Opt_covar_list
-                df_results['Covar_CT'] = CT_covar_list
-
-                # Add combined fit to dataFrame
-                df_results['Total_R2'] = combined_R2_list
-                df_results['Total_Fit'] = combined_Fit_list
-                df_results['Opt_Fit'] = Opt_Fit_list
-                df_results['CT_Fit'] = CT_Fit_list
-                df_results['Energy'] = Energy_list
-                df_results['EQE'] = EQE_list
+            if len(fit_results) != 0:  # Confirm fits are available
 
                 # Find best fit
 
@@ -4612,22 +5077,29 @@ class MainWindow(QtWidgets.QMainWindow):
 
                 label = pick_EQE_Label(self.ui.textBox_extraDouble_label, self.ui.textBox_extraDouble)
 
-                n = int(self.ui.n_Extra.value())
-                for x in np.arange(1, n + 1, 1):
+                self.logger.info(f'Kept {len(fit_results)} best of {fit_results.n_fits} fits.')
+                for x, index in enumerate(fit_results.best(), 1):
                     print('-' * 80)
                     print(('Best Fit No. {} : ').format(x))
-                    df_results = find_best_fit(df_both=df_results,
-                                               eqe=eqe,
-                                               T=self.T_xDouble,
-                                               label=label,
-                                               n_fit=x,
-                                               include_disorder=include_disorder,
-                                               save_fit=save_fit,
-                                               save_fit_file=save_fit_file
-                                               )
+                    find_best_fit(df_both=fit_results,
+                                  eqe=eqe,
+                                  T=self.T_xDouble,
+                                  label=label,
+                                  n_fit=x,
+                                  include_disorder=include_disorder,
+                                  save_fit=save_fit,
+                                  save_fit_file=save_fit_file,
+                                  index=index
+                                  )
                     print(' ' * 80)
                 print('-' * 80)
+                if save_fit:  # Save fit statistics next to the fit files
+                    fit_profiler.save(save_fit_file)
 
+        self.logger.info(window_cache.summary())
+        fit_cache.flush()
+        self.logger.info(fit_cache.summary())
+        self.logger.info(fit_profiler.report())
         self.bias = False
 
     # -----------------------------------------------------------------------------------------------------------
@@ -4679,14 +5151,8 @@ class MainWindow(QtWidgets.QMainWindow):
             EQE value
         """
 
-        EQE = 0
-        for n in range(0, 6):  # TODO: Check line breaks
-            EQE_n = (f / (E * math.sqrt(4 * math.pi * l * self.T_xDouble * self.k))) \
-                    * (math.exp(-self.S_Double) * self.S_Double ** n / math.factorial(n)) \
-                    * exp(-(Ect + l - E + n * self.hbarw_Double) ** 2 \
-                          / (4 * l * self.k * self.T_xDouble))
-            EQE += EQE_n
-        return EQE
+        return (f / (E * math.sqrt(4 * math.pi * l * self.T_xDouble * self.k))) \
+               * calculate_MLJ_replicas(Ect + l - E, 2 * l * self.k * self.T_xDouble, self.S_Double, self.hbarw_Double)
 
     # MLJ function including disorder
 
@@ -4712,14 +5178,12 @@ class MainWindow(QtWidgets.QMainWindow):
             EQE value
         """
 
-        EQE = 0
-        for n in range(0, 6):  # TODO: Check line breaks
-            EQE_n = (f / (E * math.sqrt(2 * math.pi * (2 * l * self.T_xDouble * self.k + sig ** 2))) \
-                     * (math.exp(-self.S_Double) * self.S_Double ** n / math.factorial(n)) \
-                     * exp(-(Ect + l - E + n * self.hbarw_Double) ** 2 \
-                           / (4 * l * self.k * self.T_xDouble + 2 * sig ** 2)))
-            EQE += EQE_n
-        return EQE
+        return (f / (E * math.sqrt(2 * math.pi * (2 * l * self.T_xDouble * self.k + sig ** 2)))) \
+               * calculate_MLJ_replicas(Ect + l - E,
+                                        2 * l * self.k * self.T_xDouble + sig ** 2,
+                                        self.S_Double,
+                                        self.hbarw_Double
+                                        )
 
     # -----------------------------------------------------------------------------------------------------------
 
@@ -4784,6 +5248,26 @@ class MainWindow(QtWidgets.QMainWindow):
         plt.close()
         self.axEL_1, self.axEL_2 = set_up_EL_plot()
 
+    # -----------------------------------------------------------------------------------------------------------
+
+    # Function to cancel running fits when the window is closed
+
+    def closeEvent(self, event):
+        """Function to cancel running fits when the window is closed
+
+        Parameters
+        ----------
+        event : QCloseEvent, required
+            Close event
+
+        Returns
+        -------
+        None
+        """
+
+        self.task_runner.cancel()
+        event.accept()
+
 
 # -----------------------------------------------------------------------------------------------------------
 
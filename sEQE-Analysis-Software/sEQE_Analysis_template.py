@@ -6761,6 +6761,19 @@ class Ui_MainWindow(object):
         self.statusbar = QtWidgets.QStatusBar(MainWindow)
         self.statusbar.setObjectName("statusbar")
         MainWindow.setStatusBar(self.statusbar)
+        self.actionSaveHeatMap = QtWidgets.QAction(MainWindow)
+        self.actionSaveHeatMap.setCheckable(True)
+        self.actionSaveHeatMap.setObjectName("actionSaveHeatMap")
+        self.menu.addAction(self.actionSaveHeatMap)
+        self.actionLoadHeatMap = QtWidgets.QAction(MainWindow)
+        self.actionLoadHeatMap.setObjectName("actionLoadHeatMap")
+        self.menu.addAction(self.actionLoadHeatMap)
+        self.actionGlobalFit = QtWidgets.QAction(MainWindow)
+        self.actionGlobalFit.setObjectName("actionGlobalFit")
+        self.menu.addAction(self.actionGlobalFit)
+        self.actionPlotELFiles = QtWidgets.QAction(MainWindow)
+        self.actionPlotELFiles.setObjectName("actionPlotELFiles")
+        self.menu.addAction(self.actionPlotELFiles)
         self.menubar.addAction(self.menu.menuAction())
 
         self.retranslateUi(MainWindow)
@@ -7013,6 +7026,10 @@ class Ui_MainWindow(object):
         self.plotAddButton.setText(_translate("MainWindow", "Plot All"))
         self.tabWidget.setTabText(self.tabWidget.indexOf(self.tab_6), _translate("MainWindow", "Subtract and Add Fits"))
         self.menu.setTitle(_translate("MainWindow", "sEQE Control Software"))
+        self.actionSaveHeatMap.setText(_translate("MainWindow", "Save Heat Maps"))
+        self.actionLoadHeatMap.setText(_translate("MainWindow", "Load Heat Map..."))
+        self.actionGlobalFit.setText(_translate("MainWindow", "Global Fit..."))
+        self.actionPlotELFiles.setText(_translate("MainWindow", "Plot EL Files..."))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,195 @@
+import itertools
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Define parameters for adaptive heat map refinement
+
+# NOTE: Set to True to fit a coarse grid and refine it where R2 is high or parameters change steeply.
+#       The printed statistics then cover the refined (best-biased) fit ranges only and the remaining fit
+#       ranges are filled with the nearest fit and hatched in the plots (see fill_Grid).
+use_adaptive_heatMap = False
+
+# Spacing of the initial coarse grid in units of the heat map resolution
+# NOTE: Powers of 2 refine to the full resolution grid without gaps
+coarse_step = 8
+
+# Cells with a corner R squared among this top fraction of all R squared values are refined
+r2_fraction = 0.1
+
+# Cells with a change of any fit parameter across its corners above this fraction of its range are refined
+gradient_fraction = 0.35
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to pair neighbouring grid indices
+
+def pair_Indices(indices):
+    """Function to pair neighbouring grid indices
+
+    Parameters
+    ----------
+    indices : list, required
+        Sorted list of grid indices
+
+    Returns
+    -------
+    pairs : list
+        List of (lower, upper) index pairs
+    """
+
+    return list(zip(indices[:-1], indices[1:])) or [(indices[0], indices[0])]
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to fit a heat map grid adaptively
+
+def refine_Grid(starts,
+                stops,
+                fit_windows,
+                feasible=None,
+                step=coarse_step,
+                r2_frac=r2_fraction,
+                gradient_frac=gradient_fraction
+                ):
+    """Function to fit a start / stop grid from coarse to fine resolution
+    A coarse grid is fitted first. Cells are then split recursively, down to the full resolution, if a corner
+    R squared is close to the maximum R squared or if fit parameters change steeply across the cell.
+    Both criteria are relative to the R squared and fit parameter values of all successful fits so far.
+
+    Parameters
+    ----------
+    starts : list, required
+        Start energies of the full resolution grid [eV]
+    stops : list, required
+        Stop energies of the full resolution grid [eV]
+    fit_windows : function, required
+        Function to fit a list of (start, stop) windows, returning a list of (best_vals, r_squared) tuples
+    feasible : array, optional
+        Boolean array of shape (len(starts), len(stops)) specifying which windows to fit (see feasible_Windows)
+        Infeasible windows are treated as failed fits
+    step : int, optional
+        Spacing of the coarse grid in units of the full resolution
+    r2_frac : float, optional
+        Cells with a corner R squared among the top r2_frac of all R squared values are refined
+    gradient_frac : float, optional
+        Cells with a parameter change above gradient_frac of the parameter range are refined
+
+    Returns
+    -------
+    fits : dict
+        Dictionary of fitted feasible windows {(start, stop): (best_vals, r_squared)}
+    """
+
+    n_start, n_stop = len(starts), len(stops)
+    if feasible is None:
+        feasible = np.ones((n_start, n_stop), dtype=bool)
+
+    results = {}  # Fit results by grid index (i, j)
+
+    def evaluate(points):
+        new = sorted(point for point in set(points) if point not in results)
+        for point in new:
+            if not feasible[point]:
+                results[point] = (None, 0)
+        new = [point for point in new if feasible[point]]
+        if len(new) != 0:
+            for point, result in zip(new, fit_windows([(starts[i], stops[j]) for i, j in new])):
+                results[point] = result
+
+    def refine(cell):
+        i0, i1, j0, j1 = cell
+        corners = [results[point] for point in itertools.product((i0, i1), (j0, j1))]
+        r_squared = np.array([r2 for best_vals, r2 in corners])
+        if r_squared.max() > 0 and r_squared.max() >= r2_threshold:
+            return True
+        params = np.array([best_vals for best_vals, r2 in corners if r2 > 0], dtype=float)
+        if len(params) >= 2:
+            return bool(np.any(np.ptp(params, axis=0) > gradient_frac * param_range))
+        return False
+
+    def coarse(n):
+        indices = list(range(0, n, step))
+        if indices[-1] != n - 1:
+            indices.append(n - 1)
+        return indices
+
+    start_indices, stop_indices = coarse(n_start), coarse(n_stop)
+    evaluate(itertools.product(start_indices, stop_indices))
+    cells = [(i0, i1, j0, j1) for (i0, i1), (j0, j1) in itertools.product(pair_Indices(start_indices),
+                                                                          pair_Indices(stop_indices))]
+
+    while len(cells) != 0:
+        successful = [(best_vals, r2) for best_vals, r2 in results.values() if r2 > 0]
+        if len(successful) == 0:
+            break
+        r_squared = np.array([r2 for best_vals, r2 in successful])
+        r2_threshold = np.quantile(r_squared, 1 - r2_frac)
+        param_range = np.ptp(np.array([best_vals for best_vals, r2 in successful], dtype=float), axis=0)
+
+        next_cells = []
+        for cell in cells:
+            i0, i1, j0, j1 = cell
+            if (i1 - i0 > 1 or j1 - j0 > 1) and refine(cell):
+                split_i = sorted({i0, (i0 + i1) // 2, i1})
+                split_j = sorted({j0, (j0 + j1) // 2, j1})
+                next_cells.extend((a0, a1, b0, b1) for (a0, a1), (b0, b1) in itertools.product(pair_Indices(split_i),
+                                                                                              pair_Indices(split_j)))
+
+        evaluate(point for i0, i1, j0, j1 in next_cells for point in itertools.product((i0, i1), (j0, j1)))
+        cells = next_cells
+
+    return {(starts[i], stops[j]): result for (i, j), result in results.items() if feasible[i, j]}
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to fill an adaptively fitted heat map grid
+
+def fill_Grid(fits,
+              starts,
+              stops,
+              feasible=None
+              ):
+    """Function to fill windows that were not fitted by refine_Grid with the nearest successful fit
+
+    Parameters
+    ----------
+    fits : dict, required
+        Dictionary of fitted windows {(start, stop): (best_vals, r_squared)} (see refine_Grid)
+    starts : list, required
+        Start energies of the full resolution grid [eV]
+    stops : list, required
+        Stop energies of the full resolution grid [eV]
+    feasible : array, optional
+        Boolean array of shape (len(starts), len(stops)) specifying which windows to fill
+
+    Returns
+    -------
+    filled : dict
+        Dictionary of filled windows {(start, stop): (best_vals, r_squared)}
+    """
+
+    if feasible is None:
+        feasible = np.ones((len(starts), len(stops)), dtype=bool)
+
+    start_index = {start: i for i, start in enumerate(starts)}
+    stop_index = {stop: j for j, stop in enumerate(stops)}
+
+    fitted = [window for window, (best_vals, r_squared) in fits.items() if r_squared > 0]
+    missing = [(i, j) for i, j in zip(*np.nonzero(feasible)) if (starts[i], stops[j]) not in fits]
+
+    if len(fitted) == 0 or len(missing) == 0:
+        return {}
+
+    tree = cKDTree([(start_index[start], stop_index[stop]) for start, stop in fitted])
+    nearest = tree.query(missing)[1]
+
+    return {(starts[i], stops[j]): fits[fitted[k]] for (i, j), k in zip(missing, nearest)}
+
+# -----------------------------------------------------------------------------------------------------------
@@ -1,5 +1,6 @@
 import numpy as np
 
+from source.compilation import Spectrum
 from source.gaussian import calculate_gaussian_absorption
 
 # -----------------------------------------------------------------------------------------------------------
@@ -14,26 +15,23 @@ def subtract_Opt(eqe,
 
     Parameters
     ----------
-    eqe : list, required
+    eqe : dataFrame or Spectrum, required
         EQE input data
     T : float, required
         EQE Measurement Temperature [K]
         
     Returns
     -------
-    eqe : list
+    eqe : dataFrame or Spectrum
         EQE with subtracted optical fit
     """
 
-    eqe = eqe.copy()
-
-    Opt_fit = np.array(
-        [calculate_gaussian_absorption(e,
-                                       best_vals[0],
-                                       best_vals[1],
-                                       best_vals[2],
-                                       T
-                                       ) for e in eqe['Energy']])
+    Opt_fit = calculate_gaussian_absorption(np.array(eqe['Energy']),
+                                            best_vals[0],
+                                            best_vals[1],
+                                            best_vals[2],
+                                            T
+                                            )
     EQE_data = np.array(eqe['EQE'])
 
     subtracted_EQE = EQE_data - Opt_fit
@@ -41,6 +39,10 @@ def subtract_Opt(eqe,
     assert len(Opt_fit) == len(EQE_data)
     assert len(Opt_fit) == len(subtracted_EQE)
 
+    if isinstance(eqe, Spectrum):  # Spectrum shares sorted energy values with the original EQE
+        return eqe.replace(EQE=subtracted_EQE)
+
+    eqe = eqe.copy()
     eqe['EQE'] = subtracted_EQE
 
     return eqe
@@ -0,0 +1,424 @@
+import math
+import time
+
+import numpy as np
+
+from source.compilation import compile_EQE
+from source.fit_cache import fit_cache, hash_Fit
+from source.fit_profile import fit_profiler
+from source.gaussian import calculate_gaussian_disorder_absorption_jac
+from source.utils import R_squared
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Define parameters for batched fits
+
+k = 8.617 * math.pow(10, -5)  # [ev/K]
+
+# These values are used if the closed-form guess fails
+f_guess = 0.001
+l_guess = 0.150
+
+# NOTE: Reorganization energy must be positive
+l_min = 1e-6
+
+# Levenberg-Marquardt damping
+lambda_start = 1e-3
+lambda_max = 1e10
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to compile fit windows into padded arrays
+
+def pad_Windows(eqe,
+                windows
+                ):
+    """Function to compile EQE fit windows into padded arrays
+
+    Parameters
+    ----------
+    eqe : Spectrum or dataFrame, required
+        EQE data including columns ['Energy', 'EQE']
+    windows : list, required
+        List of (start energy, stop energy) tuples [eV]
+
+    Returns
+    -------
+    energy : array
+        Array of shape (number of windows, longest window) with energy values [eV]
+        Padded values are set to 1 to avoid division by zero
+    eqe_fit : array
+        Array of the same shape with EQE values, padded with zeros
+    mask : array
+        Boolean array of the same shape marking valid values
+    """
+
+    compiled = [compile_EQE(eqe, start, stop, 1) for start, stop in windows]
+    length = max([len(window[1]) for window in compiled] + [1])
+
+    energy = np.ones((len(windows), length))
+    eqe_fit = np.zeros((len(windows), length))
+    mask = np.zeros((len(windows), length), dtype=bool)
+
+    for n, (wave_fit, energy_fit, eqe_values, log_eqe_fit) in enumerate(compiled):
+        energy[n, :len(energy_fit)] = energy_fit
+        eqe_fit[n, :len(eqe_values)] = eqe_values
+        mask[n, :len(energy_fit)] = True
+
+    return energy, eqe_fit, mask
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to calculate closed-form initial guesses for many windows
+
+def guess_Marcus_batch(energy,
+                       eqe_fit,
+                       mask,
+                       T,
+                       sig=None
+                       ):
+    """Function to calculate closed-form initial guesses for single peak Marcus fits of many windows
+    This is the batched version of guess_Marcus in utils_fit.
+
+    Parameters
+    ----------
+    energy : array, required
+        Padded energy values [eV]
+    eqe_fit : array, required
+        Padded EQE values
+    mask : array, required
+        Boolean array marking valid values
+    T : float, required
+        Temperature [K]
+    sig : float, optional
+        Disorder parameter guess [eV]
+
+    Returns
+    -------
+    p0 : array
+        Array of initial guesses [f, l, Ect] or [f, l, Ect, sig] for each window
+    ok : array
+        Boolean array marking windows with a valid closed-form guess
+    """
+
+    valid = mask & (eqe_fit > 0) & np.isfinite(eqe_fit)
+    values = np.where(valid, eqe_fit, 0)
+    peak_eqe = np.max(values, axis=1, keepdims=True)
+    weights = np.divide(values, peak_eqe, out=np.zeros_like(values), where=peak_eqe > 0) ** 2
+
+    log_values = np.log(np.where(valid, energy * values, 1))
+    X = np.stack([energy ** 2, energy, np.ones_like(energy)], axis=-1)
+
+    A = np.einsum('bl,bli,blj->bij', weights, X, X)
+    b = np.einsum('bl,bli,bl->bi', weights, X, log_values)
+    a2, a1, a0 = np.einsum('bij,bj->bi', np.linalg.pinv(A), b).T
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        V = -1 / (2 * a2)  # Peak variance (2 l k T + sig^2)
+        peak = -a1 / (2 * a2)  # Ect + l
+        f = np.exp(a0 - a1 ** 2 / (4 * a2)) * np.sqrt(2 * math.pi * V)
+
+    ok = (np.count_nonzero(valid, axis=1) >= 3) & (a2 < 0) & np.isfinite(f) & np.isfinite(peak)
+
+    if sig is None:
+        l = V / (2 * k * T)
+        p0 = np.column_stack([f, l, peak - l])
+    else:
+        sig = np.where(sig ** 2 >= V, np.sqrt(np.abs(V) / 2), sig)  # Split width equally if disorder guess is too large
+        l = (V - sig ** 2) / (2 * k * T)
+        p0 = np.column_stack([f, l, peak - l, sig])
+
+    return p0, ok
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to calculate Marcus model and Jacobian for many windows
+
+def evaluate_Marcus_batch(energy,
+                          params,
+                          T
+                          ):
+    """Function to calculate Marcus absorption and its Jacobian for many windows
+
+    Parameters
+    ----------
+    energy : array, required
+        Padded energy values [eV]
+    params : array, required
+        Array of fit parameters [f, l, Ect] or [f, l, Ect, sig] for each window
+    T : float, required
+        Temperature [K]
+
+    Returns
+    -------
+    EQE : array
+        Calculated EQE values
+    jac : array
+        Derivatives of EQE with respect to the fit parameters
+    """
+
+    f, l, Ect = (params[:, n, None] for n in range(3))
+    sig = params[:, 3, None] if params.shape[1] == 4 else 0
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore', under='ignore'):
+        jac = calculate_gaussian_disorder_absorption_jac(energy, f, l, Ect, sig, T)[..., :params.shape[1]]
+
+    return f * jac[..., 0], jac
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to fit many windows with a batched Levenberg-Marquardt solver
+
+def fit_batch(eqe,
+              windows,
+              T,
+              include_disorder=False,
+              sig=None,
+              bounds=None,
+              max_iter=200,
+              ftol=1e-10,
+              xtol=1e-10
+              ):
+    """Function to perform single peak Marcus fits of many windows at once
+
+    All windows are advanced together by a Levenberg-Marquardt solver using array operations.
+    Windows of different lengths are padded and masked. Windows that converge are removed from the active set.
+    Windows that are stored in the on-disk fit cache are not fitted again.
+    Each window is recorded by the fit profiler (see FitProfiler.batch).
+
+    Parameters
+    ----------
+    eqe : Spectrum or dataFrame, required
+        EQE data including columns ['Energy', 'EQE']
+    windows : list, required
+        List of (start energy, stop energy) tuples [eV]
+    T : float, required
+        Temperature [K]
+    include_disorder : bool, optional
+        Boolean value specifying whether to include CT state disorder
+    sig : float, optional
+        Disorder parameter guess [eV]
+    bounds : tuple, optional
+        Tuple of lower and upper bound lists in the order of the fit parameters
+    max_iter : int, optional
+        Maximum number of iterations
+    ftol : float, optional
+        Relative cost reduction below which a window is converged
+    xtol : float, optional
+        Relative step size below which a window is converged
+
+    Returns
+    -------
+    best_vals : array
+        Array of best fit parameters for each window
+    covar : array
+        Array of covariance matrices for each window
+    r_squared : array
+        R squared of each fit. Failed fits are set to 0.
+    """
+
+    n_params = 4 if include_disorder else 3
+
+    if len(windows) == 0:
+        return np.zeros((0, n_params)), np.zeros((0, n_params, n_params)), np.zeros(0)
+
+    start_time = time.perf_counter()
+    energy, eqe_fit, mask = pad_Windows(eqe, windows)
+
+    # Look up windows in the on-disk fit cache
+    keys = [None] * len(windows)
+    cached = [None] * len(windows)
+    if fit_cache.enabled:
+        keys = [hash_Fit('fit_batch', energy[n, mask[n]], eqe_fit[n, mask[n]], T, include_disorder, sig, bounds,
+                         max_iter, ftol, xtol) for n in range(len(windows))]
+        cached = [fit_cache.get(key) for key in keys]
+
+    new = np.array([n for n, result in enumerate(cached) if result is None], dtype=int)
+
+    best_vals = np.zeros((len(windows), n_params))
+    covar = np.zeros((len(windows), n_params, n_params))
+    r_squared = np.zeros(len(windows))
+    nfev = np.zeros(len(windows), dtype=int)
+
+    for n, result in enumerate(cached):
+        if result is not None:
+            best_vals[n], covar[n], r_squared[n] = result
+
+    if len(new) != 0:
+        best_vals[new], covar[new], r_squared[new], nfev[new] = solve_Batch(energy=energy[new],
+                                                                            eqe_fit=eqe_fit[new],
+                                                                            mask=mask[new],
+                                                                            T=T,
+                                                                            include_disorder=include_disorder,
+                                                                            sig=sig,
+                                                                            bounds=bounds,
+                                                                            max_iter=max_iter,
+                                                                            ftol=ftol,
+                                                                            xtol=xtol
+                                                                            )
+        if fit_cache.enabled:
+            for n in new[r_squared[new] > 0]:  # Failed fits are not stored
+                fit_cache.put(keys[n], (best_vals[n], covar[n], r_squared[n]))
+
+    fit_profiler.batch('fit_batch',
+                       windows=windows,
+                       r_squared=r_squared,
+                       nfev=nfev,
+                       cached=[result is not None for result in cached],
+                       wall_time=time.perf_counter() - start_time
+                       )
+
+    return best_vals, covar, r_squared
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to solve many padded windows with a batched Levenberg-Marquardt solver
+
+def solve_Batch(energy,
+                eqe_fit,
+                mask,
+                T,
+                include_disorder=False,
+                sig=None,
+                bounds=None,
+                max_iter=200,
+                ftol=1e-10,
+                xtol=1e-10
+                ):
+    """Function to solve single peak Marcus fits of padded windows (see fit_batch)
+
+    Parameters
+    ----------
+    energy : array, required
+        Padded energy values [eV]
+    eqe_fit : array, required
+        Padded EQE values
+    mask : array, required
+        Boolean array marking valid values
+    T : float, required
+        Temperature [K]
+    include_disorder : bool, optional
+        Boolean value specifying whether to include CT state disorder
+    sig : float, optional
+        Disorder parameter guess [eV]
+    bounds : tuple, optional
+        Tuple of lower and upper bound lists in the order of the fit parameters
+    max_iter : int, optional
+        Maximum number of iterations
+    ftol : float, optional
+        Relative cost reduction below which a window is converged
+    xtol : float, optional
+        Relative step size below which a window is converged
+
+    Returns
+    -------
+    best_vals : array
+        Array of best fit parameters for each window
+    covar : array
+        Array of covariance matrices for each window
+    r_squared : array
+        R squared of each fit. Failed fits are set to 0.
+    nfev : array
+        Number of function evaluations of each window
+    """
+
+    n_params = 4 if include_disorder else 3
+    n_windows = len(energy)
+    n_values = np.count_nonzero(mask, axis=1)
+
+    if bounds is None:
+        lower = np.full(n_params, -np.inf)
+        upper = np.full(n_params, np.inf)
+        lower[0] = 0
+    else:
+        lower = np.asarray(bounds[0], dtype=float)[:n_params].copy()
+        upper = np.asarray(bounds[1], dtype=float)[:n_params].copy()
+    lower[1] = max(lower[1], l_min)
+
+    # Initial guesses
+    if include_disorder and sig is None:
+        sig = 0.05
+    p0, ok = guess_Marcus_batch(energy, eqe_fit, mask, T, sig=sig if include_disorder else None)
+    default = [f_guess, l_guess, np.nan, sig][:n_params]
+    p0[~ok] = default
+    p0[~ok, 2] = [np.average(e[m], weights=np.abs(y[m]) + 1e-30) - l_guess if np.any(m) else 1
+                  for e, y, m in zip(energy[~ok], eqe_fit[~ok], mask[~ok])]  # Weighted peak position
+
+    params = np.clip(p0, lower, upper)
+
+    # Function to calculate masked residuals, Jacobian and cost of a subset of windows
+    def evaluate(index, params_index):
+        y_fit, jac = evaluate_Marcus_batch(energy[index], params_index, T)
+        residual = np.where(mask[index], y_fit - eqe_fit[index], 0)
+        jac = np.where(mask[index][..., None], jac, 0)
+        cost = np.sum(residual ** 2, axis=1)
+        cost[~np.isfinite(cost) | ~np.all(np.isfinite(jac), axis=(1, 2))] = np.inf
+        return residual, jac, cost
+
+    index = np.arange(n_windows)
+    residual, jac, cost = evaluate(index, params)
+    nfev = np.ones(n_windows, dtype=int)
+    damping = np.full(n_windows, lambda_start)
+    active = np.isfinite(cost) & (n_values > n_params)
+
+    for iteration in range(max_iter):
+        index = np.flatnonzero(active)
+        if len(index) == 0:
+            break
+
+        J = jac[index]
+        JtJ = np.einsum('bli,blj->bij', J, J)
+        gradient = np.einsum('bli,bl->bi', J, residual[index])
+        scale = np.maximum(np.diagonal(JtJ, axis1=1, axis2=2), 1e-300)
+
+        A = JtJ + damping[index, None, None] * np.einsum('bi,ij->bij', scale, np.eye(n_params))
+        try:
+            step = -np.linalg.solve(A, gradient[..., None])[..., 0]
+        except np.linalg.LinAlgError:
+            step = -np.einsum('bij,bj->bi', np.linalg.pinv(A), gradient)
+
+        new_params = np.clip(params[index] + step, lower, upper)
+        new_residual, new_jac, new_cost = evaluate(index, new_params)
+        nfev[index] += 1
+
+        better = new_cost < cost[index]
+        accepted = index[better]
+        converged = better & ((cost[index] - new_cost <= ftol * cost[index])
+                              | (np.linalg.norm(new_params - params[index], axis=1)
+                                 <= xtol * (np.linalg.norm(params[index], axis=1) + xtol)))
+
+        params[accepted] = new_params[better]
+        residual[accepted] = new_residual[better]
+        jac[accepted] = new_jac[better]
+        cost[accepted] = new_cost[better]
+
+        damping[accepted] = damping[accepted] / 10
+        damping[index[~better]] = damping[index[~better]] * 10
+
+        active[index[converged]] = False
+        active[index[damping[index] > lambda_max]] = False
+
+    # Calculate covariance (consistent with curve_fit)
+    JtJ = np.einsum('bli,blj->bij', jac, jac)
+    dof = np.maximum(n_values - n_params, 1)
+    with np.errstate(invalid='ignore', over='ignore'):
+        covar = np.linalg.pinv(JtJ) * (cost / dof)[:, None, None]
+
+    # Calculate R squared
+    y_fit = evaluate_Marcus_batch(energy, params, T)[0]
+    r_squared = np.zeros(n_windows)
+    for n in range(n_windows):
+        if np.isfinite(cost[n]) and n_values[n] > n_params:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                r_squared[n] = R_squared(eqe_fit[n, mask[n]], y_fit[n, mask[n]])
+    r_squared[~np.isfinite(r_squared)] = 0
+
+    return params, covar, r_squared, nfev
+
+# -----------------------------------------------------------------------------------------------------------
@@ -0,0 +1,626 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import curve_fit
+
+from source.batch_fit import l_min
+from source.compilation import compile_EQE
+from source.gaussian import calculate_gaussian_disorder_absorption_jac
+from source.utils import get_logger
+
+logger = get_logger()
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Define parameters for bootstrap uncertainty estimation
+
+# NOTE: Set to True to estimate bootstrap confidence intervals of the best fits
+use_bootstrap = False
+
+# Number of resampled data sets
+n_resamples = 500
+
+# Confidence level of the reported intervals
+confidence_level = 0.95
+
+# NOTE: 'wild' flips the sign of each residual at random and accounts for the EQE dependent noise level,
+#       'residual' draws residuals from all residuals of the fit
+resample_method = 'wild'
+
+# Number of worker processes (None to use all CPUs, 1 to fit in the calling process)
+n_workers = None
+
+# Number of resampled data sets fitted per worker task
+chunk_size = 50
+
+# Maximum number of function evaluations of each resampled fit
+max_nfev = 2000
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to calculate Marcus peaks
+
+def calculate_Marcus_peaks(energy,
+                           *params,
+                           T,
+                           include_disorder=False
+                           ):
+    """Function to calculate the sum of one or more Marcus peaks
+
+    Parameters
+    ----------
+    energy : array, required
+        Energy values [eV]
+    params : float, required
+        Fit parameters [f, l, E] of each peak, followed by the disorder of the first peak if include_disorder
+        (i.e. [f_CT, l_CT, E_CT, f_Opt, l_Opt, E_Opt, sig] for simultaneous double peak fits)
+    T : float, required
+        Temperature [K]
+    include_disorder : bool, optional
+        Boolean value specifying whether the last parameter is the disorder of the first peak
+
+    Returns
+    -------
+    EQE : array
+        Calculated EQE values
+    """
+
+    return calculate_Marcus_peaks_jac(energy, *params, T=T, include_disorder=include_disorder, value=True)
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to calculate the Jacobian of Marcus peaks
+
+def calculate_Marcus_peaks_jac(energy,
+                               *params,
+                               T,
+                               include_disorder=False,
+                               value=False
+                               ):
+    """Function to calculate the Jacobian of the sum of one or more Marcus peaks
+
+    Parameters
+    ----------
+    energy : array, required
+        Energy values [eV]
+    params : float, required
+        Fit parameters (see calculate_Marcus_peaks)
+    T : float, required
+        Temperature [K]
+    include_disorder : bool, optional
+        Boolean value specifying whether the last parameter is the disorder of the first peak
+    value : bool, optional
+        Boolean value specifying whether to return the EQE values instead of the Jacobian
+
+    Returns
+    -------
+    jac : array
+        Array of shape (len(energy), len(params)) with derivatives with respect to the fit parameters
+    """
+
+    energy = np.asarray(energy, dtype=float)
+    n_peaks = (len(params) - include_disorder) // 3
+    sig = params[-1] if include_disorder else 0
+
+    jac = np.zeros((len(energy), len(params)))
+    for n in range(n_peaks):
+        f, l, E = params[3 * n:3 * n + 3]
+        peak_jac = calculate_gaussian_disorder_absorption_jac(energy, f, l, E, sig if n == 0 else 0, T)
+        jac[:, 3 * n:3 * n + 3] = peak_jac[:, :3]
+        if n == 0 and include_disorder:
+            jac[:, -1] = peak_jac[:, 3]
+
+    if value:
+        return sum(params[3 * n] * jac[:, 3 * n] for n in range(n_peaks))
+
+    return jac
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to resample data
+
+def resample_Data(y_fit,
+                  residuals,
+                  n,
+                  rng,
+                  method=resample_method
+                  ):
+    """Function to generate resampled data sets from a fit and its residuals
+
+    Parameters
+    ----------
+    y_fit : array, required
+        Fitted values
+    residuals : array, required
+        Residuals of the fit (data - fit)
+    n : int, required
+        Number of resampled data sets
+    rng : numpy.random.Generator, required
+        Random number generator
+    method : str, optional
+        Resampling method ('wild' or 'residual')
+
+    Returns
+    -------
+    samples : array
+        Array of shape (n, len(y_fit)) with resampled data sets
+    """
+
+    if method == 'wild':
+        return y_fit + residuals * rng.choice([-1.0, 1.0], size=(n, len(residuals)))
+    elif method == 'residual':
+        return y_fit + rng.choice(residuals - np.mean(residuals), size=(n, len(residuals)), replace=True)
+    else:
+        raise ValueError(f'Unknown resampling method: {method}')
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to fit resampled data sets
+
+def fit_Resamples(energy,
+                  samples,
+                  p0,
+                  T,
+                  include_disorder=False
+                  ):
+    """Function to fit resampled data sets with the same model, starting from the best fit
+
+    Parameters
+    ----------
+    energy : array, required
+        Energy values [eV]
+    samples : array, required
+        Array of shape (number of data sets, len(energy)) with resampled EQE values
+    p0 : list, required
+        Best fit parameters used as initial guess (see calculate_Marcus_peaks)
+    T : float, required
+        Temperature [K]
+    include_disorder : bool, optional
+        Boolean value specifying whether the last parameter is the disorder of the first peak
+
+    Returns
+    -------
+    best_vals : array
+        Array of shape (number of data sets, len(p0)) with fit parameters. Failed fits are set to NaN.
+    """
+
+    p0 = np.asarray(p0, dtype=float)
+    lower = np.zeros(len(p0))
+    lower[1::3][:(len(p0) - include_disorder) // 3] = l_min
+    p0 = np.clip(p0, lower + 1e-12, np.inf)
+
+    function = partial(calculate_Marcus_peaks, T=T, include_disorder=include_disorder)
+    jac = partial(calculate_Marcus_peaks_jac, T=T, include_disorder=include_disorder)
+
+    best_vals = np.full((len(samples), len(p0)), np.nan)
+    for n, sample in enumerate(samples):
+        try:
+            best_vals[n] = curve_fit(function, energy, sample, p0=p0, jac=jac, bounds=(lower, np.inf),
+                                     max_nfev=max_nfev)[0]
+        except (RuntimeError, ValueError, np.linalg.LinAlgError):
+            pass
+
+    return best_vals
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to fit resampled data sets of separate double peak fits
+
+def fit_Resamples_double(energy,
+                         samples,
+                         mask_Opt,
+                         mask_CT,
+                         p0_Opt,
+                         p0_CT,
+                         T,
+                         include_disorder=False
+                         ):
+    """Function to repeat the separate double peak fit for resampled data sets
+    The optical peak is fitted first and subtracted before the CT state fit, as in double_fit.
+
+    Parameters
+    ----------
+    energy : array, required
+        Energy values covering both fit ranges [eV]
+    samples : array, required
+        Array of shape (number of data sets, len(energy)) with resampled EQE values
+    mask_Opt : array, required
+        Boolean array marking the optical peak fit range
+    mask_CT : array, required
+        Boolean array marking the CT state fit range
+    p0_Opt : list, required
+        Best optical peak fit parameters [f, l, E]
+    p0_CT : list, required
+        Best CT state fit parameters [f, l, E] or [f, l, E, sig]
+    T : float, required
+        Temperature [K]
+    include_disorder : bool, optional
+        Boolean value specifying whether to include CT state disorder
+
+    Returns
+    -------
+    best_vals : array
+        Array of shape (number of data sets, len(p0_CT) + 3) with CT state and optical peak fit parameters
+        Failed fits are set to NaN.
+    """
+
+    best_Opt = fit_Resamples(energy[mask_Opt], samples[:, mask_Opt], p0_Opt, T)
+
+    best_CT = np.full((len(samples), len(p0_CT)), np.nan)
+    for n in np.flatnonzero(np.all(np.isfinite(best_Opt), axis=1)):
+        subtracted = samples[n, mask_CT] - calculate_Marcus_peaks(energy[mask_CT], *best_Opt[n], T=T)
+        best_CT[n] = fit_Resamples(energy[mask_CT], subtracted[None], p0_CT, T, include_disorder)[0]
+
+    return np.column_stack([best_CT[:, :3], best_Opt, best_CT[:, 3:]])
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to run resampled fits in parallel
+
+def run_Resamples(function,
+                  samples,
+                  workers=n_workers,
+                  **kwargs
+                  ):
+    """Function to split resampled data sets into chunks and fit them in a process pool
+
+    Parameters
+    ----------
+    function : function, required
+        Module level fit function taking samples as keyword argument (i.e. fit_Resamples)
+    samples : array, required
+        Array of resampled data sets
+    workers : int, optional
+        Number of worker processes (None to use all CPUs, 1 to fit in the calling process)
+    kwargs : optional
+        Further keyword arguments of function
+
+    Returns
+    -------
+    best_vals : array
+        Fit parameters of all resampled data sets
+    """
+
+    chunks = [samples[i:i + chunk_size] for i in range(0, len(samples), chunk_size)]
+    workers = min(workers or os.cpu_count() or 1, len(chunks))
+
+    if workers > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(function, samples=chunk, **kwargs) for chunk in chunks]
+                return np.concatenate([future.result() for future in futures])
+        except (BrokenProcessPool, OSError) as e:
+            logger.warning(f'Process pool failed ({e}), fitting resampled data in a single process.')
+
+    return np.concatenate([function(samples=chunk, **kwargs) for chunk in chunks])
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to discard resampled fits above the data
+
+def reject_Biased(fits,
+                  eqe,
+                  energy_fit,
+                  samples,
+                  stopE,
+                  T,
+                  tolerance,
+                  range=1.05,
+                  include_disorder=False
+                  ):
+    """Function to discard resampled fits that lie above the data, as the fit ranking discards fits
+    The combined fit of each resampled data set is compared to the EQE data from the lowest energy up to
+    stopE * range (see calculate_combined_fit). Data points in the fit ranges are replaced by the resampled values.
+    A fit is discarded if the mean relative deviation of the fit values above the data exceeds tolerance
+    (see R_squared with bias=True).
+
+    Parameters
+    ----------
+    fits : array, required
+        Array of shape (number of data sets, number of parameters) with fit parameters (see calculate_Marcus_peaks)
+    eqe : dataFrame or Spectrum, required
+        EQE data including columns ['Energy', 'EQE']
+    energy_fit : array, required
+        Energy values of the resampled data sets [eV]
+    samples : array, required
+        Array of shape (number of data sets, len(energy_fit)) with resampled EQE values
+    stopE : float, required
+        Stop energy of the combined fit [eV]
+    T : float, required
+        Temperature [K]
+    tolerance : float, required
+        Tolerance (mean percent) allowed for fit above the data
+    range : float, optional
+        Multiplication factor of the stop energy
+    include_disorder : bool, optional
+        Boolean value specifying whether the last parameter is the disorder of the first peak
+
+    Returns
+    -------
+    fits : array
+        Fit parameters with discarded fits set to NaN
+    """
+
+    wave_data, energy_data, eqe_data, log_eqe_data = compile_EQE(eqe, min(eqe['Energy']), stopE * range, 1)
+    energy_data = np.asarray(energy_data, dtype=float)
+    data = np.tile(np.asarray(eqe_data, dtype=float), (len(samples), 1))
+
+    # Replace data points in the fit ranges by the resampled values
+    order = np.argsort(energy_fit)
+    position = np.clip(np.searchsorted(energy_fit[order], energy_data), 0, len(energy_fit) - 1)
+    resampled = energy_fit[order][position] == energy_data
+    data[:, resampled] = samples[:, order[position[resampled]]]
+
+    fits = fits.copy()
+    n_rejected = 0
+    for n in np.flatnonzero(np.all(np.isfinite(fits), axis=1)):
+        residuals = data[n] - calculate_Marcus_peaks(energy_data, *fits[n], T=T, include_disorder=include_disorder)
+        above = residuals < 0
+        if np.any(above) and abs(np.nanmean(residuals[above] / data[n][above])) > tolerance:
+            fits[n] = np.nan
+            n_rejected += 1
+
+    if n_rejected != 0:
+        logger.info(f'Discarded {n_rejected} resampled fits above the data (tolerance {tolerance}).')
+
+    return fits
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to summarize bootstrap fits
+
+def summarize_Bootstrap(best_vals,
+                        samples,
+                        names,
+                        confidence=confidence_level
+                        ):
+    """Function to calculate bootstrap standard deviations and percentile confidence intervals
+
+    Parameters
+    ----------
+    best_vals : list, required
+        Best fit parameters
+    samples : array, required
+        Array of shape (number of resampled fits, len(best_vals)) with resampled fit parameters
+    names : list, required
+        Parameter names
+    confidence : float, optional
+        Confidence level
+
+    Returns
+    -------
+    df : dataFrame
+        DataFrame with columns ['Best', 'SD', 'Lower', 'Upper'] indexed by parameter name
+        The number of successful resampled fits is stored in df.attrs['N']
+    """
+
+    samples = samples[np.all(np.isfinite(samples), axis=1)]
+    alpha = (1 - confidence) / 2 * 100
+
+    df = pd.DataFrame(index=pd.Index(names, name='Parameter'))
+    df['Best'] = np.asarray(best_vals, dtype=float)
+    if len(samples) >= 2:
+        df['SD'] = np.std(samples, axis=0, ddof=1)
+        df['Lower'], df['Upper'] = np.percentile(samples, [alpha, 100 - alpha], axis=0)
+    else:
+        df['SD'] = df['Lower'] = df['Upper'] = np.nan
+    df.attrs['N'] = len(samples)
+    df.attrs['Confidence'] = confidence
+
+    return df
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to estimate bootstrap uncertainties of single peak and simultaneous double peak fits
+
+def bootstrap_Fit(eqe,
+                  startE,
+                  stopE,
+                  best_vals,
+                  T,
+                  include_disorder=False,
+                  n=n_resamples,
+                  method=resample_method,
+                  confidence=confidence_level,
+                  workers=n_workers,
+                  seed=None,
+                  bias=False,
+                  tolerance=0,
+                  range=1.05
+                  ):
+    """Function to estimate bootstrap confidence intervals of single peak or simultaneous double peak Marcus fits
+    If bias is True, resampled double peak fits above the data are discarded (see reject_Biased).
+
+    Parameters
+    ----------
+    eqe : dataFrame or Spectrum, required
+        EQE data including columns ['Energy', 'EQE']
+    startE : float, required
+        Fit start energy value [eV]
+    stopE : float, required
+        Fit stop energy value [eV]
+    best_vals : list, required
+        Best fit parameters [f, l, E(, sig)] or [f_CT, l_CT, E_CT, f_Opt, l_Opt, E_Opt(, sig)]
+    T : float, required
+        Temperature [K]
+    include_disorder : bool, optional
+        Boolean value specifying whether the last parameter is the CT state disorder
+    n : int, optional
+        Number of resampled data sets
+    method : str, optional
+        Resampling method ('wild' or 'residual')
+    confidence : float, optional
+        Confidence level
+    workers : int, optional
+        Number of worker processes
+    seed : int, optional
+        Random seed
+    bias : bool, optional
+        Boolean value specifying whether to discard double peak fits above the data
+    tolerance : float, optional
+        Tolerance (mean percent) allowed for fit above the data
+    range : float, optional
+        Multiplication factor of the stop energy to check fits above the data
+
+    Returns
+    -------
+    df : dataFrame
+        Bootstrap summary (see summarize_Bootstrap)
+    """
+
+    wave_fit, energy_fit, eqe_fit, log_eqe_fit = compile_EQE(eqe, startE, stopE, 1)
+    energy_fit = np.asarray(energy_fit, dtype=float)
+    best_vals = [float(value) for value in best_vals]
+
+    y_fit = calculate_Marcus_peaks(energy_fit, *best_vals, T=T, include_disorder=include_disorder)
+    samples = resample_Data(y_fit, np.asarray(eqe_fit, dtype=float) - y_fit, n, np.random.default_rng(seed), method)
+
+    fits = run_Resamples(fit_Resamples, samples, workers,
+                         energy=energy_fit, p0=best_vals, T=T, include_disorder=include_disorder)
+
+    if len(best_vals) - include_disorder == 6:
+        if bias:  # As in calculate_combined_fit
+            fits = reject_Biased(fits, eqe, energy_fit, samples, stopE, T, tolerance, range, include_disorder)
+        names = ['f_CT', 'l_CT', 'E_CT', 'f_Opt', 'l_Opt', 'E_Opt']
+    else:
+        names = ['f', 'l', 'E']
+
+    return summarize_Bootstrap(best_vals, fits, names + ['Sigma'] * include_disorder, confidence)
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to estimate bootstrap uncertainties of separate double peak fits
+
+def bootstrap_Double(eqe,
+                     start_Opt,
+                     stop_Opt,
+                     start_CT,
+                     stop_CT,
+                     best_vals_Opt,
+                     best_vals_CT,
+                     T,
+                     include_disorder=False,
+                     n=n_resamples,
+                     method=resample_method,
+                     confidence=confidence_level,
+                     workers=n_workers,
+                     seed=None,
+                     bias=False,
+                     tolerance=0,
+                     range=1.05
+                     ):
+    """Function to estimate bootstrap confidence intervals of separate double peak Marcus fits
+    Data are resampled around the combined fit over both fit ranges.
+    If bias is True, resampled fits above the data are discarded (see reject_Biased).
+
+    Parameters
+    ----------
+    eqe : dataFrame or Spectrum, required
+        EQE data including columns ['Energy', 'EQE']
+    start_Opt : float, required
+        Optical peak fit start energy value [eV]
+    stop_Opt : float, required
+        Optical peak fit stop energy value [eV]
+    start_CT : float, required
+        CT state fit start energy value [eV]
+    stop_CT : float, required
+        CT state fit stop energy value [eV]
+    best_vals_Opt : list, required
+        Best optical peak fit parameters [f, l, E]
+    best_vals_CT : list, required
+        Best CT state fit parameters [f, l, E] or [f, l, E, sig]
+    T : float, required
+        Temperature [K]
+    include_disorder : bool, optional
+        Boolean value specifying whether to include CT state disorder
+    n : int, optional
+        Number of resampled data sets
+    method : str, optional
+        Resampling method ('wild' or 'residual')
+    confidence : float, optional
+        Confidence level
+    workers : int, optional
+        Number of worker processes
+    seed : int, optional
+        Random seed
+    bias : bool, optional
+        Boolean value specifying whether to discard fits above the data
+    tolerance : float, optional
+        Tolerance (mean percent) allowed for fit above the data
+    range : float, optional
+        Multiplication factor of the optical peak stop energy to check fits above the data
+
+    Returns
+    -------
+    df : dataFrame
+        Bootstrap summary (see summarize_Bootstrap)
+    """
+
+    wave_fit, energy_fit, eqe_fit, log_eqe_fit = compile_EQE(eqe, min(start_Opt, start_CT), max(stop_Opt, stop_CT), 1)
+    energy_fit = np.asarray(energy_fit, dtype=float)
+    best_vals_Opt = [float(value) for value in best_vals_Opt]
+    best_vals_CT = [float(value) for value in best_vals_CT]
+
+    y_fit = calculate_Marcus_peaks(energy_fit, *best_vals_CT[:3], *best_vals_Opt, *best_vals_CT[3:], T=T,
+                                   include_disorder=include_disorder)
+    samples = resample_Data(y_fit, np.asarray(eqe_fit, dtype=float) - y_fit, n, np.random.default_rng(seed), method)
+
+    fits = run_Resamples(fit_Resamples_double, samples, workers,
+                         energy=energy_fit,
+                         mask_Opt=(energy_fit >= start_Opt) & (energy_fit <= stop_Opt),
+                         mask_CT=(energy_fit >= start_CT) & (energy_fit <= stop_CT),
+                         p0_Opt=best_vals_Opt,
+                         p0_CT=best_vals_CT,
+                         T=T,
+                         include_disorder=include_disorder
+                         )
+
+    if bias:  # As in calculate_combined_fit
+        fits = reject_Biased(fits, eqe, energy_fit, samples, stop_Opt, T, tolerance, range, include_disorder)
+
+    return summarize_Bootstrap(best_vals_CT[:3] + best_vals_Opt + best_vals_CT[3:], fits,
+                               ['f_CT', 'l_CT', 'E_CT', 'f_Opt', 'l_Opt', 'E_Opt'] + ['Sigma'] * include_disorder,
+                               confidence)
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to format bootstrap results
+
+def format_Bootstrap(df):
+    """Function to format a bootstrap summary for printing
+
+    Parameters
+    ----------
+    df : dataFrame, required
+        Bootstrap summary (see summarize_Bootstrap)
+
+    Returns
+    -------
+    text : str
+        Formatted bootstrap summary
+    """
+
+    lines = [f"Bootstrap ({df.attrs['N']} successful resampled fits, "
+             f"{100 * df.attrs['Confidence']:g} % confidence intervals):"]
+    for name, row in df.iterrows():
+        lines.append(f"{name} : {row['Best']:.6f} +/- {row['SD']:.6f} [{row['Lower']:.6f}, {row['Upper']:.6f}]")
+
+    return '\n'.join(lines)
+
+# -----------------------------------------------------------------------------------------------------------
@@ -1,26 +1,384 @@
+import hashlib
+import itertools
 import math
+from collections import OrderedDict
 
+import numpy as np
+
+from source.fit_profile import fit_profiler
 from source.utils import get_logger
 
 logger = get_logger()
 
+_spectrum_keys = itertools.count()  # Unique identity of every spectrum, used to key the window cache
+
 
 # -----------------------------------------------------------------------------------------------------------
 
-# Function to compile EQE data
+# Class to store a spectrum sorted by energy
 
-def compile_EQE(eqe_df,
+class Spectrum:
+    """Class to store a spectrum sorted by energy to allow fast compilation of start/stop windows
+
+    The spectrum is sorted and rounded once. Any [start, stop] window is then located by binary search and
+    returned as NumPy slices (views) of the sorted arrays, rather than by iterating through every row.
+
+    Parameters
+    ----------
+    wavelength : list or array, required
+        Wavelength values [nm]
+    energy : list or array, required
+        Energy values [eV]
+    columns : dict, required
+        Dictionary of additional columns (e.g. {'EQE': [...], 'Log_EQE': [...]})
+    precision : int, optional
+        Decimal point precision to compile data
+    """
+
+    def __init__(self,
+                 wavelength,
+                 energy,
+                 columns,
+                 precision=8
+                 ):
+
+        wavelength = np.asarray(wavelength, dtype=float)
+        order = np.argsort(-wavelength, kind='stable')  # Descending wavelength corresponds to ascending energy
+
+        self.key = next(_spectrum_keys)
+        self.precision = precision
+        self._neg_wavelength = -wavelength[order]  # Ascending array used for binary search
+
+        self.columns = {'Wavelength': np.round(wavelength[order], precision),
+                        'Energy': np.round(np.asarray(energy, dtype=float)[order], precision)}
+        for name, values in columns.items():
+            self.columns[name] = np.round(np.asarray(values, dtype=float)[order], precision)
+        for values in self.columns.values():
+            values.setflags(write=False)  # Compiled windows are shared views and must not be modified
+
+    @classmethod
+    def from_df(cls,
+                df,
+                columns=None,
+                precision=8
+                ):
+        """Function to create spectrum from dataFrame
+
+        Parameters
+        ----------
+        df : dataFrame, required
+            DataFrame with columns ['Wavelength', 'Energy'] and additional data columns
+        columns : list, optional
+            List of data columns to include
+            If None, ['EQE', 'Log_EQE'] and / or ['Signal'] are included
+        precision : int, optional
+            Decimal point precision to compile data
+
+        Returns
+        -------
+        spectrum : Spectrum
+            Spectrum sorted by energy
+        """
+
+        if columns is None:
+            columns = [name for name in ['EQE', 'Log_EQE', 'Signal'] if name in df.columns]
+
+        return cls(wavelength=df['Wavelength'],
+                   energy=df['Energy'],
+                   columns={name: df[name] for name in columns},
+                   precision=precision
+                   )
+
+    def __len__(self):
+        return len(self._neg_wavelength)
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def replace(self, **columns):
+        """Function to create a new spectrum with replaced data columns
+
+        Parameters
+        ----------
+        columns : array, required
+            Columns to replace, in the sorted order of this spectrum (e.g. EQE=subtracted_EQE)
+
+        Returns
+        -------
+        spectrum : Spectrum
+            New spectrum sharing the sorted wavelength and energy values
+        """
+
+        spectrum = Spectrum.__new__(Spectrum)
+        spectrum.precision = self.precision
+        spectrum._neg_wavelength = self._neg_wavelength
+        spectrum.columns = dict(self.columns)
+        digest = hashlib.sha1()
+        for name, values in sorted(columns.items()):
+            spectrum.columns[name] = np.round(np.asarray(values, dtype=float), self.precision)
+            spectrum.columns[name].setflags(write=False)
+            digest.update(name.encode())
+            digest.update(np.ascontiguousarray(spectrum.columns[name]).tobytes())
+
+        # Spectra derived with the same columns (e.g. the same subtracted fit in every fit window) share cached windows
+        spectrum.key = (self.key, digest.hexdigest())
+
+        return spectrum
+
+    def window(self,
+               start,
+               stop,
+               number
+               ):
+        """Function to determine the index range of a start/stop window
+
+        Parameters
+        ----------
+        start : float, required
+            Start wavelength or energy [eV/nm]
+        stop : float, required
+            Stop wavelength or energy [eV/nm]
+        number : int, required
+            Number indicating wavelength or energy compilation
+            number = 0 => compile wavelength
+            number = 1 => compile energy
+
+        Returns
+        -------
+        lo, hi : int
+            Slice indices of the window
+        """
+
+        startNM, stopNM = convert_Window(start, stop, number)
+
+        # startNM <= wavelength <= stopNM is equivalent to -stopNM <= -wavelength <= -startNM
+        lo = np.searchsorted(self._neg_wavelength, -stopNM, side='left')
+        hi = np.searchsorted(self._neg_wavelength, -startNM, side='right')
+
+        return lo, max(lo, hi)
+
+    def counts(self,
+               starts,
+               stops,
+               number
+               ):
+        """Function to count the data points of many start/stop windows at once
+
+        Parameters
+        ----------
+        starts : list or array, required
+            Start wavelengths or energies [eV/nm]
+        stops : list or array, required
+            Stop wavelengths or energies [eV/nm]
+        number : int, required
+            Number indicating wavelength or energy compilation
+            number = 0 => compile wavelength
+            number = 1 => compile energy
+
+        Returns
+        -------
+        counts : array
+            Number of data points of each window
+        """
+
+        startNM, stopNM = convert_Window(np.asarray(starts, dtype=float), np.asarray(stops, dtype=float), number)
+
+        # Prefix counts of the sorted spectrum: the number of points of a window is the difference of two indices
+        lo = np.searchsorted(self._neg_wavelength, -stopNM, side='left')
+        hi = np.searchsorted(self._neg_wavelength, -startNM, side='right')
+
+        return np.maximum(hi - lo, 0)
+
+    def compile(self,
                 start,
                 stop,
                 number,
-                precision=8
+                columns=('EQE', 'Log_EQE')
                 ):
-    """Function to compile EQE data based on start/stop values
+        """Function to compile spectrum based on start/stop values
+
+        Parameters
+        ----------
+        start : float, required
+            Start wavelength or energy [eV/nm]
+        stop : float, required
+            Stop wavelength or energy [eV/nm]
+        number : int, required
+            Number indicating wavelength or energy compilation
+            number = 0 => compile wavelength
+            number = 1 => compile energy
+        columns : tuple, optional
+            Data columns to compile
+
+        Returns
+        -------
+        Wavelength : array
+            Wavelength values of the window [nm]
+        Energy : array
+            Energy values of the window [eV]
+        *columns : array
+            Data values of the window
+        """
+
+        lo, hi = self.window(start, stop, number)
+
+        return tuple(self.columns[name][lo:hi] for name in ('Wavelength', 'Energy') + tuple(columns))
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Class to cache compiled spectrum windows
+
+class WindowCache:
+    """Class to cache compiled spectrum windows in a bounded least-recently-used store
+
+    Fit range sweeps compile the same start/stop windows many times (e.g. in guess_fit, calculate_combined_fit and
+    find_best_fit). Windows are keyed by spectrum identity and window bounds.
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        Maximum number of windows to store
+    """
+
+    def __init__(self,
+                 maxsize=4096
+                 ):
+
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._windows = OrderedDict()
+
+    def __len__(self):
+        return len(self._windows)
+
+    def compile(self,
+                spectrum,
+                start,
+                stop,
+                number,
+                columns=('EQE', 'Log_EQE')
+                ):
+        """Function to return cached window or compile and store it
+
+        Parameters
+        ----------
+        spectrum : Spectrum, required
+            Spectrum to compile
+        start : float, required
+            Start wavelength or energy [eV/nm]
+        stop : float, required
+            Stop wavelength or energy [eV/nm]
+        number : int, required
+            Number indicating wavelength or energy compilation
+        columns : tuple, optional
+            Data columns to compile
+
+        Returns
+        -------
+        window : tuple
+            Tuple of compiled arrays (see Spectrum.compile)
+        """
+
+        key = (spectrum.key, float(start), float(stop), number, tuple(columns))
+
+        try:
+            window = self._windows[key]
+        except KeyError:
+            self.misses += 1
+            window = spectrum.compile(start, stop, number, columns=columns)
+            self._windows[key] = window
+            if len(self._windows) > self.maxsize:
+                self._windows.popitem(last=False)  # Remove least recently used window
+        else:
+            self.hits += 1
+            self._windows.move_to_end(key)
+
+        return window
+
+    def invalidate(self,
+                   spectrum
+                   ):
+        """Function to remove all windows of a spectrum
+
+        Parameters
+        ----------
+        spectrum : Spectrum, required
+            Spectrum to remove
+
+        Returns
+        -------
+        None
+        """
+
+        for key in [key for key in self._windows if is_derived(key[0], spectrum.key)]:
+            del self._windows[key]
+
+    def clear(self):
+        """Function to remove all windows and reset hit / miss counters"""
+
+        self._windows.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def summary(self):
+        """Function to summarize cache usage
+
+        Returns
+        -------
+        summary : str
+            Number of stored windows, hits and misses
+        """
+
+        return f'Window cache: {len(self._windows)} windows, {self.hits} hits, {self.misses} misses'
+
+
+window_cache = WindowCache()  # Shared cache used by compile_EQE and compile_EL
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to check whether a spectrum is derived from another spectrum
+
+def is_derived(key,
+               parent_key
+               ):
+    """Function to check whether a spectrum key equals or is derived from another spectrum key (see Spectrum.replace)
+
+    Parameters
+    ----------
+    key : int or tuple, required
+        Spectrum key
+    parent_key : int or tuple, required
+        Key of the parent spectrum
+
+    Returns
+    -------
+    derived : bool
+        True if key equals parent_key or was derived from it
+    """
+
+    while key != parent_key:
+        if not isinstance(key, tuple):
+            return False
+        key = key[0]
+
+    return True
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to convert start/stop values to a wavelength window
+
+def convert_Window(start,
+                   stop,
+                   number
+                   ):
+    """Function to convert start/stop values to a wavelength window
 
     Parameters
     ----------
-    eqe_df : dataFrame, required
-        Dataframe of EQE values with columns ['Wavelength', ' Energy', 'EQE', 'Log_EQE']
     start : float, required
         Start wavelength or energy [eV/nm]
     stop : float, required
@@ -29,19 +387,13 @@ def compile_EQE(eqe_df,
         Number indicating wavelength or energy compilation
         number = 0 => compile wavelength
         number = 1 => compile energy
-    precision : int, optional
-        Decimal point precision to compile data
-        
+
     Returns
     -------
-    Wavelength : list
-        Wavelength values corresponding to compiled EQE [nm]
-    Energy : list
-        Energy values corresponding to compiled EQE [eV]
-    EQE : list
-        EQE values of compiled EQE
-    log_EQE : list
-        Logarithmic EQE values of compiled EQE spectra
+    startNM : float
+        Start wavelength [nm]
+    stopNM : float
+        Stop wavelength [nm]
     """
 
     # Define variables
@@ -49,12 +401,6 @@ def compile_EQE(eqe_df,
     c = 2.998 * math.pow(10, 8)  # [m/s]
     q = 1.602 * math.pow(10, -19)  # [C]
 
-    # Define empty lists
-    Wavelength = []
-    Energy = []
-    EQE = []
-    log_EQE = []
-
     if number == 0:  # If a wavelength range is given
         startNM = start
         stopNM = stop
@@ -65,12 +411,110 @@ def compile_EQE(eqe_df,
         stopNM = (h * c * math.pow(10, 9)) / (
                 start * q)  # The stop wavelength corresponds to the low energy start value
 
-    for y in range(len(eqe_df['Wavelength'])):  # Iterate through columns of EQE file
-        if startNM <= eqe_df['Wavelength'][y] <= stopNM:  # Compile EQE if start <= wavelength <= stop, otherwise ignore
-            Wavelength.append(round(eqe_df['Wavelength'][y], precision))
-            Energy.append(round(eqe_df['Energy'][y], precision))
-            EQE.append(round(eqe_df['EQE'][y], precision))  # * eqe_df['Energy'][y] - Eventually this might need to be added for fitting
-            log_EQE.append(round(eqe_df['Log_EQE'][y], precision))
+    return startNM, stopNM
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to determine feasible fit ranges
+
+def feasible_Windows(spectrum,
+                     starts,
+                     stops,
+                     n_params,
+                     number=1,
+                     label='fit ranges'
+                     ):
+    """Function to determine which start/stop windows contain enough data points to fit
+    Windows with start >= stop or with no more data points than fit parameters are infeasible.
+
+    Parameters
+    ----------
+    spectrum : Spectrum, required
+        Spectrum to fit
+    starts : list or array, required
+        Start wavelengths or energies [eV/nm]
+    stops : list or array, required
+        Stop wavelengths or energies [eV/nm]
+    n_params : int, required
+        Number of fit parameters
+    number : int, optional
+        Number indicating wavelength or energy compilation
+        number = 0 => compile wavelength
+        number = 1 => compile energy
+    label : str, optional
+        Description of windows used to report skipped windows
+
+    Returns
+    -------
+    feasible : array
+        Boolean array specifying whether each window is feasible
+    """
+
+    starts, stops = np.broadcast_arrays(np.asarray(starts, dtype=float), np.asarray(stops, dtype=float))
+
+    feasible = (starts < stops) & (spectrum.counts(starts, stops, number) > n_params)
+
+    n_skipped = int(np.count_nonzero(~feasible))
+    if n_skipped != 0:
+        logger.info(f'Skipping {n_skipped} of {feasible.size} {label} with too few data points.')
+        fit_profiler.skip(n_skipped)
+
+    return feasible
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to compile EQE data
+
+def compile_EQE(eqe_df,
+                start,
+                stop,
+                number,
+                precision=8
+                ):
+    """Function to compile EQE data based on start/stop values
+
+    Parameters
+    ----------
+    eqe_df : dataFrame or Spectrum, required
+        Dataframe of EQE values with columns ['Wavelength', ' Energy', 'EQE', 'Log_EQE']
+        If a Spectrum is given, the window is extracted by binary search and cached
+    start : float, required
+        Start wavelength or energy [eV/nm]
+    stop : float, required
+        Stop wavelength or energy [eV/nm]
+    number : int, required
+        Number indicating wavelength or energy compilation
+        number = 0 => compile wavelength
+        number = 1 => compile energy
+    precision : int, optional
+        Decimal point precision to compile data
+        
+    Returns
+    -------
+    Wavelength : list or array
+        Wavelength values corresponding to compiled EQE [nm]
+    Energy : list or array
+        Energy values corresponding to compiled EQE [eV]
+    EQE : list or array
+        EQE values of compiled EQE
+    log_EQE : list or array
+        Logarithmic EQE values of compiled EQE spectra
+    """
+
+    if isinstance(eqe_df, Spectrum):  # Spectrum has been sorted and rounded already
+        return window_cache.compile(eqe_df, start, stop, number, columns=('EQE', 'Log_EQE'))
+
+    startNM, stopNM = convert_Window(start, stop, number)
+
+    wavelength = np.asarray(eqe_df['Wavelength'], dtype=float)
+    mask = (startNM <= wavelength) & (wavelength <= stopNM)  # Compile EQE if start <= wavelength <= stop
+
+    Wavelength = np.round(wavelength[mask], precision).tolist()
+    Energy = np.round(np.asarray(eqe_df['Energy'], dtype=float)[mask], precision).tolist()
+    EQE = np.round(np.asarray(eqe_df['EQE'], dtype=float)[mask], precision).tolist()
+    log_EQE = np.round(np.asarray(eqe_df['Log_EQE'], dtype=float)[mask], precision).tolist()
 
     if len(Wavelength) == len(EQE) and len(Energy) == len(log_EQE):  # Check that the lengths are the same
         return Wavelength, Energy, EQE, log_EQE
@@ -93,8 +537,9 @@ def compile_EL(el_df,
 
     Parameters
     ----------
-    el_df : dataFrame, required
+    el_df : dataFrame or Spectrum, required
         Dataframe of EL values 
+        If a Spectrum is given, the window is extracted by binary search and cached
     start : float, required
         Start wavelength or energy [eV/nm]
     stop : float, required
@@ -108,39 +553,25 @@ def compile_EL(el_df,
         
     Returns
     -------
-    Wavelength : list
+    Wavelength : list or array
         Wavelength values corresponding to compiled EL [nm]
-    Energy : list
+    Energy : list or array
         Energy values corresponding to compiled EL [eV]
-    EL : list
+    EL : list or array
         EL values of compiled EL spectra
     """
 
-    # Define variables
-    h = 6.626 * math.pow(10, -34)  # [m^2 kg/s]
-    c = 2.998 * math.pow(10, 8)  # [m/s]
-    q = 1.602 * math.pow(10, -19)  # [C]
-
-    # Define empty lists
-    Wavelength = []
-    Energy = []
-    EL = []
+    if isinstance(el_df, Spectrum):
+        return window_cache.compile(el_df, start, stop, number, columns=('Signal',))
 
-    if number == 0:  # If a wavelength range is given
-        startNM = start
-        stopNM = stop
+    startNM, stopNM = convert_Window(start, stop, number)
 
-    elif number == 1:  # If an energy range is given
-        startNM = (h * c * math.pow(10, 9)) / (
-                stop * q)  # The start wavelength corresponds to the high energy stop value
-        stopNM = (h * c * math.pow(10, 9)) / (
-                start * q)  # The stop wavelength corresponds to the low energy start value
+    wavelength = np.asarray(el_df['Wavelength'], dtype=float)
+    mask = (startNM <= wavelength) & (wavelength <= stopNM)  # Compile EL if start <= wavelength <= stop
 
-    for y in range(len(el_df['Wavelength'])):  # Iterate through columns of EL file
-        if startNM <= el_df['Wavelength'][y] <= stopNM:  # Compile EL if start <= wavelength <= stop, otherwise ignore
-            Wavelength.append(round(el_df['Wavelength'][y], precision))
-            Energy.append(round(el_df['Energy'][y], precision))
-            EL.append(round(el_df['Signal'][y], precision))
+    Wavelength = np.round(wavelength[mask], precision).tolist()
+    Energy = np.round(np.asarray(el_df['Energy'], dtype=float)[mask], precision).tolist()
+    EL = np.round(np.asarray(el_df['Signal'], dtype=float)[mask], precision).tolist()
 
     if len(Wavelength) == len(EL) and len(Energy) == len(EL):  # Check that the lengths are the same
         return Wavelength, Energy, EL
@@ -182,14 +613,11 @@ def compile_Data(energy,
         List of compiled y values
     """
 
-    # Define empty lists
-    Energy_comp = []
-    y_comp = []
+    energy = np.asarray(energy, dtype=float)
+    mask = (startE <= energy) & (energy <= stopE)  # Compile data only if start <= energy <= stop
 
-    for x in range(len(energy)):
-        if startE <= energy[x] <= stopE:  # Compile data only if start <= energy <= stop, otherwise ignore
-            Energy_comp.append(round(energy[x], precision))
-            y_comp.append(round(y[x], precision))
+    Energy_comp = np.round(energy[mask], precision).tolist()
+    y_comp = np.round(np.asarray(y, dtype=float)[mask], precision).tolist()
 
     if len(Energy_comp) == len(y_comp):  # Check that the lengths are the same
         return Energy_comp, y_comp
@@ -1,5 +1,54 @@
 import math
 
+import numpy as np
+import pandas as pd
+
+from source.compilation import compile_EL
+from source.file_cache import file_cache
+from source.utils import get_logger
+
+logger = get_logger()
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Define parameters for EL calculations
+
+h = 6.626 * math.pow(10, -34)  # [m^2 kg/s]
+h_2 = 4.136 * math.pow(10, -15)  # [eV s]
+c = 2.998 * math.pow(10, 8)  # [m/s]
+q = 1.602 * math.pow(10, -19)  # [C]
+k = 8.617 * math.pow(10, -5)  # [ev/K]
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to calculate the black body photon flux
+
+def calculate_bb_flux(energy,
+                      T_EL
+                      ):
+    """Function to calculate the black body photon flux
+
+    Parameters
+    ----------
+    energy : list or array, required
+        Energy values [eV]
+    T_EL : float, required
+        Temperature of EL measurement [K]
+
+    Returns
+    -------
+    phi_bb : array
+        Black body photon flux [s/kg m^4]
+    """
+
+    energy = np.asarray(energy, dtype=float)
+
+    # this equation is confirmed in Thomas Kirchartz book chapter on EL
+    with np.errstate(over='ignore'):
+        return (2 * math.pi * energy ** 2) / (h_2 ** 3 * c ** 2) / np.expm1(energy / (k * T_EL))
+
 
 # -----------------------------------------------------------------------------------------------------------
 
@@ -16,28 +65,166 @@ def bb_spectrum(E_list,
         List of input energy values [eV]
     T_EL : float, required
         Temperature of EL measurement [K]
-        
+
     Returns
     -------
     phi_bb_dict : dict
         Dictionary of calculated black body spectrum
     """
 
-    h_2 = 4.136 * math.pow(10, -15)  # [eV s]
-    c = 2.998 * math.pow(10, 8)  # [m/s]
-    k = 8.617 * math.pow(10, -5)  # [ev/K]
+    # phi_bb = 2 * math.pi * (energy) ** 2 * math.exp(-1 * energy / (k * T_EL)) / (
+    #             h_2 ** 3 * c ** 2)  # -1) - without -1 as an approximation
+
+    return dict(zip(E_list, calculate_bb_flux(E_list, T_EL).tolist()))  # [s/kg m^4]
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to calculate energy values of EL data
+
+def calculate_EL_energy(wavelength):
+    """Function to calculate energy values from wavelength values
+
+    Parameters
+    ----------
+    wavelength : list or array, required
+        Wavelength values [nm]
+
+    Returns
+    -------
+    energy : array
+        Energy values [eV]
+    """
+
+    return (h * c) / (np.asarray(wavelength, dtype=float) * math.pow(10, -9) * q)
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to calculate the reduced EQE
+
+def calculate_reduced_EQE(energy,
+                          eqe
+                          ):
+    """Function to calculate the reduced EQE
+
+    Parameters
+    ----------
+    energy : list or array, required
+        Energy values [eV]
+    eqe : list or array, required
+        EQE values
+
+    Returns
+    -------
+    red_EQE : array
+        Reduced EQE values
+    """
+
+    return np.asarray(eqe, dtype=float) * np.asarray(energy, dtype=float)  # Multiplication confirmed in Benduhn thesis
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to calculate reduced EL and EL derived absorption
+
+def process_EL(el_df,
+               startE,
+               stopE,
+               T_EL,
+               scale=1,
+               scale_abs=1
+               ):
+    """Function to calculate reduced EL and EL derived absorption of an EL spectrum in one pass
+
+    The absorption is derived from the EL spectrum by reciprocity, by dividing by the black body photon flux.
+
+    Parameters
+    ----------
+    el_df : dataFrame or Spectrum, required
+        EL data with columns ['Wavelength', 'Signal'(, 'Energy')]
+    startE : float, required
+        Start energy [eV]
+    stopE : float, required
+        Stop energy [eV]
+    T_EL : float, required
+        Temperature of EL measurement [K]
+    scale : float, optional
+        Scale factor of the reduced EL
+    scale_abs : float, optional
+        Scale factor of the EL derived absorption
+
+    Returns
+    -------
+    el_df : dataFrame
+        DataFrame with columns ['Wavelength', 'Energy', 'Signal', 'Red_EL', 'EL_Abs', 'Red_EL_Abs']
+    """
+
+    if isinstance(el_df, pd.DataFrame) and 'Energy' not in el_df.columns:
+        el_df = el_df.assign(Energy=calculate_EL_energy(el_df['Wavelength']))
+
+    wavelength, energy, signal = (np.asarray(values, dtype=float) for values in compile_EL(el_df, startE, stopE, 1))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        el_abs = signal / (scale_abs * calculate_bb_flux(energy, T_EL))
+        return pd.DataFrame({'Wavelength': wavelength,
+                             'Energy': energy,
+                             'Signal': signal,
+                             'Red_EL': signal / (scale * energy),  # Divide by energy to reduce (checked in Benduhn thesis)
+                             'EL_Abs': el_abs,
+                             'Red_EL_Abs': energy * el_abs
+                             })
 
-    phi_bb_dict = {}
 
-    for energy in E_list:
-        # phi_bb = 2 * math.pi * (energy) ** 2 * math.exp(-1 * energy / (k * T_EL)) / (
-        #             h_2 ** 3 * c ** 2)  # -1) - without -1 as an approximation
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to process many EL files
+
+def process_EL_files(files,
+                     startE,
+                     stopE,
+                     T_EL,
+                     scale=1,
+                     scale_abs=1
+                     ):
+    """Function to calculate reduced EL and EL derived absorption of many EL files
+
+    Parameters
+    ----------
+    files : list, required
+        Paths of EL files with columns ['Wavelength', 'Signal'] (read with the first column as index)
+    startE : float, required
+        Start energy [eV]
+    stopE : float, required
+        Stop energy [eV]
+    T_EL : float or list, required
+        Temperature of EL measurement [K], or one temperature per file
+    scale : float, optional
+        Scale factor of the reduced EL
+    scale_abs : float, optional
+        Scale factor of the EL derived absorption
+
+    Returns
+    -------
+    results : dict
+        Dictionary of dataFrames {file: el_df} (see process_EL). Files that cannot be read or have no
+        Wavelength and Signal columns are skipped.
+    """
 
-        # this equation is confirmed in Thomas Kirchartz book chapter on EL
-        phi_bb = (2 * math.pi * energy ** 2) / (h_2 ** 3 * c ** 2) * (1 / (math.exp(energy / (k * T_EL)) - 1))
+    temperatures = T_EL if isinstance(T_EL, (list, tuple, np.ndarray)) else [T_EL] * len(files)
 
-        phi_bb_dict[energy] = phi_bb
+    results = {}
+    for file, T in zip(files, temperatures):
+        try:
+            el_df = file_cache.read(file, index_col=0)
+        except (OSError, ValueError) as e:
+            logger.error(f'EL file {file} could not be read: {e}')
+            continue
+        if not {'Wavelength', 'Signal'}.issubset(el_df.columns):
+            logger.error(f'EL file {file} has no Wavelength and Signal columns.')
+            continue
+        results[file] = process_EL(el_df, startE, stopE, T, scale=scale, scale_abs=scale_abs)
 
-    return phi_bb_dict  # [s/kg m^4]
+    return results
 
 # -----------------------------------------------------------------------------------------------------------
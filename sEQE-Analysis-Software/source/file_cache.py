@@ -0,0 +1,280 @@
+import hashlib
+import json
+import os
+import weakref
+
+import numpy as np
+import pandas as pd
+
+from source.utils import get_logger
+
+logger = get_logger()
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Define parameters for the file cache
+
+# NOTE: Delete this directory to clear all cached files
+file_cache_dir = os.path.join(os.path.expanduser('~'), '.sEQE_file_cache')
+
+# NOTE: Set to False to parse every loaded file with pandas
+use_file_cache = True
+
+# Maximum number of binary copies kept on disk (the least recently written are removed first)
+max_cached_files = 200
+
+# File format version
+file_cache_version = 1
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to convert a column to an array
+
+def column_Array(values):
+    """Function to convert a column or index to an array that can be saved without pickling
+
+    Parameters
+    ----------
+    values : series or index, required
+        Column or index values
+
+    Returns
+    -------
+    array : array
+        Numeric, boolean or string array
+
+    Raises
+    ------
+    TypeError
+        If the values are neither numeric nor all strings (i.e. mixed types)
+    """
+
+    if pd.api.types.is_numeric_dtype(values) or pd.api.types.is_bool_dtype(values):
+        return np.asarray(values)
+
+    values = np.asarray(values, dtype=object)
+    if all(isinstance(value, str) for value in values):
+        return values.astype(str)
+
+    raise TypeError('Column has mixed types.')
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Class to share and store parsed data files
+
+class FileCache:
+    """Class to cache parsed data files in memory and as binary copies on disk
+
+    Files are keyed by their path, size and modification time. A file that is loaded in several GUI slots
+    is parsed once and all slots share the same dataFrame, so its sorted spectrum (see get_spectrum) is
+    also shared. Parsed files are stored as uncompressed npz files with one array per column, which load
+    much faster than parsing the CSV file again in a later session.
+
+    Loaded dataFrames are shared and must not be modified in place.
+
+    Parameters
+    ----------
+    directory : str, optional
+        Directory of the binary copies
+    enabled : bool, optional
+        Boolean value specifying whether to share and store parsed files
+    """
+
+    def __init__(self,
+                 directory=file_cache_dir,
+                 enabled=use_file_cache
+                 ):
+
+        self.directory = directory
+        self.enabled = enabled
+        self.shared = 0
+        self.loaded = 0
+        self.parsed = 0
+        self._frames = weakref.WeakValueDictionary()  # Files loaded in a GUI slot
+
+    def key(self,
+            file,
+            index_col=None
+            ):
+        """Function to calculate the cache key of a file
+
+        Parameters
+        ----------
+        file : str, required
+            Path of the data file
+        index_col : int, optional
+            Column to use as index
+
+        Returns
+        -------
+        key : str
+            Hexadecimal SHA-256 hash of path, size, modification time and reader settings
+        """
+
+        stat = os.stat(file)
+        parts = [os.path.abspath(file), stat.st_size, stat.st_mtime_ns, index_col, file_cache_version]
+
+        return hashlib.sha256('|'.join(map(str, parts)).encode()).hexdigest()
+
+    def read(self,
+             file,
+             index_col=None
+             ):
+        """Function to read a CSV data file
+
+        The same dataFrame is returned to every caller that reads the file while it is loaded. It must not be
+        modified in place (i.e. data_df['EQE'] = ... or data_df.loc[...] = ...), as the change would appear in
+        all GUI slots that loaded the file. Modify a copy (data_df.copy()) instead.
+
+        Parameters
+        ----------
+        file : str, required
+            Path of the data file
+        index_col : int, optional
+            Column to use as index (see pd.read_csv)
+
+        Returns
+        -------
+        data_df : dataFrame
+            Parsed data file, shared with all other callers
+        """
+
+        if not self.enabled:
+            return pd.read_csv(file, index_col=index_col)
+
+        key = self.key(file, index_col)
+
+        data_df = self._frames.get(key)
+        if data_df is not None:
+            self.shared += 1
+            return data_df
+
+        data_df = self.load(key)
+        if data_df is not None:
+            self.loaded += 1
+        else:
+            data_df = pd.read_csv(file, index_col=index_col)
+            self.parsed += 1
+            self.save(key, data_df, file)
+
+        self._frames[key] = data_df
+
+        return data_df
+
+    def path(self,
+             key
+             ):
+        """Function to return the path of the binary copy of a file"""
+
+        return os.path.join(self.directory, f'{key}.npz')
+
+    def load(self,
+             key
+             ):
+        """Function to load the binary copy of a file
+
+        Parameters
+        ----------
+        key : str, required
+            Cache key of the file (see key)
+
+        Returns
+        -------
+        data_df : dataFrame
+            Parsed data file, or None if no binary copy exists
+        """
+
+        try:
+            with np.load(self.path(key), allow_pickle=False) as data:
+                metadata = json.loads(str(data['Metadata']))
+                columns = {name: data[f'column_{x}'] for x, name in enumerate(metadata['columns'])}
+                index = pd.Index(data['index'], name=metadata['index_name']) if 'index' in data else None
+        except (OSError, KeyError, ValueError):
+            return None
+
+        return pd.DataFrame(columns, index=index)
+
+    def save(self,
+             key,
+             data_df,
+             file
+             ):
+        """Function to store a binary copy of a parsed file
+
+        Parameters
+        ----------
+        key : str, required
+            Cache key of the file (see key)
+        data_df : dataFrame, required
+            Parsed data file
+        file : str, required
+            Path of the data file
+
+        Returns
+        -------
+        None
+        """
+
+        try:
+            arrays = {f'column_{x}': column_Array(data_df[name]) for x, name in enumerate(data_df.columns)}
+            if not isinstance(data_df.index, pd.RangeIndex) or data_df.index.start != 0 or data_df.index.step != 1:
+                arrays['index'] = column_Array(data_df.index)
+        except TypeError:  # Files with mixed type columns are shared in memory only
+            return
+
+        metadata = {'columns': [str(name) for name in data_df.columns],
+                    'index_name': data_df.index.name,
+                    'source': os.path.abspath(file),
+                    'version': file_cache_version
+                    }
+        arrays['Metadata'] = np.array(json.dumps(metadata))
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            temporary = self.path(key) + '.tmp'
+            with open(temporary, 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(temporary, self.path(key))
+            self.prune()
+        except OSError as e:
+            logger.error(f'File cache unavailable: {e}')
+
+    def prune(self):
+        """Function to remove the oldest binary copies if more than max_cached_files are stored"""
+
+        files = [entry for entry in os.scandir(self.directory) if entry.name.endswith('.npz')]
+        if len(files) > max_cached_files:
+            files.sort(key=lambda entry: entry.stat().st_mtime)
+            for entry in files[:len(files) - max_cached_files]:
+                os.remove(entry.path)
+
+    def clear(self):
+        """Function to remove all binary copies and reset counters"""
+
+        if os.path.isdir(self.directory):
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith('.npz'):
+                    os.remove(entry.path)
+        self._frames.clear()
+        self.shared = 0
+        self.loaded = 0
+        self.parsed = 0
+
+    def summary(self):
+        """Function to summarize cache usage
+
+        Returns
+        -------
+        summary : str
+            Number of shared, loaded and parsed files
+        """
+
+        return f'File cache: {self.shared} shared, {self.loaded} loaded from disk, {self.parsed} parsed'
+
+
+file_cache = FileCache()  # Shared cache used by writeText
+
+# -----------------------------------------------------------------------------------------------------------
@@ -0,0 +1,290 @@
+import atexit
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from source.utils import get_logger
+
+logger = get_logger()
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Define parameters for the fit cache
+
+# NOTE: Delete this file to clear all cached fits
+cache_path = os.path.join(os.path.expanduser('~'), '.sEQE_fit_cache.sqlite')
+
+# NOTE: Set to False to disable the on-disk fit cache
+use_fit_cache = True
+
+# Maximum number of fits kept on disk (the least recently used are removed first)
+max_cached_fits = 50000
+
+# Number of new fits after which results are written to disk
+commit_interval = 256
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to hash fit inputs
+
+def hash_Fit(*parts):
+    """Function to calculate a content hash of fit inputs
+
+    Parameters
+    ----------
+    parts : required
+        Fit inputs (arrays, lists, numbers, strings, dictionaries or None)
+
+    Returns
+    -------
+    key : str
+        Hexadecimal SHA-256 hash
+    """
+
+    digest = hashlib.sha256()
+
+    def update(part):
+        if isinstance(part, np.ndarray) or (isinstance(part, (list, tuple)) and len(part) != 0
+                                             and all(isinstance(value, (int, float, np.number)) for value in part)):
+            array = np.ascontiguousarray(part, dtype=float)
+            digest.update(f'array{array.shape}'.encode())
+            digest.update(array.tobytes())
+        elif isinstance(part, dict):
+            digest.update(b'dict')
+            for name in sorted(part):
+                digest.update(str(name).encode())
+                update(part[name])
+        elif isinstance(part, (list, tuple)):
+            digest.update(f'list{len(part)}'.encode())
+            for value in part:
+                update(value)
+        else:
+            digest.update(repr(part).encode())
+        digest.update(b'|')
+
+    for part in parts:
+        update(part)
+
+    return digest.hexdigest()
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to fingerprint a model function
+
+def fingerprint_Model(function,
+                      energy_fit,
+                      p0
+                      ):
+    """Function to fingerprint a model function including its GUI settings
+
+    Model functions of the GUI read settings such as temperature, Huang-Rhys parameter or vibrational energy
+    from the main window. Evaluating the model at fixed parameters captures all of these settings.
+
+    Parameters
+    ----------
+    function : function, required
+        Model function (i.e. gaussian, MLJ_gaussian_disorder etc.)
+    energy_fit : list or array, required
+        Energy values [eV]
+    p0 : list, required
+        Parameters to evaluate the model at
+
+    Returns
+    -------
+    fingerprint : tuple
+        Tuple of function name and model values, or None if the model cannot be evaluated
+    """
+
+    try:
+        with np.errstate(all='ignore'):
+            values = np.asarray(function(np.asarray(energy_fit, dtype=float), *p0), dtype=float)
+    except Exception:
+        return None
+
+    return getattr(function, '__qualname__', repr(function)), values
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Class to store fit results on disk
+
+class FitCache:
+    """Class to store fit results in an on-disk SQLite database
+
+    Fit results are keyed by a content hash of the fitted data and all fit settings (see hash_Fit),
+    so that repeated analyses of the same data only compute fits that are new.
+
+    Parameters
+    ----------
+    path : str, optional
+        Path of the database file
+    enabled : bool, optional
+        Boolean value specifying whether to store and look up fits
+    max_fits : int, optional
+        Maximum number of fits kept on disk
+    """
+
+    def __init__(self,
+                 path=cache_path,
+                 enabled=use_fit_cache,
+                 max_fits=max_cached_fits
+                 ):
+
+        self.path = path
+        self.enabled = enabled
+        self.max_fits = max_fits
+        self.hits = 0
+        self.misses = 0
+        self._pending = 0
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        """Function to open the database on first use"""
+
+        if self._connection is None:
+            try:
+                self._connection = sqlite3.connect(self.path, check_same_thread=False)
+                self._connection.execute('CREATE TABLE IF NOT EXISTS fits (key TEXT PRIMARY KEY, result BLOB)')
+                columns = [row[1] for row in self._connection.execute('PRAGMA table_info(fits)')]
+                if 'used' not in columns:  # Database written before fits were pruned
+                    self._connection.execute('ALTER TABLE fits ADD COLUMN used REAL DEFAULT 0')
+                self._connection.execute('CREATE INDEX IF NOT EXISTS fits_used ON fits (used)')
+            except sqlite3.Error as e:
+                logger.error(f'Fit cache unavailable: {e}')
+                self.enabled = False
+                self._connection = None
+
+        return self._connection
+
+    def get(self,
+            key
+            ):
+        """Function to look up a fit result
+
+        Parameters
+        ----------
+        key : str, required
+            Hash of fit inputs (see hash_Fit)
+
+        Returns
+        -------
+        result : object
+            Cached fit result, or None if the fit is not cached or cannot be read
+        """
+
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            connection = self._connect()
+            if connection is None:
+                return None
+            row = connection.execute('SELECT result FROM fits WHERE key = ?', (key,)).fetchone()
+
+            result = None
+            if row is not None:
+                try:
+                    result = pickle.loads(row[0])
+                except (pickle.UnpicklingError, EOFError, AttributeError, ImportError, TypeError, ValueError) as e:
+                    logger.warning(f'Ignoring unreadable cached fit: {e}')  # Refit and replace the stored result
+
+            if result is None:
+                self.misses += 1
+                return None
+
+            connection.execute('UPDATE fits SET used = ? WHERE key = ?', (time.time(), key))
+            self._record()
+            self.hits += 1
+
+        return result
+
+    def put(self,
+            key,
+            result
+            ):
+        """Function to store a fit result
+
+        Parameters
+        ----------
+        key : str, required
+            Hash of fit inputs (see hash_Fit)
+        result : object, required
+            Fit result (i.e. tuple of best fit values, covariance matrix and R squared)
+
+        Returns
+        -------
+        None
+        """
+
+        if not self.enabled:
+            return
+
+        with self._lock:
+            connection = self._connect()
+            if connection is None:
+                return
+            connection.execute('INSERT OR REPLACE INTO fits (key, result, used) VALUES (?, ?, ?)',
+                               (key, pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL), time.time()))
+            self._record()
+
+    def _record(self):
+        """Function to count a database change and commit once commit_interval changes are pending"""
+
+        self._pending += 1
+        if self._pending >= commit_interval:
+            self._commit()
+
+    def _commit(self):
+        """Function to remove the least recently used fits if more than max_fits are stored and commit"""
+
+        count = self._connection.execute('SELECT COUNT(*) FROM fits').fetchone()[0]
+        if count > self.max_fits:
+            self._connection.execute('DELETE FROM fits WHERE key IN (SELECT key FROM fits ORDER BY used LIMIT ?)',
+                                     (count - self.max_fits,))
+        self._connection.commit()
+        self._pending = 0
+
+    def flush(self):
+        """Function to write pending fit results to disk"""
+
+        with self._lock:
+            if self._connection is not None and self._pending != 0:
+                self._commit()
+
+    def clear(self):
+        """Function to remove all stored fits and reset hit / miss counters"""
+
+        with self._lock:
+            connection = self._connect()
+            if connection is not None:
+                connection.execute('DELETE FROM fits')
+                connection.commit()
+                self._pending = 0
+            self.hits = 0
+            self.misses = 0
+
+    def summary(self):
+        """Function to summarize cache usage
+
+        Returns
+        -------
+        summary : str
+            Number of hits and misses
+        """
+
+        return f'Fit cache: {self.hits} hits, {self.misses} misses'
+
+
+fit_cache = FitCache()  # Shared cache used by guess_fit, fit_model_double and fit_batch
+atexit.register(fit_cache.flush)
+
+# -----------------------------------------------------------------------------------------------------------
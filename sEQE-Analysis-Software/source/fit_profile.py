@@ -0,0 +1,370 @@
+import functools
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from source.utils import get_logger
+
+logger = get_logger()
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Define parameters for fit profiling
+
+# NOTE: Set to False to disable recording of fit attempts, function evaluations and timings
+use_fit_profiler = True
+
+# Number of most common failure reasons listed in the report
+n_failure_reasons = 5
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Class to record fit statistics
+
+class FitProfiler:
+    """Class to record per call statistics of the fitting layer
+
+    Each call of a profiled function (see profile) creates one record with the fit window, the number of fit
+    attempts, the index of the successful initial guess, the number of optimizer function evaluations,
+    the wall time, whether the result was taken from the fit cache and the reasons of failed attempts.
+    Calls of profiled functions inside another profiled function (i.e. fit_model_double inside guess_fit)
+    are added to the outer record.
+
+    Parameters
+    ----------
+    enabled : bool, optional
+        Boolean value specifying whether to record fit statistics
+    """
+
+    def __init__(self,
+                 enabled=use_fit_profiler
+                 ):
+
+        self.enabled = enabled
+        self.records = []
+        self.n_skipped = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _current(self):
+        """Function to return the record of the current thread"""
+
+        return getattr(self._local, 'record', None)
+
+    def profile(self,
+                function
+                ):
+        """Decorator to record statistics of each call of a fit function
+
+        Parameters
+        ----------
+        function : function, required
+            Fit function (i.e. guess_fit, fit_model_double)
+
+        Returns
+        -------
+        wrapper : function
+            Profiled fit function
+        """
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not self.enabled or self._current() is not None:
+                return function(*args, **kwargs)
+
+            record = {'Function': function.__name__,
+                      'Start': np.nan,
+                      'Stop': np.nan,
+                      'Attempts': 0,
+                      'Success_Index': None,
+                      'Nfev': 0,
+                      'Time': 0.0,
+                      'Cached': False,
+                      'Failures': []
+                      }
+            self._local.record = record
+            start_time = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            except Exception as e:
+                record['Failures'].append(f'{type(e).__name__}: {e}')
+                raise
+            finally:
+                record['Time'] = time.perf_counter() - start_time
+                self._local.record = None
+                with self._lock:
+                    self.records.append(record)
+
+        return wrapper
+
+    def window(self,
+               startE,
+               stopE
+               ):
+        """Function to record the fit window of the current call
+
+        Parameters
+        ----------
+        startE : float, required
+            Fit start energy value [eV]
+        stopE : float, required
+            Fit stop energy value [eV]
+
+        Returns
+        -------
+        None
+        """
+
+        record = self._current()
+        if record is not None:
+            record['Start'] = startE
+            record['Stop'] = stopE
+
+    def attempt(self):
+        """Function to record a fit attempt (one optimizer run)"""
+
+        record = self._current()
+        if record is not None:
+            record['Attempts'] += 1
+
+    def evaluations(self,
+                    nfev
+                    ):
+        """Function to record optimizer function evaluations
+
+        Parameters
+        ----------
+        nfev : int, required
+            Number of function evaluations of one optimizer run
+
+        Returns
+        -------
+        None
+        """
+
+        record = self._current()
+        if record is not None and nfev is not None:
+            record['Nfev'] += int(nfev)
+
+    def success(self,
+                index
+                ):
+        """Function to record the index of the successful initial guess
+
+        Parameters
+        ----------
+        index : int, required
+            Index of initial guess in the list of guesses
+
+        Returns
+        -------
+        None
+        """
+
+        record = self._current()
+        if record is not None:
+            record['Success_Index'] = index
+
+    def cached(self):
+        """Function to record that the current fit was taken from the fit cache"""
+
+        record = self._current()
+        if record is not None:
+            record['Cached'] = True
+
+    def failure(self,
+                exception
+                ):
+        """Function to record the reason of a failed fit attempt
+        A successful guess index recorded by a nested fit function is discarded.
+
+        Parameters
+        ----------
+        exception : Exception, required
+            Exception raised by the fit attempt
+
+        Returns
+        -------
+        None
+        """
+
+        record = self._current()
+        if record is not None:
+            record['Failures'].append(f'{type(exception).__name__}: {exception}')
+            record['Success_Index'] = None
+
+    def skip(self,
+             n_skipped
+             ):
+        """Function to record fit ranges that were skipped before fitting (see feasible_Windows)
+
+        Parameters
+        ----------
+        n_skipped : int, required
+            Number of skipped fit ranges
+
+        Returns
+        -------
+        None
+        """
+
+        with self._lock:
+            self.n_skipped += n_skipped
+
+    def batch(self,
+              function,
+              windows,
+              r_squared,
+              nfev,
+              cached,
+              wall_time
+              ):
+        """Function to record statistics of a batched fit with one record per window
+        The wall time of the batch is divided equally between its windows.
+        In a profiled function, the attempts and function evaluations are added to the outer record.
+
+        Parameters
+        ----------
+        function : str, required
+            Name of the batched fit function (i.e. fit_batch)
+        windows : list, required
+            List of (start energy, stop energy) tuples [eV]
+        r_squared : array, required
+            R squared of each fit. Failed fits are set to 0.
+        nfev : array, required
+            Number of function evaluations of each window
+        cached : list, required
+            Boolean values specifying whether each fit was taken from the fit cache
+        wall_time : float, required
+            Wall time of the batch [s]
+
+        Returns
+        -------
+        None
+        """
+
+        if not self.enabled or len(windows) == 0:
+            return
+
+        record = self._current()
+        if record is not None:
+            record['Attempts'] += int(np.count_nonzero(~np.asarray(cached, dtype=bool)))
+            record['Nfev'] += int(np.sum(nfev))
+            return
+
+        records = [{'Function': function,
+                    'Start': start,
+                    'Stop': stop,
+                    'Attempts': 0 if cached[n] else 1,
+                    'Success_Index': 0 if r_squared[n] > 0 else None,
+                    'Nfev': int(nfev[n]),
+                    'Time': wall_time / len(windows),
+                    'Cached': bool(cached[n]),
+                    'Failures': [] if r_squared[n] > 0 or cached[n] else ['ArithmeticError: R squared <= 0']
+                    } for n, (start, stop) in enumerate(windows)]
+
+        with self._lock:
+            self.records.extend(records)
+
+    def reset(self):
+        """Function to remove all records"""
+
+        with self._lock:
+            self.records = []
+            self.n_skipped = 0
+
+    def to_DataFrame(self):
+        """Function to compile all records
+
+        Returns
+        -------
+        df : dataFrame
+            DataFrame with one row per profiled call
+        """
+
+        with self._lock:
+            records = [dict(record, Failures='; '.join(record['Failures'])) for record in self.records]
+
+        return pd.DataFrame(records, columns=['Function', 'Start', 'Stop', 'Attempts', 'Success_Index', 'Nfev',
+                                              'Time', 'Cached', 'Failures'])
+
+    def report(self):
+        """Function to aggregate all records per fit function
+
+        Returns
+        -------
+        report : str
+            Report of skipped fit ranges, calls, cache hits, failed windows, attempts, successful guess indices,
+            function evaluations, wall time and the most common failure reasons
+        """
+
+        with self._lock:
+            records = list(self.records)
+            n_skipped = self.n_skipped
+
+        if len(records) == 0 and n_skipped == 0:
+            return 'Fit profile: no fits recorded'
+
+        lines = ['Fit profile']
+        if n_skipped != 0:
+            lines.append(f'Skipped fit ranges with too few data points: {n_skipped}')
+        for name in dict.fromkeys(record['Function'] for record in records):
+            group = [record for record in records if record['Function'] == name]
+            fitted = [record for record in group if not record['Cached']]
+            failed = [record for record in fitted if record['Success_Index'] is None]
+            attempts = np.array([record['Attempts'] for record in fitted], dtype=float)
+            nfev = np.array([record['Nfev'] for record in fitted], dtype=float)
+            wall_time = np.array([record['Time'] for record in group], dtype=float)
+            indices = Counter(record['Success_Index'] for record in fitted if record['Success_Index'] is not None)
+            reasons = Counter(reason for record in fitted for reason in record['Failures'])
+
+            lines.append(f'{name}:')
+            lines.append(f'  Calls: {len(group)} ({len(group) - len(fitted)} cached, {len(failed)} failed)')
+            if len(fitted) != 0:
+                lines.append(f'  Attempts per fit: mean {attempts.mean():.2f}, max {int(attempts.max())}')
+                lines.append(f'  Function evaluations per fit: mean {nfev.mean():.1f}, total {int(nfev.sum())}')
+            lines.append(f'  Wall time: total {wall_time.sum():.3f} s, mean {1e3 * wall_time.mean():.3f} ms, '
+                         f'max {1e3 * wall_time.max():.3f} ms')
+            if len(indices) != 0:
+                lines.append('  Successful guess index: ' + ', '.join(f'{index}: {count}'
+                                                                    for index, count in sorted(indices.items())))
+            for reason, count in reasons.most_common(n_failure_reasons):
+                lines.append(f'  Failure ({count}x): {reason}')
+
+        return '\n'.join(lines)
+
+    def save(self,
+             save_fit_file
+             ):
+        """Function to save all records and the report next to exported fit files
+
+        Parameters
+        ----------
+        save_fit_file : str, required
+            Path and file name of the exported fit data
+
+        Returns
+        -------
+        None
+        """
+
+        if not self.enabled or (len(self.records) == 0 and self.n_skipped == 0) or not save_fit_file:
+            return
+
+        try:
+            self.to_DataFrame().to_csv(f'{save_fit_file}_Fit_profile.csv')
+            with open(f'{save_fit_file}_Fit_profile.txt', 'w') as file:
+                file.write(self.report() + '\n')
+            logger.info('Saving fit profile to: %s' % f'{save_fit_file}_Fit_profile.txt')
+        except OSError as e:
+            logger.error(f'Fit profile could not be saved: {e}')
+
+
+fit_profiler = FitProfiler()  # Shared profiler used by guess_fit, fit_model_double and the fit functions
+
+# -----------------------------------------------------------------------------------------------------------
@@ -0,0 +1,422 @@
+import heapq
+
+import numpy as np
+import pandas as pd
+
+from source.gaussian import calculate_combined_fit, calculate_combined_fit_MLJ
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to compile standard deviations from a covariance matrix
+
+def standard_deviation(covar,
+                       n_values,
+                       index=None
+                       ):
+    """Function to compile standard deviations from the diagonal of a covariance matrix
+
+    Parameters
+    ----------
+    covar : array, required
+        Covariance matrix of fit (may be None if fit was unsuccessful)
+    n_values : int, required
+        Number of standard deviations to return
+    index : list, optional
+        Diagonal indices to select (e.g. [3, 4, 5] for the optical peak of a simultaneous double fit)
+
+    Returns
+    -------
+    sd : array
+        Standard deviations, padded with zeros if unavailable
+    """
+
+    sd = np.zeros(n_values)
+
+    if covar is not None:
+        diag = np.sqrt(np.abs(np.diag(np.asarray(covar, dtype=float))))
+        if index is not None:
+            index = [i for i in index if i < len(diag)]
+            diag = diag[index]
+        diag = diag[:n_values]
+        sd[:len(diag)] = diag
+
+    return sd
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Class to store double peak fit results
+
+class FitResults:
+    """Class to store double peak fit results in typed, columnar arrays
+
+    Only fit ranges, fit parameters, standard deviations and R squared values are stored for every fit.
+    Fit curves are regenerated from the stored parameters only for fits that are plotted or saved.
+    If n_best is given, only the best n_best fits are kept (streaming top-k selection using a min-heap),
+    so that memory does not depend on the size of the fit range grid.
+
+    Parameters
+    ----------
+    T : float, required
+        Temperature [K]
+    include_disorder : bool, optional
+        Boolean value specifying whether CT state fits include disorder
+    simultaneous_double : bool, optional
+        Boolean value specifying whether simultaneous double peak fitting was performed
+    S : float, optional
+        Huang-Rhys parameter, only required for MLJ fits
+    hbarw : float, optional
+        Vibrational energy [eV], only required for MLJ fits
+    range : float, optional
+        Multiplication factor of the stop energy used to regenerate combined fits
+    n_best : int, optional
+        Number of best fits to keep. If None, all fits are kept
+    rank : str, optional
+        Column used to rank fits ('Total_R2' or 'Comp_R2')
+    capacity : int, optional
+        Number of fits to allocate initially
+    """
+
+    scalar_columns = ['Index', 'Start_Opt', 'Stop_Opt', 'R2_Opt', 'Start_CT', 'Stop_CT', 'R2_CT', 'Total_R2',
+                      'Comp_R2']
+    aliases = {'Start': 'Start_CT', 'Stop': 'Stop_CT'}  # Simultaneous double fits share one fit range
+
+    def __init__(self,
+                 T,
+                 include_disorder=False,
+                 simultaneous_double=False,
+                 S=None,
+                 hbarw=None,
+                 range=1.05,
+                 n_best=None,
+                 rank='Total_R2',
+                 capacity=256
+                 ):
+
+        self.T = T
+        self.include_disorder = include_disorder
+        self.simultaneous_double = simultaneous_double
+        self.S = S
+        self.hbarw = hbarw
+        self.range = range
+        self.n_best = n_best
+        self.rank = rank
+
+        if n_best is not None:
+            capacity = max(int(n_best), 1)
+
+        self.n_Opt = 3  # f, l, E
+        self.n_CT = 4 if include_disorder else 3  # f, l, E, (sig)
+
+        self._size = 0
+        self.n_fits = 0  # Number of fits appended, including discarded fits
+        self._heap = []  # Min-heap of (score, -index, storage row) of kept fits if n_best is given
+        self._columns = {name: np.zeros(capacity) for name in self.scalar_columns}
+        self._columns['Fit_Opt'] = np.zeros((capacity, self.n_Opt))
+        self._columns['SD_Opt'] = np.zeros((capacity, self.n_Opt))
+        self._columns['Fit_CT'] = np.zeros((capacity, self.n_CT))
+        self._columns['SD_CT'] = np.zeros((capacity, self.n_CT))
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, name):
+        return self._columns[self.aliases.get(name, name)][:self._size]
+
+    def _grow(self):
+        for name, values in self._columns.items():
+            new_values = np.zeros((2 * len(values),) + values.shape[1:])
+            new_values[:len(values)] = values
+            self._columns[name] = new_values
+
+    def append(self,
+               start_Opt,
+               stop_Opt,
+               fit_Opt,
+               R2_Opt,
+               start_CT,
+               stop_CT,
+               fit_CT,
+               R2_CT,
+               total_R2,
+               comp_R2=np.nan,
+               sd_Opt=None,
+               sd_CT=None
+               ):
+        """Function to add a fit to the store
+
+        Parameters
+        ----------
+        start_Opt, stop_Opt : float, required
+            Optical peak fit range [eV]
+        fit_Opt : list, required
+            Optical peak fit values
+        R2_Opt : float, required
+            R squared of optical peak fit
+        start_CT, stop_CT : float, required
+            CT state fit range [eV]
+        fit_CT : list, required
+            CT state fit values
+        R2_CT : float, required
+            R squared of CT state fit
+        total_R2 : float, required
+            R squared of combined fit
+        comp_R2 : float, optional
+            Average R squared of CT / Opt / Combined fit
+        sd_Opt : array, optional
+            Standard deviations of optical peak fit values
+        sd_CT : array, optional
+            Standard deviations of CT state fit values
+
+        Returns
+        -------
+        None
+        """
+
+        row = {'Index': self.n_fits,
+               'Start_Opt': start_Opt,
+               'Stop_Opt': stop_Opt,
+               'R2_Opt': R2_Opt,
+               'Start_CT': start_CT,
+               'Stop_CT': stop_CT,
+               'R2_CT': R2_CT,
+               'Total_R2': total_R2,
+               'Comp_R2': comp_R2
+               }
+
+        score = row[self.rank]
+        if np.isnan(score):
+            score = -np.inf
+        heap_item = (score, -self.n_fits)  # Earlier fits are preferred for equal scores
+        self.n_fits += 1
+
+        if self.n_best is None:
+            if self._size == len(self._columns['Total_R2']):
+                self._grow()
+            i = self._size
+            self._size += 1
+        elif self._size < self.n_best:
+            i = self._size
+            self._size += 1
+            heapq.heappush(self._heap, heap_item + (i,))
+        elif len(self._heap) != 0 and heap_item > self._heap[0][:2]:
+            i = self._heap[0][2]  # Overwrite the worst kept fit
+            heapq.heapreplace(self._heap, heap_item + (i,))
+        else:
+            return
+
+        for name, value in row.items():
+            self._columns[name][i] = value
+
+        # Failed fits may return fewer values than expected (e.g. [0, 0, 0] for a disorder fit)
+        for name, values, n_values in [('Fit_Opt', fit_Opt, self.n_Opt),
+                                       ('Fit_CT', fit_CT, self.n_CT),
+                                       ('SD_Opt', sd_Opt, self.n_Opt),
+                                       ('SD_CT', sd_CT, self.n_CT)]:
+            self._columns[name][i] = 0
+            if values is not None:
+                values = np.asarray(values, dtype=float)[:n_values]
+                self._columns[name][i, :len(values)] = values
+
+    def best(self,
+             n=None
+             ):
+        """Function to rank stored fits
+
+        Parameters
+        ----------
+        n : int, optional
+            Number of fits to return. If None, all stored fits are returned
+
+        Returns
+        -------
+        index_list : list
+            Indices of stored fits, ordered from best to worst
+        """
+
+        scores = np.nan_to_num(self[self.rank], nan=-np.inf)
+        order = np.lexsort((self['Index'], -scores))  # Highest score first, earlier fits first for equal scores
+
+        return order[:n].tolist()
+
+    def score(self,
+              parameter_dict
+              ):
+        """Function to return the score of a combined fit that is used to rank fits
+
+        Parameters
+        ----------
+        parameter_dict : dict, required
+            Dictionary returned by calculate_combined_fit
+
+        Returns
+        -------
+        score : float
+            R squared of combined fit ('Total_R2') or average R squared of CT / Opt / Combined fit ('Comp_R2')
+        """
+
+        return parameter_dict['R2_Combined'] if self.rank == 'Total_R2' else parameter_dict['R2_Average']
+
+    def append_separate(self,
+                        start_Opt,
+                        stop_Opt,
+                        fit_Opt,
+                        R2_Opt,
+                        covar_Opt,
+                        start_CT,
+                        stop_CT,
+                        fit_CT,
+                        R2_CT,
+                        covar_CT,
+                        parameter_dict
+                        ):
+        """Function to add a separate double peak fit to the store
+
+        Parameters
+        ----------
+        start_Opt, stop_Opt : float, required
+            Optical peak fit range [eV]
+        fit_Opt : list, required
+            Optical peak fit values
+        R2_Opt : float, required
+            R squared of optical peak fit
+        covar_Opt : array, required
+            Covariance matrix of optical peak fit
+        start_CT, stop_CT : float, required
+            CT state fit range [eV]
+        fit_CT : list, required
+            CT state fit values
+        R2_CT : float, required
+            R squared of CT state fit
+        covar_CT : array, required
+            Covariance matrix of CT state fit
+        parameter_dict : dict, required
+            Dictionary returned by calculate_combined_fit
+
+        Returns
+        -------
+        None
+        """
+
+        self.append(start_Opt=start_Opt,
+                    stop_Opt=stop_Opt,
+                    fit_Opt=fit_Opt,
+                    R2_Opt=R2_Opt,
+                    start_CT=start_CT,
+                    stop_CT=stop_CT,
+                    fit_CT=fit_CT,
+                    R2_CT=R2_CT,
+                    total_R2=parameter_dict['R2_Combined'],
+                    comp_R2=parameter_dict['R2_Average'],
+                    sd_Opt=standard_deviation(covar_Opt, self.n_Opt),
+                    sd_CT=standard_deviation(covar_CT, self.n_CT)
+                    )
+
+    def append_simultaneous(self,
+                            start,
+                            stop,
+                            fit_Opt,
+                            fit_CT,
+                            covar,
+                            parameter_dict
+                            ):
+        """Function to add a simultaneous double peak fit to the store
+
+        Parameters
+        ----------
+        start, stop : float, required
+            Fit range [eV]
+        fit_Opt : list, required
+            Optical peak fit values
+        fit_CT : list, required
+            CT state fit values
+        covar : array, required
+            Covariance matrix of fit with parameters [fCT, lCT, ECT, fopt, lopt, Eopt, (sig)]
+        parameter_dict : dict, required
+            Dictionary returned by calculate_combined_fit
+
+        Returns
+        -------
+        None
+        """
+
+        self.append(start_Opt=start,
+                    stop_Opt=stop,
+                    fit_Opt=fit_Opt,
+                    R2_Opt=parameter_dict['R2_Opt'],
+                    start_CT=start,
+                    stop_CT=stop,
+                    fit_CT=fit_CT,
+                    R2_CT=parameter_dict['R2_CT'],
+                    total_R2=parameter_dict['R2_Combined'],
+                    comp_R2=parameter_dict['R2_Average'],
+                    sd_Opt=standard_deviation(covar, self.n_Opt, index=[3, 4, 5]),
+                    sd_CT=standard_deviation(covar, self.n_CT, index=[0, 1, 2, 6])
+                    )
+
+    def curves(self,
+               index,
+               eqe
+               ):
+        """Function to regenerate fit curves of a stored fit
+
+        Parameters
+        ----------
+        index : int, required
+            Index of stored fit
+        eqe : dataFrame or Spectrum, required
+            EQE data used for fitting
+
+        Returns
+        -------
+        parameter_dict : dict
+            Dictionary returned by calculate_combined_fit (e.g. Combined_Fit, Opt_Fit, CT_Fit, Energy, EQE)
+        """
+
+        fit_Opt = self['Fit_Opt'][index].tolist()
+        fit_CT = self['Fit_CT'][index].tolist()
+
+        if self.S is not None and self.hbarw is not None:  # MLJ CT state fit
+            return calculate_combined_fit_MLJ(eqe=eqe,
+                                              stopE=self['Stop_Opt'][index],
+                                              best_vals_Opt=fit_Opt,
+                                              best_vals_CT=fit_CT,
+                                              T=self.T,
+                                              S=self.S,
+                                              hbarw=self.hbarw,
+                                              R2_Opt=self['R2_Opt'][index],
+                                              R2_CT=self['R2_CT'][index],
+                                              include_disorder=self.include_disorder,
+                                              range=self.range
+                                              )
+        else:
+            return calculate_combined_fit(eqe=eqe,
+                                          stopE=self['Stop_Opt'][index],
+                                          best_vals_Opt=fit_Opt,
+                                          best_vals_CT=fit_CT,
+                                          T=self.T,
+                                          R2_Opt=self['R2_Opt'][index],
+                                          R2_CT=self['R2_CT'][index],
+                                          include_disorder=self.include_disorder,
+                                          range=self.range
+                                          )
+
+    def to_df(self):
+        """Function to compile stored fits into a dataFrame of scalar columns
+
+        Returns
+        -------
+        df : dataFrame
+            DataFrame with fit ranges, fit values, standard deviations and R squared values
+        """
+
+        df = pd.DataFrame({name: self[name] for name in self.scalar_columns})
+
+        parameter_names = ['f', 'l', 'E', 'sig']
+        for peak, n_values in [('Opt', self.n_Opt), ('CT', self.n_CT)]:
+            for i in range(n_values):
+                df[f'{parameter_names[i]}_{peak}'] = self[f'Fit_{peak}'][:, i]
+                df[f'{parameter_names[i]}_{peak}_SD'] = self[f'SD_{peak}'][:, i]
+
+        return df
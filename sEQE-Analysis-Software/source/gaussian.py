@@ -1,4 +1,5 @@
 import math
+from functools import lru_cache
 
 import numpy as np
 from numpy import exp
@@ -8,6 +9,15 @@ from source.compilation import compile_EQE
 from source.utils import R_squared
 
 
+# -----------------------------------------------------------------------------------------------------------
+
+# Define parameters for MLJ calculations
+
+# NOTE: Total weight of vibronic replicas that may be neglected
+MLJ_tolerance = 1e-6
+MLJ_max_replicas = 100
+
+
 # -----------------------------------------------------------------------------------------------------------
 
 # Function to calculate gaussian absorption
@@ -73,6 +83,152 @@ def calculate_gaussian_disorder_absorption(x, f, l, E, sig, T):
     return (f / (x * math.sqrt(2 * math.pi * (2 * l * T * k + sig ** 2))) * exp(
         -(E + l - x) ** 2 / (4 * l * k * T + 2 * sig ** 2)))
 
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to calculate the Jacobian of gaussian absorption including disorder
+
+def calculate_gaussian_disorder_absorption_jac(x, f, l, E, sig, T):
+    """Function to calculate the analytic Jacobian of gaussian absorption including disorder
+
+    With d = E + l - x and V = 2lkT + sig^2, the absorption is f / (x * sqrt(2 pi V)) * exp(-d^2 / 2V).
+
+    Parameters
+    ----------
+    x : list, required
+        List of energy values [eV]
+    f : float, required
+        Oscillator strength [eV^2]
+    l : float, required
+        Reorganization energy [eV]
+    E : float, required
+        Peak energy [eV]
+    sig : float, required
+        Peak disorder parameter [eV]
+    T : float or int, required
+        Temperature [K]
+
+    Returns
+    -------
+    jac : array
+        Array of shape (len(x), 4) with derivatives with respect to [f, l, E, sig]
+        Parameters may also be arrays that broadcast against x (i.e. for batched fits)
+    """
+
+    # Define variables
+    k = 8.617 * math.pow(10, -5)  # [ev/K]
+
+    x = np.asarray(x, dtype=float)
+
+    V = 2 * l * k * T + sig ** 2
+    d = E + l - x
+
+    base = exp(-d ** 2 / (2 * V)) / (x * np.sqrt(2 * math.pi * V))  # Absorption per unit oscillator strength
+    EQE = f * base
+    dV = -1 / (2 * V) + d ** 2 / (2 * V ** 2)  # Derivative of log absorption with respect to V
+
+    return np.stack([base,  # d/df
+                     EQE * (2 * k * T * dV - d / V),  # d/dl
+                     -EQE * d / V,  # d/dE
+                     EQE * 2 * sig * dV  # d/dsig
+                     ], axis=-1)
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to calculate the Jacobian of gaussian absorption
+
+def calculate_gaussian_absorption_jac(x, f, l, E, T):
+    """Function to calculate the analytic Jacobian of gaussian absorption
+
+    Parameters
+    ----------
+    x : list, required
+        List of energy values [eV]
+    f : float, required
+        Oscillator strength [eV^2]
+    l : float, required
+        Reorganization energy [eV]
+    E : float, required
+        Peak energy [eV]
+    T : float or int, required
+        Temperature [K]
+
+    Returns
+    -------
+    jac : array
+        Array of shape (len(x), 3) with derivatives with respect to [f, l, E]
+    """
+
+    return calculate_gaussian_disorder_absorption_jac(x, f, l, E, 0, T)[..., :3]
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to calculate the weights of vibronic replicas for MLJ theory
+
+@lru_cache(maxsize=256)
+def calculate_MLJ_weights(S, hbarw, tolerance=MLJ_tolerance):
+    """Function to calculate the Poisson weights and energy shifts of vibronic replicas
+    Results are cached per (S, hbarw) pair. The number of replicas is chosen so that the neglected weight is below tolerance.
+
+    Parameters
+    ----------
+    S : float, required
+        Huang-Rhys parameter
+    hbarw : float, required
+        Vibrational energy [eV]
+    tolerance : float, optional
+        Total weight of neglected replicas
+
+    Returns
+    -------
+    weights : array
+        Poisson weights exp(-S) * S^n / n! of replicas n = 0, 1, ...
+    shifts : array
+        Energy shifts n * hbarw of replicas [eV]
+    """
+
+    weights = [math.exp(-S)]
+    while 1 - sum(weights) > tolerance and len(weights) < MLJ_max_replicas:
+        weights.append(weights[-1] * S / len(weights))  # Recursion of the Poisson distribution
+
+    weights = np.array(weights)
+    shifts = np.arange(len(weights)) * hbarw
+
+    weights.setflags(write=False)  # Cached arrays are shared between calls
+    shifts.setflags(write=False)
+
+    return weights, shifts
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to calculate the sum of vibronic replicas for MLJ theory
+
+def calculate_MLJ_replicas(d, V, S, hbarw):
+    """Function to calculate the weighted sum of vibronic replicas
+    All replicas are evaluated as one broadcasted array operation.
+
+    Parameters
+    ----------
+    d : float or array, required
+        Distance from the 0-0 replica (i.e. E + l - x for absorption) [eV]
+    V : float, required
+        Variance of the replicas (i.e. 2 l k T + sig^2) [eV^2]
+    S : float, required
+        Huang-Rhys parameter
+    hbarw : float, required
+        Vibrational energy [eV]
+
+    Returns
+    -------
+    replicas : float or array
+        Sum of exp(-(d + n * hbarw)^2 / 2V) weighted by the Poisson weights
+    """
+
+    weights, shifts = calculate_MLJ_weights(float(S), float(hbarw))
+
+    d = np.asarray(d, dtype=float)
+
+    return exp(-(d[..., None] + shifts) ** 2 / (2 * V)) @ weights
+
 # -----------------------------------------------------------------------------------------------------------
 
     # Function to calculate absorption using MLJ theory
@@ -106,14 +262,9 @@ def calculate_MLJ_absorption(x, f, l, E, T, S, hbarw):
     # Define variables
     k = 8.617 * math.pow(10, -5)  # [ev/K]
 
-    EQE = 0
-    for n in range(0, 6):
-        EQE_n = (f / (x * math.sqrt(4 * math.pi * l * T * k))) \
-                * (math.exp(-S) * S ** n / math.factorial(n)) \
-                * exp(-(E + l - x + n * hbarw) ** 2 \
-                      / (4 * l * k * T))
-        EQE += EQE_n
-    return EQE
+    x = np.asarray(x, dtype=float)
+
+    return (f / (x * math.sqrt(4 * math.pi * l * T * k))) * calculate_MLJ_replicas(E + l - x, 2 * l * k * T, S, hbarw)
 
 # -----------------------------------------------------------------------------------------------------------
 
@@ -150,14 +301,10 @@ def calculate_MLJ_disorder_absorption(x, f, l, E, T, sig, S, hbarw):
     # Define variables
     k = 8.617 * math.pow(10, -5)  # [ev/K]
 
-    EQE = 0
-    for n in range(0, 6):
-        EQE_n = (f / (x * math.sqrt(2 * math.pi * (2 * l * T * k + sig ** 2))) \
-                 * (math.exp(-S) * S ** n / math.factorial(n)) \
-                 * exp(-(E + l - x + n * hbarw) ** 2 \
-                       / (4 * l * k * T + 2 * sig ** 2)))
-        EQE += EQE_n
-    return EQE
+    x = np.asarray(x, dtype=float)
+
+    return (f / (x * math.sqrt(2 * math.pi * (2 * l * T * k + sig ** 2)))) \
+           * calculate_MLJ_replicas(E + l - x, 2 * l * k * T + sig ** 2, S, hbarw)
 
 # -----------------------------------------------------------------------------------------------------------
 
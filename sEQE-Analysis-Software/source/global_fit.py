@@ -0,0 +1,336 @@
+import numpy as np
+import pandas as pd
+from scipy.optimize import least_squares
+
+from source.batch_fit import guess_Marcus_batch, f_guess, l_guess, l_min
+from source.compilation import compile_EQE
+from source.gaussian import calculate_gaussian_disorder_absorption_jac
+from source.utils import get_logger
+
+logger = get_logger()
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Define parameters for global fits
+
+# Marcus fit parameters of each spectrum
+parameter_names = ['f', 'l', 'Ect', 'Sig']
+
+# NOTE: Parameters shared by all spectra (i.e. ['l', 'Ect'] for a thickness series or ['Ect'] for a
+#       temperature series). All other parameters are fitted to each spectrum.
+shared_parameters = ['l', 'Ect']
+
+# NOTE: Set to True to divide the residuals of each spectrum by its peak EQE, so that all spectra are weighted
+#       equally. If False, spectra with a higher EQE dominate the fit.
+normalize_spectra = True
+
+# Maximum number of function evaluations of the optimizer
+max_nfev = 5000
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to compile spectra into padded arrays
+
+def stack_Spectra(eqe_list,
+                  startE,
+                  stopE
+                  ):
+    """Function to compile the fit window of each EQE spectrum into padded arrays
+
+    Parameters
+    ----------
+    eqe_list : list, required
+        List of EQE dataFrames or Spectra including columns ['Energy', 'EQE']
+    startE : float or list, required
+        Fit start energy value [eV], or one value per spectrum
+    stopE : float or list, required
+        Fit stop energy value [eV], or one value per spectrum
+
+    Returns
+    -------
+    energy : array
+        Array of shape (number of spectra, longest window) with energy values [eV]
+        Padded values are set to 1 to avoid division by zero
+    eqe_fit : array
+        Array of the same shape with EQE values, padded with zeros
+    mask : array
+        Boolean array of the same shape marking valid values
+    """
+
+    starts = np.broadcast_to(np.asarray(startE, dtype=float), (len(eqe_list),))
+    stops = np.broadcast_to(np.asarray(stopE, dtype=float), (len(eqe_list),))
+
+    compiled = [compile_EQE(eqe, start, stop, 1) for eqe, start, stop in zip(eqe_list, starts, stops)]
+    length = max([len(window[1]) for window in compiled] + [1])
+
+    energy = np.ones((len(eqe_list), length))
+    eqe_fit = np.zeros((len(eqe_list), length))
+    mask = np.zeros((len(eqe_list), length), dtype=bool)
+
+    for n, (wave_fit, energy_fit, eqe_values, log_eqe_fit) in enumerate(compiled):
+        energy[n, :len(energy_fit)] = energy_fit
+        eqe_fit[n, :len(eqe_values)] = eqe_values
+        mask[n, :len(energy_fit)] = np.isfinite(eqe_values)
+
+    return energy, eqe_fit, mask
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to map shared and per spectrum parameters
+
+def map_Parameters(n_spectra,
+                   shared,
+                   include_disorder=False
+                   ):
+    """Function to map the fit parameters of each spectrum to the global parameter vector
+
+    Parameters
+    ----------
+    n_spectra : int, required
+        Number of spectra
+    shared : list, required
+        Names of shared parameters (see parameter_names)
+    include_disorder : bool, optional
+        Boolean value specifying whether to include the disorder parameter
+
+    Returns
+    -------
+    index : array
+        Integer array of shape (n_spectra, number of parameters) with the position of each parameter
+        of each spectrum in the global parameter vector
+    names : list
+        List of (parameter name, spectrum number) tuples of the global parameter vector
+        The spectrum number of shared parameters is None.
+    """
+
+    index = np.zeros((n_spectra, 3 + include_disorder), dtype=int)
+    names = []
+
+    for p, name in enumerate(parameter_names[:3 + include_disorder]):
+        if name in shared:
+            index[:, p] = len(names)
+            names.append((name, None))
+        else:
+            index[:, p] = len(names) + np.arange(n_spectra)
+            names.extend((name, n) for n in range(n_spectra))
+
+    return index, names
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to calculate Marcus model and Jacobian of all spectra
+
+def evaluate_Global(theta,
+                    index,
+                    energy,
+                    T
+                    ):
+    """Function to calculate Marcus absorption of all spectra and its Jacobian in one vectorized pass
+
+    Parameters
+    ----------
+    theta : array, required
+        Global parameter vector
+    index : array, required
+        Position of each parameter of each spectrum in theta (see map_Parameters)
+    energy : array, required
+        Padded energy values [eV]
+    T : array, required
+        Temperature of each spectrum [K]
+
+    Returns
+    -------
+    EQE : array
+        Calculated EQE values of shape (number of spectra, longest window)
+    jac : array
+        Derivatives of EQE with respect to theta of shape (number of spectra, longest window, len(theta))
+    """
+
+    params = theta[index]
+    f, l, Ect = (params[:, p, None] for p in range(3))
+    sig = params[:, 3, None] if params.shape[1] == 4 else 0
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore', under='ignore'):
+        local_jac = calculate_gaussian_disorder_absorption_jac(energy, f, l, Ect, sig, T[:, None])[..., :params.shape[1]]
+
+    # Parameters of one spectrum map to different positions in theta, so no derivatives need to be summed
+    jac = np.zeros(energy.shape + (len(theta),))
+    jac[np.arange(len(index))[:, None], :, index] = np.moveaxis(local_jac, -1, 1)
+
+    return f * local_jac[..., 0], jac
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to fit many spectra with shared parameters
+
+def fit_Global(eqe_list,
+               startE,
+               stopE,
+               T,
+               shared=None,
+               include_disorder=False,
+               sig=0.05,
+               labels=None,
+               callback=None
+               ):
+    """Function to fit a single Marcus peak to many EQE spectra at once with shared and per spectrum parameters
+
+    The residuals of all spectra are stacked into one vector and minimized in one optimizer run.
+    Initial guesses are calculated in closed form for each spectrum (see guess_Marcus_batch);
+    shared parameters start at the median of the guesses.
+
+    Parameters
+    ----------
+    eqe_list : list, required
+        List of EQE dataFrames or Spectra including columns ['Energy', 'EQE']
+    startE : float or list, required
+        Fit start energy value [eV], or one value per spectrum
+    stopE : float or list, required
+        Fit stop energy value [eV], or one value per spectrum
+    T : float or list, required
+        Temperature [K], or one temperature per spectrum
+    shared : list, optional
+        Names of shared parameters (see parameter_names). Defaults to shared_parameters.
+    include_disorder : bool, optional
+        Boolean value specifying whether to include the disorder parameter
+    sig : float, optional
+        Initial guess of the disorder parameter [eV]
+    labels : list, optional
+        Labels of the spectra (i.e. file names)
+    callback : function, optional
+        Function called before each function evaluation (i.e. to cancel the fit by raising an exception)
+
+    Returns
+    -------
+    df : dataFrame
+        Fit parameters, standard deviations and R squared of each spectrum
+        The attributes 'Shared', 'Total_R2', 'Nfev' and 'Success' describe the global fit.
+
+    Raises
+    ------
+    ValueError
+        If a spectrum has no more data points in the fit range than its own fit parameters
+    """
+
+    n_spectra = len(eqe_list)
+    T = np.broadcast_to(np.asarray(T, dtype=float), (n_spectra,)).copy()
+    labels = list(labels) if labels is not None else [str(n + 1) for n in range(n_spectra)]
+    shared = [name for name in (shared_parameters if shared is None else shared)
+              if name in parameter_names[:3 + include_disorder]]
+
+    energy, eqe_fit, mask = stack_Spectra(eqe_list, startE, stopE)
+    index, names = map_Parameters(n_spectra, shared, include_disorder)
+
+    # Each spectrum needs more data points than its own (not shared) fit parameters
+    n_own = len(parameter_names[:3 + include_disorder]) - len(shared)
+    for label, n_values in zip(labels, np.count_nonzero(mask, axis=1)):
+        if n_values <= n_own:
+            raise ValueError(f'{label}: more than {n_own} data points are needed in the fit range, '
+                             f'found {n_values}.')
+    if np.count_nonzero(mask) <= len(names):
+        raise ValueError('Not enough data points for the number of fit parameters.')
+
+    # Closed-form initial guess of each spectrum, with a fallback at the EQE peak
+    p0, ok = guess_Marcus_batch(energy, eqe_fit, mask, T, sig=sig if include_disorder else None)
+    ok &= np.all(np.isfinite(p0), axis=1) & (p0[:, 0] > 0) & (p0[:, 1] > l_min)
+    peak_energy = energy[np.arange(n_spectra), np.argmax(np.where(mask, eqe_fit, -np.inf), axis=1)]
+    fallback = np.column_stack([np.full(n_spectra, f_guess), np.full(n_spectra, l_guess), peak_energy - l_guess,
+                                np.full(n_spectra, sig)])[:, :p0.shape[1]]
+    p0 = np.where(ok[:, None], p0, fallback)
+
+    theta0 = np.array([p0[n, parameter_names.index(name)] if n is not None
+                       else np.median(p0[:, parameter_names.index(name)]) for name, n in names])
+    lower = np.array([l_min if name == 'l' else 0 for name, n in names])
+    theta0 = np.maximum(theta0, lower + 1e-6)
+
+    if normalize_spectra:
+        weights = 1 / np.max(np.where(mask, np.abs(eqe_fit), 0), axis=1, keepdims=True).clip(1e-300)
+    else:
+        weights = np.ones((n_spectra, 1))
+
+    evaluated = {}  # Model and Jacobian of the last parameters, shared by the residual and Jacobian functions
+
+    def evaluate(theta):
+        if evaluated.get('theta') is None or not np.array_equal(evaluated['theta'], theta):
+            if callback is not None:
+                callback()
+            evaluated['theta'] = theta.copy()
+            evaluated['EQE'], evaluated['jac'] = evaluate_Global(theta, index, energy, T)
+        return evaluated['EQE'], evaluated['jac']
+
+    def residuals(theta):
+        return ((evaluate(theta)[0] - eqe_fit) * weights)[mask]
+
+    def jacobian(theta):
+        return (evaluate(theta)[1] * weights[..., None])[mask]
+
+    result = least_squares(residuals, theta0, jac=jacobian, bounds=(lower, np.inf), x_scale='jac', max_nfev=max_nfev)
+
+    # Covariance of the global parameters from the Jacobian at the optimum
+    dof = max(np.count_nonzero(mask) - len(names), 1)
+    covar = np.linalg.pinv(result.jac.T @ result.jac) * 2 * result.cost / dof
+    sd = np.sqrt(np.clip(np.diag(covar), 0, None))
+
+    eqe_model = evaluate_Global(result.x, index, energy, T)[0]
+    ss_res = np.sum(np.where(mask, eqe_fit - eqe_model, 0) ** 2, axis=1)
+    mean = np.sum(np.where(mask, eqe_fit, 0), axis=1, keepdims=True) / np.count_nonzero(mask, axis=1)[:, None]
+    ss_tot = np.sum(np.where(mask, eqe_fit - mean, 0) ** 2, axis=1)
+
+    df = pd.DataFrame({'Label': labels, 'T': T,
+                       'Start': np.broadcast_to(startE, (n_spectra,)),
+                       'Stop': np.broadcast_to(stopE, (n_spectra,))})
+    for p, name in enumerate(parameter_names[:3 + include_disorder]):
+        df[name] = result.x[index[:, p]]
+        df[f'{name}_SD'] = sd[index[:, p]]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        df['R_Squared'] = 1 - ss_res / ss_tot
+
+    df.attrs['Shared'] = shared
+    df.attrs['Total_R2'] = float(1 - np.sum(ss_res) / np.sum(ss_tot))
+    df.attrs['Nfev'] = int(result.nfev)
+    df.attrs['Success'] = bool(result.success)
+
+    if not result.success:
+        logger.info(f'Global fit did not converge: {result.message}')
+
+    return df
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to format global fit results
+
+def format_GlobalFit(df):
+    """Function to format global fit results for printing
+
+    Parameters
+    ----------
+    df : dataFrame, required
+        Global fit results (see fit_Global)
+
+    Returns
+    -------
+    text : str
+        Formatted global fit results
+    """
+
+    names = [name for name in parameter_names if name in df.columns]
+    shared = df.attrs['Shared']
+
+    lines = [f"Global fit of {len(df)} spectra ({df.attrs['Nfev']} function evaluations, "
+             f"total R2 = {df.attrs['Total_R2']:.6f}):"]
+    for name in shared:
+        lines.append(f"{name} (shared) : {df[name].iloc[0]:.6f} +/- {df[f'{name}_SD'].iloc[0]:.6f}")
+    for _, row in df.iterrows():
+        values = ', '.join(f"{name} = {row[name]:.6f} +/- {row[f'{name}_SD']:.6f}"
+                           for name in names if name not in shared)
+        lines.append(f"{row['Label']} (T = {row['T']:g} K, R2 = {row['R_Squared']:.6f}) : {values}")
+
+    return '\n'.join(lines)
+
+# -----------------------------------------------------------------------------------------------------------
@@ -0,0 +1,156 @@
+import datetime
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from source.utils import get_logger
+
+logger = get_logger()
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Define parameters for heat map files
+
+# NOTE: Set to True to check "Save Heat Maps" in the menu by default.
+#       If checked, a file dialog asks where to save each heat map run.
+use_heat_map_file = False
+
+# File format version
+heat_map_version = 1
+
+# Fit parameter columns stored as (stop, start) grids
+heat_map_columns = ['f', 'l', 'Ect', 'R_Squared', 'Sig']
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to save a heat map run
+
+def save_HeatMap(file,
+                 parameter_df,
+                 heat_df=None,
+                 metadata=None
+                 ):
+    """Function to save a heat map run to a compressed npz file
+
+    The file holds the start and stop energy grid, one (stop, start) array per fit parameter and R squared,
+    a mask of fitted (not filled) fit ranges and the run metadata as a JSON string.
+
+    Parameters
+    ----------
+    file : str, required
+        Path of the npz file
+    parameter_df : dataFrame, required
+        Fitted fit ranges with columns ['Start', 'Stop', 'f', 'l', 'Ect', 'R_Squared'(, 'Sig')]
+    heat_df : dataFrame, optional
+        Fitted and filled fit ranges used for plotting (see fill_Grid). If None, parameter_df is used.
+    metadata : dict, optional
+        JSON serializable run metadata (i.e. temperature, peak type, data file)
+
+    Returns
+    -------
+    file : str
+        Path of the saved file
+    """
+
+    if heat_df is None:
+        heat_df = parameter_df
+
+    starts = np.unique(heat_df['Start'].to_numpy(dtype=float))
+    stops = np.unique(heat_df['Stop'].to_numpy(dtype=float))
+
+    def grid_Index(df):
+        return np.searchsorted(stops, df['Stop'].to_numpy(dtype=float)), \
+               np.searchsorted(starts, df['Start'].to_numpy(dtype=float))
+
+    arrays = {'Start': starts, 'Stop': stops}
+    rows, columns = grid_Index(heat_df)
+    for column in heat_map_columns:
+        if column in heat_df:
+            grid = np.full((len(stops), len(starts)), np.nan)
+            grid[rows, columns] = heat_df[column].to_numpy(dtype=float)
+            arrays[column] = grid
+
+    fitted = np.zeros((len(stops), len(starts)), dtype=bool)
+    fitted[grid_Index(parameter_df)] = True
+    arrays['Fitted'] = fitted
+
+    metadata = dict(metadata or {}, version=heat_map_version, saved=datetime.datetime.now().isoformat())
+    arrays['Metadata'] = np.array(json.dumps(metadata, default=float))
+
+    directory = os.path.dirname(file)
+    if len(directory) != 0:
+        os.makedirs(directory, exist_ok=True)
+    np.savez_compressed(file, **arrays)
+
+    return file if file.endswith('.npz') else f'{file}.npz'
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to load a heat map run
+
+def load_HeatMap(file):
+    """Function to load a heat map run saved by save_HeatMap
+
+    Parameters
+    ----------
+    file : str, required
+        Path of the npz file
+
+    Returns
+    -------
+    parameter_df : dataFrame
+        Fitted fit ranges with columns ['Start', 'Stop', 'f', 'l', 'Ect', 'R_Squared'(, 'Sig')]
+    heat_df : dataFrame
+        Fitted and filled fit ranges used for plotting, with a boolean 'Fitted' column
+    metadata : dict
+        Run metadata
+    """
+
+    with np.load(file, allow_pickle=False) as data:
+        metadata = json.loads(str(data['Metadata']))
+        if metadata.get('version', 0) > heat_map_version:
+            raise ValueError(f'Heat map file version {metadata["version"]} is not supported.')
+
+        stops, starts = np.meshgrid(data['Stop'], data['Start'], indexing='ij')
+        columns = {'Start': starts, 'Stop': stops}
+        columns.update({column: data[column] for column in heat_map_columns if column in data})
+        columns['Fitted'] = data['Fitted']
+
+    heat_df = pd.DataFrame({name: values.T.ravel() for name, values in columns.items()})  # Start major order
+    filled = np.isfinite(heat_df['R_Squared'].to_numpy())
+
+    parameter_df = heat_df[heat_df['Fitted']].drop(columns='Fitted').reset_index(drop=True)
+    heat_df = heat_df[filled].reset_index(drop=True)
+
+    return parameter_df, heat_df, metadata
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to name a heat map file
+
+def name_HeatMap(label):
+    """Function to generate a unique heat map file name
+
+    Parameters
+    ----------
+    label : str, required
+        Plot label or file name of the EQE data
+
+    Returns
+    -------
+    file : str
+        Name of the npz file
+    """
+
+    label = ''.join(c if c.isalnum() or c in '-_' else '_' for c in str(label)) or 'EQE'
+    timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+
+    return f'HeatMap_{label}_{timestamp}.npz'
+
+# -----------------------------------------------------------------------------------------------------------
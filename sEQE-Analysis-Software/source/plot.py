@@ -1,8 +1,24 @@
+import math
+
 import matplotlib.pyplot as plt
 import matplotlib as mpl
 import numpy as np
 
 
+# -----------------------------------------------------------------------------------------------------------
+
+# Define parameters for heat maps
+
+# NOTE: Perceptually uniform colormap similar to the former seaborn default ("rocket")
+heat_map_cmap = 'magma'
+
+# Label every n-th start and stop energy
+heat_map_ticks = 3
+
+# NOTE: For fine grids, every k * heat_map_ticks-th energy is labelled so that each axis has at most this many labels
+heat_map_max_labels = 30
+
+
 # -----------------------------------------------------------------------------------------------------------
 
 # Function to plot any data
@@ -262,4 +278,74 @@ def set_up_EL_plot():
 
     return ax_1, ax_2
 
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to plot a heat map
+
+def plot_HeatMap(df,
+                 title,
+                 ticks=heat_map_ticks,
+                 cmap=heat_map_cmap,
+                 filled=None
+                 ):
+    """Function to plot a pivoted heat map as a single raster image
+
+    Each cell is one pixel of an image instead of a separate artist, so that fine grids draw quickly.
+    Cells are shown in the order of the pivoted dataFrame (first row at the top) and missing values are left blank.
+
+    Parameters
+    ----------
+    df : dataFrame, required
+        Pivoted dataFrame (index = stop energies, columns = start energies)
+    title : str, required
+        Plot title
+    ticks : int, optional
+        Label every n-th row and column (every multiple of n for fine grids, see heat_map_max_labels)
+    cmap : str, optional
+        Name of matplotlib colormap
+    filled : dataFrame, optional
+        Pivoted boolean dataFrame of the same shape marking cells that were not fitted (see fill_Grid).
+        These cells are hatched.
+
+    Returns
+    -------
+    ax : axis object
+        matplotlib axis object
+    """
+
+    values = np.ma.masked_invalid(df.to_numpy(dtype=float))
+
+    plt.ion()
+    fig, ax = plt.subplots(figsize=(11, 9))
+    image = ax.imshow(values, cmap=cmap, aspect='auto', interpolation='nearest')
+
+    x_step = ticks * max(1, math.ceil(values.shape[1] / (ticks * heat_map_max_labels)))
+    y_step = ticks * max(1, math.ceil(values.shape[0] / (ticks * heat_map_max_labels)))
+    ax.set_xticks(np.arange(0, values.shape[1], x_step))
+    ax.set_xticklabels([str(value) for value in df.columns[::x_step]], rotation=90)
+    ax.set_yticks(np.arange(0, values.shape[0], y_step))
+    ax.set_yticklabels([str(value) for value in df.index[::y_step]], rotation=360)
+
+    if filled is not None and filled.to_numpy(dtype=bool).any():
+        # Hatch filled cells with one contour artist. Each cell is sampled just inside its edges,
+        # so that the hatched area follows the cell boundaries.
+        mask = np.repeat(np.repeat(filled.to_numpy(dtype=float), 2, axis=0), 2, axis=1)
+        x = (np.arange(values.shape[1])[:, None] + [-0.4999, 0.4999]).ravel()
+        y = (np.arange(values.shape[0])[:, None] + [-0.4999, 0.4999]).ravel()
+        ax.contourf(x, y, mask, levels=[0.5, 1.5], colors='none', hatches=['//'])
+        ax.legend(handles=[mpl.patches.Patch(facecolor='none', edgecolor='grey', hatch='//',
+                                             label='Not fitted (nearest fit)')], loc='upper right')
+
+    cbar = fig.colorbar(image, ax=ax)
+    cbar.ax.tick_params(labelsize=15)
+
+    plt.xlabel('Initial Energy Value (eV)', fontsize=17, fontweight='medium')
+    plt.ylabel('Final Energy Value (eV)', fontsize=17, fontweight='medium')
+    plt.title(title, fontsize=17, fontweight='medium')
+    plt.tick_params(labelsize=15, direction='in', axis='both', which='major', length=8, width=2)
+    plt.show()
+
+    return ax
+
 # -----------------------------------------------------------------------------------------------------------
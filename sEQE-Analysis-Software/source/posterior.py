@@ -0,0 +1,413 @@
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pandas as pd
+
+from source.compilation import compile_EQE
+from source.utils import get_logger
+from source.utils_fit import f_guess, l_guess, guess_Marcus, varpro_bounds
+
+logger = get_logger()
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Define parameters for posterior sampling of CT state fits
+
+k = 8.617 * math.pow(10, -5)  # [ev/K]
+
+# NOTE: Set to True to sample the posterior of single peak CT state fits in addition to guess_fit
+use_posterior = False
+
+# Number of walkers of the ensemble sampler (at least twice the number of parameters)
+n_walkers = 32
+
+# Number of steps of each walker, of which the first n_burn are discarded
+n_steps = 2000
+n_burn = 500
+
+# Scale parameter of the stretch move
+stretch_scale = 2.0
+
+# Relative spread of the initial walker positions around the initial guess
+init_spread = 1e-3
+
+# Credible level of the reported intervals
+credible_level = 0.95
+
+# Number of worker processes used to sample many spectra (None to use all CPUs, 1 to sample in the calling process)
+n_workers = None
+
+# Uniform priors taken from the fit_model parameter bounds
+# NOTE: Order is [f, l, Ect, sig]
+prior_bounds = varpro_bounds
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to calculate Marcus absorption for many walkers
+
+def calculate_Marcus_walkers(energy,
+                             params,
+                             T
+                             ):
+    """Function to calculate Marcus absorption for many parameter sets at once
+
+    Parameters
+    ----------
+    energy : array, required
+        Energy values [eV]
+    params : array, required
+        Array of shape (number of walkers, 3 or 4) with parameters [f, l, Ect] or [f, l, Ect, sig]
+    T : float, required
+        Temperature [K]
+
+    Returns
+    -------
+    EQE : array
+        Array of shape (number of walkers, len(energy)) with calculated EQE values
+    """
+
+    f, l, Ect = (params[:, n, None] for n in range(3))
+    sig = params[:, 3, None] if params.shape[1] == 4 else 0
+
+    V = 2 * l * k * T + sig ** 2
+
+    return f / (energy * np.sqrt(2 * math.pi * V)) * np.exp(-(Ect + l - energy) ** 2 / (2 * V))
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to calculate the log posterior for many walkers
+
+def calculate_log_posterior(params,
+                            energy,
+                            eqe,
+                            T,
+                            lower,
+                            upper
+                            ):
+    """Function to calculate the log posterior of many parameter sets at once
+
+    Priors are uniform within the parameter bounds. The noise level of the data is unknown and marginalized
+    with a Jeffreys prior, so that the log likelihood is -n/2 ln(sum of squared residuals).
+
+    Parameters
+    ----------
+    params : array, required
+        Array of shape (number of walkers, 3 or 4) with parameters [f, l, Ect] or [f, l, Ect, sig]
+    energy : array, required
+        Energy values [eV]
+    eqe : array, required
+        EQE values
+    T : float, required
+        Temperature [K]
+    lower : array, required
+        Lower parameter bounds
+    upper : array, required
+        Upper parameter bounds
+
+    Returns
+    -------
+    log_posterior : array
+        Log posterior of each parameter set (up to a constant). Parameter sets outside the bounds are set to -inf.
+    """
+
+    log_posterior = np.full(len(params), -np.inf)
+    inside = np.all((params > lower) & (params < upper), axis=1)
+
+    if np.any(inside):
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore', under='ignore'):
+            ssr = np.sum((eqe - calculate_Marcus_walkers(energy, params[inside], T)) ** 2, axis=1)
+            log_posterior[inside] = np.where(np.isfinite(ssr) & (ssr > 0), -len(eqe) / 2 * np.log(ssr), -np.inf)
+
+    return log_posterior
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to sample the posterior of a CT state fit
+
+def sample_Posterior(energy,
+                     eqe,
+                     T,
+                     p0=None,
+                     include_disorder=False,
+                     sig=0.05,
+                     walkers=n_walkers,
+                     steps=n_steps,
+                     burn=n_burn,
+                     seed=None
+                     ):
+    """Function to sample the posterior of a single peak Marcus fit with an affine-invariant ensemble sampler
+
+    All walkers of one half of the ensemble are moved at once by the stretch move (Goodman & Weare, 2010),
+    so that the log posterior is evaluated for half of the ensemble in one array operation.
+
+    Parameters
+    ----------
+    energy : array, required
+        Energy values of the fit range [eV]
+    eqe : array, required
+        EQE values of the fit range
+    T : float, required
+        Temperature [K]
+    p0 : list, optional
+        Initial guess [f, l, Ect] or [f, l, Ect, sig] (i.e. best fit of guess_fit)
+        If None, the closed-form guess of guess_Marcus is used
+    include_disorder : bool, optional
+        Boolean value specifying whether to include CT state disorder
+    sig : float, optional
+        Disorder parameter guess used if p0 is None [eV]
+    walkers : int, optional
+        Number of walkers
+    steps : int, optional
+        Number of steps of each walker
+    burn : int, optional
+        Number of initial steps to discard
+    seed : int, optional
+        Random seed
+
+    Returns
+    -------
+    chain : array
+        Array of shape ((steps - burn) * walkers, 3 or 4) with posterior samples
+    acceptance : float
+        Fraction of accepted moves
+    """
+
+    energy = np.asarray(energy, dtype=float)
+    eqe = np.asarray(eqe, dtype=float)
+    n_params = 4 if include_disorder else 3
+    walkers += walkers % 2  # Split into two equal halves
+
+    lower = np.asarray(prior_bounds[0][:n_params], dtype=float)
+    upper = np.asarray(prior_bounds[1][:n_params], dtype=float)
+
+    if p0 is None:
+        p0 = guess_Marcus(energy, eqe, T, sig=sig if include_disorder else None)
+    if p0 is None:
+        peak = np.average(energy, weights=np.abs(eqe) + 1e-30)  # Weighted peak position
+        p0 = [f_guess, l_guess, peak - l_guess, sig][:n_params]
+
+    rng = np.random.default_rng(seed)
+
+    # Initialize walkers in a small ball around the initial guess, inside the prior bounds
+    margin = 1e-6 * (upper - lower)
+    p0 = np.clip(np.asarray(p0, dtype=float)[:n_params], lower + margin, upper - margin)
+    positions = np.clip(p0 * (1 + init_spread * rng.standard_normal((walkers, n_params))),
+                        lower + margin, upper - margin)
+    log_posterior = calculate_log_posterior(positions, energy, eqe, T, lower, upper)
+
+    chain = np.empty((steps - burn, walkers, n_params))
+    n_accepted = 0
+    half = walkers // 2
+
+    for step in range(steps):
+        for active, partners in ((slice(0, half), slice(half, walkers)), (slice(half, walkers), slice(0, half))):
+            z = ((stretch_scale - 1) * rng.random(half) + 1) ** 2 / stretch_scale
+            partner = positions[partners][rng.integers(half, size=half)]
+            proposal = partner + z[:, None] * (positions[active] - partner)
+
+            new_log_posterior = calculate_log_posterior(proposal, energy, eqe, T, lower, upper)
+            with np.errstate(invalid='ignore'):
+                accept = np.log(rng.random(half)) < (n_params - 1) * np.log(z) + new_log_posterior \
+                         - log_posterior[active]
+
+            positions[active][accept] = proposal[accept]
+            log_posterior[active][accept] = new_log_posterior[accept]
+            n_accepted += np.count_nonzero(accept)
+
+        if step >= burn:
+            chain[step - burn] = positions
+
+    return chain.reshape(-1, n_params), n_accepted / (steps * walkers)
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to summarize posterior samples
+
+def summarize_Posterior(chain,
+                        acceptance,
+                        names,
+                        credible=credible_level
+                        ):
+    """Function to calculate posterior means, standard deviations, medians and credible intervals
+
+    Parameters
+    ----------
+    chain : array, required
+        Array of posterior samples (see sample_Posterior)
+    acceptance : float, required
+        Fraction of accepted moves
+    names : list, required
+        Parameter names
+    credible : float, optional
+        Credible level
+
+    Returns
+    -------
+    df : dataFrame
+        DataFrame with columns ['Mean', 'SD', 'Median', 'Lower', 'Upper'] indexed by parameter name
+        The acceptance fraction is stored in df.attrs['Acceptance']
+    """
+
+    alpha = (1 - credible) / 2 * 100
+
+    df = pd.DataFrame(index=pd.Index(names, name='Parameter'))
+    df['Mean'] = np.mean(chain, axis=0)
+    df['SD'] = np.std(chain, axis=0, ddof=1)
+    df['Median'] = np.median(chain, axis=0)
+    df['Lower'], df['Upper'] = np.percentile(chain, [alpha, 100 - alpha], axis=0)
+    df.attrs['Acceptance'] = acceptance
+    df.attrs['Credible'] = credible
+
+    return df
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to sample the posterior of a CT state fit of one spectrum
+
+def sample_Spectrum(eqe,
+                    startE,
+                    stopE,
+                    T,
+                    p0=None,
+                    include_disorder=False,
+                    seed=None,
+                    **kwargs
+                    ):
+    """Function to sample and summarize the posterior of a single peak Marcus fit of one EQE spectrum
+
+    Parameters
+    ----------
+    eqe : dataFrame or Spectrum, required
+        EQE data including columns ['Energy', 'EQE']
+    startE : float, required
+        Fit start energy value [eV]
+    stopE : float, required
+        Fit stop energy value [eV]
+    T : float, required
+        Temperature [K]
+    p0 : list, optional
+        Initial guess [f, l, Ect] or [f, l, Ect, sig]
+    include_disorder : bool, optional
+        Boolean value specifying whether to include CT state disorder
+    seed : int, optional
+        Random seed
+    kwargs : optional
+        Further keyword arguments of sample_Posterior
+
+    Returns
+    -------
+    df : dataFrame
+        Posterior summary (see summarize_Posterior)
+    """
+
+    wave_fit, energy_fit, eqe_fit, log_eqe_fit = compile_EQE(eqe, startE, stopE, 1)
+
+    chain, acceptance = sample_Posterior(energy_fit, eqe_fit, T, p0=p0, include_disorder=include_disorder,
+                                         seed=seed, **kwargs)
+
+    return summarize_Posterior(chain, acceptance, ['f', 'l', 'Ect', 'Sig'][:chain.shape[1]])
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to sample the posteriors of many spectra in parallel
+
+def sample_Spectra(eqe_list,
+                   startE,
+                   stopE,
+                   T,
+                   p0_list=None,
+                   include_disorder=False,
+                   workers=n_workers,
+                   seed=None,
+                   **kwargs
+                   ):
+    """Function to sample the posteriors of single peak Marcus fits of many EQE spectra in worker processes
+
+    Parameters
+    ----------
+    eqe_list : list, required
+        List of EQE dataFrames or Spectra
+    startE : float or list, required
+        Fit start energy value [eV], or list with one value per spectrum
+    stopE : float or list, required
+        Fit stop energy value [eV], or list with one value per spectrum
+    T : float or list, required
+        Temperature [K], or list with one value per spectrum
+    p0_list : list, optional
+        List of initial guesses, one per spectrum
+    include_disorder : bool, optional
+        Boolean value specifying whether to include CT state disorder
+    workers : int, optional
+        Number of worker processes (None to use all CPUs, 1 to sample in the calling process)
+    seed : int, optional
+        Random seed. Spectrum n is sampled with seed + n.
+    kwargs : optional
+        Further keyword arguments of sample_Posterior
+
+    Returns
+    -------
+    summaries : list
+        List of posterior summaries (see summarize_Posterior), one per spectrum
+    """
+
+    n = len(eqe_list)
+
+    def per_spectrum(value):
+        return list(value) if isinstance(value, (list, tuple, np.ndarray)) else [value] * n
+
+    tasks = [dict(eqe=eqe, startE=start, stopE=stop, T=temperature, p0=p0, include_disorder=include_disorder,
+                  seed=None if seed is None else seed + i, **kwargs)
+             for i, (eqe, start, stop, temperature, p0) in enumerate(zip(eqe_list, per_spectrum(startE),
+                                                                         per_spectrum(stopE), per_spectrum(T),
+                                                                         p0_list or [None] * n))]
+
+    workers = min(workers or os.cpu_count() or 1, n)
+
+    if workers > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(sample_Spectrum, **task) for task in tasks]
+                return [future.result() for future in futures]
+        except (BrokenProcessPool, OSError) as e:
+            logger.warning(f'Process pool failed ({e}), sampling spectra in a single process.')
+
+    return [sample_Spectrum(**task) for task in tasks]
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to format posterior summaries
+
+def format_Posterior(df):
+    """Function to format a posterior summary for printing
+
+    Parameters
+    ----------
+    df : dataFrame, required
+        Posterior summary (see summarize_Posterior)
+
+    Returns
+    -------
+    text : str
+        Formatted posterior summary
+    """
+
+    lines = [f"Posterior (acceptance fraction {df.attrs['Acceptance']:.2f}, "
+             f"{100 * df.attrs['Credible']:g} % credible intervals):"]
+    for name, row in df.iterrows():
+        lines.append(f"{name} : {row['Mean']:.6f} +/- {row['SD']:.6f} (median {row['Median']:.6f}) "
+                     f"[{row['Lower']:.6f}, {row['Upper']:.6f}]")
+
+    return '\n'.join(lines)
+
+# -----------------------------------------------------------------------------------------------------------
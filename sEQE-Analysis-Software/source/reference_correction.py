@@ -1,4 +1,51 @@
-from source.utils import interpolate
+import math
+
+import numpy as np
+
+from source.utils import get_logger
+
+logger = get_logger()
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to align reference values with sample wavelengths
+
+def align_Reference(wavelength,
+                    ref_wavelength,
+                    ref_values
+                    ):
+    """Function to align reference values with sample wavelengths in a single interpolation pass
+
+    Wavelengths contained in the reference are matched exactly, all other wavelengths are linearly interpolated.
+
+    Parameters
+    ----------
+    wavelength : list or array, required
+        Sample wavelengths [nm]
+    ref_wavelength : list or array, required
+        Reference wavelengths [nm]
+    ref_values : list or array, required
+        Reference values (e.g. power or responsivity)
+
+    Returns
+    -------
+    aligned_values : array
+        Reference values at sample wavelengths
+    """
+
+    wavelength = np.asarray(wavelength, dtype=float)
+    ref_wavelength = np.asarray(ref_wavelength, dtype=float)
+    ref_values = np.asarray(ref_values, dtype=float)
+
+    order = np.argsort(ref_wavelength, kind='stable')  # np.interp requires increasing wavelengths
+    ref_wavelength = ref_wavelength[order]
+    ref_values = ref_values[order]
+
+    if len(wavelength) != 0 and (wavelength.min() < ref_wavelength[0] or wavelength.max() > ref_wavelength[-1]):
+        raise ValueError('Wavelength outside of the reference wavelength range.')
+
+    return np.interp(wavelength, ref_wavelength, ref_values)
 
 
 # -----------------------------------------------------------------------------------------------------------
@@ -23,25 +70,74 @@ def calculate_Power(ref_df,
         Column of power values calculated in reference dataFrame
     """
 
-    # Define empty dictionaries and lists
-    cal_wave_dict = {}
-    power = []
+    responsivity = align_Reference(ref_df['Wavelength'],
+                                   cal_df['Wavelength [nm]'],
+                                   cal_df['Responsivity [A/W]']
+                                   )  # Match or interpolate responsivity
 
-    for x in range(len(cal_df['Wavelength [nm]'])):  # Iterate through columns of calibration file
-        cal_wave_dict[cal_df['Wavelength [nm]'][x]] = cal_df['Responsivity [A/W]'][
-            x]  # Add wavelength and corresponding responsivity to dictionary
+    ref_df['Power'] = np.asarray(ref_df['Mean Current'], dtype=float) / responsivity  # Create new column
 
-    for y in range(len(ref_df['Wavelength'])):  # Iterate through columns of reference file
-        if ref_df['Wavelength'][y] in cal_wave_dict.keys():  # Check if reference wavelength is in calibration file
-            power.append(float(ref_df['Mean Current'][y]) / float(
-                cal_wave_dict[ref_df['Wavelength'][y]]))  # Add power to the list
-        else:  # If reference wavelength is not in calibration file
-            resp_int = interpolate(ref_df['Wavelength'][y], cal_df['Wavelength [nm]'],
-                                   cal_df['Responsivity [A/W]'])  # Interpolate responsivity
-            power.append(float(ref_df['Mean Current'][y]) / float(resp_int))  # Add power to the list
+    return ref_df['Power']
 
-    ref_df['Power'] = power  # Create new column in reference file
 
-    return ref_df['Power']
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to calculate EQE
+
+def calculate_EQE_spectrum(ref_df,
+                           data_df,
+                           startNM,
+                           stopNM
+                           ):
+    """Function to calculate EQE spectrum from sample and reference data
+
+    Parameters
+    ----------
+    ref_df : dataFrame, required
+        DataFrame of reference diode values including columns ['Wavelength', 'Power']
+    data_df : dataFrame, required
+        DataFrame of sample values including columns ['Wavelength', 'Mean Current']
+    startNM : float, required
+        Start wavelength [nm]
+    stopNM : float, required
+        Stop wavelength [nm]
+
+    Returns
+    -------
+    Wavelength : array
+        Wavelength values [nm]
+    Energy : array
+        Energy values [eV]
+    EQE : array
+        EQE values
+    log_EQE : array
+        Logarithmic EQE values (NaN where the EQE is zero, negative or undefined)
+    """
+
+    # Define variables
+    h = 6.626 * math.pow(10, -34)  # [m^2 kg/s]
+    c = 2.998 * math.pow(10, 8)  # [m/s]
+    q = 1.602 * math.pow(10, -19)  # [C]
+
+    wavelength = np.asarray(data_df['Wavelength'], dtype=float)
+    mask = (startNM <= wavelength) & (wavelength <= stopNM)  # Calculate EQE if start <= wave <= stop, else ignore
+
+    Wavelength = wavelength[mask]
+    current = np.asarray(data_df['Mean Current'], dtype=float)[mask]
+
+    power = align_Reference(Wavelength, ref_df['Wavelength'], ref_df['Power'])  # Match or interpolate power
+
+    Energy = (h * c) / (Wavelength * math.pow(10, -9) * q)  # Calculate energy in eV
+    with np.errstate(divide='ignore', invalid='ignore'):
+        EQE = (current * Energy) / power
+
+    positive = np.isfinite(EQE) & (EQE > 0)
+    log_EQE = np.full(len(EQE), np.nan)
+    log_EQE[positive] = np.log10(EQE[positive])
+    if not np.all(positive):
+        logger.warning(f'{np.count_nonzero(~positive)} of {len(EQE)} EQE values are zero, negative or undefined. '
+                       f'Their log EQE values are set to NaN.')
+
+    return Wavelength, Energy, EQE, log_EQE
 
 # -----------------------------------------------------------------------------------------------------------
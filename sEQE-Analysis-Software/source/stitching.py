@@ -0,0 +1,229 @@
+import numpy as np
+import pandas as pd
+
+from source.utils import get_logger
+
+logger = get_logger()
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Define parameters for stitching EQE ranges
+
+# NOTE: Handling of overlapping wavelength ranges:
+#       'concatenate' : Append the ranges in order of their first wavelength and keep all data points
+#       'prefer'      : Keep the data points of one range (see prefer_range)
+#       'blend'       : Blend the ranges with linear weights across the overlap
+#       'scale'       : Scale each range to match the previous range at the overlap, then blend
+# NOTE: 'concatenate' keeps the output of earlier versions. The other methods change exported EQE files.
+overlap_method = 'concatenate'
+
+# NOTE: Range kept by 'prefer': 'first' (shorter wavelength range) or 'last' (longer wavelength range)
+prefer_range = 'first'
+
+# Columns of the stitched spectrum
+stitch_columns = ['Wavelength', 'Energy', 'EQE', 'Log_EQE']
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to sort EQE ranges
+
+def sort_Ranges(ranges,
+                sort_points=True
+                ):
+    """Function to sort EQE ranges by start wavelength and the data points of each range by wavelength
+
+    Parameters
+    ----------
+    ranges : list, required
+        List of dataFrames with columns ['Wavelength', 'Energy', 'EQE', 'Log_EQE']
+    sort_points : bool, optional
+        Boolean value specifying whether to sort the data points of each range and drop invalid wavelengths.
+        If False, ranges are sorted by their first wavelength and their data points are kept as they are.
+
+    Returns
+    -------
+    ranges : list
+        List of dictionaries of float arrays with the same keys
+    """
+
+    sorted_ranges = []
+    for df in ranges:
+        arrays = {column: np.asarray(df[column], dtype=float) for column in stitch_columns}
+        order = np.arange(len(arrays['Wavelength']))
+        if sort_points:
+            order = np.argsort(arrays['Wavelength'], kind='stable')
+            order = order[np.isfinite(arrays['Wavelength'][order])]
+        if len(order) != 0:
+            sorted_ranges.append({column: values[order] for column, values in arrays.items()})
+
+    return sorted(sorted_ranges, key=lambda arrays: arrays['Wavelength'][0])
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to match the scale of two EQE ranges
+
+def match_Scale(range_,
+                reference
+                ):
+    """Function to calculate the factor that matches the EQE of a range to a reference range at their overlap
+
+    Parameters
+    ----------
+    range_ : dict, required
+        Sorted range with keys ['Wavelength', 'EQE']
+    reference : dict, required
+        Sorted reference range with keys ['Wavelength', 'EQE']
+
+    Returns
+    -------
+    factor : float
+        Scaling factor of the range EQE (1 if the ranges do not overlap)
+    """
+
+    wave = range_['Wavelength']
+    overlap = (reference['Wavelength'][0] <= wave) & (wave <= reference['Wavelength'][-1])
+    overlap &= np.isfinite(range_['EQE'])
+
+    if not np.any(overlap):
+        return 1.0
+
+    reference_eqe = np.interp(wave[overlap], reference['Wavelength'], reference['EQE'])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        factor = np.nansum(reference_eqe) / np.nansum(range_['EQE'][overlap])
+
+    return float(factor) if np.isfinite(factor) and factor > 0 else 1.0
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to blend two overlapping EQE ranges
+
+def blend_Ranges(lower,
+                 upper
+                 ):
+    """Function to blend the EQE of two sorted ranges with linear weights across their overlap
+    At each data point in the overlap, the EQE is averaged with the EQE of the other range interpolated to it.
+    The weight of the lower range decreases from 1 at the start to 0 at the end of the overlap.
+
+    Parameters
+    ----------
+    lower : dict, required
+        Sorted range with the lower start wavelength with keys ['Wavelength', 'EQE', 'Log_EQE']
+    upper : dict, required
+        Sorted range with the higher start wavelength with keys ['Wavelength', 'EQE', 'Log_EQE']
+
+    Returns
+    -------
+    n : int
+        Number of blended data points
+    """
+
+    start = upper['Wavelength'][0]
+    stop = min(lower['Wavelength'][-1], upper['Wavelength'][-1])
+    if start >= stop:
+        return 0
+
+    blended = []
+    for own, other in [(lower, upper), (upper, lower)]:
+        wave = own['Wavelength']
+        overlap = (start <= wave) & (wave <= stop)
+        weight = (stop - wave[overlap]) / (stop - start)  # Weight of the lower range
+        if own is upper:
+            weight = 1 - weight
+        eqe = weight * own['EQE'][overlap] + (1 - weight) * np.interp(wave[overlap], other['Wavelength'],
+                                                                      other['EQE'])
+        blended.append((own, overlap, eqe))
+
+    for own, overlap, eqe in blended:  # Update both ranges after all values were interpolated
+        own['EQE'][overlap] = eqe
+        with np.errstate(divide='ignore', invalid='ignore'):
+            own['Log_EQE'][overlap] = np.log10(eqe)
+
+    return int(sum(np.count_nonzero(overlap) for own, overlap, eqe in blended))
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to stitch EQE ranges
+
+def stitch_EQE(ranges,
+               method=overlap_method,
+               prefer=prefer_range
+               ):
+    """Function to stitch EQE ranges into one spectrum sorted by wavelength
+
+    All ranges are merged at once: overlaps are resolved on whole arrays and the data points are sorted once.
+    As each range is sorted already, the stable sort only merges sorted runs.
+    The 'concatenate' method appends whole ranges in order of their first wavelength without sorting.
+
+    Parameters
+    ----------
+    ranges : list, required
+        List of dataFrames with columns ['Wavelength', 'Energy', 'EQE', 'Log_EQE'] in any order
+    method : str, optional
+        Handling of overlapping ranges: 'concatenate', 'prefer', 'blend' or 'scale'
+    prefer : str, optional
+        Range kept by the 'prefer' method: 'first' (shorter wavelength range) or 'last'
+
+    Returns
+    -------
+    stitched_df : dataFrame
+        Stitched spectrum with columns ['Wavelength', 'Energy', 'EQE', 'Log_EQE']
+    """
+
+    if method not in ['concatenate', 'prefer', 'blend', 'scale']:
+        raise ValueError(f'Unknown overlap method: {method}')
+    if prefer not in ['first', 'last']:
+        raise ValueError(f'Unknown preferred range: {prefer}')
+
+    ranges = sort_Ranges(ranges, sort_points=method != 'concatenate')
+    if len(ranges) == 0:
+        return pd.DataFrame(columns=stitch_columns)
+
+    if method == 'scale':  # Scale each range to the (scaled) previous range
+        for x in range(1, len(ranges)):
+            factor = match_Scale(ranges[x], ranges[x - 1])
+            ranges[x]['EQE'] *= factor
+            ranges[x]['Log_EQE'] += np.log10(factor)
+            logger.info(f'Scaling range {x + 1} by {factor:.4g}.')
+
+    if method in ['blend', 'scale']:
+        n_blended = sum(blend_Ranges(ranges[x], ranges[x + 1]) for x in range(len(ranges) - 1))
+        if n_blended > 0:
+            logger.info(f'Blended {n_blended} overlapping data points.')
+
+    range_no = np.repeat(np.arange(len(ranges)), [len(arrays['Wavelength']) for arrays in ranges])
+    columns = {column: np.concatenate([arrays[column] for arrays in ranges]) for column in stitch_columns}
+    wave = columns['Wavelength']
+
+    if method == 'prefer':
+        start = np.array([arrays['Wavelength'][0] for arrays in ranges])
+        stop = np.array([arrays['Wavelength'][-1] for arrays in ranges])
+        if prefer == 'first':  # Drop data points covered by a range with a lower start wavelength
+            previous_stop = np.concatenate([[-np.inf], np.maximum.accumulate(stop)[:-1]])
+            keep = wave > previous_stop[range_no]
+        else:  # Drop data points covered by a range with a higher start wavelength
+            next_start = np.concatenate([start[1:], [np.inf]])
+            keep = wave < next_start[range_no]
+        if not np.all(keep):
+            logger.info(f'Dropped {np.count_nonzero(~keep)} overlapping data points.')
+    else:
+        keep = np.ones(len(wave), dtype=bool)
+
+    if method == 'concatenate':  # Ranges are appended as they are
+        return pd.DataFrame(columns)
+
+    order = np.flatnonzero(keep)[np.argsort(wave[keep], kind='stable')]
+
+    if method in ['blend', 'scale']:  # Blended ranges hold the same EQE at shared wavelengths, so keep it once
+        shared = (wave[order][1:] == wave[order][:-1]) & (range_no[order][1:] != range_no[order][:-1])
+        order = order[np.concatenate([[True], ~shared])]
+        if np.any(shared):
+            logger.info(f'Removed {np.count_nonzero(shared)} duplicate data points.')
+
+    return pd.DataFrame({column: values[order] for column, values in columns.items()})
+
+# -----------------------------------------------------------------------------------------------------------
@@ -0,0 +1,410 @@
+import datetime
+import functools
+import threading
+import time
+
+from PyQt5 import QtCore, QtWidgets
+
+from source.utils import get_logger
+
+logger = get_logger()
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Define parameters for the task runner
+
+# NOTE: Set to False to run fits on the GUI thread (i.e. for debugging). The window is blocked until the fits are done.
+use_task_runner = True
+
+# Minimum time between progress updates [s]
+progress_interval = 0.1
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Class to signal a cancelled fit
+
+class FitCancelled(Exception):
+    """Exception raised in a fit task after the fit was cancelled"""
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Class to hold the signals of a task
+
+class TaskSignals(QtCore.QObject):
+    """Class to hold the signals of a task
+    Signals emitted in the worker thread are delivered to the GUI thread.
+    """
+
+    finished = QtCore.pyqtSignal()
+    progress = QtCore.pyqtSignal(int, int, float)  # Done steps, total steps, elapsed time [s]
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Class to run a function in the thread pool
+
+class Task(QtCore.QRunnable):
+    """Class to run a function in the Qt thread pool and store its result or exception
+
+    Parameters
+    ----------
+    function : function, required
+        Function without arguments to run
+    """
+
+    def __init__(self,
+                 function
+                 ):
+
+        QtCore.QRunnable.__init__(self)
+        self.setAutoDelete(False)  # Keep the result after the task is done
+
+        self.function = function
+        self.signals = TaskSignals()
+        self.result = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.result = self.function()
+        except Exception as e:  # Raised again in the GUI thread
+            self.error = e
+        finally:
+            self.signals.finished.emit()
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Class to run fits off the GUI thread
+
+class TaskRunner(QtCore.QObject):
+    """Class to run fits in a worker thread and show their progress in the status bar
+
+    run() starts a function in the Qt thread pool and processes GUI events until it is done, so the window stays
+    responsive and the result is returned to the calling (plotting) code. Fit loops in the function report
+    their progress with track() or step(), which raise FitCancelled after the Cancel button was pressed.
+
+    While a fit method is running, the given widgets are disabled, so that GUI events processed during the fit
+    cannot change its inputs (i.e. load a file, change a temperature or start another fit).
+
+    Parameters
+    ----------
+    statusbar : QStatusBar, required
+        Status bar to show the progress bar, throughput, ETA and Cancel button in
+    widgets : list, optional
+        Widgets and actions to disable while a fit method is running
+    """
+
+    def __init__(self,
+                 statusbar,
+                 widgets=None
+                 ):
+
+        QtCore.QObject.__init__(self)
+
+        self.active = False  # Set while a fit method is running (see fit_task)
+        self.widgets = list(widgets or [])
+        self.label = ''
+        self.done = 0
+        self.total = 0
+        self.start_time = time.perf_counter()
+        self.last_update = 0.0
+
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+
+        self.signals = TaskSignals()
+        self.signals.progress.connect(self.show_Progress)
+
+        self.statusbar = statusbar
+        self.progress_bar = QtWidgets.QProgressBar()
+        self.progress_bar.setMaximumWidth(200)
+        self.progress_label = QtWidgets.QLabel()
+        self.cancel_button = QtWidgets.QPushButton('Cancel')
+        self.cancel_button.clicked.connect(self.cancel)
+
+        for widget in [self.progress_label, self.progress_bar, self.cancel_button]:
+            statusbar.addPermanentWidget(widget)
+            widget.hide()
+
+    def run(self,
+            function,
+            label='Fitting',
+            total=None
+            ):
+        """Function to run a function in a worker thread and return its result
+
+        Parameters
+        ----------
+        function : function, required
+            Function without arguments to run. It must not access GUI objects.
+        label : str, optional
+            Task name shown in the status bar
+        total : int, optional
+            Number of steps of the task. If None, steps are added by track() or add().
+
+        Returns
+        -------
+        result : object
+            Return value of function
+
+        Raises
+        ------
+        FitCancelled
+            If the task was cancelled
+        """
+
+        self.start_Task(label, total)
+
+        try:
+            if not use_task_runner:
+                return function()
+
+            task = Task(function)
+            loop = QtCore.QEventLoop()
+            task.signals.finished.connect(loop.quit)
+            QtCore.QThreadPool.globalInstance().start(task)
+            loop.exec_()  # Process GUI events until the task is done
+
+            if task.error is not None:
+                raise task.error
+            return task.result
+
+        finally:
+            self.finish_Task()
+
+    def map(self,
+            function,
+            iterable,
+            label='Fitting'
+            ):
+        """Function to apply a function to each item in a worker thread
+
+        Parameters
+        ----------
+        function : function, required
+            Function to apply
+        iterable : list, required
+            Items to apply the function to
+        label : str, optional
+            Task name shown in the status bar
+
+        Returns
+        -------
+        results : list
+            List of return values
+        """
+
+        return self.run(lambda: [function(item) for item in self.track(iterable)], label=label)
+
+    def track(self,
+              iterable,
+              total=None
+              ):
+        """Function to iterate over items in a task and report one step per item (replaces tqdm)
+
+        Parameters
+        ----------
+        iterable : list, required
+            Items to iterate over
+        total : int, optional
+            Number of steps added to the task total. Defaults to the number of items.
+            Use 0 if the steps were added before (see add).
+
+        Returns
+        -------
+        items : generator
+            Items of iterable
+        """
+
+        self.add(len(iterable) if total is None else total)
+        for item in iterable:
+            self.check()
+            yield item
+            self.step()
+
+    def add(self,
+            n
+            ):
+        """Function to add steps to the task total
+
+        Parameters
+        ----------
+        n : int, required
+            Number of steps
+
+        Returns
+        -------
+        None
+        """
+
+        with self._lock:
+            self.total += n
+
+    def step(self,
+             n=1
+             ):
+        """Function to report finished steps of the task
+
+        Parameters
+        ----------
+        n : int, optional
+            Number of finished steps
+
+        Returns
+        -------
+        None
+        """
+
+        self.check()
+
+        with self._lock:
+            self.done += n
+            now = time.perf_counter()
+            if now - self.last_update < progress_interval and self.done < self.total:
+                return
+            self.last_update = now
+            done, total = self.done, self.total
+
+        self.signals.progress.emit(done, total, now - self.start_time)
+
+    def check(self):
+        """Function to raise FitCancelled if the task was cancelled"""
+
+        if self._cancelled.is_set():
+            raise FitCancelled()
+
+    def set_Active(self,
+                   active
+                   ):
+        """Function to mark a fit method as running and disable or enable the widgets
+
+        Parameters
+        ----------
+        active : bool, required
+            Boolean value specifying whether a fit method is running
+
+        Returns
+        -------
+        None
+        """
+
+        self.active = active
+        for widget in self.widgets:
+            widget.setEnabled(not active)
+
+    def cancel(self):
+        """Function to cancel the running task at its next step"""
+
+        if self.active and not self._cancelled.is_set():
+            self._cancelled.set()
+            self.cancel_button.setEnabled(False)
+            self.progress_label.setText(f'{self.label}: cancelling ...')
+            logger.info('Cancelling fit ...')
+
+    def start_Task(self,
+                   label,
+                   total
+                   ):
+        """Function to reset the progress and show the progress widgets"""
+
+        with self._lock:
+            self.label = label
+            self.done = 0
+            self.total = total or 0
+            self.start_time = time.perf_counter()
+            self.last_update = 0.0
+
+        self.progress_bar.setRange(0, 0)  # Busy indicator until the first step
+        self.progress_label.setText(f'{label} ...')
+        self.cancel_button.setEnabled(not self._cancelled.is_set())
+        for widget in [self.progress_label, self.progress_bar, self.cancel_button]:
+            widget.show()
+
+    def finish_Task(self):
+        """Function to hide the progress widgets"""
+
+        for widget in [self.progress_label, self.progress_bar, self.cancel_button]:
+            widget.hide()
+
+        if self.done > 0:
+            elapsed = time.perf_counter() - self.start_time
+            self.statusbar.showMessage(f'{self.label}: {self.done} steps in {elapsed:.1f} s', 10000)
+
+    def show_Progress(self,
+                      done,
+                      total,
+                      elapsed
+                      ):
+        """Function to show the progress, throughput and ETA of the task
+
+        Parameters
+        ----------
+        done : int, required
+            Number of finished steps
+        total : int, required
+            Number of steps
+        elapsed : float, required
+            Time since the start of the task [s]
+
+        Returns
+        -------
+        None
+        """
+
+        if self._cancelled.is_set():
+            return
+
+        self.progress_bar.setRange(0, max(total, done))
+        self.progress_bar.setValue(done)
+
+        rate = done / elapsed if elapsed > 0 else 0
+        text = f'{self.label}: {done}/{total} | {rate:.1f} fits/s'
+        if rate > 0 and total > done:
+            text += f' | ETA {datetime.timedelta(seconds=round((total - done) / rate))}'
+        self.progress_label.setText(text)
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to run a fit method as a cancellable task
+
+def fit_task(method):
+    """Decorator to run a MainWindow fit method that uses the task runner
+
+    A fit method is not started while another one is running, and a cancelled fit returns without plotting.
+    The widgets of the task runner are disabled while the fit method is running.
+
+    Parameters
+    ----------
+    method : function, required
+        Fit method (i.e. heatMap, double_fit)
+
+    Returns
+    -------
+    wrapper : function
+        Fit method
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        runner = self.task_runner
+        if runner.active:
+            logger.info('A fit is already running.')
+            return None
+
+        runner.set_Active(True)
+        runner._cancelled.clear()
+        try:
+            return method(self, *args, **kwargs)
+        except FitCancelled:
+            logger.info('Fit cancelled.')
+        finally:
+            runner.set_Active(False)
+
+    return wrapper
+
+# -----------------------------------------------------------------------------------------------------------
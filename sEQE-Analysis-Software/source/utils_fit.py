@@ -1,18 +1,23 @@
 import math
 import os
+import re
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-from lmfit import Model
+from lmfit import Model, __version__ as lmfit_version
 from scipy.interpolate import interp1d
-from scipy.optimize import curve_fit
+from scipy.optimize import curve_fit, least_squares, lsq_linear
 from tkinter import filedialog
 
 from source.compilation import compile_EQE
+from source.fit_cache import fit_cache, hash_Fit, fingerprint_Model
+from source.fit_profile import fit_profiler
 from source.gaussian import calculate_combined_fit, calculate_gaussian_absorption, calculate_gaussian_disorder_absorption
 from source.utils import R_squared
 from source.utils import sep_list
 from source.add_subtract import subtract_Opt
+from source.batch_fit import fit_batch
+from source.bootstrap import use_bootstrap, bootstrap_Fit, bootstrap_Double, format_Bootstrap
 from source.plot import set_up_plot
 
 
@@ -35,6 +40,48 @@ lopt_guess = 0.150
 # Set floating point precision
 precision = 8  # decimal places
 
+# Solve oscillator strengths by linear least squares in guess_fit (variable projection)
+# NOTE: Set to False to fit oscillator strengths numerically with curve_fit / lmfit
+use_varpro = True
+
+# Boundary values used for variable projection fits with bounds (same as the lmfit parameter hints in fit_model)
+# NOTE: Order is [f, l, Ect, sig]
+varpro_bounds = ([0, 0, 0, 0], [0.1, 0.6, 1.6, 0.2])
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to wrap an analytic Jacobian for lmfit.Model
+
+def model_jacobian(gmodel,
+                   jac
+                   ):
+    """Function to wrap an analytic model Jacobian as Dfun for lmfit.Model fits
+
+    Parameters
+    ----------
+    gmodel : lmfit.Model, required
+        Model to fit
+    jac : function, required
+        Jacobian of model function returning an array of shape (len(E), number of parameters)
+        Columns are in the order of the model parameters (gmodel.param_names).
+
+    Returns
+    -------
+    Dfun : function
+        Jacobian of the lmfit residual with respect to the fit parameters
+    """
+
+    # NOTE: lmfit < 1.3.3 defines the residual as model - data, later versions as data - model
+    sign = -1 if tuple(int(n) for n in re.findall(r'\d+', lmfit_version)[:3]) >= (1, 3, 3) else 1
+
+    def Dfun(params, data, weights, **kwargs):
+        derivative = sign * jac(kwargs['E'], *[params[name].value for name in gmodel.param_names])
+        if weights is not None:
+            derivative = derivative * np.asarray(weights)[:, None]
+        return derivative
+
+    return Dfun
+
 # -----------------------------------------------------------------------------------------------------------
 
 # Function to perform curve fit
@@ -45,7 +92,8 @@ def fit_function(function,
                  p0=None,
                  bounds=None,
                  include_disorder=False,
-                 double=False
+                 double=False,
+                 jac=None
                  ):
     """Function to perform curve fit
 
@@ -65,6 +113,8 @@ def fit_function(function,
         Boolean value specifying whether to include CT state disorder
     double : bool, optional
         Boolean value specifying whether to perform double peak fit
+    jac : function, optional
+        Analytic Jacobian of function (i.e. gaussian_jac). If None, derivatives are estimated numerically
 
     Returns
     -------
@@ -78,19 +128,26 @@ def fit_function(function,
         R squared of fit
     """
 
+    fit_profiler.attempt()
+
     if bounds is not None:
-        best_vals, covar = curve_fit(function,
-                                     energy_fit,
-                                     eqe_fit,
-                                     p0=p0,
-                                     bounds=bounds
-                                     )
+        best_vals, covar, infodict = curve_fit(function,
+                                               energy_fit,
+                                               eqe_fit,
+                                               p0=p0,
+                                               bounds=bounds,
+                                               jac=jac,
+                                               full_output=True
+                                               )[:3]
     else:
-        best_vals, covar = curve_fit(function,
-                                     energy_fit,
-                                     eqe_fit,
-                                     p0=p0
-                                     )
+        best_vals, covar, infodict = curve_fit(function,
+                                               energy_fit,
+                                               eqe_fit,
+                                               p0=p0,
+                                               jac=jac,
+                                               full_output=True
+                                               )[:3]
+    fit_profiler.evaluations(infodict.get('nfev'))
     if double:
         if include_disorder:
             y_fit = [function(
@@ -142,7 +199,8 @@ def fit_model(function,
               energy_fit,
               eqe_fit,
               p0=None,
-              include_disorder=False
+              include_disorder=False,
+              jac=None
               ):
     """Function to perform curve fit using lmfit
 
@@ -158,6 +216,8 @@ def fit_model(function,
         List of initial guesses for curve_fit function
     include_disorder : bool, optional
         Boolean value specifying whether to include CT state disorder
+    jac : function, optional
+        Analytic Jacobian of function (i.e. gaussian_disorder_jac). If None, derivatives are estimated numerically
 
     Returns
     -------
@@ -187,12 +247,20 @@ def fit_model(function,
     if include_disorder:
         gmodel.set_param_hint('sig', min=0, max=0.2)
 
+    fit_profiler.attempt()
+
+    fit_kws = None
+    if jac is not None:
+        fit_kws = {'Dfun': model_jacobian(gmodel, jac)}
+
+    if include_disorder:
         result = gmodel.fit(eqe_fit,
                             f=p0[0],
                             l=p0[1],
                             Ect=p0[2],
                             sig=p0[3],
-                            E=energy_fit
+                            E=energy_fit,
+                            fit_kws=fit_kws
                             )
 
         f = float(result.params['f'].value)
@@ -217,7 +285,8 @@ def fit_model(function,
                             f=p0[0],
                             l=p0[1],
                             Ect=p0[2],
-                            E=energy_fit
+                            E=energy_fit,
+                            fit_kws=fit_kws
                             )
 
         f = float(result.params['f'].value)
@@ -236,6 +305,8 @@ def fit_model(function,
                             Ect=Ect
                             )
 
+    fit_profiler.evaluations(result.nfev)
+
     r_squared = R_squared(eqe_fit, y_fit)
 
     return best_vals, covar, y_fit, r_squared
@@ -245,13 +316,15 @@ def fit_model(function,
 
 # Function to perform curve fit using lmfit.Model
 
+@fit_profiler.profile
 def fit_model_double(function,
                      energy_fit,
                      eqe_fit,
                      bound_dict,
                      p0=None,
                      include_disorder=False,
-                     print_report=False
+                     print_report=False,
+                     jac=None
                      ):
     """Function to perform double peak curve fit using lmfit.Model
 
@@ -279,6 +352,8 @@ def fit_model_double(function,
         Boolean value specifying whether to include CT state disorder
     print_report : bool, optional
         Boolean value specifying whether to print fit report
+    jac : function, optional
+        Analytic Jacobian of function (i.e. gaussian_double_sim_jac). If None, derivatives are estimated numerically
     
     Returns
     -------
@@ -298,6 +373,20 @@ def fit_model_double(function,
         else:
             p0 = [1, 1, 1, 1, 1, 1]
 
+    if len(energy_fit) != 0:
+        fit_profiler.window(min(energy_fit), max(energy_fit))
+
+    # Look up fit in the on-disk fit cache
+    cache_key = None
+    if fit_cache.enabled:
+        fingerprint = fingerprint_Model(function, energy_fit, p0)
+        if fingerprint is not None:
+            cache_key = hash_Fit('fit_model_double', energy_fit, eqe_fit, fingerprint, bound_dict, p0, include_disorder)
+            result = fit_cache.get(cache_key)
+            if result is not None:
+                fit_profiler.cached()
+                return result
+
     gmodel = Model(function)
 
     gmodel.set_param_hint('ECT', min=bound_dict['start_ECT'], max=bound_dict['stop_ECT'])
@@ -310,8 +399,16 @@ def fit_model_double(function,
     if include_disorder:
         gmodel.set_param_hint('sig', min=bound_dict['start_sig'], max=bound_dict['stop_sig'])
 
+    fit_profiler.attempt()
+
+    fit_kws = None
+    if jac is not None:
+        fit_kws = {'Dfun': model_jacobian(gmodel, jac)}
+
+    if include_disorder:
         result = gmodel.fit(eqe_fit,
                             E=energy_fit,
+                            fit_kws=fit_kws,
                             fCT=p0[0],
                             lCT=p0[1],
                             ECT=p0[2],
@@ -355,7 +452,8 @@ def fit_model_double(function,
                             ECT=p0[2],
                             fopt=p0[3],
                             lopt=p0[4],
-                            Eopt=p0[5]
+                            Eopt=p0[5],
+                            fit_kws=fit_kws
                             )
 
         if print_report:
@@ -383,15 +481,231 @@ def fit_model_double(function,
                             Eopt=Eopt
                             )
 
+    fit_profiler.evaluations(result.nfev)
+    fit_profiler.success(0)
+
     r_squared = R_squared(eqe_fit, y_fit)
 
+    if cache_key is not None and r_squared > 0:  # Failed fits are not stored, so they are repeated in a later session
+        fit_cache.put(cache_key, (best_vals, covar, y_fit, r_squared))
+
     return best_vals, covar, y_fit, r_squared
 
 
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to perform variable projection fit
+
+def fit_varpro(function,
+               energy_fit,
+               eqe_fit,
+               p0=None,
+               linear=(0,),
+               bounds=None,
+               jac=None
+               ):
+    """Function to perform variable projection fit
+
+    The oscillator strengths enter all Marcus models linearly. For every set of nonlinear parameters
+    (i.e. reorganization energy, peak energy and disorder) they are solved by linear least squares,
+    so that the nonlinear optimizer only searches the remaining parameters.
+
+    Parameters
+    ----------
+    function : function, required
+        Function to perform fit with (i.e. gaussian, gaussian_disorder_double_sim etc.)
+    energy_fit : list or array, required
+        Energy values to fit against
+    eqe_fit : list or array, required
+        EQE values to fit again
+    p0 : list, optional
+        List of initial guesses in the order of the function parameters
+        Initial guesses of the linear parameters are ignored
+    linear : tuple, optional
+        Indices of the parameters that enter the function linearly (i.e. (0,) or (0, 3) for simultaneous double fits)
+    bounds : tuple, optional
+        Tuple of lower and upper bound lists in the order of the function parameters
+        If None, the linear parameters are constrained to be positive and the nonlinear parameters are unbounded
+    jac : function, optional
+        Analytic Jacobian of function (i.e. gaussian_jac). If None, derivatives are estimated numerically
+
+    Returns
+    -------
+    best_vals : list
+        List of best fit parameters
+    covar : array
+        Covariance matrix of fit
+    y_fit : list
+        Calculated EQE values of fit
+    r_squared : float
+        R squared of fit
+    """
+
+    energy_fit = np.asarray(energy_fit, dtype=float)
+    eqe_fit = np.asarray(eqe_fit, dtype=float)
+
+    n_params = len(p0)
+    linear = list(linear)
+    nonlinear = [n for n in range(n_params) if n not in linear]
+
+    if bounds is None:
+        lower = np.full(n_params, -np.inf)
+        upper = np.full(n_params, np.inf)
+        lower[linear] = 0
+    else:
+        lower = np.asarray(bounds[0], dtype=float)[:n_params]
+        upper = np.asarray(bounds[1], dtype=float)[:n_params]
+
+    # Function to assemble the full parameter list
+    def full_params(theta, amplitudes):
+        params = np.empty(n_params)
+        params[nonlinear] = theta
+        params[linear] = amplitudes
+        return params
+
+    # Function to calculate the basis functions (model with unit amplitude of one linear parameter)
+    def basis(theta):
+        columns = []
+        for n in linear:
+            amplitudes = np.zeros(len(linear))
+            amplitudes[linear.index(n)] = 1
+            columns.append(function(energy_fit, *full_params(theta, amplitudes)))
+        return np.column_stack(columns)
+
+    # Function to solve the linear parameters
+    def solve_linear(B):
+        amplitudes = np.linalg.lstsq(B, eqe_fit, rcond=None)[0]
+        if np.any(amplitudes < lower[linear]) or np.any(amplitudes > upper[linear]):
+            amplitudes = lsq_linear(B, eqe_fit, bounds=(lower[linear], upper[linear])).x
+        return amplitudes
+
+    def residual(theta):
+        B = basis(theta)
+        return B @ solve_linear(B) - eqe_fit
+
+    # NOTE: Kaufman approximation of the variable projection Jacobian
+    def residual_jac(theta):
+        B = basis(theta)
+        amplitudes = solve_linear(B)
+        J = np.asarray(jac(energy_fit, *full_params(theta, amplitudes)), dtype=float)[:, nonlinear]
+        free = (amplitudes > lower[linear]) & (amplitudes < upper[linear])
+        if np.any(free):
+            Q = np.linalg.qr(B[:, free])[0]
+            J = J - Q @ (Q.T @ J)
+        return J
+
+    theta0 = np.clip(np.asarray(p0, dtype=float)[nonlinear], lower[nonlinear], upper[nonlinear])
+    theta_bounds = (lower[nonlinear], upper[nonlinear])
+    unbounded = np.all(np.isinf(theta_bounds[0])) and np.all(np.isinf(theta_bounds[1]))
+
+    fit_profiler.attempt()
+
+    result = least_squares(residual,
+                           theta0,
+                           jac=residual_jac if jac is not None else '2-point',
+                           bounds=theta_bounds,
+                           method='lm' if unbounded and len(eqe_fit) >= len(nonlinear) else 'trf'
+                           )
+
+    fit_profiler.evaluations(result.nfev)
+
+    B = basis(result.x)
+    best_vals = full_params(result.x, solve_linear(B))
+    y_fit = function(energy_fit, *best_vals)
+
+    # Calculate covariance of all parameters (consistent with curve_fit)
+    if jac is not None:
+        J = np.asarray(jac(energy_fit, *best_vals), dtype=float)
+    else:
+        J = np.empty((len(energy_fit), n_params))
+        for n in range(n_params):
+            step = np.sqrt(np.finfo(float).eps) * max(abs(best_vals[n]), 1)
+            shifted = best_vals.copy()
+            shifted[n] += step
+            J[:, n] = (function(energy_fit, *shifted) - y_fit) / step
+    dof = max(len(eqe_fit) - n_params, 1)
+    covar = np.linalg.pinv(J.T @ J) * np.sum((y_fit - eqe_fit) ** 2) / dof
+
+    r_squared = R_squared(eqe_fit, y_fit)
+
+    return list(best_vals), covar, list(y_fit), r_squared
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to calculate closed-form initial guess for Marcus fits
+
+def guess_Marcus(energy_fit,
+                 eqe_fit,
+                 T,
+                 sig=None
+                 ):
+    """Function to calculate a closed-form initial guess for single peak Marcus fits
+
+    ln(E * EQE) of the Marcus gaussian is quadratic in E:
+    ln(E * EQE) = ln(f / sqrt(4 pi l k T)) - (E - Ect - l)^2 / (4 l k T)
+    A weighted second order polynomial fit of the data therefore yields f, l and Ect.
+    The residuals are weighted by the EQE to emphasize the peak and suppress noise in the tail.
+
+    Parameters
+    ----------
+    energy_fit : list or array, required
+        Energy values to fit against
+    eqe_fit : list or array, required
+        EQE values to fit again
+    T : float, required
+        Temperature [K]
+    sig : float, optional
+        Disorder parameter guess [eV]
+        If not None, the peak width is shared between reorganization energy and disorder (2 l k T + sig^2)
+
+    Returns
+    -------
+    p0 : list
+        List of initial guesses [f, l, Ect] or [f, l, Ect, sig]
+        Returns None if the data are not peak shaped
+    """
+
+    energy_fit = np.asarray(energy_fit, dtype=float)
+    eqe_fit = np.asarray(eqe_fit, dtype=float)
+
+    mask = (eqe_fit > 0) & np.isfinite(eqe_fit)
+    if np.count_nonzero(mask) < 3:
+        return None
+
+    energy = energy_fit[mask]
+    eqe = eqe_fit[mask]
+
+    try:
+        a2, a1, a0 = np.polyfit(energy, np.log(energy * eqe), 2, w=eqe / np.max(eqe))
+    except (np.linalg.LinAlgError, ValueError):
+        return None
+
+    if not (a2 < 0 and np.all(np.isfinite([a2, a1, a0]))):  # Data must be curved downwards
+        return None
+
+    V = float(-1 / (2 * a2))  # Peak variance (2 l k T + sig^2)
+    peak = float(-a1 / (2 * a2))  # Ect + l
+    try:
+        f = math.exp(a0 - a1 ** 2 / (4 * a2)) * math.sqrt(2 * math.pi * V)
+    except OverflowError:  # Nearly flat data
+        return None
+
+    if sig is None:
+        l = V / (2 * k * T)
+        return [f, l, peak - l]
+    else:
+        if sig ** 2 >= V:  # Split width equally if disorder guess is too large
+            sig = math.sqrt(V / 2)
+        l = (V - sig ** 2) / (2 * k * T)
+        return [f, l, peak - l, sig]
+
+
 # -----------------------------------------------------------------------------------------------------------
 
 # Function to perform fit with guess range
 
+@fit_profiler.profile
 def guess_fit(eqe,
               startE,
               stopE,
@@ -401,10 +715,15 @@ def guess_fit(eqe,
               guessRange_sig=None,
               include_disorder=False,
               simultaneous_double=False,
-              bounds=None
+              bounds=None,
+              jac=None,
+              varpro=None,
+              T=None
               ):
     """Function to loop through guesses and determine best fit using lmfit-based fit_model function
     This function is used for both standard / disorder single and simultaneous double peak fitting.
+    Fit results are stored in the on-disk fit cache (see source.fit_cache).
+    Attempts, function evaluations, timings and failure reasons are recorded by fit_profiler (see source.fit_profile).
 
     Parameters
     ----------
@@ -431,6 +750,14 @@ def guess_fit(eqe,
     bounds : dict, optional
         Dictionary of boundary values for simultaneous double fitting
         Escalates the use of lmfit.Model for single peak fitting
+    jac : function, optional
+        Analytic Jacobian of function. If None, derivatives are estimated numerically
+    varpro : bool, optional
+        Boolean value specifying whether to solve oscillator strengths by variable projection (fit_varpro)
+        If None, use_varpro is used
+    T : float, optional
+        Temperature [K] of Marcus function
+        If not None, a closed-form guess (guess_Marcus) is attempted first for single peak fits
     
     Returns
     -------
@@ -439,9 +766,14 @@ def guess_fit(eqe,
     r_squared : float
         R squared of fit
     """
+
+    if varpro is None:
+        varpro = use_varpro
     
     if len(eqe) != 0:
 
+        fit_profiler.window(startE, stopE)
+
         # Compile EQE to fit
         wave_fit, energy_fit, eqe_fit, log_eqe_fit = compile_EQE(eqe, startE, stopE, 1) # precision 8
 
@@ -490,22 +822,67 @@ def guess_fit(eqe,
                                     round(E_guess, 3)
                                     ])
 
+        # Closed-form initial guess for single peak Marcus fitting. The guess range is used if it fails.
+        if T is not None and not simultaneous_double:
+            p0_closed = guess_Marcus(energy_fit=energy_fit,
+                                     eqe_fit=eqe_fit,
+                                     T=T,
+                                     sig=guessRange_sig[0] if include_disorder else None
+                                     )
+            if p0_closed is not None:
+                p0 = p0_closed  # First attempt of fit_function / fit_model
+                if varpro:  # fit_varpro loops through p0_list directly
+                    p0_list.insert(0, p0_closed)
+
+        # Look up fit in the on-disk fit cache
+        cache_key = None
+        if fit_cache.enabled and len(p0_list) != 0:
+            fingerprint = fingerprint_Model(function, energy_fit, p0_list[-1])
+            if fingerprint is not None:
+                cache_key = hash_Fit('guess_fit', energy_fit, eqe_fit, fingerprint, guessRange, guessRange_opt,
+                                     guessRange_sig, include_disorder, simultaneous_double, bounds, varpro, T)
+                result = fit_cache.get(cache_key)
+                if result is not None:
+                    fit_profiler.cached()
+                    return result
+
+        # Function to store successful fit result in the fit cache
+        def store(*result):
+            if cache_key is not None:
+                fit_cache.put(cache_key, result)
+            return result
+
         # Simultaneous double peak fitting
         if simultaneous_double:
-            for p0 in p0_list: # Start with initial guesses, rather than p0 = None
+            for index, p0 in enumerate(p0_list): # Start with initial guesses, rather than p0 = None
                 try:
-                    best_vals, covar, y_fit, r_squared = fit_model_double(function=function,
-                                                                          energy_fit=energy_fit,
-                                                                          eqe_fit=eqe_fit,
-                                                                          bound_dict=bounds,
-                                                                          p0=p0,
-                                                                          include_disorder=include_disorder
-                                                                          )
+                    if varpro:
+                        names = ['fCT', 'lCT', 'ECT', 'fopt', 'lopt', 'Eopt', 'sig'][:len(p0)]
+                        best_vals, covar, y_fit, r_squared = fit_varpro(function=function,
+                                                                        energy_fit=energy_fit,
+                                                                        eqe_fit=eqe_fit,
+                                                                        p0=p0,
+                                                                        linear=(0, 3),
+                                                                        bounds=([bounds['start_' + n] for n in names],
+                                                                                [bounds['stop_' + n] for n in names]),
+                                                                        jac=jac
+                                                                        )
+                    else:
+                        best_vals, covar, y_fit, r_squared = fit_model_double(function=function,
+                                                                              energy_fit=energy_fit,
+                                                                              eqe_fit=eqe_fit,
+                                                                              bound_dict=bounds,
+                                                                              p0=p0,
+                                                                              include_disorder=include_disorder,
+                                                                              jac=jac
+                                                                              )
                     if r_squared > 0:
-                        return best_vals, covar, p0, r_squared
+                        fit_profiler.success(index)
+                        return store(best_vals, covar, p0, r_squared)
                     else:
-                        raise ArithmeticError
-                except:
+                        raise ArithmeticError('R squared <= 0')
+                except Exception as e:
+                    fit_profiler.failure(e)
                     if p0 == p0_list[-1]:
                         if include_disorder:
                             best_vals = [0, 0, 0, 0, 0, 0, 0]
@@ -516,29 +893,43 @@ def guess_fit(eqe,
                         r_squared = 0
         # Single peak fitting
         else:
-            for p0_guess in p0_list:
+            for index, p0_guess in enumerate(p0_list):
                 try:
                     # NOTE: Replace permanently with fit_model?
                     # NOTE: fit_function works better with single peak Marcus fitting
-                    if bounds is None:
+                    if varpro:  # fit_varpro needs initial values of the nonlinear parameters
+                        p0 = p0_guess
+                        best_vals, covar, y_fit, r_squared = fit_varpro(function=function,
+                                                                        energy_fit=energy_fit,
+                                                                        eqe_fit=eqe_fit,
+                                                                        p0=p0,
+                                                                        bounds=varpro_bounds if bounds is not None
+                                                                        else ([0, 0, -np.inf, -np.inf], [np.inf] * 4),  # l > 0
+                                                                        jac=jac
+                                                                        )
+                    elif bounds is None:
                         best_vals, covar, y_fit, r_squared = fit_function(function=function,
                                                                           energy_fit=energy_fit,
                                                                           eqe_fit=eqe_fit,
                                                                           p0=p0,
-                                                                          include_disorder=include_disorder
+                                                                          include_disorder=include_disorder,
+                                                                          jac=jac
                                                                           )
                     else:
                         best_vals, covar, y_fit, r_squared = fit_model(function=function,
                                                                        energy_fit=energy_fit,
                                                                        eqe_fit=eqe_fit,
                                                                        p0=p0,
-                                                                       include_disorder=include_disorder
+                                                                       include_disorder=include_disorder,
+                                                                       jac=jac
                                                                        )
                     if r_squared > 0:
-                        return best_vals, covar, p0, r_squared
+                        fit_profiler.success(index)
+                        return store(best_vals, covar, p0, r_squared)
                     else:
-                        raise ArithmeticError
+                        raise ArithmeticError('R squared <= 0')
                 except Exception as e:
+                    fit_profiler.failure(e)
                     print(e)
                     p0 = p0_guess
                     if p0_guess == p0_list[-1]:
@@ -550,7 +941,7 @@ def guess_fit(eqe,
                             covar = np.zeros((3, 3))
                         r_squared = 0
 
-        return best_vals, covar, p0, r_squared
+        return best_vals, covar, p0, r_squared  # Failed fits are not stored, so they are repeated in a later session
 
 # -----------------------------------------------------------------------------------------------------------
 
@@ -565,7 +956,9 @@ def calculate_guess_fit(x,
                         guessRange_sig=None,
                         include_disorder=False,
                         simultaneous_double=False,
-                        bounds=None
+                        bounds=None,
+                        jac=None,
+                        T=None
                         ):
     """Mappable wrapper function to loop through initial guesses
     This function is used for standard / disorder single and simultaneous double peak fits.
@@ -590,6 +983,10 @@ def calculate_guess_fit(x,
         Boolean value specifying whether to include peak disorder
     simultaneous_double : bool, optional
         Boolean value specifying whether to perform simultaneous double peak fitting
+    jac : function, optional
+        Analytic Jacobian of function. If None, derivatives are estimated numerically
+    T : float, optional
+        Temperature [K] of Marcus function, used for the closed-form initial guess
     
     Returns
     -------
@@ -612,12 +1009,107 @@ def calculate_guess_fit(x,
                                                 guessRange_sig=guessRange_sig,
                                                 include_disorder=include_disorder,
                                                 simultaneous_double=simultaneous_double,
-                                                bounds=bounds
+                                                bounds=bounds,
+                                                jac=jac,
+                                                T=T
                                                 )
 
     return [best_vals, covar, r_squared, df['Start'][x], df['Stop'][x]]
 
 
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to fit many single peak fit ranges
+
+def fit_Windows(eqe,
+                windows,
+                function,
+                guessRange,
+                T=None,
+                jac=None,
+                guessRange_sig=None,
+                include_disorder=False,
+                check=None
+                ):
+    """Function to fit single peak fits of many fit ranges
+    All fit ranges are fitted at once with fit_batch and fit ranges where the batched fit fails
+    are fitted individually with guess_fit. This function is used by heatMap and double_fit.
+
+    Parameters
+    ----------
+    eqe : Spectrum or dataFrame, required
+        EQE data including columns ['Energy', 'EQE']
+    windows : list, required
+        List of (start energy, stop energy) tuples [eV]
+    function : function, required
+        Function for individual fits (i.e. gaussian or gaussian_disorder at temperature T)
+    guessRange : list, required
+        Peak energy initial values of individual fits
+    T : float, optional
+        Temperature [K] of Marcus function
+        If None (i.e. for MLJ functions), all fit ranges are fitted individually without a closed-form guess
+    jac : function, optional
+        Analytic Jacobian of function. If None, derivatives are estimated numerically
+    guessRange_sig : list, optional
+        Disorder parameter initial values. The first value is used as guess of the batched fits.
+    include_disorder : bool, optional
+        Boolean value specifying whether to include peak disorder
+    check : function, optional
+        Function called before each individual fit (i.e. to cancel a running fit)
+
+    Returns
+    -------
+    best_vals : list
+        List of best fit parameters of each fit range
+    covar : list
+        List of covariance matrices of each fit range
+    r_squared : array
+        R squared of each fit. Failed fits are set to 0.
+    """
+
+    batch_R2 = np.zeros(len(windows))
+    if T is not None:  # Fit all fit ranges at once
+        batch_vals, batch_covar, batch_R2 = fit_batch(eqe=eqe,
+                                                      windows=windows,
+                                                      T=T,
+                                                      include_disorder=include_disorder,
+                                                      sig=guessRange_sig[0] if include_disorder else None,
+                                                      bounds=varpro_bounds if include_disorder else None
+                                                      )
+
+    best_vals = []
+    covar = []
+    r_squared = np.zeros(len(windows))
+
+    for n, (start, stop) in enumerate(windows):
+        if batch_R2[n] > 0:
+            best_vals.append(list(batch_vals[n]))
+            covar.append(batch_covar[n])
+            r_squared[n] = batch_R2[n]
+            continue
+
+        if check is not None:
+            check()  # Individual fits can be slow
+
+        # Fall back to individual fit
+        vals, cov, p0, R2 = guess_fit(eqe=eqe,
+                                      startE=start,
+                                      stopE=stop,
+                                      function=function,
+                                      jac=jac,
+                                      T=T,
+                                      guessRange=guessRange,
+                                      guessRange_sig=guessRange_sig,
+                                      include_disorder=include_disorder,
+                                      bounds=True if include_disorder else None  # lmfit model / fit function
+                                      )
+        best_vals.append(list(vals))
+        covar.append(cov)
+        r_squared[n] = R2
+
+    return best_vals, covar, r_squared
+
+
 # -----------------------------------------------------------------------------------------------------------
 
 # Mappable function to determine individual / combined fits
@@ -783,15 +1275,18 @@ def find_best_fit(df_both,
                   simultaneous_double=False,
                   ext_factor=1.2,
                   save_fit=False,
-                  save_fit_file=None
+                  save_fit_file=None,
+                  index=None,
+                  bias=False,
+                  tolerance=0
                   ):
     """Function to determine the best fit for separate double peak fitting
 
     Parameters
     ----------
-    df_both : dataFrame, required
-        DataFrame with results of separate double peak fitting
-    eqe : dataFrame, required
+    df_both : FitResults, required
+        Stored results of separate or simultaneous double peak fitting
+    eqe : dataFrame or Spectrum, required
         Input EQE data
     T : float, required
         Temperature [K]
@@ -809,11 +1304,18 @@ def find_best_fit(df_both,
         Boolean value specifying whether to save fits
     save_fit_file : str, optional
         Directory or folder name to save data to
+    index : int, optional
+        Index of stored fit to show (e.g. from df_both.best())
+        If None, the stored fit with the highest rank is shown and excluded from the next search
+    bias : bool, optional
+        Boolean value specifying whether bootstrap fits above the data are discarded (as in the fit ranking)
+    tolerance : float, optional
+        Tolerance (mean percent) allowed for bootstrap fits above the data
 
     Returns
     -------
-    df_copy : dataFrame
-        Copy of dataFrame summarizing Optical (S1) and CT state fits
+    df_both : FitResults
+        Stored results
 
     """
 
@@ -822,7 +1324,13 @@ def find_best_fit(df_both,
         # self.logger.info('Determining Best Fit ...')
 
         # Determine best fit
-        max_index = df_both[df_both['Total_R2'] == max(df_both['Total_R2'])].index.values[0]
+        if index is None:
+            max_index = df_both.best(1)[0]
+        else:
+            max_index = index
+
+        # Regenerate fit curves of best fit only
+        fit_dict = df_both.curves(max_index, eqe)
 
         if simultaneous_double: # Adjusts some of the print statements
             wave_plot, energy_plot, eqe_plot, log_eqe_plot = compile_EQE(eqe,
@@ -841,22 +1349,22 @@ def find_best_fit(df_both,
             print('Fit Range (eV): ', df_both['Start'][max_index], ' - ', df_both['Stop'][max_index])
             print('-' * 35)
             print('f_Opt (eV^2) : ', format(df_both['Fit_Opt'][max_index][0], '.6f'),
-                  '+/-', format(math.sqrt(abs(df_both['Covar'][max_index][3, 3])), '.6f'))
+                  '+/-', format(df_both['SD_Opt'][max_index][0], '.6f'))
             print('l_Opt (eV) : ', format(df_both['Fit_Opt'][max_index][1], '.6f'),
-                  '+/-', format(math.sqrt(abs(df_both['Covar'][max_index][4, 4])), '.6f'))
+                  '+/-', format(df_both['SD_Opt'][max_index][1], '.6f'))
             print('E_Opt (eV) : ', format(df_both['Fit_Opt'][max_index][2], '.6f'),
-                  '+/-', format(math.sqrt(abs(df_both['Covar'][max_index][5, 5])), '.6f'))
+                  '+/-', format(df_both['SD_Opt'][max_index][2], '.6f'))
             print('-' * 35)
             print('f_CT (eV^2) : ', format(df_both['Fit_CT'][max_index][0], '.6f'),
-                  '+/-', format(math.sqrt(abs(df_both['Covar'][max_index][0, 0])), '.6f'))
+                  '+/-', format(df_both['SD_CT'][max_index][0], '.6f'))
             print('l_CT (eV) : ', format(df_both['Fit_CT'][max_index][1], '.6f'),
-                  '+/-', format(math.sqrt(abs(df_both['Covar'][max_index][1, 1])), '.6f'))
+                  '+/-', format(df_both['SD_CT'][max_index][1], '.6f'))
             print('E_CT (eV) : ', format(df_both['Fit_CT'][max_index][2], '.6f'),
-                  '+/-', format(math.sqrt(abs(df_both['Covar'][max_index][2, 2])), '.6f'))
+                  '+/-', format(df_both['SD_CT'][max_index][2], '.6f'))
 
             if include_disorder:
                 print('Sigma (eV) : ', format(df_both['Fit_CT'][max_index][3], '.6f'),
-                      '+/-', format(math.sqrt(abs(df_both['Covar'][max_index][6, 6])), '.6f'))
+                      '+/-', format(df_both['SD_CT'][max_index][3], '.6f'))
                 W = df_both['Fit_CT'][max_index][1] * T + (df_both['Fit_CT'][max_index][3] ** 2) / (2 * k)
                 print('Gaussian Variance [W] (eV K) : ', format(W, '.2f'))
 
@@ -879,42 +1387,75 @@ def find_best_fit(df_both,
             print('-' * 35)
             print('Opt Fit Range (eV): ', df_both['Start_Opt'][max_index], ' - ', df_both['Stop_Opt'][max_index])
             print('f_Opt (eV^2) : ', format(df_both['Fit_Opt'][max_index][0], '.6f'),
-                  '+/-', format(math.sqrt(abs(df_both['Covar_Opt'][max_index][0, 0])), '.6f'))
+                  '+/-', format(df_both['SD_Opt'][max_index][0], '.6f'))
             print('l_Opt (eV) : ', format(df_both['Fit_Opt'][max_index][1], '.6f'),
-                  '+/-', format(math.sqrt(abs(df_both['Covar_Opt'][max_index][1, 1])), '.6f'))
+                  '+/-', format(df_both['SD_Opt'][max_index][1], '.6f'))
             print('E_Opt (eV) : ', format(df_both['Fit_Opt'][max_index][2], '.6f'),
-                  '+/-', format(math.sqrt(abs(df_both['Covar_Opt'][max_index][2, 2])), '.6f'))
+                  '+/-', format(df_both['SD_Opt'][max_index][2], '.6f'))
             print('-' * 35)
             print('CT Fit Range (eV): ', df_both['Start_CT'][max_index], ' - ', df_both['Stop_CT'][max_index])
             print('f_CT (eV^2) : ', format(df_both['Fit_CT'][max_index][0], '.6f'),
-                  '+/-', format(math.sqrt(abs(df_both['Covar_CT'][max_index][0, 0])), '.6f'))
+                  '+/-', format(df_both['SD_CT'][max_index][0], '.6f'))
             print('l_CT (eV) : ', format(df_both['Fit_CT'][max_index][1], '.6f'),
-                  '+/-', format(math.sqrt(abs(df_both['Covar_CT'][max_index][1, 1])), '.6f'))
+                  '+/-', format(df_both['SD_CT'][max_index][1], '.6f'))
             print('E_CT (eV) : ', format(df_both['Fit_CT'][max_index][2], '.6f'),
-                  '+/-', format(math.sqrt(abs(df_both['Covar_CT'][max_index][2, 2])), '.6f'))
+                  '+/-', format(df_both['SD_CT'][max_index][2], '.6f'))
 
             if include_disorder:
                 print('Sigma (eV) : ', format(df_both['Fit_CT'][max_index][3], '.6f'),
-                      '+/-', format(math.sqrt(abs(df_both['Covar_CT'][max_index][3, 3])), '.6f'))
+                      '+/-', format(df_both['SD_CT'][max_index][3], '.6f'))
                 W = df_both['Fit_CT'][max_index][1] * T + (df_both['Fit_CT'][max_index][3] ** 2) / (2 * k)
                 print('Gaussian Variance [W] (eV K) : ', format(W, '.2f'))
 
             # print('Temperature [T] (K) : ', T)
             # print('-' * 80)
 
+        # Estimate bootstrap confidence intervals of best fit
+        # NOTE: Only Marcus fits are resampled. MLJ fits keep their covariance based uncertainties.
+        if use_bootstrap and df_both.S is None:
+            if simultaneous_double:
+                bootstrap_df = bootstrap_Fit(eqe=eqe,
+                                             startE=df_both['Start'][max_index],
+                                             stopE=df_both['Stop'][max_index],
+                                             best_vals=list(df_both['Fit_CT'][max_index][:3])
+                                                       + list(df_both['Fit_Opt'][max_index])
+                                                       + list(df_both['Fit_CT'][max_index][3:]),
+                                             T=T,
+                                             include_disorder=include_disorder,
+                                             bias=bias,
+                                             tolerance=tolerance,
+                                             range=df_both.range
+                                             )
+            else:
+                bootstrap_df = bootstrap_Double(eqe=eqe,
+                                                start_Opt=df_both['Start_Opt'][max_index],
+                                                stop_Opt=df_both['Stop_Opt'][max_index],
+                                                start_CT=df_both['Start_CT'][max_index],
+                                                stop_CT=df_both['Stop_CT'][max_index],
+                                                best_vals_Opt=df_both['Fit_Opt'][max_index],
+                                                best_vals_CT=df_both['Fit_CT'][max_index],
+                                                T=T,
+                                                include_disorder=include_disorder,
+                                                bias=bias,
+                                                tolerance=tolerance,
+                                                range=df_both.range
+                                                )
+            print('-' * 35)
+            print(format_Bootstrap(bootstrap_df))
+
         # Save fit data
         if save_fit:
             opt_file = pd.DataFrame()
-            opt_file['Energy'] = df_both['Energy'][max_index]
-            opt_file['Signal'] = df_both['Opt_Fit'][max_index]
+            opt_file['Energy'] = fit_dict['Energy']
+            opt_file['Signal'] = fit_dict['Opt_Fit']
             opt_file['Temperature'] = T
             opt_file['Oscillator Strength (eV**2)'] = df_both['Fit_Opt'][max_index][0]
             opt_file['Reorganization Energy (eV)'] = df_both['Fit_Opt'][max_index][1]
             opt_file['Optical Peak Energy (eV)'] = df_both['Fit_Opt'][max_index][2]
 
             CT_file = pd.DataFrame()
-            CT_file['Energy'] = df_both['Energy'][max_index]
-            CT_file['Signal'] = df_both['CT_Fit'][max_index]
+            CT_file['Energy'] = fit_dict['Energy']
+            CT_file['Signal'] = fit_dict['CT_Fit']
             CT_file['Temperature'] = T
             CT_file['Oscillator Strength (eV**2)'] = df_both['Fit_CT'][max_index][0]
             CT_file['Reorganization Energy (eV)'] = df_both['Fit_CT'][max_index][1]
@@ -948,14 +1489,14 @@ def find_best_fit(df_both,
                         linestyle='dotted',
                         label='Optical Peak Fit'
                         )
-        axDouble_1.plot(df_both['Energy'][max_index],
-                        df_both['CT_Fit'][max_index],
+        axDouble_1.plot(fit_dict['Energy'],
+                        fit_dict['CT_Fit'],
                         linewidth=2,
                         linestyle='--',
                         label='CT State Fit'
                         )
-        axDouble_1.plot(df_both['Energy'][max_index],
-                        df_both['Total_Fit'][max_index],
+        axDouble_1.plot(fit_dict['Energy'],
+                        fit_dict['Combined_Fit'],
                         linewidth=2,
                         linestyle='dashdot',
                         label='Total Fit'
@@ -977,14 +1518,14 @@ def find_best_fit(df_both,
                         linestyle='--',
                         label='Optical Peak Fit'
                         )
-        axDouble_2.plot(df_both['Energy'][max_index],
-                        df_both['CT_Fit'][max_index],
+        axDouble_2.plot(fit_dict['Energy'],
+                        fit_dict['CT_Fit'],
                         linewidth=2,
                         linestyle='--',
                         label='CT State Fit'
                         )
-        axDouble_2.plot(df_both['Energy'][max_index],
-                        df_both['Total_Fit'][max_index],
+        axDouble_2.plot(fit_dict['Energy'],
+                        fit_dict['Combined_Fit'],
                         linewidth=2,
                         linestyle='dashdot',
                         label='Total Fit'
@@ -1003,9 +1544,9 @@ def find_best_fit(df_both,
                     plt.savefig((f'{save_fit_filename}_Fit_Range{n_fit}.png'))
 
 
-        df_copy = df_both.copy()
-        df_copy['Total_R2'][max_index] = -10000
+        if index is None:
+            df_both[df_both.rank][max_index] = -10000  # Exclude best fit from the next search
 
-    return df_copy
+    return df_both
 
 # -----------------------------------------------------------------------------------------------------------
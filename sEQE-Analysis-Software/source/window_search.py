@@ -0,0 +1,258 @@
+import numpy as np
+from scipy.linalg import cho_factor, cho_solve, solve_triangular
+from scipy.spatial.distance import cdist
+from scipy.stats import norm
+from tqdm import tqdm
+
+from source.utils import get_logger
+
+logger = get_logger()
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Define parameters for the surrogate model search over fit ranges
+
+# NOTE: Set to True to fit a budget of fit range combinations proposed by a surrogate model
+#       instead of all combinations in double_fit and sim_double_fit
+use_window_search = False
+
+# Number of fit range combinations to evaluate
+search_budget = 200
+
+# Number of random fit range combinations evaluated before the surrogate model is used
+n_initial = 20
+
+# Exploration parameter of the expected improvement (in units of the standard deviation of the scores)
+xi = 0.01
+
+# Length scales and noise levels of the Gaussian process (length scales relative to the fit range grid)
+length_scales = [0.05, 0.1, 0.2, 0.4, 0.8]
+noise_levels = [1e-6, 1e-4, 1e-2]
+
+# NOTE: Noise level used if no length scale and noise level above can be fitted (i.e. for nearly duplicate points)
+fallback_noise = 1.0
+
+# Number of candidates predicted at once
+chunk_size = 20000
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to calculate the Matern (nu = 5/2) covariance
+
+def calculate_Matern(X1,
+                     X2,
+                     length
+                     ):
+    """Function to calculate the Matern (nu = 5/2) covariance between two sets of points
+
+    Parameters
+    ----------
+    X1 : array, required
+        Points of shape (n1, d)
+    X2 : array, required
+        Points of shape (n2, d)
+    length : float, required
+        Length scale
+
+    Returns
+    -------
+    K : array
+        Covariance matrix of shape (n1, n2)
+    """
+
+    r = np.sqrt(5) * cdist(X1, X2) / length
+
+    return (1 + r + r ** 2 / 3) * np.exp(-r)
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Class to model scores of fit ranges
+
+class GaussianProcess:
+    """Class to fit a Gaussian process surrogate model to fit range scores
+    Length scale and noise level are chosen by maximum marginal likelihood.
+    If no combination can be factorized, fallback_noise is used.
+
+    Parameters
+    ----------
+    X : array, required
+        Scaled fit range coordinates of shape (n, d)
+    y : array, required
+        Scores of shape (n,)
+    """
+
+    def __init__(self,
+                 X,
+                 y
+                 ):
+
+        self.X = X
+        self.mean = y.mean()
+        self.scale = y.std() if y.std() > 0 else 1
+        z = (y - self.mean) / self.scale
+
+        if not self.fit(z, noise_levels) and not self.fit(z, [fallback_noise]):
+            raise ValueError('Gaussian process could not be fitted to the fit range scores.')
+
+    def fit(self,
+            z,
+            noises
+            ):
+        """Function to choose the length scale and noise level with the highest marginal likelihood
+
+        Parameters
+        ----------
+        z : array, required
+            Standardized scores of shape (n,)
+        noises : list, required
+            Noise levels to try
+
+        Returns
+        -------
+        ok : bool
+            True if any length scale and noise level could be fitted
+        """
+
+        best = -np.inf
+        for length in length_scales:
+            K = calculate_Matern(self.X, self.X, length)
+            for noise in noises:
+                try:
+                    factor = cho_factor(K + noise * np.eye(len(self.X)), lower=True)
+                except (np.linalg.LinAlgError, ValueError):  # ValueError for non-finite values
+                    continue
+                alpha = cho_solve(factor, z)
+                log_likelihood = -0.5 * z @ alpha - np.sum(np.log(np.diag(factor[0])))
+                if log_likelihood > best:
+                    best = log_likelihood
+                    self.length, self.L, self.alpha = length, factor[0], alpha
+
+        return np.isfinite(best)
+
+    def predict(self,
+                X
+                ):
+        """Function to predict scores
+
+        Parameters
+        ----------
+        X : array, required
+            Scaled fit range coordinates of shape (n, d)
+
+        Returns
+        -------
+        mu : array
+            Predicted mean scores
+        sigma : array
+            Predicted standard deviations
+        """
+
+        mu = np.empty(len(X))
+        sigma = np.empty(len(X))
+
+        for i in range(0, len(X), chunk_size):
+            K = calculate_Matern(X[i:i + chunk_size], self.X, self.length)
+            v = solve_triangular(self.L, K.T, lower=True)
+            mu[i:i + chunk_size] = K @ self.alpha
+            sigma[i:i + chunk_size] = np.sqrt(np.clip(1 - np.sum(v ** 2, axis=0), 1e-12, None))
+
+        return self.mean + self.scale * mu, self.scale * sigma
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Function to search fit ranges
+
+def search_Windows(candidates,
+                   evaluate,
+                   budget=search_budget,
+                   n_random=n_initial,
+                   seed=0,
+                   track=tqdm
+                   ):
+    """Function to evaluate a budget of fit range combinations proposed by a surrogate model
+    After a random initial sample, the candidate with the highest expected improvement of a Gaussian process
+    model of the scores is evaluated next. Failed fits are scored with the lowest score found so far.
+    If the model cannot be fitted, all remaining candidates are evaluated (exhaustive search).
+
+    Parameters
+    ----------
+    candidates : array, required
+        Fit range coordinates of shape (n, d), e.g. [Start, Stop] or [Start_Opt, Stop_Opt, Start_CT, Stop_CT]
+    evaluate : function, required
+        Function to fit candidate number i and return its score (i.e. Total_R2 or Comp_R2), or NaN if it failed
+    budget : int, optional
+        Number of candidates to evaluate
+    n_random : int, optional
+        Number of random candidates evaluated before the surrogate model is used
+    seed : int, optional
+        Random seed
+    track : function, optional
+        Function wrapping the evaluation loops to report progress (i.e. tqdm or TaskRunner.track)
+
+    Returns
+    -------
+    scores : dict
+        Dictionary of evaluated candidates {i: score}
+    """
+
+    candidates = np.asarray(candidates, dtype=float)
+    n = len(candidates)
+    budget = min(budget, n)
+
+    scores = {}
+    if n == 0:
+        return scores
+
+    # Scale each coordinate to [0, 1]
+    lower = candidates.min(axis=0)
+    span = np.where(np.ptp(candidates, axis=0) > 0, np.ptp(candidates, axis=0), 1)
+    X = (candidates - lower) / span
+
+    rng = np.random.default_rng(seed)
+    remaining = np.ones(n, dtype=bool)
+
+    def run(i):
+        remaining[i] = False
+        score = evaluate(i)
+        scores[i] = float(score) if score is not None and np.isfinite(score) else np.nan
+
+    for i in track(rng.choice(n, size=min(n_random, budget), replace=False)):
+        run(i)
+
+    exhaustive = False
+    for _ in track(range(budget - len(scores))):
+        evaluated = np.array(list(scores))
+        y = np.array([scores[i] for i in evaluated])
+        if np.all(np.isnan(y)):  # No successful fit yet
+            run(rng.choice(np.flatnonzero(remaining)))
+            continue
+        y = np.where(np.isnan(y), np.nanmin(y), y)
+
+        try:
+            model = GaussianProcess(X[evaluated], y)
+        except ValueError as e:
+            logger.info(f'{e} Evaluating all remaining fit range combinations.')
+            exhaustive = True
+            break
+        index = np.flatnonzero(remaining)
+        mu, sigma = model.predict(X[index])
+
+        improvement = mu - y.max() - xi * model.scale
+        z = improvement / sigma
+        expected_improvement = improvement * norm.cdf(z) + sigma * norm.pdf(z)
+
+        run(index[np.argmax(expected_improvement)])
+
+    if exhaustive:
+        for i in track(np.flatnonzero(remaining)):
+            run(i)
+
+    logger.info(f'Window search: evaluated {len(scores)} of {n} fit range combinations.')
+
+    return scores
+
+# -----------------------------------------------------------------------------------------------------------
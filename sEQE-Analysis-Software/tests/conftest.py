@@ -0,0 +1,77 @@
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from source.compilation import Spectrum, window_cache
+from source.fit_cache import fit_cache
+from source.gaussian import calculate_gaussian_absorption
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+# Define parameters of the synthetic spectra
+
+h = 6.626 * math.pow(10, -34)  # [m^2 kg/s]
+c = 2.998 * math.pow(10, 8)  # [m/s]
+q = 1.602 * math.pow(10, -19)  # [C]
+
+T = 300  # [K]
+CT_params = [0.01, 0.25, 1.42]  # f, l, Ect
+
+
+# -----------------------------------------------------------------------------------------------------------
+
+@pytest.fixture(autouse=True)
+def isolated_caches(monkeypatch):
+    """Keep fits out of the on-disk fit cache and start each test with an empty window cache"""
+
+    monkeypatch.setattr(fit_cache, 'enabled', False)
+    window_cache.clear()
+    yield
+    window_cache.clear()
+
+
+def synthetic_EQE(params=CT_params,
+                  noise=0.0,
+                  seed=0,
+                  wavelength=None
+                  ):
+    """Function to generate a synthetic EQE spectrum of a single Marcus peak
+
+    Parameters
+    ----------
+    params : list, optional
+        Peak parameters [f, l, Ect]
+    noise : float, optional
+        Relative standard deviation of multiplicative gaussian noise
+    seed : int, optional
+        Random seed
+    wavelength : array, optional
+        Wavelengths [nm]
+
+    Returns
+    -------
+    eqe_df : dataFrame
+        EQE data with columns ['Wavelength', 'Energy', 'EQE', 'Log_EQE']
+    """
+
+    rng = np.random.default_rng(seed)
+    if wavelength is None:
+        wavelength = np.arange(700, 1100, 2, dtype=float)
+    energy = (h * c) / (wavelength * math.pow(10, -9) * q)
+
+    EQE = calculate_gaussian_absorption(energy, *params, T) * (1 + noise * rng.standard_normal(len(energy)))
+
+    return pd.DataFrame({'Wavelength': wavelength, 'Energy': energy, 'EQE': EQE, 'Log_EQE': np.log10(EQE)})
+
+
+@pytest.fixture
+def eqe_df():
+    return synthetic_EQE()
+
+
+@pytest.fixture
+def spectrum(eqe_df):
+    return Spectrum.from_df(eqe_df)
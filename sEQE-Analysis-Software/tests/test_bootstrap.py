@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import synthetic_EQE, T, CT_params
+from source.bootstrap import bootstrap_Fit, calculate_Marcus_peaks, reject_Biased
+from source.compilation import compile_EQE
+
+Opt_params = [0.5, 0.15, 1.75]  # f, l, Eopt
+
+
+@pytest.fixture
+def double_df():
+    eqe_df = synthetic_EQE()
+    energy = eqe_df['Energy'].to_numpy()
+    EQE = calculate_Marcus_peaks(energy, *CT_params, *Opt_params, T=T)
+    return pd.DataFrame({'Wavelength': eqe_df['Wavelength'], 'Energy': energy, 'EQE': EQE, 'Log_EQE': np.log10(EQE)})
+
+
+def test_fits_above_the_data_are_discarded(double_df):
+    wave_fit, energy_fit, eqe_fit, log_eqe_fit = compile_EQE(double_df, 1.2, 1.6, 1)
+    energy_fit = np.asarray(energy_fit, dtype=float)
+    samples = np.tile(np.asarray(eqe_fit, dtype=float), (3, 1))
+
+    fits = np.array([CT_params + Opt_params,
+                     [2 * CT_params[0]] + CT_params[1:] + Opt_params,  # CT state peak far above the data
+                     [np.nan] * 6])
+
+    checked = reject_Biased(fits, double_df, energy_fit, samples, 1.6, T, tolerance=0.1)
+
+    assert np.allclose(checked[0], fits[0])
+    assert np.all(np.isnan(checked[1:]))
+    assert np.isfinite(fits[1]).all()  # Input is not modified
+
+
+def test_bootstrap_applies_the_tolerance(double_df):
+    best_vals = CT_params + Opt_params
+    kwargs = dict(eqe=double_df, startE=1.2, stopE=1.6, best_vals=best_vals, T=T, n=10, workers=1, seed=0)
+
+    df = bootstrap_Fit(**kwargs)
+    assert df.attrs['N'] == 10
+    assert bootstrap_Fit(bias=True, tolerance=10, **kwargs).attrs['N'] == 10
+    assert bootstrap_Fit(bias=True, tolerance=-1, **kwargs).attrs['N'] == 0
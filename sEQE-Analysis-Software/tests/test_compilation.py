@@ -0,0 +1,33 @@
+import numpy as np
+
+from source.compilation import feasible_Windows, compile_EQE
+
+
+def test_counts_match_compiled_windows(eqe_df, spectrum):
+    starts = [1.20, 1.25, 1.30, 1.50]
+    stops = [1.30, 1.45, 1.31, 1.40]
+
+    counts = spectrum.counts(starts, stops, 1)
+
+    for start, stop, count in zip(starts, stops, counts):
+        assert count == len(compile_EQE(eqe_df, start, stop, 1)[1])
+
+
+def test_feasible_windows(spectrum):
+    starts, stops = np.meshgrid([1.20, 1.30, 1.40, 1.50], [1.30, 1.45, 1.50], indexing='ij')
+    counts = spectrum.counts(starts, stops, 1)
+
+    feasible = feasible_Windows(spectrum, starts, stops, n_params=3)
+
+    assert feasible.shape == starts.shape
+    assert np.array_equal(feasible, (starts < stops) & (counts > 3))
+    assert not feasible[3].any()  # Start above all stop energies
+    assert feasible[0].all()
+
+
+def test_feasible_windows_need_more_points_than_parameters(spectrum):
+    start, stop = 1.40, 1.41
+    n_points = int(spectrum.counts([start], [stop], 1)[0])
+
+    assert feasible_Windows(spectrum, [start], [stop], n_params=n_points - 1)[0]
+    assert not feasible_Windows(spectrum, [start], [stop], n_params=n_points)[0]
@@ -0,0 +1,73 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from source.file_cache import FileCache
+
+
+@pytest.fixture
+def data_file(tmp_path, eqe_df):
+    file = tmp_path / 'EQE.csv'
+    eqe_df.to_csv(file, index=False)
+    return str(file)
+
+
+def test_key_depends_on_content_and_settings(data_file):
+    cache = FileCache(enabled=True)
+    key = cache.key(data_file)
+
+    assert cache.key(data_file) == key
+    assert cache.key(data_file, index_col=0) != key
+
+    with open(data_file, 'a') as f:
+        f.write('\n')
+    assert cache.key(data_file) != key
+
+    stat = os.stat(data_file)
+    os.utime(data_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert cache.key(data_file) != key
+
+
+def test_round_trip(tmp_path, data_file):
+    cache = FileCache(directory=str(tmp_path / 'cache'), enabled=True)
+    parsed = pd.read_csv(data_file)
+
+    data_df = cache.read(data_file)
+    assert cache.read(data_file) is data_df  # Shared with other slots
+    assert (cache.parsed, cache.shared, cache.loaded) == (1, 1, 0)
+    assert os.path.isfile(cache.path(cache.key(data_file)))
+
+    new_cache = FileCache(directory=str(tmp_path / 'cache'), enabled=True)  # Later session
+    loaded = new_cache.read(data_file)
+    assert (new_cache.parsed, new_cache.loaded) == (0, 1)
+    pd.testing.assert_frame_equal(loaded, parsed)
+
+
+def test_index_column_round_trip(tmp_path, data_file):
+    cache = FileCache(directory=str(tmp_path / 'cache'), enabled=True)
+    cache.read(data_file, index_col=0)
+
+    loaded = FileCache(directory=str(tmp_path / 'cache'), enabled=True).read(data_file, index_col=0)
+
+    pd.testing.assert_frame_equal(loaded, pd.read_csv(data_file, index_col=0))
+
+
+def test_prune(tmp_path, data_file, monkeypatch):
+    import source.file_cache as file_cache
+
+    monkeypatch.setattr(file_cache, 'max_cached_files', 2)
+    cache = FileCache(directory=str(tmp_path / 'cache'), enabled=True)
+    for x in range(4):
+        file = tmp_path / f'EQE_{x}.csv'
+        pd.DataFrame({'Wavelength': np.arange(3.0), 'EQE': np.full(3, x)}).to_csv(file, index=False)
+        cache.read(str(file))
+
+    assert len([name for name in os.listdir(cache.directory) if name.endswith('.npz')]) == 2
+
+
+def test_disabled_cache_parses_each_read(data_file):
+    cache = FileCache(enabled=False)
+
+    assert cache.read(data_file) is not cache.read(data_file)
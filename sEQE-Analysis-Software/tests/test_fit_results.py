@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from source.fit_results import FitResults
+
+
+def append_Fits(fit_results, scores):
+    for x, score in enumerate(scores):
+        fit_results.append(start_Opt=1.8, stop_Opt=2.0, fit_Opt=[0.5, 0.15, 1.9], R2_Opt=0.99,
+                           start_CT=1.2 + x * 1e-3, stop_CT=1.5, fit_CT=[0.01, 0.25, 1.42], R2_CT=0.99,
+                           total_R2=score, comp_R2=score)
+
+
+@pytest.mark.parametrize('n_best', [1, 5, 50])
+def test_top_k_matches_full_ranking(n_best):
+    scores = np.random.default_rng(0).uniform(-1, 1, 200)
+    scores[[10, 20]] = np.nan  # Failed fits rank last
+    scores[[30, 40, 50]] = 0.999  # Ties are broken by insertion order
+
+    kept = FitResults(T=300, n_best=n_best)
+    full = FitResults(T=300)
+    append_Fits(kept, scores)
+    append_Fits(full, scores)
+
+    assert len(kept) == n_best
+    assert kept.n_fits == full.n_fits == len(scores)
+
+    expected = full['Index'][full.best(n_best)]
+    assert kept['Index'][kept.best()].tolist() == expected.tolist()
+    assert kept['Total_R2'][kept.best()].tolist() == full['Total_R2'][full.best(n_best)].tolist()
+
+
+def test_ties_prefer_earlier_fits():
+    fit_results = FitResults(T=300, n_best=2)
+    append_Fits(fit_results, [0.5, 0.9, 0.9, 0.9])
+
+    assert fit_results['Index'][fit_results.best()].tolist() == [1, 2]
+
+
+def test_short_fit_values_are_padded():
+    fit_results = FitResults(T=300, include_disorder=True)
+    fit_results.append(start_Opt=1.8, stop_Opt=2.0, fit_Opt=[0.5, 0.15, 1.9], R2_Opt=0.99, start_CT=1.2,
+                       stop_CT=1.5, fit_CT=[0, 0, 0], R2_CT=0, total_R2=0.1)
+
+    assert fit_results['Fit_CT'].shape == (1, 4)
+    assert fit_results['Fit_CT'][0].tolist() == [0, 0, 0, 0]
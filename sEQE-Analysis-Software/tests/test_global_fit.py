@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from conftest import synthetic_EQE, T
+from source.global_fit import fit_Global
+
+
+@pytest.fixture
+def series():
+    f_values = [0.005, 0.01, 0.02]
+    return f_values, [synthetic_EQE(params=[f, 0.25, 1.42], noise=0.01, seed=n) for n, f in enumerate(f_values)]
+
+
+def test_shared_parameters_are_recovered(series):
+    f_values, eqe_list = series
+
+    df = fit_Global(eqe_list, startE=1.2, stopE=1.5, T=T, shared=['l', 'Ect'], labels=['a', 'b', 'c'])
+
+    assert df.attrs['Success']
+    assert df.attrs['Shared'] == ['l', 'Ect']
+    assert df['Label'].tolist() == ['a', 'b', 'c']
+    assert np.allclose(df['f'], f_values, rtol=0.05)
+    assert np.allclose(df['l'], 0.25, rtol=0.05) and df['l'].nunique() == 1
+    assert np.allclose(df['Ect'], 1.42, rtol=0.01) and df['Ect'].nunique() == 1
+    assert (df['R_Squared'] > 0.99).all()
+
+
+def test_callback_can_cancel(series):
+    def cancel():
+        raise InterruptedError
+
+    with pytest.raises(InterruptedError):
+        fit_Global(series[1], startE=1.2, stopE=1.5, T=T, callback=cancel)
+
+
+def test_too_few_points_in_fit_range(series):
+    eqe_list = series[1]
+
+    with pytest.raises(ValueError, match='b: more than 1 data points'):
+        fit_Global(eqe_list, startE=[1.2, 1.40, 1.2], stopE=[1.5, 1.401, 1.5], T=T, labels=['a', 'b', 'c'])
@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from source.heat_map_file import save_HeatMap, load_HeatMap, heat_map_version
+
+
+@pytest.fixture
+def heat_map():
+    starts, stops = np.meshgrid([1.20, 1.25, 1.30], [1.40, 1.45], indexing='ij')
+    heat_df = pd.DataFrame({'Start': starts.ravel(), 'Stop': stops.ravel()})
+    heat_df['f'] = np.linspace(0.01, 0.02, len(heat_df))
+    heat_df['l'] = np.linspace(0.20, 0.30, len(heat_df))
+    heat_df['Ect'] = np.linspace(1.40, 1.45, len(heat_df))
+    heat_df['R_Squared'] = np.linspace(0.90, 0.99, len(heat_df))
+    parameter_df = heat_df.drop(index=[1, 4]).reset_index(drop=True)  # Fit ranges filled from neighbours
+
+    return parameter_df, heat_df
+
+
+def test_round_trip(tmp_path, heat_map):
+    parameter_df, heat_df = heat_map
+
+    file = save_HeatMap(str(tmp_path / 'run'), parameter_df, heat_df, metadata={'T': 300, 'Peak': 'CT'})
+    loaded_parameter_df, loaded_heat_df, metadata = load_HeatMap(file)
+
+    assert file.endswith('.npz')
+    pd.testing.assert_frame_equal(loaded_parameter_df, parameter_df)
+    pd.testing.assert_frame_equal(loaded_heat_df.drop(columns='Fitted'), heat_df)
+    assert loaded_heat_df['Fitted'].tolist() == [True, False, True, True, False, True]
+    assert metadata['T'] == 300 and metadata['Peak'] == 'CT'
+    assert metadata['version'] == heat_map_version
+
+
+def test_unfitted_ranges_are_not_loaded(tmp_path, heat_map):
+    parameter_df = heat_map[0]
+
+    file = save_HeatMap(str(tmp_path / 'run.npz'), parameter_df)
+    loaded_parameter_df, loaded_heat_df, metadata = load_HeatMap(file)
+
+    pd.testing.assert_frame_equal(loaded_parameter_df, parameter_df)
+    assert len(loaded_heat_df) == len(parameter_df)
+    assert loaded_heat_df['Fitted'].all()
+
+
+def test_newer_version_is_rejected(tmp_path, heat_map, monkeypatch):
+    import source.heat_map_file as heat_map_file
+
+    monkeypatch.setattr(heat_map_file, 'heat_map_version', heat_map_version + 1)
+    file = save_HeatMap(str(tmp_path / 'run.npz'), heat_map[0])
+    monkeypatch.undo()
+
+    with pytest.raises(ValueError):
+        load_HeatMap(file)
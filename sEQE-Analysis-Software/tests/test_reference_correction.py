@@ -0,0 +1,19 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from source.reference_correction import calculate_EQE_spectrum
+
+
+def test_non_positive_eqe_is_masked(caplog):
+    ref_df = pd.DataFrame({'Wavelength': [600.0, 700.0, 800.0, 900.0], 'Power': [1.0, 1.0, 0.0, 1.0]})
+    data_df = pd.DataFrame({'Wavelength': [600.0, 700.0, 800.0, 900.0], 'Mean Current': [0.5, -0.1, 0.2, 0.0]})
+
+    with caplog.at_level(logging.WARNING):
+        Wavelength, Energy, EQE, log_EQE = calculate_EQE_spectrum(ref_df, data_df, 600, 900)
+
+    assert len(Wavelength) == len(EQE) == len(log_EQE) == 4
+    assert np.isclose(log_EQE[0], np.log10(EQE[0]))
+    assert np.all(np.isnan(log_EQE[1:]))
+    assert '3 of 4 EQE values' in caplog.text
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from source.stitching import stitch_EQE
+
+
+def eqe_Range(wavelength, scale=1.0):
+    wavelength = np.asarray(wavelength, dtype=float)
+    EQE = scale * np.exp(-((wavelength - 700) / 200) ** 2)
+    return pd.DataFrame({'Wavelength': wavelength, 'Energy': 1239.84 / wavelength, 'EQE': EQE,
+                         'Log_EQE': np.log10(EQE)})
+
+
+@pytest.fixture
+def ranges():
+    return [eqe_Range(np.arange(600, 810, 10)), eqe_Range(np.arange(400, 660, 10))]
+
+
+def test_concatenate_keeps_all_points_in_range_order(ranges):
+    stitched = stitch_EQE(ranges, method='concatenate')
+
+    expected = pd.concat([ranges[1], ranges[0]], ignore_index=True)
+    assert list(stitched.columns) == ['Wavelength', 'Energy', 'EQE', 'Log_EQE']
+    assert np.array_equal(stitched.to_numpy(), expected[stitched.columns].to_numpy())
+
+
+@pytest.mark.parametrize('prefer, source', [('first', 1), ('last', 0)])
+def test_prefer_keeps_one_range_in_the_overlap(ranges, prefer, source):
+    stitched = stitch_EQE(ranges, method='prefer', prefer=prefer)
+
+    assert np.all(np.diff(stitched['Wavelength']) > 0)
+    assert np.array_equal(stitched['Wavelength'], np.arange(400, 810, 10))
+    overlap = stitched[(stitched['Wavelength'] >= 600) & (stitched['Wavelength'] <= 650)]
+    expected = ranges[source].set_index('Wavelength').loc[overlap['Wavelength'], 'EQE']
+    assert np.allclose(overlap['EQE'], expected)
+
+
+@pytest.mark.parametrize('method', ['blend', 'scale'])
+def test_blend_and_scale_keep_shared_wavelengths_once(ranges, method):
+    stitched = stitch_EQE(ranges, method=method)
+
+    assert np.array_equal(stitched['Wavelength'], np.arange(400, 810, 10))
+    assert np.allclose(stitched['Log_EQE'], np.log10(stitched['EQE']))
+
+
+def test_scale_matches_ranges():
+    ranges = [eqe_Range(np.arange(400, 660, 10)), eqe_Range(np.arange(600, 810, 10), scale=2.0)]
+
+    stitched = stitch_EQE(ranges, method='scale')
+
+    assert np.allclose(stitched['EQE'], eqe_Range(np.arange(400, 810, 10))['EQE'])
+
+
+def test_unknown_method():
+    with pytest.raises(ValueError):
+        stitch_EQE([], method='average')
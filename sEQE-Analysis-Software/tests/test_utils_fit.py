@@ -0,0 +1,61 @@
+import numpy as np
+
+import source.utils_fit as utils_fit
+from conftest import CT_params, T
+from source.gaussian import calculate_gaussian_absorption, calculate_gaussian_absorption_jac
+
+
+def gaussian(E, f, l, Ect):
+    return calculate_gaussian_absorption(E, f, l, Ect, T)
+
+
+def gaussian_jac(E, f, l, Ect):
+    return calculate_gaussian_absorption_jac(E, f, l, Ect, T)
+
+
+windows = [(1.20, 1.45), (1.25, 1.50), (1.30, 1.50)]
+
+
+def test_fit_windows(spectrum):
+    best_vals, covar, r_squared = utils_fit.fit_Windows(spectrum, windows, gaussian, guessRange=[1.3, 1.5], T=T,
+                                                        jac=gaussian_jac)
+
+    assert len(best_vals) == len(covar) == len(r_squared) == len(windows)
+    assert np.all(r_squared > 0.999)
+    assert np.allclose(best_vals, [CT_params] * len(windows), rtol=1e-3)
+
+
+def test_fit_windows_falls_back_to_individual_fits(spectrum, monkeypatch):
+    def failed_batch(eqe, windows, **kwargs):
+        return np.zeros((len(windows), 3)), np.zeros((len(windows), 3, 3)), np.zeros(len(windows))
+
+    monkeypatch.setattr(utils_fit, 'fit_batch', failed_batch)
+    checked = []
+
+    best_vals, covar, r_squared = utils_fit.fit_Windows(spectrum, windows, gaussian, guessRange=[1.3, 1.5], T=T,
+                                                        jac=gaussian_jac, check=lambda: checked.append(True))
+
+    assert len(checked) == len(windows)
+    assert np.all(r_squared > 0.999)
+    assert np.allclose(best_vals, [CT_params] * len(windows), rtol=1e-3)
+
+
+def test_fit_windows_without_temperature_fits_individually(spectrum, monkeypatch):
+    monkeypatch.setattr(utils_fit, 'fit_batch', None)  # Not called for non-Marcus functions
+
+    best_vals, covar, r_squared = utils_fit.fit_Windows(spectrum, windows[:1], gaussian, guessRange=[1.3, 1.5])
+
+    assert r_squared[0] > 0.999
+    assert np.allclose(best_vals[0], CT_params, rtol=1e-3)
+
+
+def test_fit_model_with_analytic_jacobian(eqe_df):
+    fit_df = eqe_df[(eqe_df['Energy'] >= 1.2) & (eqe_df['Energy'] <= 1.5)]
+    p0 = [0.005, 0.2, 1.4]
+
+    numeric = utils_fit.fit_model(gaussian, fit_df['Energy'], fit_df['EQE'], p0=p0)
+    analytic = utils_fit.fit_model(gaussian, fit_df['Energy'], fit_df['EQE'], p0=p0, jac=gaussian_jac)
+
+    assert analytic[3] > 0.999
+    assert np.allclose(analytic[0], CT_params, rtol=1e-3)
+    assert np.allclose(analytic[0], numeric[0], rtol=1e-4)
@@ -0,0 +1,45 @@
+import numpy as np
+
+import source.window_search as window_search
+from source.window_search import search_Windows
+
+
+def candidates():
+    starts, stops = np.meshgrid(np.linspace(1.2, 1.3, 10), np.linspace(1.4, 1.5, 10), indexing='ij')
+    return np.column_stack([starts.ravel(), stops.ravel()])
+
+
+def score(X):
+    return -((X[:, 0] - 1.25) ** 2 + (X[:, 1] - 1.45) ** 2)
+
+
+def test_budget_is_evaluated_once():
+    X = candidates()
+    evaluated = []
+
+    def evaluate(i):
+        evaluated.append(i)
+        return score(X[[i]])[0]
+
+    scores = search_Windows(X, evaluate, budget=30, n_random=10, track=iter)
+
+    assert len(scores) == len(evaluated) == len(set(evaluated)) == 30
+    assert max(scores.values()) >= np.sort(score(X))[-5]  # The search finds one of the best fit ranges
+
+
+def test_failed_fits_are_scored_nan():
+    X = candidates()
+
+    scores = search_Windows(X, lambda i: np.nan if i % 2 else score(X[[i]])[0], budget=20, n_random=5, track=iter)
+
+    assert len(scores) == 20
+    assert all(np.isnan(value) for i, value in scores.items() if i % 2)
+
+
+def test_exhaustive_search_if_the_surrogate_model_fails(monkeypatch):
+    X = candidates()
+    monkeypatch.setattr(window_search, 'calculate_Matern', lambda X1, X2, length: np.full((len(X1), len(X2)), np.nan))
+
+    scores = search_Windows(X, lambda i: score(X[[i]])[0], budget=30, n_random=10, track=iter)
+
+    assert sorted(scores) == list(range(len(X)))